@@ -0,0 +1,95 @@
+# app/bench_pdf.py
+"""
+เทียบเวลาเรนเดอร์ /export-merged-pdf ระหว่าง 2 วิธี (รันใน process เดียว ไม่ผ่าน pdf_pool)
+
+  merge  : เรนเดอร์ 4 variant ทีละไฟล์ลง temp PDF แล้ว merge ด้วย PdfMerger (วิธีเดิม)
+  single : รวม 4 variant เป็น HTML เดียว เรนเดอร์รอบเดียวลง memory
+
+    python -m app.bench_pdf --rounds 5 --items 12
+"""
+import argparse
+import time
+from datetime import date
+
+from weasyprint import HTML, CSS
+from weasyprint.text.fonts import FontConfiguration
+
+from .form import BASE_DIR, build_multi_variant_html, merge_variant_pdfs_legacy
+
+
+def sample_payload(n_items: int) -> dict:
+    return {
+        "invoice_number": "BENCH0001",
+        "invoice_date": date.today().isoformat(),
+        "customer_name": "บริษัท ทดสอบ จำกัด",
+        "customer_taxid": "0105500000000",
+        "customer_address": "69 หมู่ 10 ต.พังตรุ อ.พนมทวน จ.กาญจนบุรี",
+        "cf_provincename": "กาญจนบุรี",
+        "cf_personzipcode": "71140",
+        "items": [
+            {
+                "cf_itemid": f"P{i:04d}",
+                "cf_itemname": f"สินค้าทดสอบ {i}",
+                "quantity": 1000 + i,
+                "unit_price": 1.25,
+            }
+            for i in range(n_items)
+        ],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.bench_pdf")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--items", type=int, default=12)
+    args = parser.parse_args(argv)
+
+    payload = sample_payload(args.items)
+    font_config = FontConfiguration()
+    css = CSS(filename=str(BASE_DIR / "static" / "css" / "invoice.css"), font_config=font_config)
+
+    def render(html_str: str) -> bytes:
+        return HTML(string=html_str, base_url=str(BASE_DIR)).write_pdf(
+            stylesheets=[css], font_config=font_config,
+        )
+
+    def run_merge():
+        written = 0
+        def counting_render(html_str):
+            nonlocal written
+            data = render(html_str)
+            written += len(data)
+            return data
+        out_path = merge_variant_pdfs_legacy(payload, counting_render)
+        written += out_path.stat().st_size
+        out_path.unlink()
+        return written
+
+    def run_single():
+        render(build_multi_variant_html(payload))
+        return 0
+
+    # warm-up ให้ทั้งสองวิธีเริ่มจากฟอนต์/CSS ที่โหลดแล้ว
+    run_single()
+
+    results = {}
+    for name, fn in (("merge", run_merge), ("single", run_single)):
+        wall = cpu = 0.0
+        disk = 0
+        for _ in range(args.rounds):
+            t0, c0 = time.perf_counter(), time.process_time()
+            disk += fn()
+            wall += time.perf_counter() - t0
+            cpu += time.process_time() - c0
+        results[name] = (wall / args.rounds, cpu / args.rounds, disk // args.rounds)
+
+    print(f"{'mode':8s} {'wall ms':>10s} {'cpu ms':>10s} {'disk KB':>10s}")
+    for name, (wall, cpu, disk) in results.items():
+        print(f"{name:8s} {wall * 1000:10.1f} {cpu * 1000:10.1f} {disk / 1024:10.1f}")
+    base_cpu = results["merge"][1]
+    if base_cpu:
+        print(f"single-pass cpu saving: {(1 - results['single'][1] / base_cpu) * 100:.0f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,18 @@
 # /app/bill_note.py
 from fastapi import APIRouter, Depends, Query, HTTPException
 from sqlalchemy.orm import Session
-from sqlalchemy import func, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import BigInteger, and_, cast, func, or_, select, text, true
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from typing import Optional, List
 from datetime import date, datetime
 from pydantic import BaseModel
 
-from . import models
-from .database import SessionLocal
+from . import doc_numbers, models, pdf_cache, periods
+from .deps import get_db, get_read_db, get_async_read_db
 
 router = APIRouter()
 
-# --- DB Session ---
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 # --- Helper ---
 def _to_date(s: Optional[str]) -> Optional[date]:
     if not s:
@@ -28,39 +22,61 @@ def _to_date(s: Optional[str]) -> Optional[date]:
     except Exception:
         return None
 
+def _seed_billnote(db: Session, period: str) -> int:
+    """เลขสูงสุดของเดือนนั้นที่มีอยู่แล้ว (ใช้ครั้งแรกของแต่ละเดือนเท่านั้น)"""
+    prefix = f"BNTS{period}"
+    run = func.substring(models.BillNote.billnote_number, f"^{prefix}([0-9]+)$")
+    return (
+        db.query(func.max(cast(run, BigInteger)))
+        .filter(models.BillNote.billnote_number.like(f"{prefix}%"))
+        .scalar()
+    ) or 0
+
+doc_numbers.register("bill_note", _seed_billnote)
+
 def generate_next_billnote_number(db: Session):
-    """ สร้างเลขที่ใบวางบิล BNTS<YY><MM><NNNNNN> """
+    """ สร้างเลขที่ใบวางบิล BNTS<YY><MM><NNNNNN> (จองเลขใน transaction เดียวกับการบันทึก) """
     now = datetime.now()
-    year_be = now.year + 543
-    year_prefix = str(year_be)[-2:]
-    month_prefix = f"{now.month:02d}"
-    search_prefix = f"BNTS{year_prefix}{month_prefix}"
-
-    latest_bill = (
-        db.query(models.BillNote.billnote_number)
-        .filter(models.BillNote.billnote_number.like(f"{search_prefix}%"))
-        .order_by(models.BillNote.billnote_number.desc())
-        .first()
-    )
+    period = f"{str(now.year + 543)[-2:]}{now.month:02d}"
+    return f"BNTS{period}{doc_numbers.allocate(db, 'bill_note', period):06d}"
 
-    next_running_number = 1
-    if latest_bill and latest_bill[0]:
-        try:
-            prefix_len = len(search_prefix)
-            last_running_str = latest_bill[0][prefix_len:]
-            next_running_number = int(last_running_str) + 1
-        except (ValueError, IndexError):
-            next_running_number = 1
+# --- Duplicate guard helpers ---
+# ใบกำกับ 1 ใบอยู่ได้ในใบวางบิลเดียว: ฐานข้อมูลบังคับด้วย unique index ของ bill_note_item.invoice_number
+# (python -m app.migrations bill_note_item_unique)
 
-    return f"{search_prefix}{next_running_number:06d}"
+def _unbilled(invoice_number):
+    """เงื่อนไข: ใบกำกับนี้ยังไม่อยู่ในใบวางบิลใด (anti-join ผ่าน unique index)"""
+    bni = models.BillNoteItem
+    return ~select(bni.idx).where(bni.invoice_number == invoice_number).exists()
 
-# --- Duplicate guard helpers ---
+def _insert_items(db: Session, bill_note_number: str, items: List["BillNoteItemPayload"]) -> List[str]:
+    """
+    insert รายการทั้งหมดในคำสั่งเดียว ใบกำกับที่อยู่ในใบวางบิลอื่นแล้วจะถูกข้าม (ON CONFLICT DO NOTHING)
+    คืนรายการเลขที่ใบกำกับที่ซ้ำ — ผู้เรียกต้อง rollback ถ้าไม่ว่าง
+    """
+    if not items:
+        return []
+    bni = models.BillNoteItem
+    stmt = (
+        pg_insert(bni)
+        .values([
+            {
+                "billnote_number": bill_note_number,
+                "invoice_number": it.invoice_number,
+                "invoice_date": it.invoice_date,
+                "due_date": it.due_date,
+                "amount": it.amount,
+            }
+            for it in items
+        ])
+        .on_conflict_do_nothing(index_elements=[bni.invoice_number], index_where=text("invoice_number <> ''"))
+        .returning(bni.invoice_number)
+    )
+    inserted = set(db.execute(stmt).scalars())
+    return sorted({it.invoice_number for it in items} - inserted)
 
-def _used_invoice_numbers(db: Session, exclude_billnote: Optional[str] = None) -> set[str]:
-    q = db.query(models.BillNoteItem.invoice_number)
-    if exclude_billnote:
-        q = q.filter(models.BillNoteItem.billnote_number != exclude_billnote)
-    return {r[0] for r in q.all()}
+def _conflict(dup: List[str]):
+    return HTTPException(status_code=409, detail={"message": "บางใบกำกับถูกใช้ในใบวางบิลอื่นแล้ว", "duplicates": dup})
 
 # --- Pydantic payloads ---
 class BillNoteItemPayload(BaseModel):
@@ -82,119 +98,89 @@ class BillNoteUpdatePayload(BaseModel):
     customer_id: Optional[int] = None
 
 # --- APIs ---
-@router.get("/api/customers/all")
-def get_all_customers(db: Session = Depends(get_db)):
-    rows = (
-        db.query(
-            models.CustomerList.idx, 
-            models.CustomerList.personid, 
-            models.CustomerList.fname,
-            models.CustomerList.prename
-        )
-        .order_by(models.CustomerList.fname.asc())
-        .limit(5000)
-        .all()
-    )
-    return [
-        {
-            "idx": idx,
-            "personid": personid or "",
-            "fname": fname or "",
-            "prename": prename or "",
-            "customer_name": (fname or ""),
-        }
-        for (idx, personid, fname, prename) in rows
-    ]
+_ITEM_AMOUNT = func.sum(
+    func.coalesce(models.InvoiceItem.quantity, 0) * func.coalesce(models.InvoiceItem.cf_itempricelevel_price, 0)
+)
+
+def _customer_dict(c, branch: str) -> dict:
+    return {
+        "name": c.fname,
+        "prename": c.prename or "",
+        "tax_id": c.cf_taxid,
+        "branch": branch,
+        "address": c.cf_personaddress,
+        "person_id": c.personid,
+    }
+
+def _invoice_dict(r, grand_total: float) -> dict:
+    return {
+        "invoice_number": r.invoice_number,
+        "invoice_date": r.invoice_date.isoformat() if r.invoice_date else None,
+        "due_date": r.due_date.isoformat() if r.due_date else None,
+        "amount": round(grand_total, 2),
+    }
 
 @router.get("/api/billing-notes/{bill_note_number}")
 def get_billing_note_details(bill_note_number: str, db: Session = Depends(get_db)):
-    bill_note = db.query(models.BillNote).filter(models.BillNote.billnote_number == bill_note_number).first()
-    if not bill_note:
-        raise HTTPException(status_code=404, detail="Bill Note not found")
-
-    items = (
-        db.query(models.BillNoteItem)
-        .filter(models.BillNoteItem.billnote_number == bill_note_number)
-        .order_by(models.BillNoteItem.invoice_date.asc())
-        .all()
+    """หัว + รายการ + ยอดของแต่ละใบกำกับ + สาขาลูกค้า ในคิวรีเดียว (แถวละรายการ หัวซ้ำทุกแถว)"""
+    bn = models.BillNote
+    bni = models.BillNoteItem
+    cl = models.CustomerList
+    inv = models.Invoice
+    itm = models.InvoiceItem
+    # ยอดรวมตามเลขที่ใบกำกับ (correlated กับรายการในใบวางบิล)
+    sub_total = (
+        select(_ITEM_AMOUNT)
+        .select_from(inv)
+        .join(itm, itm.invoice_idx == inv.idx)
+        .where(inv.invoice_number == bni.invoice_number)
+        .scalar_subquery()
     )
+    cust = (
+        select(cl.idx, cl.cf_hq, cl.cf_branch)
+        .where(cl.personid == bn.personid)
+        .limit(1)
+        .lateral("cust")
+    )
+    rows = db.execute(
+        select(
+            bn,
+            cust.c.idx.label("customer_idx"), cust.c.cf_hq, cust.c.cf_branch,
+            bni.idx.label("item_idx"), bni.invoice_number, bni.invoice_date, bni.due_date,
+            sub_total.label("sub_total"),
+        )
+        .select_from(bn)
+        .outerjoin(cust, true())
+        .outerjoin(bni, bni.billnote_number == bn.billnote_number)
+        .where(bn.billnote_number == bill_note_number)
+        .order_by(bni.invoice_date.asc())
+    ).all()
+    if not rows:
+        raise HTTPException(status_code=404, detail="Bill Note not found")
 
-    if not items:
+    bill_note = rows[0].BillNote
+    if rows[0].item_idx is None:
         return {
-            "customer": {
-                "name": bill_note.fname,
-                "prename": bill_note.prename or "",
-                "tax_id": bill_note.cf_taxid,
-                "branch": "สำนักงานใหญ่",
-                "address": bill_note.cf_personaddress,
-                "person_id": bill_note.personid,
-            },
+            "customer": _customer_dict(bill_note, "สำนักงานใหญ่"),
             "invoices": [],
             "summary": {"total_amount": 0},
             "bill_note_number": bill_note.billnote_number,
             "bill_date": datetime.now().date().isoformat(),
         }
 
-    invoice_numbers = [it.invoice_number for it in items]
-
-    inv = models.Invoice
-    itm = models.InvoiceItem
-
-    target_invoices = (
-        db.query(inv.idx, inv.invoice_number)
-        .filter(inv.invoice_number.in_(invoice_numbers))
-        .all()
-    )
-
-    target_idxs_as_str = {str(i.idx) for i in target_invoices}
-    target_numbers = {i.invoice_number for i in target_invoices}
-
-    amount_subq = (
-        db.query(
-            itm.invoice_number,
-            func.sum(func.coalesce(itm.quantity, 0) * func.coalesce(itm.cf_itempricelevel_price, 0)).label("sub_total"),
-        )
-        .filter(or_(itm.invoice_number.in_(target_numbers), itm.invoice_number.in_(target_idxs_as_str)))
-        .group_by(itm.invoice_number)
-        .subquery()
-    )
-
-    amounts_raw = db.query(amount_subq).all()
-
-    invoice_map = {str(i.idx): i.invoice_number for i in target_invoices}
-    amounts = {}
-    for row in amounts_raw:
-        main_no = invoice_map.get(row.invoice_number, row.invoice_number)
-        amounts[main_no] = float(row.sub_total or 0)
-
     invoice_details = []
     total_amount = 0.0
-    for it in items:
-        sub_total = amounts.get(it.invoice_number, 0.0)
-        vat = sub_total * 0.07
-        grand_total = sub_total + vat
+    for r in rows:
+        sub = float(r.sub_total or 0)
+        grand_total = sub + sub * 0.07
         total_amount += grand_total
-        invoice_details.append(
-            {
-                "invoice_number": it.invoice_number,
-                "invoice_date": it.invoice_date.isoformat() if it.invoice_date else None,
-                "due_date": it.due_date.isoformat() if it.due_date else None,
-                "amount": round(grand_total, 2),
-            }
-        )
+        invoice_details.append(_invoice_dict(r, grand_total))
 
-    customer = db.query(models.CustomerList).filter(models.CustomerList.personid == bill_note.personid).first()
-    branch_info = "สำนักงานใหญ่" if not customer or customer.cf_hq == 1 else f"สาขาที่ {customer.cf_branch}"
+    c = rows[0]
+    branch_info = "สำนักงานใหญ่" if c.customer_idx is None or c.cf_hq == 1 else f"สาขาที่ {c.cf_branch}"
 
     return {
-        "customer": {
-            "name": bill_note.fname,
-            "prename": bill_note.prename or "",
-            "tax_id": bill_note.cf_taxid,
-            "branch": branch_info,
-            "address": bill_note.cf_personaddress,
-            "person_id": bill_note.personid,
-        },
+        "customer": _customer_dict(bill_note, branch_info),
         "invoices": invoice_details,
         "summary": {"total_amount": round(total_amount, 2)},
         "bill_note_number": bill_note.billnote_number,
@@ -212,101 +198,53 @@ def get_invoices_for_billing_note(
     """
     ดึงรายการใบกำกับภาษีของลูกค้าในช่วงวันที่ เพื่อนำไปสร้างใบวางบิล
     *จะ **ตัด** invoice ที่ถูกใช้งานแล้วในใบวางบิลอื่น ๆ ออกเสมอ*
+    ลูกค้า + ใบกำกับ + ยอดของแต่ละใบ ในคิวรีเดียว (ลูกค้าซ้ำทุกแถว)
     """
     d_start = _to_date(start)
     d_end = _to_date(end)
 
-    customer = db.query(models.CustomerList).filter(models.CustomerList.idx == customer_id).first()
-    if not customer:
-        return {"error": "Customer not found"}
-
+    cl = models.CustomerList
     inv = models.Invoice
-    invoices_query = (
-        db.query(inv.idx, inv.invoice_number, inv.invoice_date, inv.due_date)
-        .filter(inv.personid == customer.personid, inv.invoice_date.between(d_start, d_end))
+    itm = models.InvoiceItem
+    sub_total = select(_ITEM_AMOUNT).where(itm.invoice_idx == inv.idx).scalar_subquery()
+    rows = db.execute(
+        select(
+            cl,
+            inv.idx.label("invoice_idx"), inv.invoice_number, inv.invoice_date, inv.due_date,
+            sub_total.label("sub_total"),
+        )
+        # ตัดใบที่ถูกใช้แล้วใน Bill Note อื่น ๆ ใน SQL (NOT EXISTS)
+        .outerjoin(inv, and_(
+            inv.personid == cl.personid,
+            inv.invoice_date.between(d_start, d_end),
+            _unbilled(inv.invoice_number),
+        ))
+        .where(cl.idx == customer_id)
         .order_by(inv.invoice_date.asc())
-        .all()
-    )
-
-    if not invoices_query:
-        return {
-            "customer": {
-                "name": customer.fname,
-                "prename": customer.prename or "",
-                "tax_id": customer.cf_taxid,
-                "branch": "สำนักงานใหญ่" if customer.cf_hq == 1 else f"สาขาที่ {customer.cf_branch}",
-                "address": customer.cf_personaddress,
-                "person_id": customer.personid,
-            },
-            "invoices": [],
-            "summary": {"total_amount": 0.0},
-        }
-
-    # --- ตัดใบที่ถูกใช้แล้วใน Bill Note อื่น ๆ ---
-    used = _used_invoice_numbers(db)
-    invoices_query = [r for r in invoices_query if r.invoice_number not in used]
+    ).all()
+    if not rows:
+        return {"error": "Customer not found"}
 
-    # ถ้าเหลือว่างหลังตัด ให้ตอบกลับโครงสร้างปกติ
-    if not invoices_query:
+    customer = rows[0].CustomerList
+    customer_out = _customer_dict(
+        customer, "สำนักงานใหญ่" if customer.cf_hq == 1 else f"สาขาที่ {customer.cf_branch}"
+    )
+    if rows[0].invoice_idx is None:
         return {
-            "customer": {
-                "name": customer.fname,
-                "prename": customer.prename or "",
-                "tax_id": customer.cf_taxid,
-                "branch": "สำนักงานใหญ่" if customer.cf_hq == 1 else f"สาขาที่ {customer.cf_branch}",
-                "address": customer.cf_personaddress,
-                "person_id": customer.personid,
-            },
+            "customer": customer_out,
             "invoices": [],
             "summary": {"total_amount": 0.0},
         }
 
-    invoice_numbers = [r.invoice_number for r in invoices_query]
-    invoice_idxs_as_str = [str(r.idx) for r in invoices_query]
-
-    itm = models.InvoiceItem
-    amount_subq = (
-        db.query(
-            itm.invoice_number,
-            func.sum(func.coalesce(itm.quantity, 0) * func.coalesce(itm.cf_itempricelevel_price, 0)).label("sub_total"),
-        )
-        .filter(or_(itm.invoice_number.in_(invoice_numbers), itm.invoice_number.in_(invoice_idxs_as_str)))
-        .group_by(itm.invoice_number)
-        .subquery()
-    )
-
-    amounts_raw = db.query(amount_subq).all()
-    invoice_map = {str(r.idx): r.invoice_number for r in invoices_query}
-
-    amounts = {}
-    for row in amounts_raw:
-        main_no = invoice_map.get(row.invoice_number, row.invoice_number)
-        amounts[main_no] = float(row.sub_total or 0)
-
     details, total_amount = [], 0.0
-    for inv_row in invoices_query:
-        sub_total = amounts.get(inv_row.invoice_number, 0.0)
-        vat = sub_total * 0.07
-        grand_total = sub_total + vat
+    for r in rows:
+        sub = float(r.sub_total or 0)
+        grand_total = sub + sub * 0.07
         total_amount += grand_total
-        details.append(
-            {
-                "invoice_number": inv_row.invoice_number,
-                "invoice_date": inv_row.invoice_date.isoformat() if inv_row.invoice_date else None,
-                "due_date": inv_row.due_date.isoformat() if inv_row.due_date else None,
-                "amount": round(grand_total, 2),
-            }
-        )
+        details.append(_invoice_dict(r, grand_total))
 
     return {
-        "customer": {
-            "name": customer.fname,
-            "prename": customer.prename or "",
-            "tax_id": customer.cf_taxid,
-            "branch": "สำนักงานใหญ่" if customer.cf_hq == 1 else f"สาขาที่ {customer.cf_branch}",
-            "address": customer.cf_personaddress,
-            "person_id": customer.personid,
-        },
+        "customer": customer_out,
         "invoices": details,
         "summary": {"total_amount": round(total_amount, 2)},
     }
@@ -317,13 +255,6 @@ def create_billing_note(payload: BillNotePayload, db: Session = Depends(get_db))
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
 
-    # Guard: prevent reusing invoices already in any bill
-    wanted = {it.invoice_number for it in payload.items}
-    used = _used_invoice_numbers(db)
-    dup = sorted(list(wanted & used))
-    if dup:
-        raise HTTPException(status_code=409, detail={"message": "บางใบกำกับถูกใช้ในใบวางบิลอื่นแล้ว", "duplicates": dup})
-
     new_bill_number = generate_next_billnote_number(db)
 
     bill_date_today = payload.bill_date
@@ -347,42 +278,35 @@ def create_billing_note(payload: BillNotePayload, db: Session = Depends(get_db))
         cf_taxid=customer.cf_taxid,
     )
     db.add(new_bill)
+    db.flush()
 
-    for it in payload.items:
-        db.add(
-            models.BillNoteItem(
-                billnote_number=new_bill_number,
-                invoice_number=it.invoice_number,
-                invoice_date=it.invoice_date,
-                due_date=it.due_date,
-                amount=it.amount,
-            )
-        )
+    # Guard: ใบกำกับที่อยู่ในใบวางบิลอื่นแล้ว -> ยกเลิกทั้งหมด (เลขใบวางบิลที่จองไว้ถูกคืนด้วย)
+    dup = _insert_items(db, new_bill_number, payload.items)
+    if dup:
+        db.rollback()
+        raise _conflict(dup)
 
     db.commit()
     db.refresh(new_bill)
     return {"ok": True, "billnote_number": new_bill.billnote_number, "idx": new_bill.idx}
 
 @router.get("/api/suggest/bill-notes")
-def suggest_bill_note_numbers(q: Optional[str] = None, db: Session = Depends(get_db)):
+async def suggest_bill_note_numbers(q: Optional[str] = None, db: AsyncSession = Depends(get_async_read_db)):
     if not q or len(q.strip()) < 2:
         return []
     search_term = f"%{q.strip()}%"
     query = (
-        db.query(models.BillNote.billnote_number)
+        select(models.BillNote.billnote_number)
         .filter(models.BillNote.billnote_number.ilike(search_term))
         .order_by(models.BillNote.billnote_number.desc())
         .limit(10)
     )
-    return [r[0] for r in query.all()]
+    return list((await db.execute(query)).scalars().all())
 
 @router.get("/api/search-billing-notes")
-def search_billing_notes(start: Optional[str] = None, end: Optional[str] = None, q: Optional[str] = None, db: Session = Depends(get_db)):
+def search_billing_notes(start: Optional[str] = None, end: Optional[str] = None, q: Optional[str] = None, db: Session = Depends(get_read_db)):
     query = db.query(models.BillNote)
-    if start:
-        query = query.filter(models.BillNote.bill_date >= _to_date(start))
-    if end:
-        query = query.filter(models.BillNote.bill_date <= _to_date(end))
+    query = periods.apply(query, models.BillNote.bill_date, start=start, end=end)
     if q:
         search_term = f"%{q.strip()}%"
         query = query.filter(
@@ -400,13 +324,6 @@ def update_billing_note(bill_note_number: str, payload: BillNoteUpdatePayload, d
     if not bill_note:
         raise HTTPException(status_code=404, detail="Bill Note not found")
 
-    # Guard: prevent reusing invoices that belong to other bills
-    wanted = {it.invoice_number for it in payload.items}
-    used_elsewhere = _used_invoice_numbers(db, exclude_billnote=bill_note_number)
-    dup = sorted(list(wanted & used_elsewhere))
-    if dup:
-        raise HTTPException(status_code=409, detail={"message": "บางใบกำกับถูกใช้ในใบวางบิลอื่นแล้ว", "duplicates": dup})
-
     bill_note.bill_date = payload.bill_date or datetime.now().date()
     if payload.items:
         latest_invoice_date = max((it.invoice_date for it in payload.items if it.invoice_date), default=None)
@@ -414,20 +331,15 @@ def update_billing_note(bill_note_number: str, payload: BillNoteUpdatePayload, d
     else:
         bill_note.payment_duedate = None
 
-    # replace items
+    # replace items (ของใบนี้ถูกลบก่อน ที่ชนจึงเป็นใบกำกับของใบวางบิลอื่นเท่านั้น)
     db.query(models.BillNoteItem).filter(models.BillNoteItem.billnote_number == bill_note_number).delete()
-    for it in payload.items:
-        db.add(
-            models.BillNoteItem(
-                billnote_number=bill_note_number,
-                invoice_number=it.invoice_number,
-                invoice_date=it.invoice_date,
-                due_date=it.due_date,
-                amount=it.amount,
-            )
-        )
+    dup = _insert_items(db, bill_note_number, payload.items)
+    if dup:
+        db.rollback()
+        raise _conflict(dup)
 
     db.commit()
+    pdf_cache.invalidate(pdf_cache.make_tag("billnote", bill_note_number))
     return {"ok": True, "billnote_number": bill_note_number}
 
 @router.delete("/api/billing-notes/{bill_note_number}")
@@ -437,4 +349,5 @@ def delete_billing_note(bill_note_number: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Bill Note not found")
     db.delete(bill_note)
     db.commit()
+    pdf_cache.invalidate(pdf_cache.make_tag("billnote", bill_note_number))
     return {"ok": True}
\ No newline at end of file
@@ -1,23 +1,16 @@
 # app/cars.py
 from typing import Optional
-from fastapi import APIRouter, Depends, HTTPException, Query, Body
+from fastapi import APIRouter, Depends, HTTPException, Query, Body, Request
 from pydantic import BaseModel, field_validator
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
+from sqlalchemy import select
 from sqlalchemy.exc import IntegrityError
 
-from .database import SessionLocal
-from . import models
+from .deps import get_db
+from . import master_cache, models
 
 router = APIRouter()
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 # --------- Pydantic ---------
 class CarIn(BaseModel):
     number_plate: str
@@ -46,46 +39,59 @@ class CarOut(BaseModel):
     car_brand: Optional[str] = None
     province: Optional[str] = None
 
+# --------- Master cache -----
+def _load_cars(db: Session) -> list:
+    rows = db.query(models.Car).order_by(models.Car.idx.asc()).all()
+    return [{"idx": r.idx, "number_plate": r.number_plate, "car_brand": r.car_brand, "province": r.province} for r in rows]
+
+def _load_car_brands(db: Session) -> list:
+    rows = db.execute(select(models.CarBrand.brand_name).order_by(models.CarBrand.brand_name.asc())).all()
+    return [{"brand_name": r[0]} for r in rows]
+
+def _load_provinces(db: Session) -> list:
+    rows = db.execute(select(models.ProvinceNostra.prov_nam_t).order_by(models.ProvinceNostra.prov_nam_t.asc())).all()
+    return [{"prov_nam_t": r[0]} for r in rows]
+
+master_cache.register("cars", _load_cars)
+master_cache.register("car_brands", _load_car_brands)
+master_cache.register("provinces", _load_provinces)
+
+def _suggest(request: Request, e: master_cache.Entry, field: str, q: str, limit: int):
+    """ค้นหาแบบ ILIKE '%q%' ในแคช เรียงตาม field"""
+    needle = q.strip().casefold()
+    def build():
+        hits = [r for r in e.rows if master_cache.contains(r[field], needle)]
+        hits.sort(key=lambda r: r[field])
+        return [{field: r[field]} for r in hits[:limit]]
+    return master_cache.respond(request, e, build)
+
 # --------- Suggest ----------
 @router.get("/api/suggest/number_plate")
-def suggest_number_plate(q: str = Query("", min_length=1), limit: int = Query(15, ge=1, le=50), db: Session = Depends(get_db)):
-    pat = f"%{q.strip()}%"
-    rows = (
-        db.query(models.Car)
-        .filter(models.Car.number_plate.ilike(pat))
-        .order_by(models.Car.number_plate.asc())
-        .limit(limit)
-        .all()
-    )
-    return [{"number_plate": r.number_plate} for r in rows]
+async def suggest_number_plate(request: Request, q: str = Query("", min_length=1), limit: int = Query(15, ge=1, le=50)):
+    return _suggest(request, await master_cache.aget("cars"), "number_plate", q, limit)
 
 # --------- List -------------
 @router.get("/api/cars")
 def list_cars(
+    request: Request,
     search: str = Query("", description="ค้นหา (ทะเบียน / ยี่ห้อ / จังหวัด)"),
     page: int = Query(1, ge=1),
     page_size: int = Query(50, ge=1, le=200),
-    db: Session = Depends(get_db)
 ):
-    q = db.query(models.Car)
-    if search.strip():
-        pat = f"%{search.strip()}%"
-        q = q.filter(or_(
-            models.Car.number_plate.ilike(pat),
-            models.Car.car_brand.ilike(pat),
-            models.Car.province.ilike(pat)
-        ))
-    total = q.count()
-    rows = q.order_by(models.Car.idx.asc()).offset((page-1)*page_size).limit(page_size).all()
-    return {
-        "total": total,
-        "page": page,
-        "page_size": page_size,
-        "items": [
-            {"idx": r.idx, "number_plate": r.number_plate, "car_brand": r.car_brand, "province": r.province}
-            for r in rows
-        ]
-    }
+    e = master_cache.get("cars")
+
+    def build():
+        rows = e.rows
+        needle = search.strip().casefold()
+        if needle:
+            rows = [r for r in rows if any(master_cache.contains(r[k], needle) for k in ("number_plate", "car_brand", "province"))]
+        return {
+            "total": len(rows),
+            "page": page,
+            "page_size": page_size,
+            "items": rows[(page-1)*page_size:page*page_size],
+        }
+    return master_cache.respond(request, e, build)
 
 # --------- Create -----------
 @router.post("/api/cars", response_model=CarOut)
@@ -101,6 +107,7 @@ def create_car(data: CarIn, db: Session = Depends(get_db)):
         db.rollback()
         raise HTTPException(status_code=409, detail=f"save car failed: {e.orig}")
     db.refresh(car)
+    master_cache.invalidate("cars")
     return CarOut(idx=car.idx, number_plate=car.number_plate, car_brand=car.car_brand, province=car.province)
 
 # --------- Update -----------
@@ -120,6 +127,7 @@ def update_car(idx: int, data: CarIn, db: Session = Depends(get_db)):
         db.rollback()
         raise HTTPException(status_code=409, detail=f"update car failed: {e.orig}")
     db.refresh(car)
+    master_cache.invalidate("cars")
     return CarOut(idx=car.idx, number_plate=car.number_plate, car_brand=car.car_brand, province=car.province)
 
 # --------- Delete -----------
@@ -128,38 +136,23 @@ def delete_car(idx: int, db: Session = Depends(get_db)):
     car = db.query(models.Car).filter(models.Car.idx == idx).first()
     if not car: raise HTTPException(status_code=404, detail="not found")
     db.delete(car); db.commit()
+    master_cache.invalidate("cars")
     return
 
 # --------- Suggest: car brand ----------
 @router.get("/api/suggest/car_brand")
-def suggest_car_brand(
+async def suggest_car_brand(
+    request: Request,
     q: str = Query("", min_length=1),
     limit: int = Query(20, ge=1, le=100),
-    db: Session = Depends(get_db)
 ):
-    pat = f"%{q.strip()}%"
-    rows = (
-        db.query(models.CarBrand.brand_name)
-        .filter(models.CarBrand.brand_name.ilike(pat))
-        .order_by(models.CarBrand.brand_name.asc())
-        .limit(limit)
-        .all()
-    )
-    return [{"brand_name": r[0]} for r in rows]
+    return _suggest(request, await master_cache.aget("car_brands"), "brand_name", q, limit)
 
 # --------- Suggest: province ----------
 @router.get("/api/suggest/province")
-def suggest_province(
+async def suggest_province(
+    request: Request,
     q: str = Query("", min_length=1),
     limit: int = Query(20, ge=1, le=100),
-    db: Session = Depends(get_db)
 ):
-    pat = f"%{q.strip()}%"
-    rows = (
-        db.query(models.ProvinceNostra.prov_nam_t)
-        .filter(models.ProvinceNostra.prov_nam_t.ilike(pat))
-        .order_by(models.ProvinceNostra.prov_nam_t.asc())
-        .limit(limit)
-        .all()
-    )
-    return [{"prov_nam_t": r[0]} for r in rows]
+    return _suggest(request, await master_cache.aget("provinces"), "prov_nam_t", q, limit)
@@ -0,0 +1,164 @@
+# app/compression.py
+"""
+บีบอัด response (brotli / gzip) ตาม Accept-Encoding ของ browser
+
+- บีบเฉพาะ JSON / HTML / text / css / js ที่ใหญ่กว่า COMPRESS_MIN_BYTES
+  (รายการบิลพร้อมรายการสินค้า, รายงานภาษีขาย, หน้า HTML)
+- เลือก br ก่อนถ้าติดตั้งโมดูล brotli และ browser รับได้ ไม่งั้น gzip
+- response แบบ streaming (export CSV ฯลฯ) บีบต่อเนื่องทีละ chunk
+- ไม่ยุ่งกับ response ที่มี Content-Encoding อยู่แล้ว (ไฟล์ที่บีบไว้ก่อนใน /assets),
+  206 (Range), 204, 304 และไฟล์ที่บีบอยู่แล้ว (pdf, zip, xlsx, png, ...)
+- ETag ที่ถูกบีบจะกลายเป็น weak (W/"...") ตาม RFC 9110 — master_cache.respond เทียบแบบ weak แล้ว
+
+ตั้งค่าผ่าน environment:
+  COMPRESS_MIN_BYTES        ขนาดขั้นต่ำที่จะบีบ (ค่าเริ่มต้น 1024, 0 = ปิด)
+  COMPRESS_GZIP_LEVEL       1-9 (ค่าเริ่มต้น 6)
+  COMPRESS_BROTLI_QUALITY   0-11 (ค่าเริ่มต้น 4 — ระดับสูงกว่านี้ช้าเกินไปสำหรับบีบสด)
+"""
+import os
+import zlib
+from typing import List
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # brotli เป็น optional — ไม่มีก็ใช้ gzip อย่างเดียว
+    brotli = None
+
+MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "4"))
+
+COMPRESSIBLE_TYPES = (
+    "application/json", "text/", "application/javascript", "image/svg+xml",
+)
+_SKIP_STATUS = {204, 206, 304}
+
+
+def accepted_encodings(accept_encoding: str) -> List[str]:
+    """encoding ที่ใช้ได้ เรียงตามที่เราอยากใช้ ("br", "gzip") — ตัดตัวที่ q=0 ออก"""
+    accepted = set()
+    for part in (accept_encoding or "").lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip())
+    out = []
+    if brotli is not None and "br" in accepted:
+        out.append("br")
+    if "gzip" in accepted:
+        out.append("gzip")
+    return out
+
+
+class _Compressor:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._c = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._c = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # 31 = gzip header
+
+    def compress(self, data: bytes) -> bytes:
+        return self._c.process(data) if self.encoding == "br" else self._c.compress(data)
+
+    def finish(self) -> bytes:
+        return self._c.finish() if self.encoding == "br" else self._c.flush()
+
+
+def _compressible(headers: Headers) -> bool:
+    if "content-encoding" in headers:
+        return False
+    ctype = headers.get("content-type", "").lower()
+    return ctype.startswith(COMPRESSIBLE_TYPES)
+
+def _add_vary(headers: MutableHeaders):
+    vary = headers.get("vary", "")
+    if "accept-encoding" not in vary.lower():
+        headers["Vary"] = f"{vary}, Accept-Encoding" if vary else "Accept-Encoding"
+
+
+class CompressionMiddleware:
+    """ASGI middleware (ใส่ใน main.py: app.add_middleware(CompressionMiddleware))"""
+
+    def __init__(self, app, minimum_size: int = MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.minimum_size <= 0:
+            await self.app(scope, receive, send)
+            return
+        encodings = accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+        if not encodings:
+            await self.app(scope, receive, send)
+            return
+
+        start = None          # http.response.start ที่ยังไม่ได้ส่ง (รอดูขนาด body ก่อน)
+        compressor = None     # สร้างเมื่อรู้แล้วว่าจะบีบ
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, compressor, passthrough
+            mtype = message["type"]
+            if passthrough:
+                await send(message)
+                return
+
+            if mtype == "http.response.start":
+                if message["status"] in _SKIP_STATUS or not _compressible(Headers(raw=message["headers"])):
+                    passthrough = True
+                    await send(message)
+                else:
+                    start = message
+                return
+
+            if mtype != "http.response.body":
+                # เช่น http.response.pathsend — ส่งตามเดิม
+                passthrough = True
+                if start is not None:
+                    await send(start)
+                    start = None
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more = message.get("more_body", False)
+
+            if compressor is None:
+                if not more and len(body) < self.minimum_size:
+                    # เล็กเกินไป — ส่งตามเดิม
+                    _add_vary(MutableHeaders(scope=start))
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+                compressor = _Compressor(encodings[0])
+                headers = MutableHeaders(scope=start)
+                headers["Content-Encoding"] = compressor.encoding
+                _add_vary(headers)
+                etag = headers.get("etag")
+                if etag and not etag.startswith("W/"):
+                    headers["ETag"] = "W/" + etag
+                if not more:
+                    data = compressor.compress(body) + compressor.finish()
+                    headers["Content-Length"] = str(len(data))
+                    await send(start)
+                    await send({"type": "http.response.body", "body": data})
+                    return
+                del headers["Content-Length"]
+                await send(start)
+
+            data = compressor.compress(body)
+            if not more:
+                data += compressor.finish()
+            if data or not more:
+                await send({"type": "http.response.body", "body": data, "more_body": more})
+
+        await self.app(scope, receive, send_wrapper)
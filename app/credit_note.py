@@ -1,22 +1,24 @@
 # app/credit_note.py
-from fastapi import APIRouter, Request, Depends, Body, HTTPException, Query
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse
+import re
+from fastapi import APIRouter, Request, Response, Depends, Body, HTTPException, Query
+from fastapi.responses import HTMLResponse, JSONResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import Column, Integer, String, Float, Date, ForeignKey, func, text, or_, Numeric
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import Column, Integer, String, Float, Date, ForeignKey, and_, cast, func, text, or_, select, tuple_, Numeric
 from datetime import datetime, date
-from typing import Optional
+from typing import List, Optional
 from pathlib import Path
-import tempfile, uuid
-from . import models  
+from pydantic import BaseModel
+from . import customer_search, doc_numbers, master_cache, models, pdf_pool, pdf_cache, periods, product_prices, static_assets
 
-from .database import SessionLocal, Base
-from weasyprint import HTML, CSS
-from weasyprint.text.fonts import FontConfiguration
+from .database import Base
+from .deps import get_db, get_read_db, get_async_read_db
 from fastapi.templating import Jinja2Templates
 
 router = APIRouter()
 BASE_DIR = Path(__file__).resolve().parent
 templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
+templates.env.globals["static_url"] = static_assets.static_url
 
 class CreditNote(Base):
     __tablename__ = "credit_note"
@@ -65,40 +67,47 @@ class CreditNoteItem(Base):
     cf_itemid = Column(String(6))
     cf_itemname = Column(String(1000))
 
-def get_db():
-    db = SessionLocal()
-    try: yield db
-    finally: db.close()
-
 def _to_date(s: str) -> date:
     try: return date.fromisoformat(s)
     except Exception: return datetime.now().date()
 
 def _be_year(ad: int) -> int: return ad + 543
 
-def generate_creditnote_number(db: Session, doc_date: date) -> str:
-    dd = f"{doc_date.day:02d}"
-    mm = f"{doc_date.month:02d}"
-    be = _be_year(doc_date.year)
+CREDIT_NOTE_PREFIX = "SSCR"
+# SSCR<running>-<DD><MM>/<ปี พ.ศ.>  running นับต่อเนื่องทั้งปี
+_CREDIT_NOTE_NO_RE = re.compile(rf"^{CREDIT_NOTE_PREFIX}(\d+)-(\d{{4}})/(\d{{4}})$")
 
-    prefix = "SSCR"
-    suffix = f"-{dd}{mm}/{be}"
+def _seed_creditnote(db: Session, period: str) -> int:
+    """running สูงสุดของปี (พ.ศ.) ที่มีอยู่แล้ว (ใช้ครั้งแรกของแต่ละปีเท่านั้น)"""
+    run = func.substring(CreditNote.creditnote_number, f"^{CREDIT_NOTE_PREFIX}([0-9]+)-")
+    return (
+        db.query(func.max(cast(run, Integer)))
+        .filter(CreditNote.creditnote_number.like(f"{CREDIT_NOTE_PREFIX}%/{period}"))
+        .scalar()
+    ) or 0
 
-    rows = (
-        db.query(CreditNote.creditnote_number)
-        .filter(CreditNote.creditnote_number.like(f"{prefix}%/{be}"))
-        .all()
-    )
+doc_numbers.register("credit_note", _seed_creditnote)
 
-    max_run = 0
-    for (no,) in rows:
-        try:
-            run = int(no.replace(prefix, "").split("-", 1)[0])
-            max_run = max(max_run, run)
-        except Exception:
-            pass
+def _format_creditnote_number(run: int, doc_date: date) -> str:
+    return f"{CREDIT_NOTE_PREFIX}{run}-{doc_date.day:02d}{doc_date.month:02d}/{_be_year(doc_date.year)}"
+
+def generate_creditnote_number(db: Session, doc_date: date) -> str:
+    """เลขที่คาดว่าจะได้ (แสดงในฟอร์ม) — เลขจริงถูกจองตอนบันทึก ดู _allocate_creditnote_number"""
+    run = doc_numbers.peek(db, "credit_note", str(_be_year(doc_date.year)))
+    return _format_creditnote_number(run, doc_date)
 
-    return f"{prefix}{max_run + 1}{suffix}"
+def _allocate_creditnote_number(db: Session, cn_number: str) -> str:
+    """
+    เลขในรูปแบบอัตโนมัติ (จากปุ่มสร้างเลข) จองเลขจริงจากตัวนับของปีนั้น
+    ถ้ามีคนบันทึกเลขที่แสดงไปก่อนแล้ว จะได้เลขถัดไปแทน (ตอบเลขจริงกลับไปใน response)
+    เลขที่พิมพ์เองในรูปแบบอื่นใช้ตามที่ส่งมา
+    """
+    m = _CREDIT_NOTE_NO_RE.match(cn_number)
+    if not m:
+        return cn_number
+    ddmm, be = m.group(2), m.group(3)
+    run = doc_numbers.allocate(db, "credit_note", be)
+    return f"{CREDIT_NOTE_PREFIX}{run}-{ddmm}/{be}"
 
 CREDIT_NOTE_ROWS_PER_PAGE = 15
 CREDIT_NOTE_TESTED_ROWS_PER_PAGE = (15, 16, 17, 18, 19, 20)
@@ -119,76 +128,94 @@ def _paginate_credit_note_rows(rows: list[dict]) -> tuple[list[dict], int]:
 def credit_note_form_page(request: Request):
     return templates.TemplateResponse(request, "credit_note_form.html", {"request": request})
 
+# --- ค้นหาลูกค้า (จากแคช "customers" ที่ลงทะเบียนใน customers.py) ---
+_CUSTOMER_LOOKUP_FIELDS = (
+    "personid", "fname", "tel", "mobile",
+    "cf_personaddress", "cf_personzipcode", "cf_provincename", "cf_taxid",
+)
+
+def _suggest_customers(request: Request, e, field: str, key, needle: str, limit: int):
+    """key(row) -> ข้อความที่ใช้เทียบ (รูปเดียวกับ needle)"""
+    def build():
+        items = sorted(r[field] for r in e.rows if r[field] and needle in key(r))
+        return {"items": items[:limit]}
+    return master_cache.respond(request, e, build)
+
 @router.get("/api/customers/suggest-personid")
-def api_cust_suggest_personid(q: str = Query(""), limit: int = Query(10, ge=1, le=50), db: Session = Depends(get_db)):
-    q = q.strip()
-    qs = db.query(models.CustomerList.personid).filter(models.CustomerList.personid.ilike(f"%{q}%"))\
-            .order_by(models.CustomerList.personid.asc()).limit(limit).all()
-    return {"items": [r[0] for r in qs if r[0]]}
+async def api_cust_suggest_personid(request: Request, q: str = Query(""), limit: int = Query(10, ge=1, le=50)):
+    return _suggest_customers(request, await master_cache.aget("customers"), "personid",
+                              lambda r: r["personid"].casefold(), q.strip().casefold(), limit)
 
 @router.get("/api/customers/suggest-name")
-def api_cust_suggest_name(q: str = Query(""), limit: int = Query(10, ge=1, le=50), db: Session = Depends(get_db)):
-    q = q.strip()
-    qs = db.query(models.CustomerList.fname).filter(models.CustomerList.fname.ilike(f"%{q}%"))\
-            .order_by(models.CustomerList.fname.asc()).limit(limit).all()
-    return {"items": [r[0] for r in qs if r[0]]}
+async def api_cust_suggest_name(request: Request, q: str = Query(""), limit: int = Query(10, ge=1, le=50)):
+    # เทียบด้วย search_key (ไม่สนคำนำหน้า บริษัท/หจก., ช่องว่าง, เลขไทย, ลำดับวรรณยุกต์)
+    return _suggest_customers(request, await master_cache.aget("customers"), "fname",
+                              lambda r: r["search_key"], customer_search.query_key(q), limit)
 
 @router.get("/api/customers/by-personid")
-def api_cust_by_personid(personid: str = Query(...), db: Session = Depends(get_db)):
-    c = db.query(models.CustomerList).filter(models.CustomerList.personid == personid).first()
+def api_cust_by_personid(personid: str = Query(...)):
+    c = master_cache.get("customers").lookup("personid", personid)
     if not c:
         raise HTTPException(status_code=404, detail="customer not found")
-    return {
-        "personid": c.personid, "fname": c.fname,
-        "tel": c.tel, "mobile": c.mobile,
-        "cf_personaddress": c.cf_personaddress,
-        "cf_personzipcode": c.cf_personzipcode,
-        "cf_provincename": c.cf_provincename,
-        "cf_taxid": c.cf_taxid,
-    }
+    return {k: c[k] for k in _CUSTOMER_LOOKUP_FIELDS}
 
 @router.get("/api/customers/by-name")
-def api_cust_by_name(name: str = Query(...), db: Session = Depends(get_db)):
-    c = db.query(models.CustomerList).filter(models.CustomerList.fname == name).first()
+def api_cust_by_name(name: str = Query(...)):
+    c = master_cache.get("customers").lookup("fname", name)
     if not c:
         raise HTTPException(status_code=404, detail="customer not found")
-    return {
-        "personid": c.personid, "fname": c.fname,
-        "tel": c.tel, "mobile": c.mobile,
-        "cf_personaddress": c.cf_personaddress,
-        "cf_personzipcode": c.cf_personzipcode,
-        "cf_provincename": c.cf_provincename,
-        "cf_taxid": c.cf_taxid,
-    }
+    return {k: c[k] for k in _CUSTOMER_LOOKUP_FIELDS}
+
+_PREVIEW_SQL = text("""
+    WITH head AS (
+        SELECT creditnote_number, created_at FROM credits.credit_note WHERE creditnote_number = :no
+    ),
+    items AS (
+        SELECT it.idx, it.invoice_number, it.cf_itemname, it.sum_quantity, it.fine, it.price_after_fine
+        FROM credits.credit_note_item AS it
+        WHERE it.creditnote_number = :no
+    ),
+    buyer AS (
+        -- ลูกค้าของ invoice แรกที่มีเลขที่
+        SELECT c.idx, c.fname, c.cf_personaddress, c.cf_hq, c.cf_branch, c.cf_taxid
+        FROM products.customer_list AS c
+        JOIN ss_invoices.invoices AS inv ON inv.personid = c.personid
+        WHERE inv.invoice_number = (
+            SELECT invoice_number FROM items WHERE invoice_number <> '' ORDER BY idx LIMIT 1
+        )
+        LIMIT 1
+    )
+    SELECT h.creditnote_number, h.created_at,
+           i.idx AS item_idx, i.invoice_number, i.cf_itemname, i.sum_quantity, i.fine, i.price_after_fine,
+           d.invoice_date,
+           b.idx IS NOT NULL AS buyer_found,
+           b.fname, b.cf_personaddress, b.cf_hq, b.cf_branch, b.cf_taxid
+    FROM head AS h
+    LEFT JOIN items AS i ON true
+    LEFT JOIN LATERAL (
+        SELECT invoice_date FROM ss_invoices.invoices
+        WHERE invoice_number = btrim(i.invoice_number)
+        LIMIT 1
+    ) AS d ON true
+    LEFT JOIN buyer AS b ON true
+    ORDER BY i.idx
+""")
 
 @router.get("/credit_note.html", response_class=HTMLResponse)
 def credit_note_preview_page(request: Request, no: str = Query(...), db: Session = Depends(get_db)):
-    # ดึงหัวเอกสาร + รายการ
-    head = db.query(CreditNote).filter(CreditNote.creditnote_number == no).first()
-    if not head:
+    # หัวเอกสาร + รายการ (+ วันที่ใบกำกับ) + ลูกค้าจากใบกำกับแรก ในคิวรีเดียว (แถวละรายการ)
+    data = db.execute(_PREVIEW_SQL, {"no": no}).all()
+    if not data:
         return HTMLResponse("<div style='padding:20px'>ไม่พบเลขที่เอกสาร</div>", status_code=404)
-
-    items = db.query(CreditNoteItem).filter(CreditNoteItem.creditnote_number == no).all()
+    head = data[0]
+    items = [r for r in data if r.item_idx is not None]
 
     # --- map invoice_number -> วันที่ใบกำกับ (พ.ศ.) ---
     inv_date_map: dict[str, str] = {}
-    from sqlalchemy import text  # ถ้ายังไม่ได้ import ไว้ข้างบนก็เพิ่มบรรทัดนี้
-
     for it in items:
         inv_no = (it.invoice_number or "").strip()
-        if not inv_no or inv_no in inv_date_map:
-            continue
-        row = db.execute(
-            text("""
-                SELECT invoice_date
-                FROM ss_invoices.invoices
-                WHERE invoice_number = :inv
-                LIMIT 1
-            """),
-            {"inv": inv_no},
-        ).first()
-        if row and row[0]:
-            d = row[0]
+        if inv_no and it.invoice_date and inv_no not in inv_date_map:
+            d = it.invoice_date
             inv_date_map[inv_no] = f"{d.day:02d}/{d.month:02d}/{d.year + 543}"
 
     # สร้างข้อมูลสำหรับรายงาน
@@ -226,22 +253,7 @@ def credit_note_preview_page(request: Request, no: str = Query(...), db: Session
     be_date = f"{d.day:02d}/{d.month:02d}/{d.year + 543}"
 
     # ---------------- Buyer จาก DB ----------------
-    buyer = None
-    try:
-        from . import models
-        # ใช้ invoice แรกที่มีเลขที่
-        first_inv_no = next((it.invoice_number for it in items if it.invoice_number), None)
-        if first_inv_no:
-            Inv = models.Invoice
-            Cust = models.CustomerList
-            buyer = (
-                db.query(Cust)
-                .join(Inv, Inv.personid == Cust.personid)
-                .filter(Inv.invoice_number == first_inv_no)
-                .first()
-            )
-    except Exception:
-        buyer = None
+    buyer = head if head.buyer_found else None
 
     if buyer:
         branch_info = "สำนักงานใหญ่" if getattr(buyer, "cf_hq", 0) == 1 else (buyer.cf_branch or "")
@@ -307,6 +319,7 @@ def create_credit_note(payload: dict = Body(...), db: Session = Depends(get_db))
         if not cn_number:
             raise HTTPException(400, "missing creditnote_number")
 
+        cn_number = _allocate_creditnote_number(db, cn_number)
         if db.query(CreditNote).filter(
             CreditNote.creditnote_number == cn_number
         ).first():
@@ -397,7 +410,6 @@ def export_creditnote_pdf(payload: dict = Body(...), db: Session = Depends(get_d
     เป็นไฟล์ PDF เดียวกัน (2 หน้า)
     """
     base_dir = BASE_DIR
-    css_path = base_dir / "static" / "css" / "credit_note.css"
 
     # 1) สร้าง context พื้นฐานเหมือน preview (ไม่สน variant ใน payload)
     ctx_common = _build_creditnote_context_from_payload(payload, db)
@@ -426,35 +438,26 @@ def export_creditnote_pdf(payload: dict = Body(...), db: Session = Depends(get_d
                 "</body></html>"
     )
 
-    # 5) เขียนไฟล์ PDF ด้วย WeasyPrint
+    # 5) เรนเดอร์ PDF ด้วย WeasyPrint ใน pdf_pool (ฟอนต์ + credit_note.css โหลดค้างไว้แล้ว)
     try:
-        raw_no = (payload.get("creditnote_number") or "document").strip()
-        safe_no = (
-            raw_no.replace("/", "-")
-                  .replace("\\", "-")
-                  .replace(" ", "_")
-        )
-        tmp_pdf = Path(tempfile.gettempdir()) / f"credit_note_{safe_no}.pdf"
-
-        # font_config ต้องเป็นตัวเดียวกันทั้งใน CSS() และ write_pdf()
-        # ไม่งั้น @font-face (TH Sarabun New) ถูกทิ้งเงียบ ๆ แล้ว fallback เป็นฟอนต์ระบบ
-        font_config = FontConfiguration()
-        HTML(string=html_str, base_url=str(base_dir)).write_pdf(
-            str(tmp_pdf),
-            stylesheets=[CSS(filename=str(css_path), font_config=font_config)],
-            font_config=font_config,
+        pdf_bytes = pdf_cache.render_cached(
+            pdf_cache.make_tag("creditnote", payload.get("creditnote_number")),
+            html_str,
+            base_url=str(base_dir),
+            stylesheet="credit_note",
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"weasyprint error: {e}")
 
-    if not tmp_pdf.exists():
-        raise HTTPException(status_code=500, detail="PDF file not generated")
-
-    return FileResponse(
-        path=tmp_pdf,
-        media_type="application/pdf",
-        filename=tmp_pdf.name
+    raw_no = (payload.get("creditnote_number") or "document").strip()
+    safe_no = (
+        raw_no.replace("/", "-")
+              .replace("\\", "-")
+              .replace(" ", "_")
     )
+    return pdf_pool.pdf_response(pdf_bytes, f"credit_note_{safe_no}.pdf")
 
 # ==============================================================================
 # START: โค้ดที่แก้ไข
@@ -593,43 +596,22 @@ def preview_credit_note(request: Request, payload: dict = Body(...), db: Session
 
 # -------- GRN APIs --------
 @router.get("/api/grn/suggest")
-def suggest_grn(q: str = Query(""), limit: int = Query(10, ge=1, le=50), db: Session = Depends(get_db)):
-    sql = text("""
-        SELECT DISTINCT grn_number
-        FROM ss_invoices.invoices
-        WHERE grn_number ILIKE :pat
-        ORDER BY grn_number
-        LIMIT :lim
-    """)
-    pat = f"%{q.strip()}%" if q else "%"
-    rows = db.execute(sql, {"pat": pat, "lim": limit}).fetchall()
-    return {"items": [r[0] for r in rows if r[0]]}
+async def suggest_grn(q: str = Query(""), limit: int = Query(10, ge=1, le=50), db: AsyncSession = Depends(get_async_read_db)):
+    """ค้นจาก ss_invoices.grn_index (แถวละ GRN, trigram index) เลขที่ขึ้นต้นด้วยคำค้นมาก่อน"""
+    g = models.GrnIndex.grn_number
+    needle = q.strip()
+    query = select(g)
+    if needle:
+        pat = needle.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        query = query.where(g.ilike(f"%{pat}%", escape="\\")).order_by(~g.ilike(f"{pat}%", escape="\\"), g)
+    else:
+        query = query.order_by(g)
+    rows = (await db.execute(query.limit(limit))).scalars().all()
+    return {"items": list(rows)}
 
 @router.get("/api/grn/summary")
-def grn_summary(grn: str = Query(..., min_length=1), db: Session = Depends(get_db)):
-    sql = text("""
-        WITH inv_first AS (
-          SELECT invoice_number, personid
-          FROM ss_invoices.invoices
-          WHERE grn_number = :grn
-          ORDER BY invoice_number
-          LIMIT 1
-        ),
-        src AS (
-          SELECT it.cf_itemid, it.cf_itemname, it.quantity
-          FROM ss_invoices.invoices AS inv
-          JOIN ss_invoices.invoice_items AS it
-            ON inv.idx::text = it.invoice_number
-          WHERE inv.grn_number = :grn
-        )
-        SELECT
-          (SELECT invoice_number FROM inv_first) AS invoice_number_first,
-          (SELECT personid FROM inv_first) AS personid_first,
-          (SELECT ARRAY_AGG(DISTINCT cf_itemid) FROM src) AS product_codes,
-          (SELECT ARRAY_AGG(DISTINCT cf_itemname) FROM src) AS descriptions,
-          (SELECT COALESCE(SUM(quantity),0) FROM src) AS quantity_sum
-    """)
-    row = db.execute(sql, {"grn": grn}).first()
+def grn_summary(grn: str = Query(..., min_length=1), db: Session = Depends(get_read_db)):
+    row = db.get(models.GrnIndex, grn)
     if not row:
         return {
             "invoice_number": None,
@@ -640,81 +622,67 @@ def grn_summary(grn: str = Query(..., min_length=1), db: Session = Depends(get_d
             "buyer": None
         }
 
-    invoice_number = row[0]
-    personid = row[1]
-    product_codes = row[2] or []
-    descriptions = row[3] or []
-    quantity_sum = float(row[4] or 0)
-
-    # (ออปชัน) map personid -> ข้อมูลลูกค้า (ปรับ model ให้ตรงตารางของคุณ)
+    personid = row.first_personid
     buyer = None
-    try:
-        from . import models
-        c = db.query(models.CustomerList).filter(models.CustomerList.personid == personid).first()
+    if personid:
+        c = master_cache.get("customers").lookup("personid", personid)
         if c:
             buyer = {
-                "personid": c.personid,
-                "name": c.fname,
-                "addr": c.cf_personaddress,
-                "tax": c.cf_taxid,
-                "tel": c.tel,
-                "mobile": c.mobile,
-                "zipcode": c.cf_personzipcode,
-                "prov": c.cf_provincename,
+                "personid": c.get("personid"),
+                "name": c.get("fname"),
+                "addr": c.get("cf_personaddress"),
+                "tax": c.get("cf_taxid"),
+                "tel": c.get("tel"),
+                "mobile": c.get("mobile"),
+                "zipcode": c.get("cf_personzipcode"),
+                "prov": c.get("cf_provincename"),
             }
-    except Exception:
-        buyer = None
 
     return {
-        "invoice_number": invoice_number,
+        "invoice_number": row.first_invoice_number,
         "personid": personid,
-        "product_codes": product_codes,
-        "descriptions": descriptions,
-        "quantity_sum": quantity_sum,
+        "product_codes": row.product_codes or [],
+        "descriptions": row.descriptions or [],
+        "quantity_sum": float(row.quantity_sum or 0),
         "buyer": buyer
     }
 @router.get("/api/products/price")
 def api_product_price(
     code: str = Query(..., min_length=1),
     grn: str | None = Query(None),
-    db: Session = Depends(get_db)
+    personid: str | None = Query(None),
+    db: Session = Depends(get_read_db)
 ):
     """
     คืนราคา/หน่วย (cf_itempricelevel_price) ของรหัสสินค้า (cf_itemid)
-    แหล่งข้อมูล: ss_invoices.invoice_items โดย join ss_invoices.invoices
     - ถ้าระบุ grn: เอาราคาจาก invoice ของ GRN นั้นก่อน (ใบล่าสุด)
-    - ถ้าไม่พบ: fallback เป็นราคาล่าสุดของรหัสนั้นจากทุกใบ
+    - ถ้าไม่พบ: ราคาล่าสุดของลูกค้า (ถ้าระบุ personid) แล้วราคาล่าสุดจากทุกใบ (ss_invoices.product_last_price)
+    หลายรหัสพร้อมกันใช้ POST /api/product-prices
     """
-    # 1) พยายามเอาราคาจาก GRN เดียวกัน (ถ้ามีส่งมา)
-    if grn:
-        sql_grn = text("""
-            SELECT it.cf_itempricelevel_price
-            FROM ss_invoices.invoices AS inv
-            JOIN ss_invoices.invoice_items AS it
-              ON inv.idx::text = it.invoice_number
-            WHERE inv.grn_number = :grn
-              AND it.cf_itemid = :code
-            ORDER BY inv.invoice_date DESC NULLS LAST, inv.invoice_number DESC
-            LIMIT 1
-        """)
-        row = db.execute(sql_grn, {"grn": grn, "code": code}).first()
-        if row and row[0] is not None:
-            return {"code": code, "price": float(row[0])}
-
-    # 2) fallback: ราคาล่าสุดของรหัสสินค้านี้ (ดูจากวันที่/เลขที่)
-    sql_last = text("""
-        SELECT it.cf_itempricelevel_price
-        FROM ss_invoices.invoices AS inv
-        JOIN ss_invoices.invoice_items AS it
-          ON inv.idx::text = it.invoice_number
-        WHERE it.cf_itemid = :code
-        ORDER BY inv.invoice_date DESC NULLS LAST, inv.invoice_number DESC
-        LIMIT 1
-    """)
-    row2 = db.execute(sql_last, {"code": code}).first()
+    price = product_prices.lookup(db, [(code, grn)], personid=personid)[0]
+    return {"code": code, "price": price if price is not None else 0.0}
+
+PRICE_BATCH_MAX = 500
+
+class PriceQuery(BaseModel):
+    code: str
+    grn: Optional[str] = None
+
+class PriceBatch(BaseModel):
+    items: List[PriceQuery]
+    personid: Optional[str] = None
+
+@router.post("/api/product-prices")
+def api_product_prices(payload: PriceBatch, db: Session = Depends(get_read_db)):
+    """ราคาของหลายรายการ (รหัส + GRN) ในคิวรีเดียว ลำดับเดียวกับที่ส่งมา"""
+    if len(payload.items) > PRICE_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"too many items (max {PRICE_BATCH_MAX})")
+    prices = product_prices.lookup(db, [(it.code, it.grn) for it in payload.items], personid=payload.personid)
     return {
-        "code": code,
-        "price": float(row2[0]) if row2 and row2[0] is not None else 0.0
+        "prices": [
+            {"code": it.code, "grn": it.grn, "price": price if price is not None else 0.0}
+            for it, price in zip(payload.items, prices)
+        ]
     }
 
 
@@ -722,66 +690,102 @@ def api_product_price(
 # SEARCH / DETAIL / UPDATE / DELETE APIs
 # ====================================================
 
+SEARCH_DEFAULT_LIMIT = 100
+SEARCH_MAX_LIMIT = 500
+
+def _encode_search_cursor(created_at, number: str) -> str:
+    return f"{created_at.isoformat() if created_at else ''}|{number}"
+
+def _decode_search_cursor(cursor: str):
+    """'YYYY-MM-DD|เลขที่ใบลดหนี้' (วันที่ว่าง = ใบที่ไม่มีวันที่ ซึ่งอยู่ต้นสุด)"""
+    try:
+        d, no = cursor.split("|", 1)
+        return (date.fromisoformat(d) if d else None), no
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid cursor")
+
 @router.get("/api/search-credit-notes")
 def search_credit_notes(
+    response: Response,
     start: Optional[str] = Query(None),
     end: Optional[str] = Query(None),
     q: Optional[str] = Query(None),
-    db: Session = Depends(get_db)
+    limit: int = Query(SEARCH_DEFAULT_LIMIT, ge=1, le=SEARCH_MAX_LIMIT),
+    cursor: Optional[str] = Query(None, description="ค่าจาก header X-Next-Cursor ของหน้าก่อน"),
+    db: Session = Depends(get_read_db)
 ):
-    """ค้นหาใบลดหนี้ตามช่วงวันที่และคำค้นหา"""
-    query = db.query(CreditNote)
-    
-    if start:
-        d_start = _to_date(start)
-        if d_start:
-            query = query.filter(CreditNote.created_at >= d_start)
-    if end:
-        d_end = _to_date(end)
-        if d_end:
-            query = query.filter(CreditNote.created_at <= d_end)
+    """
+    ค้นหาใบลดหนี้ตามช่วงวันที่และคำค้นหา (created_at desc, เลขที่ desc) แบบ keyset pagination
+    ยอดรวมและชื่อลูกค้าคำนวณในคิวรีเดียวกัน ถ้ายังมีหน้าถัดไป ส่ง cursor กลับใน header X-Next-Cursor
+    """
+    it = CreditNoteItem
+    inv = models.Invoice
+    cust = models.CustomerList
+
+    # correlated subquery: คำนวณเฉพาะแถวในหน้านี้
+    total = (
+        select(func.coalesce(func.sum(
+            func.coalesce(it.sum_quantity, 0) * func.coalesce(it.price_after_fine, 0)
+        ), 0))
+        .where(it.creditnote_number == CreditNote.creditnote_number)
+        .scalar_subquery()
+    )
+    # ชื่อลูกค้าจาก invoice ของรายการแรก
+    first_inv = (
+        select(it.invoice_number)
+        .where(it.creditnote_number == CreditNote.creditnote_number)
+        .order_by(it.idx)
+        .limit(1)
+        .correlate(CreditNote)   # อยู่ลึก 2 ชั้น ต้องระบุเอง
+        .scalar_subquery()
+    )
+    personid = select(inv.personid).where(inv.invoice_number == first_inv).limit(1).scalar_subquery()
+    customer_name = select(cust.fname).where(cust.personid == personid).limit(1).scalar_subquery()
+
+    query = db.query(
+        CreditNote.creditnote_number,
+        CreditNote.created_at,
+        customer_name.label("customer_name"),
+        total.label("total_amount"),
+    )
+    query = periods.apply(query, CreditNote.created_at, start=start, end=end)
     if q and q.strip():
         search_term = f"%{q.strip()}%"
         query = query.filter(CreditNote.creditnote_number.ilike(search_term))
-    
-    results = query.order_by(CreditNote.created_at.desc(), CreditNote.creditnote_number.desc()).limit(100).all()
-    
-    # สร้างผลลัพธ์พร้อมข้อมูลลูกค้าและยอดรวม
-    output = []
-    for cn in results:
-        # ดึงรายการ items
-        items = db.query(CreditNoteItem).filter(CreditNoteItem.creditnote_number == cn.creditnote_number).all()
-        
-        # คำนวณยอดรวม
-        total_amount = 0.0
-        customer_name = None
-        
-        for it in items:
-            qty = float(it.sum_quantity or 0)
-            price_after_fine = float(it.price_after_fine or 0)
-            total_amount += qty * price_after_fine
-        
-        # หาชื่อลูกค้าจาก invoice แรก
-        if items:
-            first_inv = items[0].invoice_number
-            if first_inv:
-                inv_row = db.execute(
-                    text("SELECT personid FROM ss_invoices.invoices WHERE invoice_number = :inv LIMIT 1"),
-                    {"inv": first_inv}
-                ).first()
-                if inv_row and inv_row[0]:
-                    cust = db.query(models.CustomerList).filter(models.CustomerList.personid == inv_row[0]).first()
-                    if cust:
-                        customer_name = cust.fname
-        
-        output.append({
-            "creditnote_number": cn.creditnote_number,
-            "created_at": str(cn.created_at) if cn.created_at else None,
-            "customer_name": customer_name,
-            "total_amount": round(total_amount, 2),
-        })
-    
-    return output
+
+    # ใบที่ไม่มีวันที่ขึ้นก่อน (NULLS FIRST = ค่าปกติของ DESC ใน PostgreSQL เหมือนก่อนแบ่งหน้า)
+    if cursor:
+        c_date, c_no = _decode_search_cursor(cursor)
+        if c_date is None:
+            query = query.filter(or_(
+                and_(CreditNote.created_at.is_(None), CreditNote.creditnote_number < c_no),
+                CreditNote.created_at.isnot(None),
+            ))
+        else:
+            # แถว created_at เป็น NULL ผ่านไปแล้ว (การเทียบ tuple กับ NULL ไม่เป็นจริง)
+            query = query.filter(
+                tuple_(CreditNote.created_at, CreditNote.creditnote_number) < tuple_(c_date, c_no)
+            )
+
+    results = (
+        query.order_by(CreditNote.created_at.desc().nulls_first(), CreditNote.creditnote_number.desc())
+        .limit(limit + 1)
+        .all()
+    )
+    if len(results) > limit:
+        results = results[:limit]
+        last = results[-1]
+        response.headers["X-Next-Cursor"] = _encode_search_cursor(last.created_at, last.creditnote_number)
+
+    return [
+        {
+            "creditnote_number": r.creditnote_number,
+            "created_at": str(r.created_at) if r.created_at else None,
+            "customer_name": r.customer_name,
+            "total_amount": round(float(r.total_amount or 0), 2),
+        }
+        for r in results
+    ]
 
 @router.get("/api/credit-notes/detail")
 def get_credit_note_detail(no: str = Query(...), db: Session = Depends(get_db)):
@@ -865,6 +869,7 @@ def update_credit_note(no: str = Query(...), payload: dict = Body(...), db: Sess
         ))
     
     db.commit()
+    pdf_cache.invalidate(pdf_cache.make_tag("creditnote", no))
     return {"ok": True, "creditnote_number": no}
 
 
@@ -880,4 +885,5 @@ def delete_credit_note(no: str, db: Session = Depends(get_db)):
 
     db.delete(head)
     db.commit()
+    pdf_cache.invalidate(pdf_cache.make_tag("creditnote", no))
     return {"ok": True}
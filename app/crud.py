@@ -2,26 +2,33 @@ from .models import Invoice, InvoiceItem
 from .database import SessionLocal
 from sqlalchemy.orm import joinedload
 
-def create_invoice(data, items_data):
-    db = SessionLocal()
-    invoice = Invoice(**data)
-    db.add(invoice)
-    db.flush()
-    for item in items_data:
-        amount = item['quantity'] * item['unit_price']
-        db.add(InvoiceItem(**item, amount=amount, invoice_id=invoice.id))
-    db.commit()
-    db.refresh(invoice)
-    db.close()
-    return invoice
-
-def get_invoice(invoice_id):
-    db = SessionLocal()
-    invoice = db.query(Invoice)\
-    .options(joinedload(Invoice.items))\
-    .filter(Invoice.id == invoice_id)\
-    .first()
-    db.close()
-    return invoice
+# ส่ง db (จาก app.deps.get_db) มาเพื่อใช้ session เดียวกับ request; ไม่ส่ง = เปิด session ใหม่เอง
 
+def create_invoice(data, items_data, db=None):
+    own = db is None
+    db = db or SessionLocal()
+    try:
+        invoice = Invoice(**data)
+        db.add(invoice)
+        db.flush()
+        for item in items_data:
+            amount = item['quantity'] * item['unit_price']
+            db.add(InvoiceItem(**item, amount=amount, invoice_id=invoice.id))
+        db.commit()
+        db.refresh(invoice)
+        return invoice
+    finally:
+        if own:
+            db.close()
 
+def get_invoice(invoice_id, db=None):
+    own = db is None
+    db = db or SessionLocal()
+    try:
+        return db.query(Invoice)\
+        .options(joinedload(Invoice.items))\
+        .filter(Invoice.id == invoice_id)\
+        .first()
+    finally:
+        if own:
+            db.close()
@@ -0,0 +1,197 @@
+# app/customer_search.py
+"""
+ค้นหาลูกค้าสำหรับ autocomplete / ตารางรายชื่อ (ชื่อ / รหัส / เลขภาษี / จังหวัด / โทร / มือถือ)
+
+เรียงผลลัพธ์ตามความตรง:
+  0 = รหัสลูกค้า (personid) หรือเลขภาษีตรงทั้งคำ
+  1 = ขึ้นต้นด้วยคำค้นในช่องใดช่องหนึ่ง
+  2 = มีคำค้นอยู่ตรงกลาง
+แล้วเรียงตามชื่อ
+
+ชื่อเทียบด้วย search_key (app/thai_text.py: ตัดคำนำหน้า/ประเภทกิจการ, เลขไทย, ช่องว่าง,
+ลำดับวรรณยุกต์) ช่องอื่นเทียบด้วย thai_text.fold — คำค้นก็ถูกทำให้อยู่ในรูปเดียวกัน
+
+มี 2 backend:
+  trgm    ILIKE บน GIN index ของ pg_trgm (สร้างด้วย python -m app.migrations customer_search_index search_keys)
+  memory  n-gram index (3 ตัวอักษร) บนรายชื่อลูกค้าในแคช "customers" (app/master_cache.py)
+          สร้างใหม่อัตโนมัติเมื่อแคชถูกโหลดใหม่ (สร้าง/แก้ไข/ลบลูกค้า หรือครบ TTL)
+
+ตั้งค่าผ่าน environment:
+  CUSTOMER_SEARCH_BACKEND   auto | trgm | memory (ค่าเริ่มต้น auto = trgm ถ้ามี index แล้ว ไม่งั้น memory)
+"""
+import os
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from sqlalchemy import case, func, or_, text
+
+from . import master_cache, models, thai_text
+
+BACKEND = os.getenv("CUSTOMER_SEARCH_BACKEND", "auto").strip().lower()
+if BACKEND not in ("auto", "trgm", "memory"):
+    raise ValueError(f"CUSTOMER_SEARCH_BACKEND must be auto, trgm or memory (got {BACKEND!r})")
+
+NGRAM = 3
+
+# คีย์ใน dict ของแคช customers (ดู customers._load_customers) ตามลำดับเดียวกับคอลัมน์ใน SEARCH_COLUMNS
+# ช่องแรกเป็นชื่อในรูป search_key
+SEARCH_FIELDS = ("search_key", "personid", "cf_taxid", "cf_provincename", "tel", "mobile")
+_EXACT_FIELDS = (1, 2)  # personid, cf_taxid
+
+_CL = models.CustomerList
+SEARCH_COLUMNS = (_CL.fname, _CL.personid, _CL.cf_taxid, _CL.cf_provincename, _CL.tel, _CL.mobile)
+
+# index ของ pg_trgm (ชื่อเดียวกับใน migration)
+TRGM_INDEXES = {col.key: f"ix_customer_list_{col.key}_trgm" for col in SEARCH_COLUMNS}
+_DETECT_SQL = text("SELECT to_regclass(:name) IS NOT NULL")
+
+_trgm_ready: Optional[bool] = None
+
+
+def _normalize(q: str) -> str:
+    return (q or "").strip().casefold()
+
+def query_key(q: str) -> str:
+    """คำค้นในรูปเดียวกับข้อมูลที่ index ไว้ (ถ้าตัดคำนำหน้าแล้วว่าง เช่น "บริษัท" ใช้แบบไม่ตัด)"""
+    return thai_text.search_key(q) or thai_text.fold(q)
+
+# ---------- เลือก backend ----------
+def _detect_name() -> str:
+    return f"products.{TRGM_INDEXES['fname']}"
+
+def use_trgm(db) -> bool:
+    """ตรวจครั้งเดียวต่อ process ว่ามี trigram index แล้วหรือยัง (Session ปกติ)"""
+    global _trgm_ready
+    if BACKEND != "auto":
+        return BACKEND == "trgm"
+    if _trgm_ready is None:
+        _trgm_ready = bool(db.execute(_DETECT_SQL, {"name": _detect_name()}).scalar())
+    return _trgm_ready
+
+async def use_trgm_async(db) -> bool:
+    global _trgm_ready
+    if BACKEND != "auto":
+        return BACKEND == "trgm"
+    if _trgm_ready is None:
+        _trgm_ready = bool((await db.execute(_DETECT_SQL, {"name": _detect_name()})).scalar())
+    return _trgm_ready
+
+# ---------- backend: pg_trgm ----------
+def _like_escape(s: str) -> str:
+    return s.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def sql_filter(q: str):
+    """WHERE ของคำค้น (ILIKE '%q%' ทุกช่อง + search_key — ใช้ GIN trigram index ได้)"""
+    pat = f"%{_like_escape(q.strip())}%"
+    key_pat = f"%{_like_escape(query_key(q))}%"
+    return or_(_CL.search_key.like(key_pat, escape="\\"),
+               *(col.ilike(pat, escape="\\") for col in SEARCH_COLUMNS))
+
+def sql_order(q: str):
+    """ORDER BY ตามลำดับความตรง แล้วตามชื่อ"""
+    q = q.strip()
+    prefix = f"{_like_escape(q)}%"
+    key_prefix = f"{_like_escape(query_key(q))}%"
+    rank = case(
+        (or_(func.lower(_CL.personid) == q.lower(), _CL.cf_taxid == q), 0),
+        (or_(_CL.search_key.like(key_prefix, escape="\\"),
+             *(col.ilike(prefix, escape="\\") for col in SEARCH_COLUMNS)), 1),
+        else_=2,
+    )
+    return (rank, _CL.fname.asc())
+
+# ---------- backend: memory ----------
+class _NgramIndex:
+    """
+    แถวถูกเรียงตามชื่อไว้ก่อน (posting list ก็เรียงตามชื่อ) ทำให้ผลในลำดับเดียวกัน
+    เรียงตามชื่ออยู่แล้ว และหยุดไล่ได้ทันทีเมื่อได้ครบ limit
+
+    posting list ใช้เวลาสร้างนาน (หลายวินาทีที่ 50k ราย) จึงสร้างใน thread เบื้องหลัง
+    ระหว่างนั้นค้นด้วยการไล่ทุกแถว (ผลเหมือนกัน แค่ช้ากว่า)
+    """
+
+    def __init__(self, entry: master_cache.Entry):
+        self.entry = entry
+        fold = thai_text.fold
+        vals_all = [
+            (r.get("search_key") or thai_text.search_key(r.get("fname")),)
+            + tuple(fold(r.get(f)) for f in SEARCH_FIELDS[1:])
+            for r in entry.rows
+        ]
+        order = sorted(range(len(vals_all)), key=lambda i: _normalize(entry.rows[i].get("fname")))
+        self.rows: List[dict] = [entry.rows[i] for i in order]
+        self.haystacks: List[str] = []
+        self.exact: Dict[str, List[int]] = defaultdict(list)
+        self.grams: Optional[Dict[str, List[int]]] = None
+        for pos, i in enumerate(order):
+            vals = vals_all[i]
+            # ขึ้นต้นแต่ละช่องด้วย \n: "ขึ้นต้นด้วย q ในช่องใดช่องหนึ่ง" = ("\n" + q) in hay
+            hay = "".join("\n" + v for v in vals)
+            self.haystacks.append(hay)
+            for f in _EXACT_FIELDS:
+                if vals[f] and pos not in self.exact[vals[f]]:
+                    self.exact[vals[f]].append(pos)
+        self.exact = dict(self.exact)
+
+    def build_grams(self):
+        grams: Dict[str, List[int]] = defaultdict(list)
+        for pos, hay in enumerate(self.haystacks):
+            for g in {hay[j:j + NGRAM] for j in range(len(hay) - NGRAM + 1)}:
+                grams[g].append(pos)
+        self.grams = dict(grams)
+
+    def _candidates(self, q: str):
+        if len(q) < NGRAM or self.grams is None:
+            return range(len(self.haystacks))
+        postings = []
+        for j in range(len(q) - NGRAM + 1):
+            p = self.grams.get(q[j:j + NGRAM])
+            if not p:
+                return ()
+            postings.append(p)
+        # ใช้ posting list ที่สั้นที่สุดเป็นตัวตั้ง แล้วตรวจ substring จริงทีละแถว
+        return min(postings, key=len)
+
+    def search(self, q: str, limit: Optional[int] = None) -> List[dict]:
+        hays = self.haystacks
+        nq = "\n" + q
+        exact = self.exact.get(q, [])
+        skip = set(exact)
+        prefix, inner = [], []
+        for pos in self._candidates(q):
+            hay = hays[pos]
+            if q not in hay or pos in skip:
+                continue
+            if nq in hay:
+                prefix.append(pos)
+                if limit is not None and len(exact) + len(prefix) >= limit:
+                    break
+            elif limit is None or len(inner) < limit:
+                inner.append(pos)
+        hits = exact + prefix + inner
+        if limit is not None:
+            hits = hits[:limit]
+        return [self.rows[pos] for pos in hits]
+
+_index: Optional[_NgramIndex] = None
+_index_lock = threading.Lock()
+
+def _index_for(entry: master_cache.Entry) -> _NgramIndex:
+    global _index
+    idx = _index
+    if idx is None or idx.entry is not entry:
+        with _index_lock:
+            idx = _index
+            if idx is None or idx.entry is not entry:
+                idx = _index = _NgramIndex(entry)
+                threading.Thread(target=idx.build_grams, name="customer-search-ngram", daemon=True).start()
+    return idx
+
+def search_memory(entry: master_cache.Entry, q: str, limit: Optional[int] = None) -> List[dict]:
+    """ลูกค้าที่ตรงคำค้น เรียงตามความตรง (dict เดียวกับ /api/customers/all)"""
+    q = query_key(q)
+    idx = _index_for(entry)
+    if not q:
+        return idx.rows[:limit]
+    return idx.search(q, limit)
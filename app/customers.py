@@ -1,29 +1,24 @@
 # app/customers.py
 from __future__ import annotations
-import os
+import json
+import re
 from math import ceil
 from typing import List, Optional, Dict, Any
 from pydantic import BaseModel
 from datetime import datetime
 
-from fastapi import APIRouter, Depends, HTTPException, Query, Form
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi import APIRouter, Depends, HTTPException, Query, Form, Request
+from fastapi.responses import Response
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from sqlalchemy import or_, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import Integer, cast, func, select, text
 
-from .database import SessionLocal
-from . import models
+from .deps import get_db, get_async_read_db
+from . import customer_search, doc_numbers, master_cache, models, thai_text
 
 router = APIRouter()
 
-# ---------------- DB Session ----------------
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 # -------------- Helpers ---------------------
 def _row_to_dict(c: models.CustomerList) -> Dict[str, Any]:
     """
@@ -38,6 +33,7 @@ def _row_to_dict(c: models.CustomerList) -> Dict[str, Any]:
         "idx": c.idx,
         "personid": c.personid,
         "customer_name": customer_name,
+        "fname": c.fname,
         "prename": c.prename,
 
         # เลขภาษี: ส่งให้ครบทั้งสามคีย์
@@ -67,64 +63,121 @@ def _row_to_dict(c: models.CustomerList) -> Dict[str, Any]:
         "fmlpaymentcreditday": c.fmlpaymentcreditday,
     }
 
-def _find_template(filename: str) -> Optional[str]:
-    """พยายามหาไฟล์ HTML หลาย path"""
-    here = os.path.dirname(os.path.abspath(__file__))
-    candidates = [
-        os.path.join(here, filename),
-        os.path.join(here, "templates", filename),
-        os.path.join(os.getcwd(), filename),
-        os.path.join(os.getcwd(), "templates", filename),
-    ]
-    for p in candidates:
-        if os.path.isfile(p):
-            return p
-    return None
-
-# -------------- Pages (optional) -------------
-@router.get("/customers", response_class=HTMLResponse)
-def customers_page():
-    """เสิร์ฟหน้า customer_form.html (ถ้าไม่พบไฟล์จะ 404)"""
-    path = _find_template("customer_form.html")
-    if not path:
-        raise HTTPException(status_code=404, detail="templates/customer_form.html not found")
-    return FileResponse(path)
+def _load_customers(db: Session) -> List[Dict[str, Any]]:
+    rows = db.query(models.CustomerList).order_by(models.CustomerList.idx.desc()).all()
+    # search_key ใช้กับการค้นหาในแคช (แถวเก่าที่ยังไม่ backfill คำนวณให้ตอนโหลด)
+    return [{**_row_to_dict(r), "search_key": r.search_key or thai_text.search_key(r.fname)} for r in rows]
+
+master_cache.register("customers", _load_customers)
 
 # -------------- APIs ------------------------
 @router.get("/api/customers/all")
-def api_customers_all(db: Session = Depends(get_db)) -> List[Dict[str, Any]]:
-    """ดึงลูกค้าทั้งหมด (ไว้ใช้ทำ datalist/fallback)"""
-    rows = (
-        db.query(models.CustomerList)
-        .order_by(models.CustomerList.idx.desc())
-        .all()
-    )
-    return [_row_to_dict(r) for r in rows]
+def api_customers_all(request: Request):
+    """ดึงลูกค้าทั้งหมด (ไว้ใช้ทำ datalist/fallback) จากแคช + ETag"""
+    e = master_cache.get("customers")
+    return master_cache.respond(request, e, lambda: e.rows)
+
+# -------------- Lookup (compact + delta sync) --------------
+# ฟิลด์ที่ขอได้ผ่าน ?fields= (ชื่อเดียวกับคอลัมน์ ไม่ส่งคีย์ซ้ำแบบ _row_to_dict)
+LOOKUP_FIELDS = (
+    "idx", "personid", "fname", "prename", "lname", "cf_taxid",
+    "cf_personaddress", "cf_personzipcode", "cf_provincename",
+    "tel", "mobile", "cf_hq", "cf_branch", "fmlpaymentcreditday",
+)
+LOOKUP_DEFAULT_FIELDS = ("idx", "personid", "fname")
+LOOKUP_MAX_LIMIT = 5000
+# delta ที่มีแถวเปลี่ยนเกินนี้ ให้ browser โหลดใหม่ทั้งชุดแทน
+DELTA_MAX_ROWS = 5000
+
+def _compact_json(payload: Dict[str, Any]) -> Response:
+    """JSON แบบไม่มีช่องว่าง (CompressionMiddleware บีบ br/gzip ให้อีกชั้น)"""
+    body = json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+    return Response(body, media_type="application/json", headers={"Cache-Control": "no-store"})
+
+def _current_row_version(db: Session) -> int:
+    """
+    version สำหรับ sync ครั้งถัดไป = xmin ของ snapshot (row_version คือเลข transaction ที่เขียนแถว)
+    transaction ที่ยังไม่ commit ทุกตัวมีเลข >= ค่านี้ แถวของมันจึงอยู่ใน delta ถัดไปเสมอ
+    (แถวที่ commit แล้วแต่เลข >= ค่านี้ถูกส่งซ้ำได้ ฝั่ง browser upsert ตาม idx อยู่แล้ว)
+    เรียกก่อนอ่านแถว: แถวที่เลขต่ำกว่าค่านี้ commit ก่อน snapshot นี้แล้วทั้งหมด
+    """
+    return db.execute(text("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint")).scalar()
+
+@router.get("/api/customers/lookup")
+def api_customers_lookup(
+    fields: Optional[str] = Query(None, description="คั่นด้วย , เช่น idx,personid,fname"),
+    since: Optional[int] = Query(None, ge=0, description="version ล่าสุดที่ browser มี (โหมด delta)"),
+    cursor: Optional[str] = Query(None, description="จาก next_cursor ของหน้าก่อน (โหมดโหลดทั้งชุด)"),
+    limit: int = Query(1000, ge=1, le=LOOKUP_MAX_LIMIT),
+    db: Session = Depends(get_db),
+):
+    """
+    รายชื่อลูกค้าแบบกระชับสำหรับเก็บไว้ใน browser (ดู static/js/customer_lookup.js)
+      ทั้งชุด:  ?fields=...&limit=1000 แล้วตาม next_cursor จนเป็น null  -> เก็บ version ไว้
+      delta:   ?fields=...&since=<version>  -> rows ที่เปลี่ยน + deleted (idx ที่ถูกลบ)
+               reset=true แปลว่าให้โหลดทั้งชุดใหม่
+    rows เป็น list ตามลำดับ fields (ไม่ซ้ำชื่อคีย์ทุกแถว) — บีบอัด br/gzip ผ่าน CompressionMiddleware
+    """
+    names = [f.strip() for f in (fields or "").split(",") if f.strip()] or list(LOOKUP_DEFAULT_FIELDS)
+    bad = [f for f in names if f not in LOOKUP_FIELDS]
+    if bad:
+        raise HTTPException(status_code=400, detail=f"unknown fields: {', '.join(bad)}")
+    # idx อยู่คอลัมน์แรกเสมอ (ใช้เป็น key และ cursor)
+    names = ["idx"] + [f for f in dict.fromkeys(names) if f != "idx"]
+    CL = models.CustomerList
+    cols = [getattr(CL, f) for f in names]
+
+    if since is not None:
+        version = _current_row_version(db)
+        if since > version:
+            return _compact_json({"fields": names, "reset": True, "version": version})
+        rows = db.execute(
+            select(*cols).filter(CL.row_version >= since).order_by(CL.row_version).limit(DELTA_MAX_ROWS + 1)
+        ).all()
+        if len(rows) > DELTA_MAX_ROWS:
+            return _compact_json({"fields": names, "reset": True, "version": version})
+        deleted = db.execute(
+            text("SELECT idx FROM products.customer_list_deleted WHERE row_version >= :v"), {"v": since}
+        ).scalars().all()
+        return _compact_json({
+            "fields": names, "rows": [list(r) for r in rows], "deleted": deleted, "version": version,
+        })
+
+    # ทั้งชุด: keyset ตาม idx; version ของหน้าแรกติดไปกับ cursor ให้ทุกหน้าตอบค่าเดียวกัน
+    if cursor:
+        try:
+            version, after = (int(x) for x in cursor.split(":", 1))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="invalid cursor")
+    else:
+        version, after = _current_row_version(db), 0
+    rows = db.execute(select(*cols).filter(CL.idx > after).order_by(CL.idx).limit(limit + 1)).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return _compact_json({
+        "fields": names,
+        "rows": [list(r) for r in rows],
+        "version": version,
+        "next_cursor": f"{version}:{rows[-1][0]}" if more else None,
+    })
 
 @router.get("/api/customers/suggest")
-def api_customers_suggest(
+async def api_customers_suggest(
     q: str = Query(..., min_length=1, description="ค้นหาจาก ชื่อ/รหัส/ภาษี/จังหวัด/โทร/มือถือ"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_read_db),
 ) -> List[Dict[str, Any]]:
-    """autocomplete ลูกค้า (ลิมิต 20)"""
-    q = q.strip()
-    CL = models.CustomerList
-    pat = f"%{q}%"
-    rows = (
-        db.query(CL)
-        .filter(or_(
-            CL.fname.ilike(pat),
-            CL.personid.ilike(pat),
-            CL.cf_taxid.ilike(pat),
-            CL.cf_provincename.ilike(pat),
-            CL.tel.ilike(pat),
-            CL.mobile.ilike(pat),
-        ))
-        .order_by(CL.fname.asc())
-        .limit(20)
-        .all()
-    )
-    return [_row_to_dict(r) for r in rows]
+    """autocomplete ลูกค้า (ลิมิต 20) เรียงตามความตรง (ดู app/customer_search.py)"""
+    if await customer_search.use_trgm_async(db):
+        rows = (await db.execute(
+            select(models.CustomerList)
+            .filter(customer_search.sql_filter(q))
+            .order_by(*customer_search.sql_order(q))
+            .limit(20)
+        )).scalars().all()
+        return [_row_to_dict(r) for r in rows]
+
+    entry = await master_cache.aget("customers")
+    return await run_in_threadpool(customer_search.search_memory, entry, q, 20)
 
 @router.get("/api/customers/detail")
 def api_customer_detail(
@@ -159,25 +212,33 @@ def api_customers_list(
     คืนค่า: { items: [...], total, page, pages, limit }
     """
     CL = models.CustomerList
-    base = db.query(CL)
+    q = (q or "").strip()
+
+    if not customer_search.use_trgm(db):
+        matched = customer_search.search_memory(master_cache.get("customers"), q)
+        total = len(matched)
+        pages = max(1, ceil(total / limit))
+        page = min(max(1, page), pages)
+        return {
+            "items": matched[(page - 1) * limit:page * limit],
+            "total": total,
+            "page": page,
+            "pages": pages,
+            "limit": limit,
+        }
 
-    if q and q.strip():
-        pat = f"%{q.strip()}%"
-        base = base.filter(or_(
-            CL.fname.ilike(pat),
-            CL.personid.ilike(pat),
-            CL.cf_taxid.ilike(pat),
-            CL.cf_provincename.ilike(pat),
-            CL.tel.ilike(pat),
-            CL.mobile.ilike(pat),
-        ))
+    base = db.query(CL)
+    order = (CL.fname.asc(),)
+    if q:
+        base = base.filter(customer_search.sql_filter(q))
+        order = customer_search.sql_order(q)
 
     total = base.with_entities(func.count(CL.idx)).scalar() or 0
     pages = max(1, ceil(total / limit))
     page = min(max(1, page), pages)
 
     rows = (
-        base.order_by(CL.fname.asc())
+        base.order_by(*order)
         .offset((page - 1) * limit)
         .limit(limit)
         .all()
@@ -191,40 +252,31 @@ def api_customers_list(
         "limit": limit,
     }
 
+# รหัสลูกค้าอัตโนมัติ PC<YY><NNNN> (YY = 2 หลักท้ายของปี พ.ศ., NNNN = running ในปีนั้น)
+_AUTO_PERSONID_RE = re.compile(r"^PC(\d{2})(\d{4,})$")
+
+def _seed_customer(db: Session, period: str) -> int:
+    """running สูงสุดของปีนั้นที่มีอยู่แล้ว (ใช้ครั้งแรกของแต่ละปีเท่านั้น)"""
+    run = func.substring(models.CustomerList.personid, f"^PC{period}([0-9]+)$")
+    return (
+        db.query(func.max(cast(run, Integer)))
+        .filter(models.CustomerList.personid.like(f"PC{period}%"))
+        .scalar()
+    ) or 0
+
+doc_numbers.register("customer", _seed_customer)
+
+def _current_personid_period() -> str:
+    return str(datetime.now().year + 543)[-2:]
+
 @router.get("/api/customers/next-id")
 def api_get_next_customer_id(db: Session = Depends(get_db)):
     """
-    สร้างรหัสลูกค้าใหม่ (personid) ตามรูปแบบ PC<YY><NNNN>
-    โดย YY คือ 2 หลักสุดท้ายของปี พ.ศ.
-    และ NNNN คือ running number ในปีนั้นๆ
+    รหัสลูกค้าถัดไป (personid) ตามรูปแบบ PC<YY><NNNN> สำหรับแสดงในฟอร์ม
+    รหัสจริงถูกจองตอนบันทึก (POST /api/customers) — ถ้ามีคนใช้รหัสนี้ไปก่อนจะได้รหัสถัดไป
     """
-    # 1. หา 2 หลักสุดท้ายของปี พ.ศ. ปัจจุบัน
-    current_buddhist_year = datetime.now().year + 543
-    year_prefix = str(current_buddhist_year)[-2:]
-    
-    # 2. สร้าง Prefix สำหรับค้นหา เช่น "PC68"
-    search_prefix = f"PC{year_prefix}"
-    
-    # 3. ค้นหารหัสล่าสุดของปีนี้
-    latest_customer = db.query(models.CustomerList)\
-        .filter(models.CustomerList.personid.like(f"{search_prefix}%"))\
-        .order_by(models.CustomerList.personid.desc())\
-        .first()
-    
-    next_running_number = 1
-    if latest_customer and latest_customer.personid:
-        try:
-            # ดึงเลข 4 หลักสุดท้ายออกมา แล้ว +1
-            last_running_str = latest_customer.personid[4:]
-            next_running_number = int(last_running_str) + 1
-        except (ValueError, IndexError):
-            # ถ้า format เก่าไม่ถูกต้อง ให้เริ่มนับ 1 ใหม่
-            next_running_number = 1
-            
-    # 4. สร้างรหัสใหม่โดยเติม 0 ข้างหน้าให้ครบ 4 หลัก
-    new_id = f"{search_prefix}{next_running_number:04d}"
-    
-    return {"next_id": new_id}
+    period = _current_personid_period()
+    return {"next_id": f"PC{period}{doc_numbers.peek(db, 'customer', period):04d}"}
 
 @router.post("/api/customers")
 def api_customers_create(payload: CustomerUpdate, db: Session = Depends(get_db)):
@@ -238,12 +290,19 @@ def api_customers_create(payload: CustomerUpdate, db: Session = Depends(get_db))
     if "cf_branch" in customer_data and not customer_data["cf_branch"]:
         customer_data["cf_branch"] = None
         
+    # รหัสในรูปแบบอัตโนมัติ (จาก /api/customers/next-id) จองรหัสจริงจากตัวนับ
+    m = _AUTO_PERSONID_RE.match(customer_data.get("personid") or "")
+    if m:
+        period = m.group(1)
+        customer_data["personid"] = f"PC{period}{doc_numbers.allocate(db, 'customer', period):04d}"
+
     new_customer = models.CustomerList(**customer_data)
     db.add(new_customer)
     db.commit()
     db.refresh(new_customer)
+    master_cache.invalidate("customers")
     
-    return {"ok": True, "idx": new_customer.idx}
+    return {"ok": True, "idx": new_customer.idx, "personid": new_customer.personid}
 
 # ====== เพิ่ม: อัปเดต/เช็กซ้ำลูกค้า ======
 class CustomerUpdate(BaseModel):
@@ -300,6 +359,7 @@ def api_customers_update(idx: int, payload: CustomerUpdate, db: Session = Depend
                 setattr(c, field, val)
 
     db.commit()
+    master_cache.invalidate("customers")
     return {"ok": True, "idx": idx}
 
 @router.delete("/api/customers/{idx}")
@@ -317,6 +377,7 @@ def api_customers_delete(idx: int, db: Session = Depends(get_db)):
     # 3. สั่งลบข้อมูล
     db.delete(customer_to_delete)
     db.commit()
+    master_cache.invalidate("customers")
     
     # 4. ส่งผลลัพธ์กลับไป
     return {"ok": True, "message": f"Customer with idx {idx} deleted."}
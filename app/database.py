@@ -1,7 +1,21 @@
 # app/database.py
+"""
+engine / session factory ของฐานข้อมูล (dependency สำหรับ endpoint อยู่ใน app/deps.py)
+
+ตั้งค่าผ่าน environment:
+  DATABASE_URL           ฐานข้อมูลหลัก (อ่าน/เขียน)
+  DATABASE_REPLICA_URL   read replica สำหรับรายงาน / suggest / ค้นหา (ไม่ตั้ง = ใช้ฐานหลัก)
+
+session ฝั่งอ่าน (ReadSessionLocal / AsyncReadSessionLocal) เปิดทุก transaction ด้วย
+SET TRANSACTION READ ONLY ไม่ว่าจะชี้ไป replica หรือฐานหลัก
+"""
 import os
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+
+from . import db_pool
 
 def _normalize_db_url(url: str) -> str:
     if not url:
@@ -19,13 +33,64 @@ def _normalize_db_url(url: str) -> str:
     return url
 
 DATABASE_URL = _normalize_db_url(os.getenv("DATABASE_URL", ""))
+DATABASE_REPLICA_URL = _normalize_db_url(os.getenv("DATABASE_REPLICA_URL", ""))
+
+def _make_engine(url: str):
+    # ขนาด pool / recycle / pre-ping ตั้งผ่าน environment (ดู app/db_pool.py)
+    eng = create_engine(url, future=True, **db_pool.engine_kwargs())
+    db_pool.install(eng)
+    return eng
+
+engine = _make_engine(DATABASE_URL)
+# ไม่มี replica → ใช้ engine (และ pool) เดียวกับฐานหลัก
+read_engine = _make_engine(DATABASE_REPLICA_URL) if DATABASE_REPLICA_URL else engine
+
+
+class ReadOnlySession(Session):
+    """Session ของ endpoint อ่านอย่างเดียว (ทุก transaction เป็น READ ONLY)"""
+
+@event.listens_for(ReadOnlySession, "after_begin")
+def _set_transaction_read_only(session, transaction, connection):
+    connection.exec_driver_sql("SET TRANSACTION READ ONLY")
 
-# แนะนำเปิด pool_pre_ping กัน connection ตาย และใช้ future=True
-engine = create_engine(
-    DATABASE_URL,
-    pool_pre_ping=True,
-    future=True,
-)
 
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
+ReadSessionLocal = sessionmaker(bind=read_engine, class_=ReadOnlySession,
+                                autoflush=False, autocommit=False, future=True)
 Base = declarative_base()
+
+# ---------- Async (asyncpg) สำหรับ endpoint อ่านอย่างเดียวที่ถูกเรียกบ่อย ----------
+def _async_db_url(url: str):
+    """
+    แปลง URL ของ engine ปกติเป็น postgresql+asyncpg://
+    asyncpg ไม่รู้จัก ?sslmode=... จึงย้ายไปเป็น connect_args["ssl"]
+    """
+    u = make_url(url)
+    query = dict(u.query)
+    connect_args = {}
+    sslmode = query.pop("sslmode", None)
+    if sslmode:
+        connect_args["ssl"] = sslmode
+    return u.set(drivername="postgresql+asyncpg", query=query), connect_args
+
+def _make_async_engine(url: str):
+    async_url, connect_args = _async_db_url(url)
+    eng = create_async_engine(
+        async_url,
+        connect_args=connect_args,
+        **db_pool.engine_kwargs(is_async=True),
+    )
+    db_pool.install(eng.sync_engine)
+    return eng
+
+async_engine = _make_async_engine(DATABASE_URL)
+async_read_engine = _make_async_engine(DATABASE_REPLICA_URL) if DATABASE_REPLICA_URL else async_engine
+
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+AsyncReadSessionLocal = async_sessionmaker(bind=async_read_engine, sync_session_class=ReadOnlySession,
+                                           autoflush=False, expire_on_commit=False)
+
+async def dispose_async_engines():
+    await async_engine.dispose()
+    if async_read_engine is not async_engine:
+        await async_read_engine.dispose()
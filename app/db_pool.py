@@ -0,0 +1,160 @@
+# app/db_pool.py
+"""
+ตั้งค่า connection pool จาก environment + เก็บสถิติการรอ connection
+
+ตั้งค่าผ่าน environment (ใช้กับทั้ง engine ปกติและ async engine แยก pool กัน):
+  DB_POOL_SIZE            จำนวน connection ค้างใน pool (ค่าเริ่มต้น 5)
+  DB_MAX_OVERFLOW         connection ชั่วคราวเกิน pool_size (ค่าเริ่มต้น 10)
+  DB_POOL_TIMEOUT         วินาทีที่รอ connection ว่างก่อน error (ค่าเริ่มต้น 30)
+  DB_POOL_RECYCLE         วินาทีก่อนเปิด connection ใหม่แทนตัวเก่า (ค่าเริ่มต้น 1800, -1 = ไม่ recycle)
+  DB_POOL_PRE_PING        always | idle | never (ค่าเริ่มต้น idle)
+                            always = SELECT 1 ทุกครั้งที่ยืม connection (พฤติกรรมเดิม)
+                            idle   = ping เฉพาะ connection ที่ว่างนานเกิน DB_POOL_PRE_PING_IDLE
+  DB_POOL_PRE_PING_IDLE   วินาที (ค่าเริ่มต้น 30)
+  DB_POOL_WAIT_WARN_MS    log warning เมื่อรอ connection นานเกินกว่านี้ (ค่าเริ่มต้น 500)
+
+สถิติดูได้ที่ /internal/metrics/db-pool
+"""
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+logger = logging.getLogger(__name__)
+
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+PRE_PING = os.getenv("DB_POOL_PRE_PING", "idle").strip().lower()
+PRE_PING_IDLE = float(os.getenv("DB_POOL_PRE_PING_IDLE", "30"))
+WAIT_WARN_MS = float(os.getenv("DB_POOL_WAIT_WARN_MS", "500"))
+
+# ขอบบนของ bucket (ms) ของ histogram เวลารอ connection
+WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+if PRE_PING not in ("always", "idle", "never"):
+    raise ValueError(f"DB_POOL_PRE_PING must be always, idle or never (got {PRE_PING!r})")
+
+
+class _PoolMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.overflow_events = 0
+        self.timeouts = 0
+        self.wait_sum_ms = 0.0
+        self.wait_max_ms = 0.0
+        self.buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)  # ช่องสุดท้าย = +Inf
+
+    def observe(self, wait_ms: float, overflowed: bool):
+        i = 0
+        while i < len(WAIT_BUCKETS_MS) and wait_ms > WAIT_BUCKETS_MS[i]:
+            i += 1
+        with self.lock:
+            self.checkouts += 1
+            self.wait_sum_ms += wait_ms
+            self.wait_max_ms = max(self.wait_max_ms, wait_ms)
+            self.buckets[i] += 1
+            if overflowed:
+                self.overflow_events += 1
+
+    def timed_out(self):
+        with self.lock:
+            self.timeouts += 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            labels = [f"le_{b}" for b in WAIT_BUCKETS_MS] + ["le_inf"]
+            return {
+                "checkouts": self.checkouts,
+                "overflow_events": self.overflow_events,
+                "timeouts": self.timeouts,
+                "wait_ms_sum": round(self.wait_sum_ms, 3),
+                "wait_ms_max": round(self.wait_max_ms, 3),
+                "wait_ms_avg": round(self.wait_sum_ms / self.checkouts, 3) if self.checkouts else 0.0,
+                "wait_ms_histogram": dict(zip(labels, self.buckets)),
+            }
+
+
+class _InstrumentedMixin:
+    """จับเวลาใน _do_get (รอ connection ว่าง / เปิด connection overflow ใหม่)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = _PoolMetrics()
+
+    def _do_get(self):
+        before = self._overflow
+        t0 = time.perf_counter()
+        try:
+            rec = super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.timed_out()
+            logger.warning("db pool timeout: %s", self.status())
+            raise
+        wait_ms = (time.perf_counter() - t0) * 1000
+        # _overflow เริ่มติดลบ (= -pool_size) และเพิ่มทุกครั้งที่เปิด connection ใหม่
+        self.metrics.observe(wait_ms, self._overflow > before and self._overflow > 0)
+        if wait_ms >= WAIT_WARN_MS:
+            logger.warning("db pool checkout waited %.0f ms: %s", wait_ms, self.status())
+        return rec
+
+
+class InstrumentedQueuePool(_InstrumentedMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def engine_kwargs(is_async: bool = False) -> dict:
+    """kwargs สำหรับ create_engine / create_async_engine"""
+    return {
+        "poolclass": InstrumentedAsyncQueuePool if is_async else InstrumentedQueuePool,
+        "pool_size": POOL_SIZE,
+        "max_overflow": MAX_OVERFLOW,
+        "pool_timeout": POOL_TIMEOUT,
+        "pool_recycle": POOL_RECYCLE,
+        "pool_pre_ping": PRE_PING == "always",
+    }
+
+def install(sync_engine):
+    """ผูก event ของ pre-ping แบบ idle (ส่ง engine.sync_engine สำหรับ async engine)"""
+    if PRE_PING != "idle":
+        return
+    dialect = sync_engine.dialect
+
+    @event.listens_for(sync_engine, "checkin")
+    def _mark_idle(dbapi_connection, connection_record):
+        connection_record.info["db_pool_checkin_at"] = time.monotonic()
+
+    @event.listens_for(sync_engine, "checkout")
+    def _ping_if_idle(dbapi_connection, connection_record, connection_proxy):
+        last = connection_record.info.get("db_pool_checkin_at")
+        if last is None or time.monotonic() - last < PRE_PING_IDLE:
+            return
+        try:
+            dialect.do_ping(dbapi_connection)
+        except Exception:
+            # ให้ pool ทิ้ง connection นี้แล้วลองใหม่ด้วย connection ใหม่
+            raise exc.DisconnectionError("idle connection failed pre-ping")
+
+def stats(pool) -> dict:
+    out = {
+        "size": pool.size(),
+        "in_use": pool.checkedout(),
+        "idle": pool.checkedin(),
+        "overflow": max(0, pool.overflow()),
+        "max_overflow": MAX_OVERFLOW,
+        "timeout": POOL_TIMEOUT,
+        "recycle": POOL_RECYCLE,
+        "pre_ping": PRE_PING,
+    }
+    if isinstance(pool, _InstrumentedMixin):
+        out.update(pool.metrics.snapshot())
+    return out
@@ -0,0 +1,37 @@
+# app/deps.py
+"""
+dependency ของ DB session ที่ทุก router ใช้ร่วมกัน (1 request = 1 session)
+
+  get_db             อ่าน/เขียน ฐานหลัก — หน้าบันทึก/แก้ไข และ endpoint ที่ต้องเห็นข้อมูลล่าสุด
+                     (ตรวจเลขซ้ำ, โหลดบิลมาแก้ไข, ออกเลขถัดไป)
+  get_read_db        อ่านอย่างเดียว ผ่าน DATABASE_REPLICA_URL ถ้ามี — รายงาน / ค้นหา / export
+  get_async_db       AsyncSession ฐานหลัก
+  get_async_read_db  AsyncSession อ่านอย่างเดียว — suggest / รายการรายงานที่ถูกเรียกบ่อย
+
+ข้อมูลบน replica อาจช้ากว่าฐานหลักเล็กน้อย endpoint ที่ผู้ใช้เพิ่งบันทึกแล้วเปิดดูต่อทันที
+จึงยังใช้ get_db
+"""
+from .database import SessionLocal, ReadSessionLocal, AsyncSessionLocal, AsyncReadSessionLocal
+
+
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_async_read_db():
+    async with AsyncReadSessionLocal() as db:
+        yield db
@@ -0,0 +1,109 @@
+# app/doc_numbers.py
+"""
+ออกเลขเอกสาร / รหัส แบบ running number จากตารางตัวนับ public.doc_counters
+
+    แถวละ (name, period) เช่น ("bill_note", "6810"), ("credit_note", "2568"), ("driver", "")
+    value = เลขล่าสุดที่ออกไปแล้ว
+
+แทนการหา "max + 1" จากตารางเอกสารทุกครั้ง (ช้าลงเรื่อยๆ ตามจำนวนเอกสาร และได้เลขซ้ำเมื่อบันทึกพร้อมกัน)
+- allocate(db, name, period) = UPDATE ... SET value = value + 1 RETURNING value
+  อยู่ใน transaction เดียวกับการบันทึกเอกสาร: แถวตัวนับถูก lock จน commit
+  request ที่บันทึกพร้อมกันจะรอกันเฉพาะช่วงสั้นๆ นั้น ถ้า rollback เลขก็ถูกคืน (ไม่มีเลขข้าม)
+- peek(db, name, period) = เลขถัดไปที่คาดว่าจะได้ (ไม่จอง) ใช้แสดงในฟอร์มก่อนบันทึก
+- period ใหม่ (เดือน/ปีใหม่) หรือยังไม่เคยมีแถว: เรียก seed ที่ลงทะเบียนไว้ครั้งเดียวเพื่อหาเลขสูงสุดเดิม
+      doc_numbers.register("bill_note", _seed_billnote)   # seed(db, period) -> เลขสูงสุดที่มีอยู่ (หรือ 0)
+
+จองเป็นช่วง (block) ต่อ process ได้สำหรับรหัสที่ยอมให้มีเลขข้าม (เช่นรหัสลูกค้า/พนักงานขับรถ):
+จองครั้งละ N เลขใน transaction แยก แล้วแจกจาก memory — เลขที่จองแล้วไม่ได้ใช้จะหายไปเมื่อ restart
+ไม่ควรใช้กับเอกสารภาษี (ใบวางบิล / ใบลดหนี้)
+
+ตั้งค่าผ่าน environment:
+  DOC_NUMBER_BLOCKS   ขนาด block ต่อชื่อ เช่น "customer=20,driver=10" (ค่าเริ่มต้น: ไม่จอง block)
+
+สร้างตาราง: python -m app.migrations doc_counters
+"""
+import os
+import threading
+from typing import Callable, Dict, List, Tuple
+
+from sqlalchemy import text
+
+from .database import SessionLocal
+
+Seed = Callable[[object, str], int]
+
+
+def _parse_blocks(raw: str) -> Dict[str, int]:
+    out = {}
+    for part in raw.split(","):
+        if not part.strip():
+            continue
+        name, _, size = part.partition("=")
+        try:
+            out[name.strip()] = int(size)
+        except ValueError:
+            raise ValueError(f"DOC_NUMBER_BLOCKS: expected name=size (got {part.strip()!r})")
+    return out
+
+BLOCKS = _parse_blocks(os.getenv("DOC_NUMBER_BLOCKS", ""))
+
+_UPDATE_SQL = text("""
+    UPDATE public.doc_counters SET value = value + :n, updated_at = now()
+    WHERE name = :name AND period = :period
+    RETURNING value
+""")
+_INSERT_SQL = text("""
+    INSERT INTO public.doc_counters AS c (name, period, value) VALUES (:name, :period, :seed + :n)
+    ON CONFLICT (name, period) DO UPDATE SET value = c.value + :n, updated_at = now()
+    RETURNING value
+""")
+_PEEK_SQL = text("SELECT value FROM public.doc_counters WHERE name = :name AND period = :period")
+
+_seeds: Dict[str, Seed] = {}
+_pools: Dict[Tuple[str, str], List[int]] = {}   # (name, period) -> [เลขถัดไป, เลขสุดท้ายของ block]
+_pool_lock = threading.Lock()
+
+
+def register(name: str, seed: Seed):
+    _seeds[name] = seed
+
+def _reserve(db, name: str, period: str, n: int) -> int:
+    """เพิ่มตัวนับ n คืนค่าเลขสุดท้ายที่จองได้ (แถวถูก lock จนจบ transaction ของ db)"""
+    params = {"name": name, "period": period, "n": n}
+    row = db.execute(_UPDATE_SQL, params).first()
+    if row is None:
+        # ยังไม่มีแถว: seed จากเลขสูงสุดเดิม (ถ้าอีก request insert ไปก่อน ON CONFLICT จะบวกต่อให้)
+        seed = int(_seeds[name](db, period) or 0)
+        row = db.execute(_INSERT_SQL, {**params, "seed": seed}).first()
+    return int(row[0])
+
+def allocate(db, name: str, period: str = "") -> int:
+    """จองเลขถัดไป (ใช้ใน transaction ที่บันทึกเอกสาร แล้ว commit ตามปกติ)"""
+    block = BLOCKS.get(name, 1)
+    if block <= 1:
+        return _reserve(db, name, period, 1)
+
+    key = (name, period)
+    with _pool_lock:
+        pool = _pools.get(key)
+        if pool is None or pool[0] > pool[1]:
+            s = SessionLocal()
+            try:
+                last = _reserve(s, name, period, block)
+                s.commit()
+            finally:
+                s.close()
+            pool = _pools[key] = [last - block + 1, last]
+        n = pool[0]
+        pool[0] += 1
+        return n
+
+def peek(db, name: str, period: str = "") -> int:
+    """เลขถัดไปที่ allocate น่าจะได้ (ไม่จอง อาจถูก request อื่นใช้ก่อนได้)"""
+    pool = _pools.get((name, period))
+    if pool is not None and pool[0] <= pool[1]:
+        return pool[0]
+    value = db.execute(_PEEK_SQL, {"name": name, "period": period}).scalar()
+    if value is None:
+        value = _seeds[name](db, period) or 0
+    return int(value) + 1
@@ -3,26 +3,18 @@ from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException, Query
 from pydantic import BaseModel, field_validator
 from sqlalchemy.orm import Session
-from sqlalchemy import or_, Column, String
+from sqlalchemy import Column, Integer, String, cast
 from sqlalchemy.exc import IntegrityError
-from .database import SessionLocal
-from . import models
+from .deps import get_db, get_read_db
+from . import doc_numbers, master_cache, models, periods, revenue_rollup
 from .models import Driver
 
-from datetime import date
 from sqlalchemy import func
 
 VAT_RATE = 0.07
 
 router = APIRouter()
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 class DriverIn(BaseModel):
     citizen_id: str
     prefix: Optional[str] = ""
@@ -49,44 +41,50 @@ class DriverOut(BaseModel):
     first_name: str
     last_name: str
 
+def _seed_driver(db: Session, period: str) -> int:
+    """เลขสูงสุดของรหัส D<NNNN> ที่มีอยู่แล้ว (ใช้ครั้งแรกครั้งเดียว)"""
+    run = func.substring(Driver.driver_id, "^D([0-9]+)$")
+    return db.query(func.max(cast(run, Integer))).filter(Driver.driver_id.like("D%")).scalar() or 0
+
+doc_numbers.register("driver", _seed_driver)
+
 def gen_sequential_driver_id(db: Session) -> str:
-    row = (
-        db.query(Driver.driver_id)
-        .filter(Driver.driver_id.like("D%"))
-        .order_by(Driver.driver_id.desc())
-        .first()
-    )
-    if not row or not row[0] or not row[0].startswith("D"):
-        nxt = 1
-    else:
-        try:
-            nxt = int(row[0][1:]) + 1
-        except ValueError:
-            nxt = 1
-    return f"D{nxt:04d}"
+    return f"D{doc_numbers.allocate(db, 'driver'):04d}"
+
+def _load_drivers(db: Session) -> list:
+    rows = db.query(Driver).order_by(Driver.driver_id.asc(), Driver.first_name.asc()).all()
+    return [
+        {
+            "driver_id": r.driver_id,
+            "citizen_id": r.citizen_id,
+            "prefix": r.prefix,
+            "first_name": r.first_name,
+            "last_name": r.last_name,
+        }
+        for r in rows
+    ]
+
+master_cache.register("drivers", _load_drivers)
+
+_DRIVER_SEARCH_FIELDS = ("driver_id", "first_name", "last_name", "citizen_id", "prefix")
 
 @router.get("/api/drivers")
 def list_drivers(
     search: str = Query("", description="ค้นหา (ชื่อ/สกุล/เลขบัตร)"),
     page: int = Query(1, ge=1),
     page_size: int = Query(50, ge=1, le=200),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    q = db.query(Driver)
-    if search.strip():
-        pat = f"%{search.strip()}%"
-        q = q.filter(or_(
-            Driver.driver_id.ilike(pat), 
-            Driver.first_name.ilike(pat),
-            Driver.last_name.ilike(pat),
-            Driver.citizen_id.ilike(pat),
-            Driver.prefix.ilike(pat),
-        ))
-    total = q.count()
-    rows = q.order_by(Driver.driver_id.asc(), Driver.first_name.asc()).offset((page-1)*page_size).limit(page_size).all()
+    # รายชื่อพนักงานขับรถมาจากแคช; ทะเบียนรถ (จากบิล) ยังอ่านจาก DB เฉพาะคนในหน้านี้
+    drivers = master_cache.get("drivers").rows
+    needle = search.strip().casefold()
+    if needle:
+        drivers = [d for d in drivers if any(master_cache.contains(d[k], needle) for k in _DRIVER_SEARCH_FIELDS)]
+    total = len(drivers)
+    rows = drivers[(page-1)*page_size:page*page_size]
 
     # Batch-load car plates for each driver from invoices
-    driver_ids = [r.driver_id for r in rows]
+    driver_ids = [r["driver_id"] for r in rows]
     car_plates_map = {}
     if driver_ids:
         inv = models.Invoice
@@ -110,14 +108,7 @@ def list_drivers(
         "page": page,
         "page_size": page_size,
         "items": [
-            {
-                "driver_id": r.driver_id,
-                "citizen_id": r.citizen_id,
-                "prefix": r.prefix,
-                "first_name": r.first_name,
-                "last_name": r.last_name,
-                "car_plates": car_plates_map.get(r.driver_id, ""),
-            }
+            {**r, "car_plates": car_plates_map.get(r["driver_id"], "")}
             for r in rows
         ]
     }
@@ -143,6 +134,7 @@ def create_driver(data: DriverIn, db: Session = Depends(get_db)):
         db.rollback()
         raise HTTPException(status_code=409, detail=f"save driver failed: {e.orig}")
     db.refresh(driver)
+    master_cache.invalidate("drivers")
     return DriverOut(
         driver_id=driver.driver_id,
         citizen_id=driver.citizen_id,
@@ -172,6 +164,7 @@ def update_driver(driver_id: str, data: DriverIn, db: Session = Depends(get_db))
         db.rollback()
         raise HTTPException(status_code=409, detail=f"update driver failed: {e.orig}")
     db.refresh(driver)
+    master_cache.invalidate("drivers")
     return DriverOut(
         driver_id=driver.driver_id,
         citizen_id=driver.citizen_id,
@@ -187,6 +180,7 @@ def delete_driver(driver_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="not found")
     db.delete(driver)
     db.commit()
+    master_cache.invalidate("drivers")
     return
 
 @router.get("/api/driver-summary")
@@ -197,61 +191,27 @@ def driver_summary(
     end: Optional[str] = Query(None, description="YYYY-MM-DD"),
     month: Optional[str] = Query(None, description="YYYY-MM"),
     year: Optional[int] = Query(None, ge=2000, le=2100),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ):
-    inv = models.Invoice
-    itm = models.InvoiceItem
-
-    if granularity == "day":
-        label_expr = func.to_char(inv.invoice_date, 'YYYY-MM-DD')
-    elif granularity == "month":
-        label_expr = func.to_char(inv.invoice_date, 'YYYY-MM')
-    else:
-        label_expr = func.to_char(inv.invoice_date, 'YYYY')
-
-    # คำนวณยอดรวมของรายการต่อบิล
-    sum_amount = func.sum(
-        func.coalesce(
-            itm.amount,
-            func.coalesce(itm.quantity, 0) * func.coalesce(itm.cf_itempricelevel_price, 0)
-        )
-    )
+    # อ่านจาก rollup รายวัน (เดือน/ปี รวมจากแถวรายวัน)
+    rd = models.RevenueDaily
 
     car_list = func.array_to_string(
-            func.array_agg(func.distinct(inv.car_numberplate)),
+            func.array_agg(func.distinct(func.nullif(rd.car_numberplate, ''))),
             ', '
         )
 
     q = (
         db.query(
-            label_expr.label("period"),
-            func.count(func.distinct(inv.idx)).label("count"),
-            func.coalesce(sum_amount, 0).label("amount"),
-            car_list.label("car_plates"), 
+            revenue_rollup.period_label(granularity).label("period"),
+            func.coalesce(func.sum(rd.invoice_count), 0).label("count"),
+            func.coalesce(func.sum(rd.amount), 0).label("amount"),
+            car_list.label("car_plates"),
         )
-        .outerjoin(itm, itm.invoice_number == inv.invoice_number)
-        .filter(inv.driver_id == driver_id)
+        .filter(rd.driver_id == driver_id)
     )
 
-    def _to_date(s):
-        if not s:
-            return None
-        try:
-            return date.fromisoformat(s)
-        except Exception:
-            return None
-
-    if granularity == "day":
-        d1 = _to_date(start); d2 = _to_date(end)
-        if d1: q = q.filter(inv.invoice_date >= d1)
-        if d2: q = q.filter(inv.invoice_date <= d2)
-    elif granularity == "month":
-        if month and len(month) == 7:
-            q = q.filter(func.to_char(inv.invoice_date, 'YYYY-MM') == month)
-    else:
-        if year:
-            q = q.filter(func.extract("year", inv.invoice_date) == year)
-
+    q = periods.apply(q, rd.day, granularity, start, end, month, year)
     q = q.group_by("period").order_by("period")
 
     out = []
@@ -278,7 +238,7 @@ def driver_invoices(
     start: Optional[str] = Query(None),
     end: Optional[str] = Query(None),
     qtext: Optional[str] = Query(None, alias="q"),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ):
     inv = models.Invoice
     itm = models.InvoiceItem
@@ -291,10 +251,10 @@ def driver_invoices(
     )
     sub = (
         db.query(
-            itm.invoice_number.label("inv_no"),
+            itm.invoice_idx.label("inv_idx"),
             func.coalesce(sub_amount, 0).label("amount"),
         )
-        .group_by(itm.invoice_number)
+        .group_by(itm.invoice_idx)
         .subquery()
     )
 
@@ -310,21 +270,11 @@ def driver_invoices(
             inv.car_numberplate,
             func.coalesce(sub.c.amount, 0).label("amount"),
         )
-        .outerjoin(sub, sub.c.inv_no == inv.invoice_number)
+        .outerjoin(sub, sub.c.inv_idx == inv.idx)
         .filter(inv.driver_id == driver_id)
     )
 
-    def _to_date(s):
-        if not s:
-            return None
-        try:
-            return date.fromisoformat(s)
-        except Exception:
-            return None
-
-    d1 = _to_date(start); d2 = _to_date(end)
-    if d1: q = q.filter(inv.invoice_date >= d1)
-    if d2: q = q.filter(inv.invoice_date <= d2)
+    q = periods.apply(q, inv.invoice_date, start=start, end=end)
 
     if qtext and qtext.strip():
         pat = f"%{qtext.strip()}%"
@@ -4,6 +4,7 @@ from datetime import date, datetime, timedelta
 from decimal import Decimal, ROUND_HALF_UP
 from typing import Optional, List
 
+import re
 import tempfile
 import uuid
 # --- PdfMerger compatibility (pypdf 3.x & 4.x) ---
@@ -23,23 +24,22 @@ except ImportError:
         def close(self):
             pass
 
-# ใช้ WeasyPrint แทน pdfkit/wkhtmltopdf
-from weasyprint import HTML, CSS
 from fastapi import APIRouter, Request, Form, HTTPException, Query, Depends, Body
 from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, FileResponse
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
-from sqlalchemy import func, cast, Integer, Date
+from sqlalchemy import func, Date
 from sqlalchemy.exc import IntegrityError
 
-from .database import SessionLocal
-from . import models
+from .deps import get_db
+from . import grn_index, invoice_items, models, pdf_pool, pdf_cache, product_prices, revenue_rollup, static_assets
 
 router = APIRouter()
 
 # ---------- Templates + ฟิลเตอร์ ----------
 BASE_DIR = Path(__file__).resolve().parent
 templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
+templates.env.globals["static_url"] = static_assets.static_url
 
 TH_MONTHS = ["มกราคม","กุมภาพันธ์","มีนาคม","เมษายน","พฤษภาคม","มิถุนายน",
              "กรกฎาคม","สิงหาคม","กันยายน","ตุลาคม","พฤศจิกายน","ธันวาคม"]
@@ -115,14 +115,6 @@ def thai_baht_text(value) -> str:
 templates.env.filters["thaidate"] = thaidate
 templates.env.filters["thbaht"] = thai_baht_text
 
-# ---------- DB dependency ----------
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 # ---------- Utils ----------
 TH_MONTHS_MAP = {
     "มกราคม":1,"กุมภาพันธ์":2,"มีนาคม":3,"เมษายน":4,"พฤษภาคม":5,"มิถุนายน":6,
@@ -225,11 +217,12 @@ def submit(
         db.add(inv)
         db.flush()
 
+        rows = []
         for i in range(len(product_code)):
             qty   = float(quantity[i] or 0)
             price = float(unit_price[i] or 0)
-            db.add(models.InvoiceItem(
-                invoice_number=inv.idx,
+            rows.append(dict(
+                invoice_number=str(inv.idx),
                 personid=personid,
                 cf_itemid=product_code[i],
                 cf_itemname=description[i],
@@ -239,7 +232,11 @@ def submit(
                 quantity=qty,
                 amount=qty*price
             ))
+        invoice_items.insert_items(db, inv.idx, rows)
 
+        revenue_rollup.add_invoices(db, [inv.idx])
+        grn_index.add_invoices(db, [inv.idx])
+        product_prices.add_invoices(db, [inv.idx])
         db.commit()
     except IntegrityError as e:
         db.rollback()
@@ -252,12 +249,13 @@ def submit(
 def api_invoice_items(inv_id: int, db: Session = Depends(get_db)):
     it = models.InvoiceItem
     rows = db.query(
-        it.cf_itemid, it.cf_itemname, it.quantity, it.cf_itempricelevel_price, it.amount
+        it.cf_itemid, it.cf_itemname, it.quantity, it.cf_itempricelevel_price, it.amount, it.idx
     ).filter(
-        cast(it.invoice_number, Integer) == inv_id
+        it.invoice_idx == inv_id
     ).order_by(it.cf_items_ordinary.asc()).all()
 
     data = [{
+        "idx": r[5],
         "cf_itemid": r[0],
         "cf_itemname": r[1],
         "quantity": float(r[2] or 0),
@@ -296,7 +294,7 @@ def api_invoice_detail(inv_id: int, db: Session = Depends(get_db)):
     }
 
     rows = db.query(models.InvoiceItem)\
-        .filter(cast(models.InvoiceItem.invoice_number, Integer) == inv_id)\
+        .filter(models.InvoiceItem.invoice_idx == inv_id)\
         .order_by(models.InvoiceItem.cf_items_ordinary.asc())\
         .all()
 
@@ -311,7 +309,7 @@ def api_invoice_detail(inv_id: int, db: Session = Depends(get_db)):
 
     return {"invoice": head, "items": items}
 
-# ---------- API: อัปเดตบิล + แทนที่รายการทั้งหมด ----------
+# ---------- API: อัปเดตบิล + รายการ ----------
 from pydantic import BaseModel
 
 class InvoiceItemIn(BaseModel):
@@ -345,9 +343,14 @@ class InvoiceUpdate(BaseModel):
 
 @router.put("/api/invoices/{inv_id}")
 def api_update_invoice(inv_id: int, payload: InvoiceUpdate, db: Session = Depends(get_db)):
-    inv = db.query(models.Invoice).filter(models.Invoice.idx == inv_id).first()
+    # lock แถวบิลก่อนถอนออกจาก rollup: แก้บิลเดียวกันพร้อมกันจะรอกัน ไม่ถอนยอดซ้ำ
+    inv = db.query(models.Invoice).filter(models.Invoice.idx == inv_id).with_for_update().first()
     if not inv:
         raise HTTPException(status_code=404, detail="invoice not found")
+    old_inv_no = inv.invoice_number
+    revenue_rollup.remove_invoices(db, [inv.idx])
+    grn_index.remove_invoices(db, [inv.idx])
+    product_prices.remove_invoices(db, [inv.idx])
 
     for field in [
         "invoice_number","fname","personid","tel","mobile",
@@ -367,16 +370,16 @@ def api_update_invoice(inv_id: int, payload: InvoiceUpdate, db: Session = Depend
     d = _parse_ymd(payload.due_date) if payload.due_date is not None else None
     if d: inv.due_date = d
 
+    db.flush()
     if payload.items is not None:
-        db.query(models.InvoiceItem)\
-          .filter(cast(models.InvoiceItem.invoice_number, Integer) == inv_id)\
-          .delete()
-        order = 1
-        for it in payload.items:
+        # เขียนเฉพาะรายการที่เปลี่ยน (จับคู่ตาม idx ของรายการเดิม)
+        rows = []
+        for order, it in enumerate(payload.items, start=1):
             qty = float(it.quantity or 0)
             price = float(it.unit_price or 0)
-            db.add(models.InvoiceItem(
-                invoice_number=inv_id,
+            rows.append(dict(
+                idx=it.idx,
+                invoice_number=str(inv_id),
                 personid=inv.personid,
                 cf_itemid=it.cf_itemid,
                 cf_itemname=it.cf_itemname,
@@ -386,9 +389,16 @@ def api_update_invoice(inv_id: int, payload: InvoiceUpdate, db: Session = Depend
                 quantity=qty,
                 amount=qty*price
             ))
-            order += 1
+        invoice_items.sync_items(db, inv_id, rows)
 
+    revenue_rollup.add_invoices(db, [inv.idx])
+    grn_index.add_invoices(db, [inv.idx])
+    product_prices.add_invoices(db, [inv.idx])
     db.commit()
+    pdf_cache.invalidate(
+        pdf_cache.make_tag("invoice", old_inv_no),
+        pdf_cache.make_tag("invoice", inv.invoice_number),
+    )
     return {"ok": True}
 
 # ---------- Preview HTML (เรนเดอร์จาก invoice.html) ----------
@@ -405,102 +415,130 @@ def preview(request: Request, payload: dict = Body(...)):
         }
     )
 
-@router.post("/export-merged-pdf")
-def export_merged_pdf(request: Request, payload: dict = Body(...)):
+# ---------- Export PDF (ต้นฉบับ/สำเนา ของใบกำกับ + ใบเสร็จ) ----------
+INVOICE_VARIANTS = [
+    ("invoice_original", "ใบกำกับ/ส่งของ/แจ้งหนี้ (ต้นฉบับ)"),
+    ("receipt_original", "ใบเสร็จรับเงิน (ต้นฉบับ)"),
+    ("invoice_copy",     "ใบกำกับ/ส่งของ/ใบแจ้งหนี้ (สำเนา)"),
+    ("receipt_copy",     "ใบเสร็จรับเงิน (สำเนา)"),
+]
+
+def _normalize_invoice_payload(src: dict) -> dict:
+    """normalize คีย์จาก payload ให้ตรงกับเทมเพลต invoice.html"""
+    out = dict(src or {})
+    # ---- หัวลูกค้า ----
+    out["customer_name"]     = src.get("customer_name") or src.get("fname") or ""
+    out["customer_taxid"]    = src.get("customer_taxid") or src.get("cf_taxid") or ""
+    out["customer_address"]  = src.get("customer_address") or src.get("cf_personaddress") or ""
+    out["cf_personzipcode"]  = src.get("cf_personzipcode") or ""
+    out["cf_provincename"]   = src.get("cf_provincename") or ""
+    out["tel"]               = src.get("tel") or src.get("mobile") or ""
+    out["mobile"]            = src.get("mobile") or src.get("tel") or ""
+
+    # ---- รายการสินค้า ----
+    items = []
+    for it in (src.get("items") or []):
+        items.append({
+            "product_code": it.get("product_code") or it.get("cf_itemid") or "",
+            "description":  it.get("description")  or it.get("cf_itemname") or "",
+            "quantity":     float(it.get("quantity") or 0),
+            "unit_price":   float(it.get("unit_price") or 0),
+        })
+    out["items"] = items
+    return out
+
+def render_invoice_variant_html(payload: dict, variant_code: str) -> str:
     """
-    สร้าง PDF 4 เวอร์ชันจาก invoice.html (เหมือน preview) แล้ว merge เป็นไฟล์เดียว
-    - normalize คีย์จาก payload ให้ตรงกับเทมเพลต
-    - map ทุกลิงก์ /static/* เป็น file://…/static/* สำหรับ WeasyPrint
-    - แนบ stylesheet /static/css/invoice.css เสมอ
+    เรนเดอร์ invoice.html หนึ่ง variant (HTML เดียวกับ preview)
+    แล้ว map /static/* -> file://…/static/* (ครอบคลุม <link>, <img>) สำหรับ WeasyPrint
     """
-    variants = [
-        ("invoice_original", "ใบกำกับ/ส่งของ/แจ้งหนี้ (ต้นฉบับ)"),
-        ("receipt_original", "ใบเสร็จรับเงิน (ต้นฉบับ)"),
-        ("invoice_copy",     "ใบกำกับ/ส่งของ/ใบแจ้งหนี้ (สำเนา)"),
-        ("receipt_copy",     "ใบเสร็จรับเงิน (สำเนา)"),
-    ]
-
-    base_dir = BASE_DIR
-    css_path = base_dir / "static" / "css" / "invoice.css"
-    static_root_uri = (base_dir / "static").as_uri()  # e.g. file:///app/app/static
-
-    def normalize_payload(src: dict) -> dict:
-        out = dict(src or {})
-        # ---- หัวลูกค้า ----
-        out["customer_name"]     = src.get("customer_name") or src.get("fname") or ""
-        out["customer_taxid"]    = src.get("customer_taxid") or src.get("cf_taxid") or ""
-        out["customer_address"]  = src.get("customer_address") or src.get("cf_personaddress") or ""
-        out["cf_personzipcode"]  = src.get("cf_personzipcode") or ""
-        out["cf_provincename"]   = src.get("cf_provincename") or ""
-        out["tel"]               = src.get("tel") or src.get("mobile") or ""
-        out["mobile"]            = src.get("mobile") or src.get("tel") or ""
-
-        # ---- รายการสินค้า ----
-        items = []
-        for it in (src.get("items") or []):
-            items.append({
-                "product_code": it.get("product_code") or it.get("cf_itemid") or "",
-                "description":  it.get("description")  or it.get("cf_itemname") or "",
-                "quantity":     float(it.get("quantity") or 0),
-                "unit_price":   float(it.get("unit_price") or 0),
-            })
-        out["items"] = items
-        return out
+    view_payload = _normalize_invoice_payload({**(payload or {}), "variant": variant_code})
+    html_str = templates.get_template("invoice.html").render({
+        "invoice": view_payload,
+        "discount": view_payload.get("discount", 0),
+        "vat_rate": view_payload.get("vat_rate", 7),
+    })
+    static_root_uri = (BASE_DIR / "static").as_uri()  # e.g. file:///app/app/static
+    return (html_str
+        .replace('href="/static/',  f'href="{static_root_uri}/')
+        .replace('src="/static/',   f'src="{static_root_uri}/')
+    )
 
+_BODY_RE = re.compile(r"<body[^>]*>(.*)</body>", re.S | re.I)
+
+def build_multi_variant_html(payload: dict) -> str:
+    """
+    รวมทุก variant ใน INVOICE_VARIANTS เป็น HTML เอกสารเดียว คั่นด้วย page break
+    (ใช้ <head> ของ variant แรก) เพื่อให้ WeasyPrint layout รอบเดียว
+    """
+    docs = [render_invoice_variant_html(payload, code) for code, _name in INVOICE_VARIANTS]
+    first = docs[0]
+    head = first[:_BODY_RE.search(first).start()]
+    sections = []
+    for i, doc in enumerate(docs):
+        style = ' style="page-break-before: always;"' if i else ""
+        sections.append(f"<section{style}>{_BODY_RE.search(doc).group(1)}</section>")
+    return f"{head}<body>{''.join(sections)}</body></html>"
+
+def merge_variant_pdfs_legacy(payload: dict, render) -> Path:
+    """
+    วิธีเดิม: เรนเดอร์ทีละ variant ลง temp PDF แล้ว merge ด้วย PdfMerger
+    render(html_str) -> bytes
+    """
     temp_pdf_paths = []
     merger = PdfMerger()
-
     try:
-        for variant_code, _name in variants:
-            payload["variant"] = variant_code
-            view_payload = normalize_payload(payload)
-
-            # 1) เรนเดอร์ HTML เดียวกับ preview
-            html_resp = templates.TemplateResponse(
-                request,
-                "invoice.html",
-                {
-                    "request": request,
-                    "invoice": view_payload,
-                    "discount": view_payload.get("discount", 0),
-                    "vat_rate": view_payload.get("vat_rate", 7),
-                }
-            )
-            html_str = html_resp.body.decode("utf-8")
-
-            # 2) map /static/* -> file://…/static/* (ครอบคลุม <link>, <img>, @font-face)
-            html_str = (html_str
-                .replace('href="/static/',  f'href="{static_root_uri}/')
-                .replace('src="/static/',   f'src="{static_root_uri}/')
-            )
-
-            # 3) เขียน PDF ชั่วคราว ด้วย CSS เดียวกับ preview
+        for variant_code, _name in INVOICE_VARIANTS:
+            html_str = render_invoice_variant_html(payload, variant_code)
             tmp_pdf = Path(tempfile.gettempdir()) / f"{uuid.uuid4()}.pdf"
-            HTML(string=html_str, base_url=str(base_dir)).write_pdf(
-                str(tmp_pdf),
-                stylesheets=[CSS(filename=str(css_path))]
-            )
+            tmp_pdf.write_bytes(render(html_str))
             temp_pdf_paths.append(tmp_pdf)
 
-        # 4) รวม PDF
         for p in temp_pdf_paths:
             merger.append(str(p))
 
         out_path = Path(tempfile.gettempdir()) / f"merged_invoice_{payload.get('invoice_number', 'doc')}.pdf"
         merger.write(str(out_path))
         merger.close()
-
-        return FileResponse(
-            path=out_path,
-            media_type="application/pdf",
-            filename=f"invoice_merged_{payload.get('invoice_number', 'doc')}.pdf"
-        )
-
+        return out_path
     finally:
-        # 5) เก็บกวาด temp เสมอ
+        # เก็บกวาด temp เสมอ
         for p in temp_pdf_paths:
             try:
                 if p.exists():
                     p.unlink()
             except Exception:
                 pass
+
+@router.post("/export-merged-pdf")
+def export_merged_pdf(
+    request: Request,
+    payload: dict = Body(...),
+    mode: str = Query("single", pattern="^(single|merge)$"),
+):
+    """
+    สร้าง PDF 4 เวอร์ชันจาก invoice.html (เหมือน preview) เป็นไฟล์เดียว
+    - mode=single (ค่าเริ่มต้น): รวม 4 variant เป็น HTML เดียว เรนเดอร์รอบเดียวลง memory
+    - mode=merge: วิธีเดิม เรนเดอร์ 4 ครั้งลง temp PDF แล้ว merge
+    - แนบ stylesheet /static/css/invoice.css เสมอ (parse ค้างไว้ใน pdf_pool)
+    """
+    inv_no = payload.get("invoice_number", "doc")
+
+    def render(html_str: str) -> bytes:
+        return pdf_pool.render_pdf(html_str, base_url=str(BASE_DIR), stylesheet="invoice")
+
+    if mode == "single":
+        pdf_bytes = pdf_cache.render_cached(
+            pdf_cache.make_tag("invoice", inv_no),
+            build_multi_variant_html(payload),
+            base_url=str(BASE_DIR),
+            stylesheet="invoice",
+        )
+        return pdf_pool.pdf_response(pdf_bytes, f"invoice_merged_{inv_no}.pdf")
+
+    out_path = merge_variant_pdfs_legacy(payload, render)
+    return FileResponse(
+        path=out_path,
+        media_type="application/pdf",
+        filename=f"invoice_merged_{inv_no}.pdf"
+    )
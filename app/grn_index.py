@@ -0,0 +1,134 @@
+# app/grn_index.py
+"""
+ตารางสรุปต่อเลข GRN ss_invoices.grn_index (ใช้ในฟอร์มใบลดหนี้)
+
+    grn_number -> จำนวนบิล, เลขที่บิลแรก + รหัสลูกค้าของบิลนั้น, รหัส/ชื่อสินค้า (ไม่ซ้ำ), ปริมาณรวม
+
+แทนการ SELECT DISTINCT / join บิลกับรายการทุกครั้งที่พิมพ์ GRN:
+- /api/grn/suggest ค้นจากตารางนี้ (แถวละ GRN) ด้วย trigram index (ถ้ามี pg_trgm) ขึ้นต้นตรงก่อน
+- /api/grn/summary อ่านแถวเดียวตาม primary key
+
+อัปเดตใน transaction เดียวกับการเขียนบิล (เรียกคู่กับ revenue_rollup):
+    grn_index.remove_invoices(db, [idx])   # ก่อนแก้ไข/ลบ: คำนวณ GRN เดิมใหม่โดยไม่นับบิลนี้
+    ... แก้ไขบิล / รายการ ...
+    db.flush()
+    grn_index.add_invoices(db, [idx])      # หลังบันทึก: คำนวณ GRN ของบิลนี้ใหม่
+แต่ละ GRN ถูกคำนวณใหม่จากตารางบิลทั้งก้อน (ไม่ใช่บวก/ลบ) และ lock ด้วย advisory lock ต่อ GRN
+ทำให้บันทึกบิลของ GRN เดียวกันพร้อมกันแล้วไม่ได้ค่าที่ขาดหาย
+
+สร้างใหม่ทั้งตาราง: python -m app.migrations grn_index
+"""
+from typing import Iterable, List
+
+from sqlalchemy import text
+
+# namespace ของ pg_advisory_xact_lock(int, int) ไม่ให้ชนกับ lock อื่น
+_LOCK_NS = 0x67726E   # "grn"
+
+# รวมต่อ GRN จากบิล + รายการ ({where} กรองบิล)
+_SOURCE_SQL = """
+    SELECT inv.grn_number,
+           count(DISTINCT inv.idx) AS invoice_count,
+           (array_agg(inv.invoice_number ORDER BY inv.invoice_number NULLS LAST, inv.idx))[1] AS first_invoice_number,
+           (array_agg(inv.personid ORDER BY inv.invoice_number NULLS LAST, inv.idx))[1] AS first_personid,
+           array_agg(DISTINCT it.cf_itemid) FILTER (WHERE it.idx IS NOT NULL) AS product_codes,
+           array_agg(DISTINCT it.cf_itemname) FILTER (WHERE it.idx IS NOT NULL) AS descriptions,
+           coalesce(sum(it.quantity), 0) AS quantity_sum
+    FROM ss_invoices.invoices AS inv
+    LEFT JOIN ss_invoices.invoice_items AS it ON it.invoice_idx = inv.idx
+    WHERE inv.grn_number <> '' {where}
+    GROUP BY inv.grn_number
+"""
+
+_UPSERT_SQL = """
+    INSERT INTO ss_invoices.grn_index AS g
+        (grn_number, invoice_count, first_invoice_number, first_personid,
+         product_codes, descriptions, quantity_sum, updated_at)
+    SELECT s.*, now() FROM ({source}) AS s
+    ON CONFLICT (grn_number) DO UPDATE SET
+        invoice_count = EXCLUDED.invoice_count,
+        first_invoice_number = EXCLUDED.first_invoice_number,
+        first_personid = EXCLUDED.first_personid,
+        product_codes = EXCLUDED.product_codes,
+        descriptions = EXCLUDED.descriptions,
+        quantity_sum = EXCLUDED.quantity_sum,
+        updated_at = now()
+"""
+
+CREATE_SQL = """
+    CREATE TABLE IF NOT EXISTS ss_invoices.grn_index (
+        grn_number           varchar PRIMARY KEY,
+        invoice_count        integer NOT NULL DEFAULT 0,
+        first_invoice_number varchar,
+        first_personid       varchar,
+        product_codes        varchar[],
+        descriptions         varchar[],
+        quantity_sum         numeric NOT NULL DEFAULT 0,
+        updated_at           timestamptz NOT NULL DEFAULT now()
+    )
+"""
+
+# ใช้หา GRN ที่ต้องคำนวณใหม่ และรวมยอดต่อ GRN
+CREATE_INVOICES_INDEX_SQL = """
+    CREATE INDEX IF NOT EXISTS ix_ss_invoices_invoices_grn_number
+    ON ss_invoices.invoices (grn_number)
+"""
+
+TRGM_INDEX = "ix_ss_invoices_grn_index_grn_trgm"
+CREATE_TRGM_INDEX_SQL = f"""
+    CREATE INDEX IF NOT EXISTS {TRGM_INDEX}
+    ON ss_invoices.grn_index USING gin (grn_number gin_trgm_ops)
+"""
+
+
+def _grns_of(conn, ids: List[int]) -> List[str]:
+    rows = conn.execute(text("""
+        SELECT DISTINCT grn_number FROM ss_invoices.invoices
+        WHERE idx = ANY(:ids) AND grn_number <> ''
+        ORDER BY grn_number
+    """), {"ids": ids}).scalars().all()
+    return list(rows)
+
+def refresh(conn, grns: Iterable[str], exclude: Iterable[int] = ()):
+    """คำนวณแถวของ GRN ที่ระบุใหม่จากตารางบิล (ไม่นับบิล idx ใน exclude) GRN ที่ไม่เหลือบิลถูกลบ"""
+    grns = sorted({g for g in grns if g})
+    if not grns:
+        return
+    exclude = [int(i) for i in exclude]
+    # lock ตามลำดับชื่อ GRN (กัน deadlock) แล้วคำนวณใน statement ถัดไป ซึ่งเห็นข้อมูลที่ commit แล้วล่าสุด
+    conn.execute(
+        text("SELECT pg_advisory_xact_lock(:ns, hashtext(g)) FROM unnest(CAST(:grns AS varchar[])) AS g ORDER BY g"),
+        {"ns": _LOCK_NS, "grns": grns},
+    )
+    params = {"grns": grns, "exclude": exclude}
+    where = "AND inv.grn_number = ANY(:grns) AND NOT (inv.idx = ANY(:exclude))"
+    conn.execute(text(_UPSERT_SQL.format(source=_SOURCE_SQL.format(where=where))), params)
+    conn.execute(text("""
+        DELETE FROM ss_invoices.grn_index AS g
+        WHERE g.grn_number = ANY(:grns)
+          AND NOT EXISTS (
+              SELECT 1 FROM ss_invoices.invoices AS inv
+              WHERE inv.grn_number = g.grn_number AND NOT (inv.idx = ANY(:exclude))
+          )
+    """), params)
+
+def add_invoices(db, invoice_idxs: Iterable[int]):
+    """คำนวณ GRN ของบิลเหล่านี้ใหม่ (เรียกหลัง flush บิลและรายการแล้ว)"""
+    ids = [int(i) for i in invoice_idxs if i is not None]
+    if ids:
+        refresh(db, _grns_of(db, ids))
+
+def remove_invoices(db, invoice_idxs: Iterable[int]):
+    """คำนวณ GRN เดิมของบิลเหล่านี้ใหม่โดยไม่นับบิลเหล่านี้ (เรียกก่อนแก้ไข/ลบ)"""
+    ids = [int(i) for i in invoice_idxs if i is not None]
+    if ids:
+        refresh(db, _grns_of(db, ids), exclude=ids)
+
+def rebuild(conn) -> int:
+    """สร้างตารางใหม่จากบิลทั้งหมด คืนจำนวน GRN"""
+    conn.execute(text(CREATE_SQL))
+    conn.execute(text(CREATE_INVOICES_INDEX_SQL))
+    conn.execute(text("TRUNCATE ss_invoices.grn_index"))
+    conn.execute(text(_UPSERT_SQL.format(source=_SOURCE_SQL.format(where=""))))
+    conn.execute(text("ANALYZE ss_invoices.grn_index"))
+    return conn.execute(text("SELECT count(*) FROM ss_invoices.grn_index")).scalar()
@@ -0,0 +1,65 @@
+# app/internal_metrics.py
+"""
+สถิติภายในสำหรับผู้ดูแลระบบ (ไม่เปิดให้ผู้ใช้ทั่วไป)
+
+  GET /internal/metrics/pdf-cache      hit/miss/ขนาดของ app/pdf_cache.py
+  GET /internal/metrics/master-cache   เวอร์ชัน/จำนวนแถวของ app/master_cache.py
+  GET /internal/metrics/db-pool        สถานะ connection pool (app/db_pool.py)
+
+ตั้งค่าผ่าน environment:
+  INTERNAL_METRICS_TOKEN   token ที่ต้องส่งมากับ request
+                             Authorization: Bearer <token>  หรือ  X-Metrics-Token: <token>
+                           ไม่ตั้ง = ตอบเฉพาะ request จากเครื่องเดียวกัน (127.0.0.1 / ::1)
+"""
+import hmac
+import os
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+
+from . import database, db_pool, master_cache, pdf_cache
+
+METRICS_TOKEN = os.getenv("INTERNAL_METRICS_TOKEN", "")
+_LOOPBACK = ("127.0.0.1", "::1")
+
+
+def _bearer(authorization: Optional[str]) -> str:
+    if authorization and authorization[:7].lower() == "bearer ":
+        return authorization[7:].strip()
+    return ""
+
+def require_internal(
+    request: Request,
+    authorization: Optional[str] = Header(None),
+    x_metrics_token: Optional[str] = Header(None),
+):
+    if METRICS_TOKEN:
+        given = x_metrics_token or _bearer(authorization)
+        if given and hmac.compare_digest(given.encode(), METRICS_TOKEN.encode()):
+            return
+    elif request.client and request.client.host in _LOOPBACK:
+        return
+    raise HTTPException(status_code=403, detail="forbidden")
+
+
+router = APIRouter(prefix="/internal/metrics", dependencies=[Depends(require_internal)])
+
+@router.get("/pdf-cache")
+def pdf_cache_metrics():
+    return pdf_cache.stats()
+
+@router.get("/master-cache")
+def master_cache_metrics():
+    return master_cache.stats()
+
+@router.get("/db-pool")
+def db_pool_metrics():
+    out = {
+        "sync": db_pool.stats(database.engine.pool),
+        "async": db_pool.stats(database.async_engine.sync_engine.pool),
+    }
+    # replica มี pool แยก (ไม่ตั้ง DATABASE_REPLICA_URL = ใช้ pool เดียวกับฐานหลัก)
+    if database.read_engine is not database.engine:
+        out["replica_sync"] = db_pool.stats(database.read_engine.pool)
+        out["replica_async"] = db_pool.stats(database.async_read_engine.sync_engine.pool)
+    return out
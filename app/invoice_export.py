@@ -0,0 +1,320 @@
+# app/invoice_export.py
+"""
+Export ใบกำกับหลายใบเป็นไฟล์เดียว (PDF รวม หรือ ZIP แยกไฟล์ต่อใบ)
+
+  POST /api/invoices/export-batch                 สร้างงาน คืน job_id ทันที
+  GET  /api/invoices/export-batch/{job_id}        ดูความคืบหน้า (ให้หน้าเว็บ poll)
+  GET  /api/invoices/export-batch/{job_id}/download  ดาวน์โหลดผลลัพธ์เมื่อเสร็จ
+
+งานรันใน thread เบื้องหลัง: โหลดหัวบิล + รายการด้วย 2 query แล้วส่งเรนเดอร์ขนานกัน
+ใน pdf_pool (ดูแคชใน pdf_cache ก่อน) สถานะงานเก็บใน memory ของ process นี้
+(ใช้กับ uvicorn process เดียวตาม Procfile)
+
+รันพร้อมกันได้ EXPORT_MAX_JOBS งาน ที่เกินรอคิวได้ EXPORT_QUEUE_DEPTH งาน คิวเต็มตอบ 503 + Retry-After
+ทุกงานรวมกันเรนเดอร์ค้างใน pdf_pool ได้ไม่เกิน EXPORT_RENDERS ใบ (ค่าเริ่มต้นน้อยกว่าจำนวน process หนึ่ง)
+export รายใบจากหน้าฟอร์ม (/export-merged-pdf) จึงยังมี process ว่างระหว่างงาน batch
+
+PDF แต่ละใบถูกเขียนลงดิสก์ทันทีที่เรนเดอร์เสร็จ (ZIP: ลงไฟล์ zip, PDF รวม: ไฟล์ชั่วคราวรายใบ)
+ZIP ใช้ memory แค่ PDF ของงานที่กำลังเรนเดอร์ แต่ PDF รวม merge ด้วย PdfWriter ซึ่งเก็บทุกหน้า
+ไว้ใน memory จนเขียนไฟล์ตอนท้าย (ใบละ 4 หน้า) จึงจำกัดจำนวนใบต่ำกว่า ZIP มาก
+
+ตั้งค่าผ่าน environment:
+  EXPORT_BATCH_MAX      จำนวนใบสูงสุดต่องาน ZIP (ค่าเริ่มต้น 2000)
+  EXPORT_MERGED_MAX     จำนวนใบสูงสุดต่องาน PDF รวม (ค่าเริ่มต้น 200)
+  EXPORT_JOB_TTL        วินาทีที่เก็บผลลัพธ์ไว้ให้ดาวน์โหลด (ค่าเริ่มต้น 3600)
+  EXPORT_MAX_JOBS       จำนวนงานที่รันพร้อมกัน (ค่าเริ่มต้น 1)
+  EXPORT_QUEUE_DEPTH    จำนวนงานที่รอคิวได้ (ค่าเริ่มต้น 4)
+  EXPORT_RENDERS        จำนวนใบที่งาน batch เรนเดอร์ค้างได้พร้อมกัน (ค่าเริ่มต้น PDF_POOL_SIZE - 1, อย่างน้อย 1)
+"""
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, wait
+from datetime import date
+from typing import Callable, List, Optional
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse
+from pydantic import BaseModel
+from pypdf import PdfWriter
+
+from .database import ReadSessionLocal
+from . import models, pdf_pool, pdf_cache, periods
+from .form import BASE_DIR, build_multi_variant_html
+
+router = APIRouter()
+
+EXPORT_BATCH_MAX = int(os.getenv("EXPORT_BATCH_MAX", "2000"))
+EXPORT_MERGED_MAX = int(os.getenv("EXPORT_MERGED_MAX", "200"))
+EXPORT_JOB_TTL = int(os.getenv("EXPORT_JOB_TTL", "3600"))
+EXPORT_MAX_JOBS = max(1, int(os.getenv("EXPORT_MAX_JOBS", "1")))
+EXPORT_QUEUE_DEPTH = max(0, int(os.getenv("EXPORT_QUEUE_DEPTH", "4")))
+EXPORT_RENDERS = max(1, int(os.getenv("EXPORT_RENDERS", str(pdf_pool.POOL_SIZE - 1))))
+# Retry-After เมื่อคิวงานเต็ม (งาน batch ใช้เวลาเป็นนาที)
+RETRY_AFTER = 30
+
+_jobs: dict = {}
+_jobs_lock = threading.Lock()
+_job_slots = threading.Semaphore(EXPORT_MAX_JOBS)
+_render_slots = threading.BoundedSemaphore(EXPORT_RENDERS)
+
+
+# --- Pydantic payloads ---
+class ExportBatchPayload(BaseModel):
+    start: Optional[date] = None
+    end: Optional[date] = None
+    personid: Optional[str] = None
+    idxs: Optional[List[int]] = None
+    format: str = "pdf"  # pdf | zip
+
+
+# --- Helpers ---
+def _iso(d) -> Optional[str]:
+    return d.isoformat() if d else None
+
+def _invoice_payload(inv: models.Invoice, items: list) -> dict:
+    """หัวบิล + รายการ ในรูปแบบเดียวกับ payload ที่ form.js ส่งมา /export-merged-pdf"""
+    return {
+        "invoice_number": inv.invoice_number,
+        "invoice_date": _iso(inv.invoice_date),
+        "due_date": _iso(inv.due_date),
+        "fname": inv.fname,
+        "personid": inv.personid,
+        "tel": inv.tel,
+        "mobile": inv.mobile,
+        "cf_personaddress": inv.cf_personaddress,
+        "cf_personzipcode": inv.cf_personzipcode,
+        "cf_provincename": inv.cf_provincename,
+        "cf_taxid": inv.cf_taxid,
+        "cf_branch": inv.cf_branch,
+        "po_number": inv.po_number,
+        "grn_number": inv.grn_number,
+        "dn_number": inv.dn_number,
+        "fmlpaymentcreditday": inv.fmlpaymentcreditday,
+        "car_numberplate": inv.car_numberplate,
+        "driver_id": inv.driver_id,
+        "items": [
+            {
+                "cf_itemid": it.cf_itemid,
+                "cf_itemname": it.cf_itemname,
+                "quantity": float(it.quantity or 0),
+                "unit_price": float(it.cf_itempricelevel_price or 0),
+            }
+            for it in items
+        ],
+    }
+
+def _max_invoices(fmt: str) -> int:
+    return EXPORT_BATCH_MAX if fmt == "zip" else EXPORT_MERGED_MAX
+
+def _load_payloads(payload: ExportBatchPayload) -> list:
+    """โหลดหัวบิลทั้งหมด 1 query + รายการทั้งหมด 1 query"""
+    limit = _max_invoices(payload.format)
+    inv = models.Invoice
+    itm = models.InvoiceItem
+    db = ReadSessionLocal()
+    try:
+        q = db.query(inv)
+        if payload.idxs:
+            q = q.filter(inv.idx.in_(payload.idxs))
+        q = periods.apply(q, inv.invoice_date, start=payload.start, end=payload.end)
+        if payload.personid:
+            q = q.filter(inv.personid == payload.personid)
+        invoices = q.order_by(inv.invoice_date.asc(), inv.invoice_number.asc()).limit(limit + 1).all()
+        if len(invoices) > limit:
+            hint = "" if payload.format == "zip" else ", use format=zip or a shorter date range"
+            raise ValueError(f"too many invoices (max {limit} for {payload.format}{hint})")
+
+        items_by_inv = {i.idx: [] for i in invoices}
+        if items_by_inv:
+            rows = (
+                db.query(itm)
+                .filter(itm.invoice_idx.in_(list(items_by_inv)))
+                .order_by(itm.invoice_idx, itm.cf_items_ordinary.asc(), itm.idx.asc())
+                .all()
+            )
+            for r in rows:
+                items_by_inv[r.invoice_idx].append(r)
+        return [_invoice_payload(i, items_by_inv[i.idx]) for i in invoices]
+    finally:
+        db.close()
+
+def _set(job_id: str, **fields):
+    with _jobs_lock:
+        _jobs[job_id].update(fields)
+
+def _tick(job_id: str):
+    with _jobs_lock:
+        _jobs[job_id]["done"] += 1
+
+def _zip_names(payloads: list) -> List[str]:
+    """ชื่อไฟล์ใน ZIP ต่อใบ (เลขที่บิลซ้ำ -> เติม _1, _2, ...)"""
+    used: dict = {}
+    names = []
+    for p in payloads:
+        base = re.sub(r"[^\w.-]", "_", p["invoice_number"] or "doc")
+        n = used.get(base, 0)
+        used[base] = n + 1
+        names.append(f"invoice_{base}{f'_{n}' if n else ''}.pdf")
+    return names
+
+def _render_each(job_id: str, payloads: list, emit: Callable[[int, bytes], None]):
+    """
+    เรนเดอร์ทุกใบ (ดูแคชก่อน) แล้วเรียก emit(ลำดับ, pdf) ใน thread ของงานทันทีที่แต่ละใบเสร็จ
+    (ลำดับการเรียกตามที่เรนเดอร์เสร็จ ไม่ใช่ตามลำดับบิล)
+    """
+    pending: dict = {}   # future -> (ลำดับ, tag, cache key)
+
+    def _finish(done):
+        for fut in done:
+            i, tag, key = pending.pop(fut)
+            data = fut.result()
+            pdf_cache.store_key(tag, key, data)
+            emit(i, data)
+            _tick(job_id)
+
+    for i, p in enumerate(payloads):
+        html = build_multi_variant_html(p)
+        tag = pdf_cache.make_tag("invoice", p["invoice_number"])
+        cached = pdf_cache.lookup(tag, html, "invoice")
+        if cached is not None:
+            emit(i, cached)
+            _tick(job_id)
+            continue
+        # ส่งเรนเดอร์ขนานใน pdf_pool ไม่เกิน EXPORT_RENDERS ใบรวมทุกงาน
+        # (เหลือ process ไว้ให้ export รายใบจากหน้าฟอร์ม ไม่โดน 503 ระหว่างงาน batch)
+        if len(pending) >= EXPORT_RENDERS:
+            _finish(wait(pending, return_when=FIRST_COMPLETED).done)
+        key = pdf_cache.cache_key(html, "invoice")
+        _render_slots.acquire()
+        try:
+            fut = pdf_pool.submit(html, base_url=str(BASE_DIR), stylesheet="invoice")
+        except BaseException:
+            _render_slots.release()
+            raise
+        fut.add_done_callback(lambda _f: _render_slots.release())
+        pending[fut] = (i, tag, key)
+    while pending:
+        _finish(wait(pending, return_when=FIRST_COMPLETED).done)
+
+def _write_zip(job_id: str, payloads: list, out_path: str):
+    names = _zip_names(payloads)
+    # PDF บีบอัดอยู่แล้ว เก็บแบบ STORED
+    with zipfile.ZipFile(out_path, "w", zipfile.ZIP_STORED) as zf:
+        _render_each(job_id, payloads, lambda i, data: zf.writestr(names[i], data))
+
+def _write_merged(job_id: str, payloads: list, out_path: str):
+    with tempfile.TemporaryDirectory(prefix=f"export_batch_{job_id}_") as workdir:
+        paths = [os.path.join(workdir, f"{i:05d}.pdf") for i in range(len(payloads))]
+
+        def _save(i: int, data: bytes):
+            with open(paths[i], "wb") as fp:
+                fp.write(data)
+
+        _render_each(job_id, payloads, _save)
+        _set(job_id, status="writing")
+        # append ตามลำดับบิล: PdfWriter เก็บทุกหน้าไว้จน write() (จำนวนใบถูกจำกัดด้วย EXPORT_MERGED_MAX)
+        writer = PdfWriter()
+        for path in paths:
+            writer.append(path)
+        with open(out_path, "wb") as fp:
+            writer.write(fp)
+        writer.close()
+
+def _run_job(job_id: str, payload: ExportBatchPayload):
+    suffix = ".zip" if payload.format == "zip" else ".pdf"
+    out_path = os.path.join(tempfile.gettempdir(), f"export_batch_{job_id}{suffix}")
+    try:
+        with _job_slots:   # รอคิวในสถานะ queued
+            _set(job_id, status="loading")
+            payloads = _load_payloads(payload)
+            _set(job_id, status="rendering", total=len(payloads))
+            if payload.format == "zip":
+                _write_zip(job_id, payloads, out_path)
+            else:
+                _write_merged(job_id, payloads, out_path)
+        _set(job_id, status="done", path=out_path, finished_at=time.time())
+    except Exception as e:
+        try:
+            os.unlink(out_path)
+        except FileNotFoundError:
+            pass
+        _set(job_id, status="error", error=str(e), finished_at=time.time())
+
+def _cleanup_expired():
+    now = time.time()
+    with _jobs_lock:
+        expired = [
+            jid for jid, j in _jobs.items()
+            if j.get("finished_at") and now - j["finished_at"] > EXPORT_JOB_TTL
+        ]
+        for jid in expired:
+            path = _jobs.pop(jid).get("path")
+            if path:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+
+def _job_status(job_id: str) -> dict:
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="export job not found")
+        return dict(job)
+
+
+# --- APIs ---
+@router.post("/api/invoices/export-batch")
+def create_export_batch(payload: ExportBatchPayload):
+    if payload.format not in ("pdf", "zip"):
+        raise HTTPException(status_code=400, detail="format must be pdf or zip")
+    if not (payload.idxs or payload.start or payload.end or payload.personid):
+        raise HTTPException(status_code=400, detail="idxs, date range or personid is required")
+    if payload.idxs and len(payload.idxs) > _max_invoices(payload.format):
+        raise HTTPException(status_code=400, detail=f"too many invoices (max {_max_invoices(payload.format)} for {payload.format})")
+
+    _cleanup_expired()
+    job_id = uuid.uuid4().hex
+    with _jobs_lock:
+        active = sum(1 for j in _jobs.values() if not j.get("finished_at"))
+        if active >= EXPORT_MAX_JOBS + EXPORT_QUEUE_DEPTH:
+            raise HTTPException(
+                status_code=503,
+                detail="export queue is full, please retry",
+                headers={"Retry-After": str(RETRY_AFTER)},
+            )
+        _jobs[job_id] = {
+            "job_id": job_id,
+            "status": "queued",
+            "format": payload.format,
+            "total": None,
+            "done": 0,
+            "error": None,
+            "created_at": time.time(),
+            "finished_at": None,
+            "path": None,
+        }
+    threading.Thread(target=_run_job, args=(job_id, payload), daemon=True).start()
+    return {"job_id": job_id, "status_url": f"/api/invoices/export-batch/{job_id}"}
+
+@router.get("/api/invoices/export-batch/{job_id}")
+def get_export_batch(job_id: str):
+    job = _job_status(job_id)
+    job.pop("path", None)
+    if job["status"] == "done":
+        job["download_url"] = f"/api/invoices/export-batch/{job_id}/download"
+    return job
+
+@router.get("/api/invoices/export-batch/{job_id}/download")
+def download_export_batch(job_id: str):
+    job = _job_status(job_id)
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"export job is {job['status']}")
+    if job["format"] == "zip":
+        return FileResponse(job["path"], media_type="application/zip", filename=f"invoices_{job_id[:8]}.zip")
+    return FileResponse(job["path"], media_type="application/pdf", filename=f"invoices_{job_id[:8]}.pdf")
@@ -0,0 +1,373 @@
+# app/invoice_import.py
+"""
+นำเข้าใบกำกับจำนวนมากจากไฟล์ CSV / XLSX (เช่นข้อมูลจากเครื่องชั่งรายวัน)
+
+  POST /api/invoices/import?dry_run=&strict=      (multipart: file)
+  python -m app.invoice_import <file.csv|file.xlsx> [--dry-run] [--strict]
+
+รูปแบบไฟล์: แถวแรกเป็นชื่อคอลัมน์ หนึ่งแถว = หนึ่งรายการสินค้า
+แถวที่ invoice_number เดียวกันรวมเป็นบิลเดียว (ค่าหัวบิลใช้จากแถวแรกของบิลนั้น)
+  หัวบิล   invoice_number*, invoice_date, due_date, grn_number, dn_number, po_number,
+           personid*, car_numberplate, driver_id
+           fname, cf_taxid, cf_personaddress, cf_personzipcode, cf_provincename, cf_branch,
+           tel, mobile, fmlpaymentcreditday  (ว่าง = ใช้ข้อมูลจากทะเบียนลูกค้า)
+  รายการ   cf_itemid*, quantity*, unit_price, amount, cf_itemname, cf_unitname
+           (ว่าง = ใช้ชื่อ/หน่วย/ราคาจากทะเบียนสินค้า, amount ว่าง = quantity x unit_price)
+  ใช้ชื่อเดียวกับฟอร์ม /submit ได้ด้วย (customer_name, customer_taxid, customer_address,
+  product_code, description)
+
+ตรวจทั้งไฟล์ก่อนบันทึก:
+- ลูกค้า / สินค้า / พนักงานขับรถ เทียบกับแคช master_cache (ไม่ query ทีละแถว)
+- เลขที่บิลซ้ำกับในฐานข้อมูล (query เป็นชุด) หรือหัวบิลในไฟล์ขัดกันเอง
+บิลที่มีแถวผิดถูกข้ามทั้งใบ และรายงานข้อผิดพลาดพร้อมเลขแถวในไฟล์
+strict=true: ถ้ามีข้อผิดพลาดแม้แต่แถวเดียว ไม่บันทึกอะไรเลย
+
+บันทึกใน transaction เดียว: insert หัวบิลแบบ executemany (RETURNING idx) และรายการ
+ทีละ IMPORT_BATCH_SIZE แถว แล้วนับเข้า revenue_rollup / grn_index / product_prices ครั้งเดียว
+
+ตั้งค่าผ่าน environment:
+  IMPORT_MAX_ROWS     จำนวนแถวสูงสุดต่อไฟล์ (ค่าเริ่มต้น 200000)
+  IMPORT_BATCH_SIZE   จำนวนแถวต่อ executemany (ค่าเริ่มต้น 1000)
+"""
+import argparse
+import csv
+import io
+import os
+import sys
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from .database import SessionLocal
+from .deps import get_db
+from . import grn_index, master_cache, models, product_prices, revenue_rollup
+# ลงทะเบียนชุดข้อมูล customers / products / drivers ใน master_cache (สำหรับ CLI)
+from . import customers, drivers_form, products  # noqa: F401
+from .form import _parse_ymd
+
+router = APIRouter()
+
+IMPORT_MAX_ROWS = int(os.getenv("IMPORT_MAX_ROWS", "200000"))
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+MAX_REPORTED_ERRORS = 1000
+
+HEAD_FIELDS = (
+    "invoice_number", "invoice_date", "due_date", "grn_number", "dn_number", "po_number",
+    "personid", "fname", "cf_taxid", "cf_personaddress", "cf_personzipcode", "cf_provincename",
+    "cf_branch", "tel", "mobile", "fmlpaymentcreditday", "car_numberplate", "driver_id",
+)
+LINE_FIELDS = ("cf_itemid", "cf_itemname", "cf_unitname", "quantity", "unit_price", "amount")
+REQUIRED = ("invoice_number", "personid", "cf_itemid", "quantity")
+# ข้อมูลลูกค้าที่เก็บ snapshot ไว้กับบิล (ว่างในไฟล์ = ใช้จากทะเบียนลูกค้า)
+CUSTOMER_SNAPSHOT = (
+    "fname", "cf_taxid", "cf_personaddress", "cf_personzipcode", "cf_provincename",
+    "cf_branch", "tel", "mobile", "fmlpaymentcreditday",
+)
+# หัวบิลที่ต้องตรงกันทุกแถวของบิลเดียวกัน
+_CONSISTENT = ("invoice_date", "personid", "driver_id", "car_numberplate")
+
+HEADER_ALIASES = {
+    "customer_name": "fname",
+    "customer_taxid": "cf_taxid",
+    "customer_address": "cf_personaddress",
+    "product_code": "cf_itemid",
+    "description": "cf_itemname",
+    "price": "unit_price",
+    "cf_itempricelevel_price": "unit_price",
+}
+_KNOWN = set(HEAD_FIELDS) | set(LINE_FIELDS)
+
+
+class ImportFileError(ValueError):
+    """ข้อผิดพลาดของทั้งไฟล์ (อ่านไม่ได้ / ไม่มีคอลัมน์ที่ต้องใช้)"""
+
+
+# ---------- อ่านไฟล์ ----------
+def _field(name) -> Optional[str]:
+    key = str(name or "").strip().lower().replace(" ", "_")
+    key = HEADER_ALIASES.get(key, key)
+    return key if key in _KNOWN else None
+
+def _text(v) -> str:
+    if v is None:
+        return ""
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))  # รหัสที่ Excel เก็บเป็นตัวเลข
+    return str(v).strip()
+
+def _read_rows(fileobj, filename: str) -> Iterator[Tuple[int, Dict[str, object]]]:
+    """(เลขแถวในไฟล์, {field: value}) ทีละแถว ข้ามแถวว่าง"""
+    if filename.lower().endswith((".xlsx", ".xlsm")):
+        from openpyxl import load_workbook
+        wb = load_workbook(fileobj, read_only=True, data_only=True)
+        rows = wb.active.iter_rows(values_only=True)
+    else:
+        rows = csv.reader(io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline=""))
+
+    header = next(rows, None)
+    if not header:
+        raise ImportFileError("empty file")
+    keys = [_field(h) for h in header]
+    missing = [f for f in REQUIRED if f not in keys]
+    if missing:
+        raise ImportFileError(f"missing columns: {', '.join(missing)}")
+
+    for n, values in enumerate(rows, start=2):
+        if n - 1 > IMPORT_MAX_ROWS:
+            raise ImportFileError(f"too many rows (max {IMPORT_MAX_ROWS})")
+        row = {k: v for k, v in zip(keys, values) if k}
+        if any(_text(v) for v in row.values()):
+            yield n, row
+
+
+# ---------- ตรวจ + แปลงเป็นแถวที่จะ insert ----------
+def _to_date(v) -> Optional[date]:
+    if isinstance(v, datetime):
+        return v.date()
+    if isinstance(v, date):
+        return v
+    s = _text(v)
+    if not s:
+        return None
+    d = _parse_ymd(s)
+    if d is None:
+        raise ValueError(f"invalid date {s!r}")
+    return d
+
+def _to_float(v, field: str) -> Optional[float]:
+    s = _text(v).replace(",", "")
+    if not s:
+        return None
+    try:
+        return float(s)
+    except ValueError:
+        raise ValueError(f"invalid {field} {s!r}")
+
+def _to_int(v, field: str) -> Optional[int]:
+    f = _to_float(v, field)
+    return None if f is None else int(f)
+
+class _Invoice:
+    __slots__ = ("number", "first_row", "head", "lines", "errors")
+
+    def __init__(self, number: str, first_row: int):
+        self.number = number
+        self.first_row = first_row
+        self.head: Optional[dict] = None
+        self.lines: List[dict] = []
+        self.errors: List[dict] = []
+
+def _parse_head(raw: dict) -> dict:
+    head = {f: _text(raw.get(f)) or None for f in HEAD_FIELDS}
+    head["invoice_date"] = _to_date(raw.get("invoice_date"))
+    head["due_date"] = _to_date(raw.get("due_date"))
+    head["fmlpaymentcreditday"] = _to_int(raw.get("fmlpaymentcreditday"), "fmlpaymentcreditday")
+    return head
+
+def _parse_line(raw: dict) -> dict:
+    qty = _to_float(raw.get("quantity"), "quantity")
+    if qty is None:
+        raise ValueError("missing quantity")
+    return {
+        "cf_itemid": _text(raw.get("cf_itemid")),
+        "cf_itemname": _text(raw.get("cf_itemname")) or None,
+        "cf_unitname": _text(raw.get("cf_unitname")) or None,
+        "quantity": qty,
+        "unit_price": _to_float(raw.get("unit_price"), "unit_price"),
+        "amount": _to_float(raw.get("amount"), "amount"),
+    }
+
+def _group(rows) -> Dict[str, _Invoice]:
+    invoices: Dict[str, _Invoice] = {}
+    for n, raw in rows:
+        number = _text(raw.get("invoice_number"))
+        if not number:
+            inv = invoices.setdefault("", _Invoice("", n))
+            inv.errors.append({"row": n, "invoice_number": "", "error": "missing invoice_number"})
+            continue
+        inv = invoices.get(number)
+        if inv is None:
+            inv = invoices[number] = _Invoice(number, n)
+        try:
+            head = _parse_head(raw)
+            if inv.head is None:
+                inv.head = head
+            else:
+                diff = [f for f in _CONSISTENT if head[f] and head[f] != inv.head[f]]
+                if diff:
+                    raise ValueError(f"{', '.join(diff)} differs from row {inv.first_row}")
+            line = _parse_line(raw)
+            line["row"] = n
+            inv.lines.append(line)
+        except ValueError as e:
+            inv.errors.append({"row": n, "invoice_number": number, "error": str(e)})
+    return invoices
+
+def _validate(db: Session, invoices: Dict[str, _Invoice]):
+    """ตรวจกับทะเบียนลูกค้า/สินค้า/พนักงานขับรถ และเลขที่บิลในฐานข้อมูล แล้วเติมค่าที่ว่าง"""
+    cust = master_cache.get("customers")
+    prod = master_cache.get("products")
+    drv = master_cache.get("drivers")
+
+    numbers = [n for n in invoices if n]
+    existing = set()
+    for i in range(0, len(numbers), IMPORT_BATCH_SIZE):
+        chunk = numbers[i:i + IMPORT_BATCH_SIZE]
+        existing.update(r[0] for r in db.query(models.Invoice.invoice_number)
+                        .filter(models.Invoice.invoice_number.in_(chunk)))
+
+    for number, inv in invoices.items():
+        if not number or inv.head is None:
+            continue
+        head = inv.head
+
+        def err(row: int, msg: str, inv=inv, number=number):
+            inv.errors.append({"row": row, "invoice_number": number, "error": msg})
+
+        if number in existing:
+            err(inv.first_row, "invoice_number already exists")
+        c = cust.lookup("personid", head["personid"]) if head["personid"] else None
+        if head["personid"] is None:
+            err(inv.first_row, "missing personid")
+        elif c is None:
+            err(inv.first_row, f"unknown personid {head['personid']!r}")
+        else:
+            for f in CUSTOMER_SNAPSHOT:
+                if head[f] is None:
+                    head[f] = c.get(f)
+        if head["driver_id"] and drv.lookup("driver_id", head["driver_id"]) is None:
+            err(inv.first_row, f"unknown driver_id {head['driver_id']!r}")
+        if head["due_date"] is None and head["invoice_date"] and head["fmlpaymentcreditday"]:
+            head["due_date"] = head["invoice_date"] + timedelta(days=head["fmlpaymentcreditday"])
+
+        for line in inv.lines:
+            p = prod.lookup("cf_itemid", line["cf_itemid"])
+            if p is None:
+                err(line["row"], f"unknown cf_itemid {line['cf_itemid']!r}")
+                continue
+            line["cf_itemname"] = line["cf_itemname"] or p.get("cf_itemname")
+            line["cf_unitname"] = line["cf_unitname"] or p.get("cf_unitname")
+            if line["unit_price"] is None:
+                line["unit_price"] = float(p.get("cf_itempricelevel_price") or 0)
+            if line["amount"] is None:
+                line["amount"] = line["quantity"] * line["unit_price"]
+
+
+# ---------- บันทึก ----------
+def _insert(db: Session, invoices: List[_Invoice]) -> Tuple[List[int], int]:
+    heads = [{f: inv.head[f] for f in HEAD_FIELDS} for inv in invoices]
+    stmt = insert(models.Invoice).returning(models.Invoice.idx, sort_by_parameter_order=True)
+    idxs: List[int] = []
+    for i in range(0, len(heads), IMPORT_BATCH_SIZE):
+        idxs.extend(db.execute(stmt, heads[i:i + IMPORT_BATCH_SIZE]).scalars().all())
+
+    items = []
+    for inv, idx in zip(invoices, idxs):
+        for order, line in enumerate(inv.lines, start=1):
+            items.append({
+                "invoice_number": str(idx),  # เหมือน /submit: invoice_number ของรายการเก็บ idx ของบิล
+                "invoice_idx": idx,
+                "personid": inv.head["personid"],
+                "cf_itemid": line["cf_itemid"],
+                "cf_itemname": line["cf_itemname"],
+                "cf_unitname": line["cf_unitname"],
+                "cf_itempricelevel_price": line["unit_price"],
+                "cf_items_ordinary": order,
+                "quantity": line["quantity"],
+                "amount": line["amount"],
+            })
+    for i in range(0, len(items), IMPORT_BATCH_SIZE):
+        db.execute(insert(models.InvoiceItem), items[i:i + IMPORT_BATCH_SIZE])
+
+    revenue_rollup.add_invoices(db, idxs)
+    grn_index.add_invoices(db, idxs)
+    product_prices.add_invoices(db, idxs)
+    return idxs, len(items)
+
+def import_file(db: Session, fileobj, filename: str, dry_run: bool = False, strict: bool = False) -> dict:
+    """
+    อ่าน ตรวจ และบันทึก (commit) คืนรายงาน
+    {"ok", "dry_run", "strict", "invoices", "items", "skipped_invoices", "error_count", "errors"}
+    """
+    invoices = _group(_read_rows(fileobj, filename))
+    _validate(db, invoices)
+
+    good = [inv for inv in invoices.values() if inv.number and inv.head and not inv.errors]
+    errors = sorted((e for inv in invoices.values() for e in inv.errors), key=lambda e: e["row"])
+    skipped = sum(1 for inv in invoices.values() if inv.number and inv.errors)
+
+    report = {
+        "ok": not errors,
+        "dry_run": dry_run,
+        "strict": strict,
+        "invoices": len(good),
+        "items": sum(len(inv.lines) for inv in good),
+        "skipped_invoices": skipped,
+        "error_count": len(errors),
+        "errors": errors[:MAX_REPORTED_ERRORS],
+    }
+    if dry_run or not good or (strict and errors):
+        if strict and errors:
+            report["invoices"] = report["items"] = 0
+        return report
+
+    try:
+        idxs, n_items = _insert(db, good)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    report["invoices"], report["items"] = len(idxs), n_items
+    return report
+
+
+# ---------- API ----------
+@router.post("/api/invoices/import")
+def api_import_invoices(
+    file: UploadFile = File(..., description="CSV (UTF-8) หรือ XLSX หนึ่งแถวต่อหนึ่งรายการสินค้า"),
+    dry_run: bool = Query(False, description="ตรวจอย่างเดียว ไม่บันทึก"),
+    strict: bool = Query(False, description="มีข้อผิดพลาดแถวเดียวก็ไม่บันทึกทั้งไฟล์"),
+    db: Session = Depends(get_db),
+):
+    try:
+        report = import_file(db, file.file, file.filename or "", dry_run=dry_run, strict=strict)
+    except (ImportFileError, UnicodeDecodeError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"อ่านไฟล์ไม่ได้: {e}")
+    if strict and report["error_count"]:
+        raise HTTPException(status_code=422, detail=report)
+    return report
+
+
+# ---------- CLI ----------
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.invoice_import")
+    parser.add_argument("path", help="ไฟล์ .csv หรือ .xlsx")
+    parser.add_argument("--dry-run", action="store_true", help="ตรวจอย่างเดียว ไม่บันทึก")
+    parser.add_argument("--strict", action="store_true", help="มีข้อผิดพลาดแถวเดียวก็ไม่บันทึกทั้งไฟล์")
+    args = parser.parse_args(argv)
+
+    db = SessionLocal()
+    try:
+        with open(args.path, "rb") as f:
+            report = import_file(db, f, args.path, dry_run=args.dry_run, strict=args.strict)
+    except ImportFileError as e:
+        print(f"invoice_import: {e}", file=sys.stderr)
+        return 2
+    finally:
+        db.close()
+
+    for e in report["errors"]:
+        print(f"row {e['row']:>6}  {e['invoice_number'] or '-':<20} {e['error']}", file=sys.stderr)
+    if report["error_count"] > len(report["errors"]):
+        print(f"... {report['error_count'] - len(report['errors'])} more errors", file=sys.stderr)
+    action = "validated" if args.dry_run else "imported"
+    print(f"invoice_import: {action} {report['invoices']} invoices / {report['items']} items, "
+          f"skipped {report['skipped_invoices']} invoices with {report['error_count']} errors")
+    return 0 if report["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
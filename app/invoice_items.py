@@ -0,0 +1,99 @@
+# app/invoice_items.py
+"""
+บันทึกรายการสินค้าของบิล (ss_invoices.invoice_items) เป็นชุด แทน db.add() ทีละแถว
+
+  insert_items(db, invoice_idx, rows)  insert ทุกแถวด้วย executemany ครั้งเดียว (insertmanyvalues)
+  sync_items(db, invoice_idx, rows)    แก้ไขบิล: เทียบกับรายการเดิมแล้ว insert / update / delete
+                                       เฉพาะแถวที่เปลี่ยน (ไม่ลบทั้งบิลแล้วเขียนใหม่)
+
+rows เป็น dict ตามชื่อคอลัมน์ใน ITEM_FIELDS (+ "idx" ของรายการเดิมสำหรับ sync_items ถ้ามี)
+sync_items จับคู่แถวใหม่กับแถวเดิมตามลำดับนี้
+  1) idx เดียวกัน (หน้าแก้ไขส่ง idx ของรายการเดิมกลับมา)
+  2) ค่าเหมือนเดิมทุกช่อง (ลบ/แทรกบรรทัดกลางบิล บรรทัดอื่นไม่ต้องเขียนใหม่)
+  3) ที่เหลือจับคู่ตามลำดับ -> update
+แถวใหม่ที่ไม่มีคู่ -> insert, แถวเดิมที่ไม่มีคู่ -> delete
+
+ผู้เรียกยังต้อง revenue_rollup / grn_index / product_prices .remove_invoices / add_invoices ตามเดิม
+"""
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import delete, insert, select, update
+
+from . import models
+
+ITEM_FIELDS = (
+    "invoice_number", "personid", "cf_itemid", "cf_itemname", "cf_unitname",
+    "cf_itempricelevel_price", "cf_items_ordinary", "quantity", "amount",
+)
+
+_IT = models.InvoiceItem
+
+
+def _values(row: dict) -> dict:
+    return {f: row.get(f) for f in ITEM_FIELDS}
+
+def _key(values: dict) -> tuple:
+    return tuple(values[f] for f in ITEM_FIELDS)
+
+def insert_items(db, invoice_idx: int, rows: Sequence[dict]) -> int:
+    """insert รายการทั้งหมดของบิลใน statement เดียว คืนจำนวนแถว"""
+    if not rows:
+        return 0
+    db.execute(insert(_IT), [{"invoice_idx": invoice_idx, **_values(r)} for r in rows])
+    return len(rows)
+
+def sync_items(db, invoice_idx: int, rows: Sequence[dict]) -> Dict[str, int]:
+    """ให้รายการของบิลเป็นตาม rows โดยเขียนเฉพาะส่วนที่ต่าง คืนจำนวน inserted/updated/deleted/unchanged"""
+    cols = [getattr(_IT, f) for f in ITEM_FIELDS]
+    old: Dict[int, dict] = {
+        r.idx: {f: getattr(r, f) for f in ITEM_FIELDS}
+        for r in db.execute(
+            select(_IT.idx, *cols)
+            .where(_IT.invoice_idx == invoice_idx)
+            .order_by(_IT.cf_items_ordinary.asc(), _IT.idx.asc())
+        )
+    }
+    wanted = [_values(r) for r in rows]
+    pairs: List[Optional[int]] = [None] * len(wanted)
+    free = dict(old)
+
+    # 1) idx
+    for i, r in enumerate(rows):
+        idx = r.get("idx")
+        if idx in free:
+            pairs[i] = idx
+            del free[idx]
+    # 2) ค่าเหมือนเดิม
+    by_key: Dict[tuple, List[int]] = defaultdict(list)
+    for idx, values in free.items():
+        by_key[_key(values)].append(idx)
+    for i, values in enumerate(wanted):
+        if pairs[i] is None and by_key.get(_key(values)):
+            idx = by_key[_key(values)].pop(0)
+            pairs[i] = idx
+            del free[idx]
+    # 3) ตามลำดับ
+    rest = list(free)
+    for i in range(len(wanted)):
+        if pairs[i] is None and rest:
+            pairs[i] = rest.pop(0)
+
+    updates = [
+        {"idx": idx, **values}
+        for idx, values in zip(pairs, wanted)
+        if idx is not None and values != old[idx]
+    ]
+    inserts = [values for idx, values in zip(pairs, wanted) if idx is None]
+
+    if rest:
+        db.execute(delete(_IT).where(_IT.idx.in_(rest)))
+    if updates:
+        db.execute(update(_IT), updates)   # ORM bulk UPDATE ตาม primary key (executemany)
+    insert_items(db, invoice_idx, inserts)
+    return {
+        "inserted": len(inserts),
+        "updated": len(updates),
+        "deleted": len(rest),
+        "unchanged": len(wanted) - len(inserts) - len(updates),
+    }
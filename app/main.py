@@ -1,10 +1,11 @@
-from fastapi import FastAPI, Form, Request, HTTPException
-from fastapi.responses import HTMLResponse, FileResponse, RedirectResponse
+from fastapi import FastAPI, Form, Request, HTTPException, Depends
+from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from jinja2 import TemplateNotFound 
-from . import models, database, pdf_generator
-from .database import SessionLocal
+from . import models, database, pdf_generator, pdf_pool, static_assets
+from .compression import CompressionMiddleware
+from .deps import get_db
 from .form import router as form_router
 from .summary_invoices import router as summary_router
 from .customers import router as customers_router
@@ -14,7 +15,10 @@ from .bill_note import router as bill_note_router
 from .saletax_report import router as saletax_router
 from .drivers_form import router as drivers_router
 from .credit_note import router as credit_router
-from sqlalchemy.orm import joinedload
+from .invoice_export import router as invoice_export_router
+from .invoice_import import router as invoice_import_router
+from .internal_metrics import router as internal_metrics_router
+from sqlalchemy.orm import Session, joinedload
 
 from pathlib import Path
 import os
@@ -28,11 +32,16 @@ app.add_middleware(
     secret_key=os.getenv("SESSION_SECRET", "ymB4BaVZOwDSM1UhXu7uh"),
     max_age=60*60*2,  # 2 ชั่วโมง
 )
+# บีบ JSON/HTML ตาม Accept-Encoding (ดู app/compression.py)
+app.add_middleware(CompressionMiddleware)
 
 
 BASE_DIR = Path(__file__).resolve().parent
 app.mount("/static", StaticFiles(directory=BASE_DIR / "static"), name="static")
+# ไฟล์ static ที่ build แล้ว (python -m app.static_assets) ชื่อมี hash + .br/.gz, cache ยาว
+app.mount(static_assets.URL_PREFIX, static_assets.PrecompressedStaticFiles(directory=static_assets.BUILD_DIR, check_dir=False), name="assets")
 templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
+templates.env.globals["static_url"] = static_assets.static_url
 
 @app.get("/login", response_class=HTMLResponse)
 def login_page(request: Request):
@@ -72,6 +81,9 @@ app.include_router(bill_note_router)
 app.include_router(saletax_router)
 app.include_router(drivers_router)
 app.include_router(credit_router)
+app.include_router(invoice_export_router)
+app.include_router(invoice_import_router)
+app.include_router(internal_metrics_router)
 
 # หน้า: รายการใบกำกับภาษี
 @app.get("/summary_invoices.html", response_class=HTMLResponse)
@@ -129,19 +141,27 @@ def saletax_report_page(request: Request):
 
 # ========= (ตัวอย่าง) export-pdf ใช้ ORM แทน crud =========
 @app.get("/export-pdf/{invoice_id}")
-async def export_pdf(invoice_id: int):
-    db = SessionLocal()
-    try:
-        inv = db.query(models.Invoice)\
-                .options(joinedload(models.Invoice.items))\
-                .filter(models.Invoice.idx == invoice_id)\
-                .first()
-        if not inv:
-            raise HTTPException(status_code=404, detail="invoice not found")
-        pdf_path = pdf_generator.generate_invoice_pdf(inv)
-        return FileResponse(pdf_path, media_type="application/pdf", filename=f"invoice_{inv.invoice_number}.pdf")
-    finally:
-        db.close()
+def export_pdf(invoice_id: int, db: Session = Depends(get_db)):
+    inv = db.query(models.Invoice)\
+            .options(joinedload(models.Invoice.items))\
+            .filter(models.Invoice.idx == invoice_id)\
+            .first()
+    if not inv:
+        raise HTTPException(status_code=404, detail="invoice not found")
+    pdf_bytes = pdf_generator.generate_invoice_pdf(inv)
+    return pdf_pool.pdf_response(pdf_bytes, f"invoice_{inv.invoice_number}.pdf")
+
+@app.on_event("startup")
+def start_pdf_pool():
+    pdf_pool.start()
+
+@app.on_event("shutdown")
+def shutdown_pdf_pool():
+    pdf_pool.shutdown()
+
+@app.on_event("shutdown")
+async def dispose_async_engines():
+    await database.dispose_async_engines()
 
 @app.get("/healthz")
 def healthz():
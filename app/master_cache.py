@@ -0,0 +1,143 @@
+# app/master_cache.py
+"""
+แคชข้อมูลหลัก (ลูกค้า / สินค้า / พนักงานขับรถ / รถ / ยี่ห้อรถ / จังหวัด) ใน memory ของ process
+
+ข้อมูลชุดนี้เปลี่ยนวันละไม่กี่ครั้ง แต่หน้าฟอร์มบิลโหลด/ค้นหาทุกครั้งที่เปิดหน้าหรือพิมพ์
+- แต่ละชุด (dataset) ลงทะเบียน loader ไว้ในโมดูล router เจ้าของตาราง:
+      master_cache.register("products", _load_products)   # loader(db) -> list[dict]
+- โหลดใหม่เมื่อหมดอายุ (MASTER_CACHE_TTL) หรือถูก invalidate จาก endpoint สร้าง/แก้ไข/ลบ:
+      db.commit(); master_cache.invalidate("products")
+- โหลดจากฐานหลักเสมอ (ไม่ใช้ replica) เพื่อไม่ให้ข้อมูลเก่าที่ยัง replicate ไม่ถึงค้างในแคช
+- ETag = hash ของข้อมูลทั้งชุด ใช้ respond() ตอบ 304 เมื่อ If-None-Match ตรง
+  (ใช้ได้กับ endpoint ที่ผลลัพธ์ขึ้นกับข้อมูลชุดเดียว + query string เท่านั้น)
+
+invalidate มีผลเฉพาะ process นี้ (ใช้กับ uvicorn process เดียวตาม Procfile)
+process อื่นจะเห็นข้อมูลใหม่เมื่อครบ TTL
+
+ตั้งค่าผ่าน environment:
+  MASTER_CACHE_TTL   วินาทีก่อนโหลดใหม่ (ค่าเริ่มต้น 300, 0 = ไม่แคช)
+
+สถิติดูได้ที่ /internal/metrics/master-cache
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+
+from .database import SessionLocal
+
+TTL = float(os.getenv("MASTER_CACHE_TTL", "300"))
+
+Loader = Callable[[Any], List[dict]]
+
+_loaders: Dict[str, Loader] = {}
+_entries: Dict[str, "Entry"] = {}
+_versions: Dict[str, int] = {}
+_lock = threading.Lock()
+_load_locks: Dict[str, threading.Lock] = {}
+_counters = {"hits": 0, "loads": 0, "invalidations": 0, "not_modified": 0}
+
+
+class Entry:
+    """ข้อมูลหนึ่งชุดที่โหลดแล้ว (rows ห้ามแก้ไข — ใช้ร่วมกันทุก request)"""
+
+    def __init__(self, name: str, rows: List[dict], version: int):
+        self.name = name
+        self.rows = rows
+        self.version = version
+        self.loaded_at = time.monotonic()
+        digest = hashlib.sha1(json.dumps(rows, default=str, ensure_ascii=False).encode("utf-8")).hexdigest()[:20]
+        self.etag = f'"{name}-{digest}"'
+        self._indexes: Dict[str, Dict[Any, dict]] = {}
+
+    def fresh(self) -> bool:
+        return (time.monotonic() - self.loaded_at) < TTL and self.version == _versions.get(self.name, 0)
+
+    def lookup(self, field: str, value) -> Optional[dict]:
+        """หาแถวแรกที่ field == value (สร้าง dict index ครั้งแรกที่ใช้)"""
+        idx = self._indexes.get(field)
+        if idx is None:
+            idx = {}
+            for r in self.rows:
+                idx.setdefault(r.get(field), r)
+            self._indexes[field] = idx
+        return idx.get(value)
+
+
+def register(name: str, loader: Loader):
+    _loaders[name] = loader
+    _load_locks.setdefault(name, threading.Lock())
+
+def invalidate(*names: str):
+    """เรียกหลัง commit ของ endpoint ที่แก้ไขตารางนั้น"""
+    with _lock:
+        for n in names:
+            _versions[n] = _versions.get(n, 0) + 1
+            _counters["invalidations"] += 1
+
+def _cached(name: str) -> Optional[Entry]:
+    e = _entries.get(name)
+    if e is not None and e.fresh():
+        with _lock:
+            _counters["hits"] += 1
+        return e
+    return None
+
+def get(name: str) -> Entry:
+    e = _cached(name)
+    if e is not None:
+        return e
+    # ให้โหลดทีละ request ต่อชุด (request อื่นที่มาพร้อมกันรอแล้วใช้ผลเดียวกัน)
+    with _load_locks[name]:
+        e = _cached(name)
+        if e is not None:
+            return e
+        version = _versions.get(name, 0)
+        db = SessionLocal()
+        try:
+            rows = _loaders[name](db)
+        finally:
+            db.close()
+        e = Entry(name, rows, version)
+        _entries[name] = e
+        with _lock:
+            _counters["loads"] += 1
+        return e
+
+async def aget(name: str) -> Entry:
+    """สำหรับ async endpoint: โหลดใหม่ใน threadpool เพื่อไม่บล็อก event loop"""
+    e = _cached(name)
+    if e is not None:
+        return e
+    return await run_in_threadpool(get, name)
+
+def respond(request: Request, entry: Entry, build: Callable[[], Any]) -> Response:
+    """ตอบ 304 ถ้า browser มีข้อมูลเวอร์ชันเดียวกันแล้ว ไม่งั้นสร้าง JSON ด้วย build()"""
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    inm = request.headers.get("if-none-match")
+    # เทียบแบบ weak: CompressionMiddleware เปลี่ยน ETag ที่ถูกบีบเป็น W/"..."
+    if inm and entry.etag in [t.strip().removeprefix("W/") for t in inm.split(",")]:
+        with _lock:
+            _counters["not_modified"] += 1
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(build(), headers=headers)
+
+def contains(value, needle: str) -> bool:
+    """เทียบแบบ ILIKE '%needle%' (needle ต้อง casefold แล้ว)"""
+    return bool(value) and needle in str(value).casefold()
+
+def stats() -> dict:
+    with _lock:
+        out = dict(_counters)
+    out["ttl"] = TTL
+    out["datasets"] = {
+        n: {"rows": len(e.rows), "etag": e.etag, "age_s": round(time.monotonic() - e.loaded_at, 1), "fresh": e.fresh()}
+        for n, e in list(_entries.items())
+    }
+    return out
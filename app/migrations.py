@@ -0,0 +1,331 @@
+# app/migrations.py
+"""
+คำสั่ง migration / backfill ที่รันมือ (โปรเจกต์นี้ไม่ได้ใช้ create_all/alembic)
+
+    python -m app.migrations --list
+    python -m app.migrations invoice_idx
+    python -m app.migrations invoice_list_index
+    python -m app.migrations revenue_rollup
+    python -m app.migrations customer_search_index
+    python -m app.migrations search_keys
+    python -m app.migrations customer_row_version
+    python -m app.migrations doc_counters
+    python -m app.migrations bill_note_item_unique
+    python -m app.migrations grn_index
+    python -m app.migrations product_last_price
+"""
+import argparse
+import sys
+
+from sqlalchemy import text
+
+from .database import engine
+from . import customer_search, grn_index, product_prices, revenue_rollup, thai_text
+
+
+# ---------- invoice_items.invoice_idx ----------
+def migrate_invoice_idx(conn):
+    """
+    เพิ่มคอลัมน์ invoice_idx (int) ให้ invoice_items แล้ว backfill จากข้อมูลเดิม
+    ซึ่งเก็บ invoice_number ไว้ 2 แบบ:
+      1) เลขที่บิลจริง (invoices.invoice_number)
+      2) idx ของบิลเป็นข้อความ (ที่ /submit บันทึกไว้)
+    รันซ้ำได้ (แตะเฉพาะแถวที่ invoice_idx ยังว่าง)
+    """
+    conn.execute(text("""
+        ALTER TABLE ss_invoices.invoice_items
+        ADD COLUMN IF NOT EXISTS invoice_idx integer
+        REFERENCES ss_invoices.invoices(idx)
+    """))
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS ix_ss_invoices_invoice_items_invoice_idx
+        ON ss_invoices.invoice_items (invoice_idx)
+    """))
+
+    by_number = conn.execute(text("""
+        UPDATE ss_invoices.invoice_items AS it
+        SET invoice_idx = inv.idx
+        FROM ss_invoices.invoices AS inv
+        WHERE it.invoice_idx IS NULL
+          AND it.invoice_number = inv.invoice_number
+    """)).rowcount
+
+    by_idx = conn.execute(text("""
+        UPDATE ss_invoices.invoice_items AS it
+        SET invoice_idx = inv.idx
+        FROM ss_invoices.invoices AS inv
+        WHERE it.invoice_idx IS NULL
+          AND it.invoice_number ~ '^[0-9]+$'
+          AND inv.idx = it.invoice_number::integer
+    """)).rowcount
+
+    orphans = conn.execute(text("""
+        SELECT count(*) FROM ss_invoices.invoice_items WHERE invoice_idx IS NULL
+    """)).scalar()
+
+    conn.execute(text("ANALYZE ss_invoices.invoice_items"))
+    print(f"invoice_idx: linked by invoice_number={by_number}, by idx={by_idx}, unlinked={orphans}")
+
+
+# ---------- invoices (invoice_date desc, idx desc) ----------
+def migrate_invoice_list_index(conn):
+    """
+    index สำหรับ keyset pagination ของ /api/invoices และ /api/invoices/export
+    (ORDER BY invoice_date DESC NULLS FIRST, idx DESC)
+    """
+    # index รุ่นแรกเรียง NULLS LAST ซึ่งไม่ตรงกับลำดับของหน้าเว็บ
+    conn.execute(text("DROP INDEX IF EXISTS ss_invoices.ix_ss_invoices_invoices_date_idx_desc"))
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS ix_ss_invoices_invoices_date_nulls_first_idx_desc
+        ON ss_invoices.invoices (invoice_date DESC NULLS FIRST, idx DESC)
+    """))
+    conn.execute(text("ANALYZE ss_invoices.invoices"))
+    print("invoice_list_index: ok")
+
+
+# ---------- revenue_daily rollup ----------
+def migrate_revenue_rollup(conn):
+    """
+    สร้าง (หรือสร้างใหม่ทั้งหมด) ตาราง ss_invoices.revenue_daily จากบิลทั้งหมด
+    ใช้ครั้งแรก และเมื่อสงสัยว่ายอดใน rollup ไม่ตรงกับบิล
+    """
+    rows = revenue_rollup.rebuild(conn)
+    print(f"revenue_rollup: {rows} rows")
+
+
+# ---------- customer_list trigram index ----------
+def migrate_customer_search_index(conn):
+    """
+    GIN trigram index ของช่องที่ค้นหาลูกค้า (ต้องใช้ extension pg_trgm)
+    ถ้าสร้าง extension ไม่ได้ (ไม่มีสิทธิ์) ระบบจะค้นหาด้วย n-gram index ใน memory แทน
+    """
+    try:
+        with conn.begin_nested():
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    except Exception as e:
+        print(f"customer_search_index: pg_trgm unavailable ({e.__class__.__name__}), using in-memory search")
+        return
+    for col in customer_search.SEARCH_COLUMNS:
+        conn.execute(text(f"""
+            CREATE INDEX IF NOT EXISTS {customer_search.TRGM_INDEXES[col.key]}
+            ON products.customer_list USING gin ({col.key} gin_trgm_ops)
+        """))
+    conn.execute(text("ANALYZE products.customer_list"))
+    print(f"customer_search_index: {len(customer_search.SEARCH_COLUMNS)} indexes ok")
+
+
+# ---------- customer_list / product_list search_key ----------
+_SEARCH_KEY_TABLES = (
+    # (ตาราง, คอลัมน์ต้นทาง, ตัดคำนำหน้า)
+    ("products.customer_list", "fname", True),
+    ("products.product_list", "cf_itemname", False),
+)
+
+def migrate_search_keys(conn):
+    """
+    เพิ่มคอลัมน์ search_key (ชื่อที่ normalize แล้ว ดู app/thai_text.py) แล้วคำนวณใหม่ทุกแถว
+    รันซ้ำหลังเปลี่ยนกฎใน thai_text ได้ (แถวใหม่/แก้ไขคำนวณเองตอนบันทึกผ่าน ORM)
+    """
+    has_trgm = conn.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).first() is not None
+    for table, source, strip_prename in _SEARCH_KEY_TABLES:
+        name = table.split(".")[1]
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_key varchar"))
+        rows = conn.execute(text(f"SELECT idx, {source} FROM {table}")).all()
+        params = [{"idx": idx, "k": thai_text.search_key(v, strip_prename=strip_prename)} for idx, v in rows]
+        if params:
+            conn.execute(text(f"UPDATE {table} SET search_key = :k WHERE idx = :idx"), params)
+        conn.execute(text(f"""
+            CREATE INDEX IF NOT EXISTS ix_{name}_search_key_prefix
+            ON {table} (search_key text_pattern_ops)
+        """))
+        if has_trgm:
+            conn.execute(text(f"""
+                CREATE INDEX IF NOT EXISTS ix_{name}_search_key_trgm
+                ON {table} USING gin (search_key gin_trgm_ops)
+            """))
+        conn.execute(text(f"ANALYZE {table}"))
+        print(f"search_keys: {table} {len(params)} rows{' (+trgm)' if has_trgm else ''}")
+
+
+# ---------- customer_list.row_version (delta sync) ----------
+def migrate_customer_row_version(conn):
+    """
+    row_version ของลูกค้า = เลข transaction ที่ insert/update แถวล่าสุด (pg_current_xact_id ผ่าน trigger)
+    + ตาราง customer_list_deleted เก็บ idx ที่ถูกลบ ใช้กับ GET /api/customers/lookup?since=<version>
+    version ที่ส่งให้ browser คือ xmin ของ snapshot (transaction ที่ยังไม่จบทั้งหมดมีเลข >= ค่านี้)
+    แถวของ transaction ที่ commit ช้าจึงไม่หลุดจาก delta (ต้องใช้ PostgreSQL 13+)
+    รันซ้ำได้ (รุ่นก่อนใช้ sequence: ทุกแถวได้เลข transaction ของ migration นี้ browser โหลดใหม่ครั้งเดียว)
+    """
+    xid = "pg_current_xact_id()::text::bigint"
+    conn.execute(text("ALTER TABLE products.customer_list ADD COLUMN IF NOT EXISTS row_version bigint"))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS products.customer_list_deleted (
+            idx         integer     PRIMARY KEY,
+            row_version bigint      NOT NULL,
+            deleted_at  timestamptz NOT NULL DEFAULT now()
+        )
+    """))
+    conn.execute(text(f"""
+        CREATE OR REPLACE FUNCTION products.customer_list_row_version() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                INSERT INTO products.customer_list_deleted (idx, row_version)
+                VALUES (OLD.idx, {xid})
+                ON CONFLICT (idx) DO UPDATE
+                    SET row_version = EXCLUDED.row_version, deleted_at = now();
+                RETURN OLD;
+            END IF;
+            NEW.row_version := {xid};
+            RETURN NEW;
+        END $$
+    """))
+    conn.execute(text("DROP TRIGGER IF EXISTS trg_customer_list_row_version ON products.customer_list"))
+    conn.execute(text("""
+        CREATE TRIGGER trg_customer_list_row_version
+        BEFORE INSERT OR UPDATE ON products.customer_list
+        FOR EACH ROW EXECUTE FUNCTION products.customer_list_row_version()
+    """))
+    conn.execute(text("DROP TRIGGER IF EXISTS trg_customer_list_deleted ON products.customer_list"))
+    conn.execute(text("""
+        CREATE TRIGGER trg_customer_list_deleted
+        AFTER DELETE ON products.customer_list
+        FOR EACH ROW EXECUTE FUNCTION products.customer_list_row_version()
+    """))
+    # ค่าจาก sequence ของรุ่นก่อนเทียบกับเลข transaction ไม่ได้: เขียนทับทุกแถว (trigger ใส่เลข transaction นี้)
+    filled = conn.execute(text("UPDATE products.customer_list SET row_version = NULL")).rowcount
+    conn.execute(text(f"UPDATE products.customer_list_deleted SET row_version = {xid}"))
+    conn.execute(text(f"""
+        ALTER TABLE products.customer_list
+            ALTER COLUMN row_version SET DEFAULT {xid},
+            ALTER COLUMN row_version SET NOT NULL
+    """))
+    conn.execute(text("DROP SEQUENCE IF EXISTS products.customer_list_row_version_seq"))
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS ix_customer_list_row_version
+        ON products.customer_list (row_version)
+    """))
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS ix_customer_list_deleted_row_version
+        ON products.customer_list_deleted (row_version)
+    """))
+    print(f"customer_row_version: stamped {filled} rows")
+
+
+# ---------- ตัวนับเลขเอกสาร ----------
+def migrate_doc_counters(conn):
+    """
+    ตาราง public.doc_counters สำหรับออกเลขใบวางบิล / ใบลดหนี้ / รหัสลูกค้า / รหัสพนักงานขับรถ
+    (app/doc_numbers.py) ตัวนับของแต่ละเดือน/ปี ถูก seed จากเลขสูงสุดเดิมเมื่อใช้ครั้งแรก
+    """
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS public.doc_counters (
+            name text NOT NULL,
+            period text NOT NULL DEFAULT '',
+            value bigint NOT NULL,
+            updated_at timestamptz NOT NULL DEFAULT now(),
+            PRIMARY KEY (name, period)
+        )
+    """))
+    rows = conn.execute(text("SELECT name, period, value FROM public.doc_counters ORDER BY name, period")).all()
+    for name, period, value in rows:
+        print(f"doc_counters: {name} {period or '-'} = {value}")
+    print("doc_counters: ok")
+
+
+# ---------- bill_note_item: 1 ใบกำกับต่อ 1 ใบวางบิล ----------
+def migrate_bill_note_item_unique(conn):
+    """
+    unique index ของ bill_note_item.invoice_number (เฉพาะที่ไม่ว่าง) ให้ฐานข้อมูลกันใบกำกับซ้ำข้ามใบวางบิล
+    และใช้กับ NOT EXISTS ตอนหาใบกำกับที่ยังไม่วางบิล + index (personid, invoice_date) ของ invoices
+    ถ้ามีใบกำกับอยู่หลายใบวางบิลอยู่แล้ว จะแสดงรายการและหยุด (ต้องแก้ข้อมูลก่อน)
+    """
+    dups = conn.execute(text("""
+        SELECT invoice_number, string_agg(billnote_number, ', ' ORDER BY billnote_number)
+        FROM ss_bills.bill_note_item
+        WHERE invoice_number <> ''
+        GROUP BY invoice_number
+        HAVING count(*) > 1
+        ORDER BY invoice_number
+    """)).all()
+    if dups:
+        for invoice_number, bills in dups:
+            print(f"bill_note_item_unique: {invoice_number} อยู่ในใบวางบิล {bills}")
+        raise RuntimeError(f"bill_note_item_unique: ใบกำกับซ้ำ {len(dups)} ใบ ต้องแก้ก่อนสร้าง unique index")
+
+    conn.execute(text("""
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_ss_bills_bill_note_item_invoice_number
+        ON ss_bills.bill_note_item (invoice_number)
+        WHERE invoice_number <> ''
+    """))
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS ix_ss_invoices_invoices_personid_date
+        ON ss_invoices.invoices (personid, invoice_date)
+    """))
+    conn.execute(text("ANALYZE ss_bills.bill_note_item"))
+    conn.execute(text("ANALYZE ss_invoices.invoices"))
+    print("bill_note_item_unique: ok")
+
+
+# ---------- grn_index ----------
+def migrate_grn_index(conn):
+    """
+    สร้าง (หรือสร้างใหม่ทั้งหมด) ตาราง ss_invoices.grn_index จากบิลทั้งหมด (app/grn_index.py)
+    + index ของ invoices.grn_number และ trigram index ของ grn_number (ถ้ามี pg_trgm)
+    """
+    rows = grn_index.rebuild(conn)
+    has_trgm = conn.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).first() is not None
+    if has_trgm:
+        conn.execute(text(grn_index.CREATE_TRGM_INDEX_SQL))
+    print(f"grn_index: {rows} rows{' (+trgm)' if has_trgm else ''}")
+
+
+# ---------- product_last_price ----------
+def migrate_product_last_price(conn):
+    """
+    สร้าง (หรือสร้างใหม่ทั้งหมด) ตาราง ss_invoices.product_last_price จากบิลทั้งหมด (app/product_prices.py)
+    + index ของ invoice_items.cf_itemid
+    """
+    rows = product_prices.rebuild(conn)
+    print(f"product_last_price: {rows} rows")
+
+
+MIGRATIONS = {
+    "invoice_idx": migrate_invoice_idx,
+    "invoice_list_index": migrate_invoice_list_index,
+    "revenue_rollup": migrate_revenue_rollup,
+    "customer_search_index": migrate_customer_search_index,
+    "search_keys": migrate_search_keys,
+    "customer_row_version": migrate_customer_row_version,
+    "doc_counters": migrate_doc_counters,
+    "bill_note_item_unique": migrate_bill_note_item_unique,
+    "grn_index": migrate_grn_index,
+    "product_last_price": migrate_product_last_price,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.migrations")
+    parser.add_argument("names", nargs="*", help="ชื่อ migration ที่จะรัน (ตามลำดับ)")
+    parser.add_argument("--list", action="store_true", help="แสดงรายชื่อ migration")
+    args = parser.parse_args(argv)
+
+    if args.list or not args.names:
+        for name, fn in MIGRATIONS.items():
+            doc = (fn.__doc__ or "").strip().splitlines()
+            print(f"{name:24s} {doc[0] if doc else ''}")
+        return 0
+
+    unknown = [n for n in args.names if n not in MIGRATIONS]
+    if unknown:
+        parser.error(f"unknown migration: {', '.join(unknown)}")
+
+    for name in args.names:
+        # แต่ละ migration อยู่ใน transaction ของตัวเอง
+        with engine.begin() as conn:
+            MIGRATIONS[name](conn)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,9 @@
 # app/models.py
-from sqlalchemy import Column, Integer, String, Float, Date, ForeignKey, Text
+from sqlalchemy import BigInteger, Column, Integer, String, Float, Date, DateTime, ForeignKey, Index, Text, Numeric, event, text
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import relationship, foreign
 from .database import Base
+from .thai_text import search_key
 
 # ------------------ Invoices (schema: ss_invoices) ------------------
 
@@ -33,11 +35,10 @@ class Invoice(Base):
     car_numberplate = Column(String)
     driver_id = Column(String(10), ForeignKey("products.drivers.driver_id"), index=True)
 
-    # ความสัมพันธ์กับ items โดย match ที่ "เลขที่บิล (varchar)" ไม่ใช่ idx
+    # ความสัมพันธ์กับ items ผ่านคีย์เชื่อม invoice_idx (int) ที่มี index
     items = relationship(
         "InvoiceItem",
-        primaryjoin="Invoice.invoice_number == foreign(InvoiceItem.invoice_number)",
-        foreign_keys="[InvoiceItem.invoice_number]",
+        primaryjoin="Invoice.idx == foreign(InvoiceItem.invoice_idx)",
         back_populates="invoice",
         viewonly=True,  # ป้องกัน SQLA บังคับ unique/constraint ฝั่ง parent
     )
@@ -55,6 +56,9 @@ class InvoiceItem(Base):
         ForeignKey("ss_invoices.invoices.invoice_number"),
         index=True
     )
+    # คีย์เชื่อมหลัก (int) -> invoices.idx
+    # invoice_number ด้านบนเป็นค่าเดิมที่อาจเก็บทั้ง "เลขที่บิล" หรือ "idx เป็นข้อความ"
+    invoice_idx = Column(Integer, ForeignKey("ss_invoices.invoices.idx"), index=True)
 
     personid = Column(String)
     cf_itemid = Column(String(6))
@@ -67,10 +71,42 @@ class InvoiceItem(Base):
 
     invoice = relationship(
         "Invoice",
-        primaryjoin="foreign(InvoiceItem.invoice_number) == Invoice.invoice_number",
+        primaryjoin="foreign(InvoiceItem.invoice_idx) == Invoice.idx",
         viewonly=True,
     )
 
+class RevenueDaily(Base):
+    """ยอดขายสรุปรายวัน (ดูแลโดย app/revenue_rollup.py) ค่าว่างใน key เก็บเป็น ''"""
+    __tablename__ = "revenue_daily"
+    __table_args__ = {"schema": "ss_invoices"}
+
+    day = Column(Date, primary_key=True)
+    personid = Column(String, primary_key=True)
+    fname = Column(String, primary_key=True)
+    driver_id = Column(String, primary_key=True)
+    car_numberplate = Column(String, primary_key=True)
+    cf_itemid = Column(String, primary_key=True)   # '' = แถวนับจำนวนบิล
+
+    invoice_count = Column(Integer)
+    item_count = Column(Integer)
+    quantity = Column(Numeric)
+    quantity_ton = Column(Numeric)
+    amount = Column(Numeric)
+
+class GrnIndex(Base):
+    """สรุปต่อเลข GRN (ดูแลโดย app/grn_index.py)"""
+    __tablename__ = "grn_index"
+    __table_args__ = {"schema": "ss_invoices"}
+
+    grn_number = Column(String, primary_key=True)
+    invoice_count = Column(Integer)
+    first_invoice_number = Column(String)
+    first_personid = Column(String)
+    product_codes = Column(ARRAY(String))
+    descriptions = Column(ARRAY(String))
+    quantity_sum = Column(Numeric)
+    updated_at = Column(DateTime(timezone=True))
+
 # ------------------ Billing Notes (schema: ss_bills) ------------------
 
 class BillNote(Base):
@@ -102,7 +138,14 @@ class BillNote(Base):
 
 class BillNoteItem(Base):
     __tablename__ = "bill_note_item"
-    __table_args__ = {"schema": "ss_bills"}
+    __table_args__ = (
+        # ใบกำกับ 1 ใบอยู่ได้ในใบวางบิลเดียว (python -m app.migrations bill_note_item_unique)
+        Index(
+            "ux_ss_bills_bill_note_item_invoice_number", "invoice_number",
+            unique=True, postgresql_where=text("invoice_number <> ''"),
+        ),
+        {"schema": "ss_bills"},
+    )
 
     idx = Column(Integer, primary_key=True)
     billnote_number = Column(String, index=True) # Foreign key to BillNote.billnote_number
@@ -140,6 +183,11 @@ class CustomerList(Base):
     cf_branch = Column(String) 
     fmlpaymentcreditday = Column(Integer)
 
+    # คีย์ค้นหาของ fname (app/thai_text.search_key) คำนวณตอนบันทึก
+    search_key = Column(String)
+    # เลข transaction ที่เขียนแถวล่าสุด (trigger ใน DB) สำหรับ delta sync ของ /api/customers/lookup
+    row_version = Column(BigInteger)
+
 # ------------------ Products (schema: products) ------------------
 
 class ProductList(Base):
@@ -153,6 +201,9 @@ class ProductList(Base):
     cf_itempricelevel_price = Column(Float)
     cf_items_ordinary = Column(Integer)
 
+    # คีย์ค้นหาของ cf_itemname (ไม่ตัดคำนำหน้า) คำนวณตอนบันทึก
+    search_key = Column(String)
+
 # ------------------ Cars (schema: products) ------------------
 
 class Car(Base):
@@ -187,4 +238,26 @@ class ProvinceNostra(Base):
     __tablename__ = "province_nostra"
     __table_args__ = {"schema": "public"}
 
-    prov_nam_t = Column(String, primary_key=True)
\ No newline at end of file
+    prov_nam_t = Column(String, primary_key=True)
+
+class DocCounter(Base):
+    """ตัวนับเลขเอกสาร/รหัส (ดูแลโดย app/doc_numbers.py) value = เลขล่าสุดที่ออกไปแล้ว"""
+    __tablename__ = "doc_counters"
+    __table_args__ = {"schema": "public"}
+
+    name = Column(String, primary_key=True)     # bill_note / credit_note / customer / driver
+    period = Column(String, primary_key=True)   # เช่น '6810' (ปีเดือน พ.ศ.), '2568', '' = ไม่แยกช่วง
+    value = Column(BigInteger, nullable=False)
+    updated_at = Column(DateTime(timezone=True))
+
+# ------------------ search_key (คำนวณทุกครั้งที่ insert/update ผ่าน ORM) ------------------
+
+@event.listens_for(CustomerList, "before_insert")
+@event.listens_for(CustomerList, "before_update")
+def _customer_search_key(mapper, connection, target):
+    target.search_key = search_key(target.fname)
+
+@event.listens_for(ProductList, "before_insert")
+@event.listens_for(ProductList, "before_update")
+def _product_search_key(mapper, connection, target):
+    target.search_key = search_key(target.cf_itemname, strip_prename=False)
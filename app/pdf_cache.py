@@ -0,0 +1,202 @@
+# app/pdf_cache.py
+"""
+แคช PDF บนดิสก์ แบบ content-addressed
+
+- key = sha256(HTML ที่เรนเดอร์แล้ว + เวอร์ชันของ stylesheet/renderer)
+  เอกสารที่เนื้อหาไม่เปลี่ยน (พิมพ์ซ้ำ) จะได้ไฟล์เดิมโดยไม่ต้องเรนเดอร์ใหม่
+- ชื่อไฟล์ = <doc_tag>__<key>.pdf เพื่อให้ invalidate ตามเอกสารได้
+  (เช่น invoice-IV6801001 เมื่อแก้ไขบิล)
+- จำกัดขนาดรวม ลบไฟล์ที่ใช้ล่าสุดนานที่สุดก่อน (LRU ตาม mtime ซึ่งถูก touch ทุกครั้งที่ hit)
+  ขนาดรวมนับไว้ใน memory (บวกตอน store ลบตอน invalidate) scan โฟลเดอร์เฉพาะตอนเกินขนาด
+  และทุก ๆ PDF_CACHE_RESCAN_EVERY ครั้งที่ store (เผื่อไฟล์ถูกเพิ่ม/ลบจากที่อื่น)
+
+ตั้งค่าผ่าน environment:
+  PDF_CACHE_DIR        โฟลเดอร์เก็บแคช (ค่าเริ่มต้น <tmp>/ssincom_pdf_cache)
+  PDF_CACHE_MAX_BYTES  ขนาดรวมสูงสุด (ค่าเริ่มต้น 512 MB, 0 = ปิดแคช)
+  PDF_CACHE_RESCAN_EVERY  scan โฟลเดอร์ใหม่ทุกกี่ครั้งที่ store (ค่าเริ่มต้น 500)
+"""
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import uuid
+from pathlib import Path
+from typing import Optional
+
+from . import pdf_pool
+
+CACHE_DIR = Path(os.getenv("PDF_CACHE_DIR", str(Path(tempfile.gettempdir()) / "ssincom_pdf_cache")))
+MAX_BYTES = int(os.getenv("PDF_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+RESCAN_EVERY = max(1, int(os.getenv("PDF_CACHE_RESCAN_EVERY", "500")))
+
+# เปลี่ยนค่านี้เมื่อวิธีเรนเดอร์เปลี่ยน (เช่น อัปเกรด WeasyPrint) เพื่อทิ้งแคชเดิมทั้งหมด
+RENDER_VERSION = "1"
+
+_lock = threading.Lock()
+_counters = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+_asset_versions: dict = {}
+# ขนาดรวมของแคชที่ process นี้รู้ (None = ยังไม่ได้ scan) และจำนวน store ตั้งแต่ scan ล่าสุด
+_total_bytes: Optional[int] = None
+_stores_since_scan = 0
+
+
+def _bump(name: str, n: int = 1):
+    with _lock:
+        _counters[name] += n
+
+def _asset_version(stylesheet: Optional[str]) -> str:
+    """hash ของไฟล์ CSS ที่แนบ (คำนวณครั้งเดียวต่อ process)"""
+    if not stylesheet:
+        return ""
+    v = _asset_versions.get(stylesheet)
+    if v is None:
+        v = hashlib.sha256(pdf_pool.STYLESHEETS[stylesheet].read_bytes()).hexdigest()[:16]
+        _asset_versions[stylesheet] = v
+    return v
+
+def _safe_tag(doc_tag: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", doc_tag)
+
+def make_tag(kind: str, number) -> str:
+    """เช่น make_tag("invoice", "IV6801001") -> "invoice-IV6801001" """
+    return _safe_tag(f"{kind}-{number or ''}")
+
+def cache_key(html: str, stylesheet: Optional[str]) -> str:
+    h = hashlib.sha256()
+    h.update(f"{RENDER_VERSION}|{stylesheet or ''}|{_asset_version(stylesheet)}|".encode())
+    h.update(html.encode("utf-8"))
+    return h.hexdigest()
+
+def _entries():
+    try:
+        return [e for e in os.scandir(CACHE_DIR) if e.name.endswith(".pdf") and e.is_file()]
+    except FileNotFoundError:
+        return []
+
+def _evict():
+    """scan โฟลเดอร์ ลบไฟล์เก่าสุดจนไม่เกิน MAX_BYTES แล้วตั้งขนาดรวมใหม่ตามจริง"""
+    global _total_bytes, _stores_since_scan
+    entries = []
+    total = 0
+    for e in _entries():
+        try:
+            st = e.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, e.path))
+        total += st.st_size
+    if total > MAX_BYTES:
+        entries.sort()
+        for _mtime, size, path in entries:
+            if total <= MAX_BYTES:
+                break
+            try:
+                os.unlink(path)
+                _bump("evictions")
+            except FileNotFoundError:
+                pass
+            total -= size
+    with _lock:
+        _total_bytes = total
+        _stores_since_scan = 0
+
+def _added(nbytes: int) -> bool:
+    """นับขนาดที่เปลี่ยน คืน True ถ้าต้อง scan/evict"""
+    global _total_bytes, _stores_since_scan
+    with _lock:
+        if _total_bytes is None or _stores_since_scan >= RESCAN_EVERY:
+            return True
+        _total_bytes += nbytes
+        _stores_since_scan += 1
+        return _total_bytes > MAX_BYTES
+
+def _removed(nbytes: int):
+    global _total_bytes
+    with _lock:
+        if _total_bytes is not None:
+            _total_bytes = max(0, _total_bytes - nbytes)
+
+def _path(doc_tag: str, key: str) -> Path:
+    return CACHE_DIR / f"{_safe_tag(doc_tag)}__{key}.pdf"
+
+def lookup(doc_tag: str, html: str, stylesheet: Optional[str] = None) -> Optional[bytes]:
+    """คืน PDF จากแคช (นับ hit/miss) หรือ None ถ้าไม่มี"""
+    if MAX_BYTES <= 0:
+        return None
+    path = _path(doc_tag, cache_key(html, stylesheet))
+    try:
+        data = path.read_bytes()
+        os.utime(path)  # LRU: touch เมื่อถูกใช้
+        _bump("hits")
+        return data
+    except FileNotFoundError:
+        _bump("misses")
+        return None
+
+def store(doc_tag: str, html: str, stylesheet: Optional[str], data: bytes):
+    store_key(doc_tag, cache_key(html, stylesheet), data)
+
+def store_key(doc_tag: str, key: str, data: bytes):
+    """เหมือน store() แต่รับ cache_key() ที่คำนวณไว้แล้ว (ไม่ต้องเก็บ HTML ไว้รอผลเรนเดอร์)"""
+    if MAX_BYTES <= 0:
+        return
+    # เขียนแบบ atomic: export พร้อมกันหลาย request ไม่เห็นไฟล์ครึ่ง ๆ
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = CACHE_DIR / f".{uuid.uuid4().hex}.tmp"
+    tmp.write_bytes(data)
+    path = _path(doc_tag, key)
+    try:
+        replaced = path.stat().st_size
+    except FileNotFoundError:
+        replaced = 0
+    os.replace(tmp, path)
+    if _added(len(data) - replaced):
+        _evict()
+
+def render_cached(doc_tag: str, html: str, base_url: Optional[str] = None,
+                  stylesheet: Optional[str] = None) -> bytes:
+    """เหมือน pdf_pool.render_pdf() แต่ดูแคชก่อน"""
+    data = lookup(doc_tag, html, stylesheet)
+    if data is None:
+        data = pdf_pool.render_pdf(html, base_url=base_url, stylesheet=stylesheet)
+        store(doc_tag, html, stylesheet, data)
+    return data
+
+def invalidate(*doc_tags: str) -> int:
+    """ลบแคชทุกเวอร์ชันของเอกสารที่ระบุ คืนจำนวนไฟล์ที่ลบ"""
+    removed = 0
+    prefixes = {f"{_safe_tag(t)}__" for t in doc_tags if t}
+    if not prefixes:
+        return 0
+    for e in _entries():
+        if any(e.name.startswith(p) for p in prefixes):
+            try:
+                size = e.stat().st_size
+                os.unlink(e.path)
+                removed += 1
+                _removed(size)
+            except FileNotFoundError:
+                pass
+    _bump("invalidations", removed)
+    return removed
+
+def stats() -> dict:
+    files = _entries()
+    size = 0
+    for e in files:
+        try:
+            size += e.stat().st_size
+        except FileNotFoundError:
+            pass
+    with _lock:
+        out = dict(_counters)
+    total = out["hits"] + out["misses"]
+    out.update({
+        "hit_ratio": round(out["hits"] / total, 4) if total else 0.0,
+        "entries": len(files),
+        "bytes": size,
+        "max_bytes": MAX_BYTES,
+        "dir": str(CACHE_DIR),
+    })
+    return out
@@ -1,12 +1,16 @@
 from jinja2 import Environment, FileSystemLoader
-from weasyprint import HTML
 from pathlib import Path
 
-def generate_invoice_pdf(invoice):
+from . import pdf_cache
+
+def generate_invoice_pdf(invoice) -> bytes:
     base_path = Path(__file__).resolve().parent
     env = Environment(loader=FileSystemLoader(str(base_path / "templates")))
     template = env.get_template("invoice.html")
     html_out = template.render(invoice=invoice)
-    pdf_path = "/tmp/invoice.pdf"
-    HTML(string=html_out).write_pdf(pdf_path)
-    return pdf_path
+    # เรนเดอร์ใน pdf_pool (ผ่านแคช) แล้วคืน bytes (ไม่เขียน /tmp/invoice.pdf ร่วมกันอีก)
+    return pdf_cache.render_cached(
+        pdf_cache.make_tag("invoice", invoice.invoice_number),
+        html_out,
+        stylesheet="invoice",
+    )
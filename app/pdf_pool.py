@@ -0,0 +1,187 @@
+# app/pdf_pool.py
+"""
+Process pool สำหรับเรนเดอร์ PDF ด้วย WeasyPrint
+
+- worker แต่ละตัวโหลด FontConfiguration + invoice.css / credit_note.css ไว้ครั้งเดียว
+  ตอนเริ่ม process (pre-warm) แล้วใช้ซ้ำทุกงาน; start() สร้าง worker ทั้งหมดตอน startup ของแอป
+- endpoint ส่งงานผ่าน render_pdf() ซึ่งรอผลใน thread ของ request เอง
+  งานเรนเดอร์จึงไม่แย่ง GIL กับ request อื่นใน uvicorn worker
+- จำกัดจำนวนงานค้าง (กำลังเรนเดอร์ + รอคิว) ถ้าเต็มตอบ 503 + Retry-After
+  งานที่ timeout (504) ยังนับจนกว่า worker จะเรนเดอร์เสร็จจริง
+
+ตั้งค่าผ่าน environment:
+  PDF_POOL_SIZE         จำนวน process (ค่าเริ่มต้น 2)
+  PDF_POOL_QUEUE_DEPTH  จำนวนงานที่รอคิวได้นอกเหนือจากที่กำลังเรนเดอร์ (ค่าเริ่มต้น 4 x pool size)
+  PDF_POOL_RETRY_AFTER  วินาทีที่ส่งใน Retry-After เมื่อคิวเต็ม (ค่าเริ่มต้น 5)
+  PDF_RENDER_TIMEOUT    วินาทีสูงสุดที่รอผลเรนเดอร์หนึ่งงาน (ค่าเริ่มต้น 120)
+"""
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Optional
+from urllib.parse import quote
+
+from fastapi import HTTPException
+from fastapi.responses import Response
+
+BASE_DIR = Path(__file__).resolve().parent
+
+# stylesheet ที่ worker parse เก็บไว้ล่วงหน้า (ชื่อ -> ไฟล์)
+STYLESHEETS = {
+    "invoice": BASE_DIR / "static" / "css" / "invoice.css",
+    "credit_note": BASE_DIR / "static" / "css" / "credit_note.css",
+}
+
+POOL_SIZE = max(1, int(os.getenv("PDF_POOL_SIZE", "2")))
+QUEUE_DEPTH = max(0, int(os.getenv("PDF_POOL_QUEUE_DEPTH", str(POOL_SIZE * 4))))
+RETRY_AFTER = int(os.getenv("PDF_POOL_RETRY_AFTER", "5"))
+RENDER_TIMEOUT = float(os.getenv("PDF_RENDER_TIMEOUT", "120"))
+
+
+# ---------- ฝั่ง worker process ----------
+_font_config = None
+_stylesheets = {}
+
+def _init_worker():
+    global _font_config
+    from weasyprint import HTML, CSS
+    from weasyprint.text.fonts import FontConfiguration
+
+    # font_config ต้องเป็นตัวเดียวกันทั้งใน CSS() และ write_pdf()
+    # ไม่งั้น @font-face (TH Sarabun New) ถูกทิ้งเงียบ ๆ
+    _font_config = FontConfiguration()
+    for name, path in STYLESHEETS.items():
+        _stylesheets[name] = CSS(filename=str(path), font_config=_font_config)
+
+    # layout เอกสารสั้น ๆ หนึ่งรอบ ให้ pango/fontconfig โหลดฟอนต์ไทยไว้ก่อนงานจริง
+    HTML(string="<p>ทดสอบ ภาษาไทย</p>").write_pdf(
+        stylesheets=list(_stylesheets.values()),
+        font_config=_font_config,
+    )
+
+def _render(html: str, base_url: Optional[str], stylesheet: Optional[str]) -> bytes:
+    from weasyprint import HTML
+
+    sheets = [_stylesheets[stylesheet]] if stylesheet else []
+    return HTML(string=html, base_url=base_url).write_pdf(
+        stylesheets=sheets,
+        font_config=_font_config,
+    )
+
+
+# ---------- ฝั่ง web process ----------
+_lock = threading.Lock()
+_executor: Optional[ProcessPoolExecutor] = None
+_slots = threading.BoundedSemaphore(POOL_SIZE + QUEUE_DEPTH)
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            # spawn: ไม่ fork สถานะของ uvicorn (thread / connection pool) ติดไปด้วย
+            _executor = ProcessPoolExecutor(
+                max_workers=POOL_SIZE,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+        return _executor
+
+def _warm() -> int:
+    return os.getpid()
+
+def start():
+    """สร้าง pool และเริ่ม worker ทุกตัวตอน startup (ไม่รอ) งานแรกจึงไม่ต้องรอ spawn + โหลดฟอนต์"""
+    executor = _get_executor()
+    for _ in range(POOL_SIZE):
+        executor.submit(_warm)
+
+def _reset_executor(broken: ProcessPoolExecutor):
+    global _executor
+    with _lock:
+        if _executor is broken:
+            _executor = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+def shutdown():
+    global _executor
+    with _lock:
+        ex, _executor = _executor, None
+    if ex is not None:
+        ex.shutdown(wait=False, cancel_futures=True)
+
+def _busy() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="PDF renderer busy, please retry",
+        headers={"Retry-After": str(RETRY_AFTER)},
+    )
+
+def _strip_resident_link(html: str, stylesheet: Optional[str]) -> str:
+    """ตัด <link> ของ stylesheet ที่ worker parse ไว้แล้ว ไม่ให้ WeasyPrint โหลด/parse ซ้ำ"""
+    if not stylesheet:
+        return html
+    fname = re.escape(STYLESHEETS[stylesheet].name)
+    return re.sub(rf'<link[^>]*href="[^"]*/css/{fname}"[^>]*>', "", html)
+
+def render_pdf(html: str, base_url: Optional[str] = None, stylesheet: Optional[str] = None) -> bytes:
+    """
+    เรนเดอร์ HTML -> PDF (bytes) ใน process pool
+    stylesheet: ชื่อใน STYLESHEETS ที่จะแนบ (ใช้ตัวที่ parse ค้างไว้ใน worker)
+    """
+    if stylesheet is not None and stylesheet not in STYLESHEETS:
+        raise ValueError(f"unknown stylesheet: {stylesheet}")
+    executor = _get_executor()
+    if not _slots.acquire(blocking=False):
+        raise _busy()
+
+    try:
+        future = executor.submit(_render, _strip_resident_link(html, stylesheet), base_url, stylesheet)
+    except BrokenProcessPool:
+        _slots.release()
+        _reset_executor(executor)
+        raise _busy()
+    except BaseException:
+        _slots.release()
+        raise
+    # คืน slot เมื่องานจบจริง ไม่ใช่เมื่อเลิกรอ: งานที่ timeout แต่ยังเรนเดอร์อยู่ยังนับเป็นงานค้าง
+    future.add_done_callback(lambda _f: _slots.release())
+    try:
+        return future.result(timeout=RENDER_TIMEOUT)
+    except FutureTimeout:
+        future.cancel()   # ได้ผลเฉพาะงานที่ยังรอคิว
+        raise HTTPException(status_code=504, detail="PDF render timed out")
+    except BrokenProcessPool:
+        _reset_executor(executor)
+        raise _busy()
+
+def submit(html: str, base_url: Optional[str] = None, stylesheet: Optional[str] = None) -> Future:
+    """
+    ส่งงานเข้า pool แบบรอคิวว่าง (ไม่ตอบ 503) สำหรับงาน batch ที่รันเบื้องหลัง
+    คืน Future ของ bytes; คิวถูกคืนเมื่องานเสร็จ
+    """
+    if stylesheet is not None and stylesheet not in STYLESHEETS:
+        raise ValueError(f"unknown stylesheet: {stylesheet}")
+    _slots.acquire()
+    try:
+        future = _get_executor().submit(_render, _strip_resident_link(html, stylesheet), base_url, stylesheet)
+    except BaseException:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _f: _slots.release())
+    return future
+
+def pdf_response(data: bytes, filename: str) -> Response:
+    """ตอบไฟล์ PDF จาก bytes (Content-Disposition แบบเดียวกับ FileResponse)"""
+    if filename.isascii():
+        disposition = f'attachment; filename="{filename}"'
+    else:
+        disposition = f"attachment; filename*=utf-8''{quote(filename)}"
+    return Response(
+        content=data,
+        media_type="application/pdf",
+        headers={"Content-Disposition": disposition},
+    )
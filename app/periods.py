@@ -0,0 +1,80 @@
+# app/periods.py
+"""
+ตัวกรองช่วงวันที่ของรายงาน แปลงเป็นช่วงครึ่งเปิด  col >= a AND col < b
+เพื่อให้ใช้ index ของคอลัมน์วันที่ได้ (แทน to_char(col, 'YYYY-MM') = ... / extract('year', col) = ...)
+
+    q = periods.apply(q, inv.invoice_date, start=start, end=end, month=month, year=year)
+    q = periods.apply(q, rd.day, granularity, start, end, month, year)
+
+granularity:
+  None   ใช้ month ถ้ามี, ไม่งั้น year, ไม่งั้น start/end (แบบ /api/saletax/list)
+  "day"  ใช้ start/end   "month" ใช้ month (YYYY-MM)   "year" ใช้ year
+"""
+from datetime import date, timedelta
+from typing import Optional, Tuple, Union
+
+DateLike = Union[str, date, None]
+
+
+def parse_date(s: DateLike) -> Optional[date]:
+    """'YYYY-MM-DD' -> date (ค่าผิดรูปแบบ = None)"""
+    if not s:
+        return None
+    if isinstance(s, date):
+        return s
+    try:
+        return date.fromisoformat(s)
+    except Exception:
+        return None
+
+def day_range(start: DateLike = None, end: DateLike = None) -> Tuple[Optional[date], Optional[date]]:
+    """start..end (รวมวัน end) -> [start, end + 1 วัน)"""
+    d1, d2 = parse_date(start), parse_date(end)
+    return d1, (d2 + timedelta(days=1) if d2 else None)
+
+def month_range(month: Optional[str]) -> Tuple[Optional[date], Optional[date]]:
+    """'YYYY-MM' -> [วันที่ 1, วันที่ 1 ของเดือนถัดไป)"""
+    if not month or len(month) != 7:
+        return None, None
+    try:
+        y, m = int(month[:4]), int(month[5:7])
+        first = date(y, m, 1)
+    except ValueError:
+        return None, None
+    return first, (date(y + 1, 1, 1) if m == 12 else date(y, m + 1, 1))
+
+def year_range(year: Optional[int]) -> Tuple[Optional[date], Optional[date]]:
+    if not year:
+        return None, None
+    try:
+        return date(year, 1, 1), date(year + 1, 1, 1)
+    except ValueError:
+        return None, None
+
+def period_range(granularity: Optional[str] = None, start: DateLike = None, end: DateLike = None,
+                 month: Optional[str] = None, year: Optional[int] = None) -> Tuple[Optional[date], Optional[date]]:
+    """คืน (a, b) สำหรับ a <= วันที่ < b (None = ไม่จำกัดด้านนั้น)"""
+    if granularity is None:
+        if month and len(month) == 7:
+            return month_range(month)
+        if year:
+            return year_range(year)
+        return day_range(start, end)
+    if granularity == "day":
+        return day_range(start, end)
+    if granularity == "month":
+        return month_range(month)
+    return year_range(year)
+
+def filter_range(q, col, a: Optional[date], b: Optional[date]):
+    if a:
+        q = q.filter(col >= a)
+    if b:
+        q = q.filter(col < b)
+    return q
+
+def apply(q, col, granularity: Optional[str] = None, start: DateLike = None, end: DateLike = None,
+          month: Optional[str] = None, year: Optional[int] = None):
+    """กรอง query ด้วยคอลัมน์วันที่ col ตามช่วงที่ขอ"""
+    a, b = period_range(granularity, start, end, month, year)
+    return filter_range(q, col, a, b)
@@ -0,0 +1,167 @@
+# app/product_prices.py
+"""
+ราคาขายล่าสุดของสินค้า ss_invoices.product_last_price
+
+    (cf_itemid, personid) -> ราคา/หน่วยจากรายการล่าสุด (ไม่นับรายการที่ไม่มีราคา)
+    personid = '' คือราคาล่าสุดจากทุกลูกค้า
+"ล่าสุด" = invoice_date ใหม่สุด (ไม่มีวันที่ถือว่าเก่าสุด) แล้วตามเลขที่บิล, idx บิล, idx รายการ
+
+แทนการ sort join บิลกับรายการทั้งหมดของรหัสนั้นทุกครั้งที่ถามราคา
+lookup() ตอบหลายรหัสในคิวรีเดียว ตามลำดับ: ราคาจาก GRN ที่ระบุ -> ราคาล่าสุดของลูกค้า -> ราคาล่าสุด
+
+อัปเดตใน transaction เดียวกับการเขียนบิล (เรียกคู่กับ revenue_rollup):
+    product_prices.remove_invoices(db, [idx])   # ก่อนแก้ไข/ลบ: แถวที่มาจากบิลนี้คำนวณใหม่โดยไม่นับบิลนี้
+    ... แก้ไขบิล / รายการ ...
+    db.flush()
+    product_prices.add_invoices(db, [idx])      # หลังบันทึก: แทนที่เฉพาะแถวที่บิลนี้ใหม่กว่า
+lock ด้วย advisory lock ต่อรหัสสินค้า
+
+สร้างใหม่ทั้งตาราง: python -m app.migrations product_last_price
+"""
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import text
+
+# namespace ของ pg_advisory_xact_lock(int, int) ไม่ให้ชนกับ lock อื่น
+_LOCK_NS = 0x6C7072   # "lpr"
+
+# ลำดับ "ใหม่กว่า" (ใช้ทั้งเลือกแถวและเทียบตอน upsert)
+_ROW_ORDER = "coalesce({t}.invoice_date, '-infinity'::date), coalesce({t}.invoice_number, ''), {t}.invoice_idx, {t}.item_idx"
+
+# รายการล่าสุดต่อ (รหัส, ลูกค้า) และต่อรหัส (personid '') ({where} กรองบิล/รายการ)
+_SOURCE_SQL = """
+    SELECT DISTINCT ON (it.cf_itemid, k.personid)
+           it.cf_itemid, k.personid, it.cf_itempricelevel_price AS price,
+           inv.idx AS invoice_idx, inv.invoice_date, inv.invoice_number, it.idx AS item_idx
+    FROM ss_invoices.invoices AS inv
+    JOIN ss_invoices.invoice_items AS it ON it.invoice_idx = inv.idx
+    CROSS JOIN LATERAL (VALUES (''), (coalesce(inv.personid, ''))) AS k(personid)
+    WHERE it.cf_itemid <> '' AND it.cf_itempricelevel_price IS NOT NULL {where}
+    ORDER BY it.cf_itemid, k.personid,
+             coalesce(inv.invoice_date, '-infinity'::date) DESC, coalesce(inv.invoice_number, '') DESC,
+             inv.idx DESC, it.idx DESC
+"""
+
+_UPSERT_SQL = f"""
+    INSERT INTO ss_invoices.product_last_price AS p
+        (cf_itemid, personid, price, invoice_idx, invoice_date, invoice_number, item_idx, updated_at)
+    SELECT s.*, now() FROM ({{source}}) AS s
+    ON CONFLICT (cf_itemid, personid) DO UPDATE SET
+        price = EXCLUDED.price,
+        invoice_idx = EXCLUDED.invoice_idx,
+        invoice_date = EXCLUDED.invoice_date,
+        invoice_number = EXCLUDED.invoice_number,
+        item_idx = EXCLUDED.item_idx,
+        updated_at = now()
+    WHERE ({_ROW_ORDER.format(t="EXCLUDED")}) >= ({_ROW_ORDER.format(t="p")})
+"""
+
+CREATE_SQL = """
+    CREATE TABLE IF NOT EXISTS ss_invoices.product_last_price (
+        cf_itemid      varchar NOT NULL,
+        personid       varchar NOT NULL DEFAULT '',
+        price          numeric NOT NULL,
+        invoice_idx    integer NOT NULL,
+        invoice_date   date,
+        invoice_number varchar,
+        item_idx       integer NOT NULL,
+        updated_at     timestamptz NOT NULL DEFAULT now(),
+        PRIMARY KEY (cf_itemid, personid)
+    )
+"""
+
+CREATE_INDEX_SQLS = (
+    # หาแถวที่มาจากบิลที่ถูกแก้/ลบ
+    """
+    CREATE INDEX IF NOT EXISTS ix_ss_invoices_product_last_price_invoice_idx
+    ON ss_invoices.product_last_price (invoice_idx)
+    """,
+    # คำนวณใหม่ต่อรหัสสินค้า
+    """
+    CREATE INDEX IF NOT EXISTS ix_ss_invoices_invoice_items_cf_itemid
+    ON ss_invoices.invoice_items (cf_itemid)
+    """,
+)
+
+_LOOKUP_SQL = text("""
+    SELECT coalesce(
+        (SELECT it.cf_itempricelevel_price
+         FROM ss_invoices.invoices AS inv
+         JOIN ss_invoices.invoice_items AS it ON it.invoice_idx = inv.idx
+         WHERE r.grn <> '' AND inv.grn_number = r.grn AND it.cf_itemid = r.code
+           AND it.cf_itempricelevel_price IS NOT NULL
+         ORDER BY inv.invoice_date DESC NULLS LAST, inv.invoice_number DESC
+         LIMIT 1),
+        (SELECT p.price FROM ss_invoices.product_last_price AS p
+         WHERE :personid <> '' AND p.cf_itemid = r.code AND p.personid = :personid),
+        (SELECT p.price FROM ss_invoices.product_last_price AS p
+         WHERE p.cf_itemid = r.code AND p.personid = '')
+    ) AS price
+    FROM unnest(CAST(:codes AS varchar[]), CAST(:grns AS varchar[])) WITH ORDINALITY AS r(code, grn, n)
+    ORDER BY r.n
+""")
+
+
+def lookup(db, wanted: Sequence[Tuple[str, Optional[str]]], personid: Optional[str] = None) -> List[Optional[float]]:
+    """ราคาของแต่ละ (รหัสสินค้า, GRN) ตามลำดับที่ขอ (None = ไม่พบราคา)"""
+    if not wanted:
+        return []
+    params = {
+        "codes": [code for code, _ in wanted],
+        "grns": [grn or "" for _, grn in wanted],
+        "personid": personid or "",
+    }
+    return [float(p) if p is not None else None for p in db.execute(_LOOKUP_SQL, params).scalars()]
+
+def _lock_codes(conn, ids: List[int]):
+    # lock ตามลำดับรหัส (กัน deadlock) ก่อนอ่าน/เขียนแถวของรหัสเหล่านั้น
+    conn.execute(text("""
+        SELECT pg_advisory_xact_lock(:ns, hashtext(c))
+        FROM (
+            SELECT DISTINCT cf_itemid AS c FROM ss_invoices.invoice_items
+            WHERE invoice_idx = ANY(:ids) AND cf_itemid <> ''
+        ) AS codes
+        ORDER BY c
+    """), {"ns": _LOCK_NS, "ids": ids})
+
+def add_invoices(db, invoice_idxs: Iterable[int]):
+    """ใช้ราคาจากบิลเหล่านี้แทนแถวเดิมที่เก่ากว่า (เรียกหลัง flush บิลและรายการแล้ว)"""
+    ids = [int(i) for i in invoice_idxs if i is not None]
+    if not ids:
+        return
+    _lock_codes(db, ids)
+    db.execute(text(_UPSERT_SQL.format(source=_SOURCE_SQL.format(where="AND inv.idx = ANY(:ids)"))), {"ids": ids})
+
+def remove_invoices(db, invoice_idxs: Iterable[int]):
+    """แถวที่ราคามาจากบิลเหล่านี้ คำนวณใหม่จากบิลอื่น (เรียกก่อนแก้ไข/ลบ)"""
+    ids = [int(i) for i in invoice_idxs if i is not None]
+    if not ids:
+        return
+    _lock_codes(db, ids)
+    gone = db.execute(text("""
+        DELETE FROM ss_invoices.product_last_price
+        WHERE invoice_idx = ANY(:ids)
+        RETURNING cf_itemid, personid
+    """), {"ids": ids}).all()
+    if not gone:
+        return
+    where = """
+        AND NOT (inv.idx = ANY(:ids))
+        AND it.cf_itemid = ANY(:codes)
+        AND (it.cf_itemid, k.personid) IN (SELECT * FROM unnest(CAST(:codes AS varchar[]), CAST(:pids AS varchar[])))
+    """
+    db.execute(text(_UPSERT_SQL.format(source=_SOURCE_SQL.format(where=where))), {
+        "ids": ids,
+        "codes": [code for code, _ in gone],
+        "pids": [pid for _, pid in gone],
+    })
+
+def rebuild(conn) -> int:
+    """สร้างตารางใหม่จากบิลทั้งหมด คืนจำนวนแถว"""
+    conn.execute(text(CREATE_SQL))
+    for sql in CREATE_INDEX_SQLS:
+        conn.execute(text(sql))
+    conn.execute(text("TRUNCATE ss_invoices.product_last_price"))
+    conn.execute(text(_UPSERT_SQL.format(source=_SOURCE_SQL.format(where=""))))
+    conn.execute(text("ANALYZE ss_invoices.product_last_price"))
+    return conn.execute(text("SELECT count(*) FROM ss_invoices.product_last_price")).scalar()
@@ -1,22 +1,16 @@
 # app/products.py
 from typing import Optional
-from fastapi import APIRouter, Depends, Query, Form, HTTPException
+from fastapi import APIRouter, Depends, Query, Form, HTTPException, Request
 from fastapi.responses import JSONResponse, RedirectResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import or_, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import or_, func, select
 
-from .database import SessionLocal
-from . import models
+from .deps import get_db, get_async_read_db
+from . import master_cache, models, thai_text
 
 router = APIRouter()
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 # ---------- Utils ----------
 def product_to_dict(p: models.ProductList) -> dict:
     return {
@@ -28,9 +22,7 @@ def product_to_dict(p: models.ProductList) -> dict:
         "cf_items_ordinary": p.cf_items_ordinary,
     }
 
-# ---------- NEW: โหลดสินค้าทั้งหมด (ให้ product_form.js ใช้) ----------
-@router.get("/api/products/all")
-def api_products_all(db: Session = Depends(get_db)):
+def _load_products(db: Session) -> list:
     rows = (
         db.query(models.ProductList)
         .order_by(
@@ -42,6 +34,14 @@ def api_products_all(db: Session = Depends(get_db)):
     )
     return [product_to_dict(r) for r in rows]
 
+master_cache.register("products", _load_products)
+
+# ---------- NEW: โหลดสินค้าทั้งหมด (ให้ product_form.js ใช้) ----------
+@router.get("/api/products/all")
+def api_products_all(request: Request):
+    e = master_cache.get("products")
+    return master_cache.respond(request, e, lambda: e.rows)
+
 # ---------- NEW: ตรวจข้อมูลซ้ำ (รหัส/ชื่อสินค้า) ----------
 @router.post("/api/products/check-duplicate")
 def api_products_check_duplicate(
@@ -83,6 +83,7 @@ def api_products_create(
         cf_items_ordinary=cf_items_ordinary,
     )
     db.add(row); db.commit(); db.refresh(row)
+    master_cache.invalidate("products")
     if redirect_to_dashboard:
         return RedirectResponse(url="/dashboard?msg=product_saved", status_code=303)
     return {"ok": True, "idx": row.idx, "product": product_to_dict(row)}
@@ -124,6 +125,7 @@ def api_products_update(
             setattr(row, k, v)
 
     db.commit(); db.refresh(row)
+    master_cache.invalidate("products")
     if redirect_to_dashboard:
         return RedirectResponse(url="/dashboard?msg=product_saved", status_code=303)
     return {"ok": True, "product": product_to_dict(row)}
@@ -135,30 +137,34 @@ def api_products_delete(idx: int, db: Session = Depends(get_db)):
     if not row:
         raise HTTPException(status_code=404, detail="product not found")
     db.delete(row); db.commit()
+    master_cache.invalidate("products")
     return JSONResponse(status_code=204, content=None)
 
 # ---------- เดิม: suggest สินค้าจากประวัติใบกำกับ ----------
 @router.get("/api/products/suggest")
-def suggest_products(
+async def suggest_products(
     q: str = Query("", description="ค้นหาจากรหัส/ชื่อสินค้า"),
     limit: int = Query(20, ge=1, le=100),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_read_db),
 ):
     it = models.InvoiceItem
+    pl = models.ProductList
     pat = f"%{q.strip()}%"
-    rows = (
-        db.query(
+    # ชื่อสินค้าที่ต่างกันแค่ช่องว่าง/เลขไทย/ลำดับวรรณยุกต์ หาเจอผ่าน search_key ของ product_list
+    key = thai_text.search_key(q, strip_prename=False)
+    by_key = select(pl.cf_itemid).filter(pl.search_key.contains(key, autoescape=True))
+    rows = (await db.execute(
+        select(
             it.cf_itemid.label("code"),
             it.cf_itemname.label("name"),
             func.avg(it.cf_itempricelevel_price).label("avg_price"),
             func.count().label("count_used")
         )
-        .filter(or_(it.cf_itemid.ilike(pat), it.cf_itemname.ilike(pat)))
+        .filter(or_(it.cf_itemid.ilike(pat), it.cf_itemname.ilike(pat), it.cf_itemid.in_(by_key)))
         .group_by(it.cf_itemid, it.cf_itemname)
         .order_by(func.count().desc())
         .limit(limit)
-        .all()
-    )
+    )).all()
     return [
         {
             "product_code": r.code,
@@ -0,0 +1,110 @@
+# app/report_export.py
+"""
+ส่งออกรายงานเป็น CSV / XLSX แบบ stream ทีละแถว
+
+- rows_factory เป็นฟังก์ชันที่คืน iterator ของแถว (list) ถูกเรียกตอนเริ่มส่ง response
+  ภายใน generator เอง จึงเปิด session / server-side cursor ของตัวเองได้
+  (dependency ใน app/deps.py ปิด session ก่อน StreamingResponse เริ่มส่ง — ใช้ ReadSessionLocal)
+- CSV ใส่ UTF-8 BOM ให้ Excel อ่านภาษาไทยถูก แล้ว flush ทุก CSV_CHUNK_ROWS แถว
+- XLSX ใช้ openpyxl แบบ write_only (แถวถูกเขียนลง temp file ไม่ค้างใน memory)
+  แล้ว stream ไฟล์ zip ที่ได้ออกไปเป็นก้อน ๆ
+"""
+import csv
+import io
+import tempfile
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence
+from urllib.parse import quote
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+CSV_CHUNK_ROWS = 500
+FILE_CHUNK_BYTES = 64 * 1024
+YIELD_PER = 1000  # จำนวนแถวต่อรอบ fetch ของ server-side cursor
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+RowsFactory = Callable[[], Iterable[Sequence]]
+
+
+def _disposition(filename: str) -> str:
+    if filename.isascii():
+        return f'attachment; filename="{filename}"'
+    return f"attachment; filename*=utf-8''{quote(filename)}"
+
+def _iter_csv(header: Sequence[str], rows_factory: RowsFactory) -> Iterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    buf.write("\ufeff")  # BOM
+    writer.writerow(header)
+    n = 0
+    for row in rows_factory():
+        writer.writerow(row)
+        n += 1
+        if n % CSV_CHUNK_ROWS == 0:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode("utf-8")
+
+def _iter_xlsx(header: Sequence[str], rows_factory: RowsFactory, sheet_title: str,
+               col_widths: Optional[List[int]], number_formats: Optional[dict]) -> Iterator[bytes]:
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.utils import get_column_letter
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title=sheet_title[:31])
+    for i, w in enumerate(col_widths or [], start=1):
+        ws.column_dimensions[get_column_letter(i)].width = w
+    ws.append(list(header))
+
+    fmts = number_formats or {}
+    for row in rows_factory():
+        if fmts:
+            out = []
+            for c, v in enumerate(row):
+                if c in fmts and isinstance(v, (int, float)):
+                    cell = WriteOnlyCell(ws, value=v)
+                    cell.number_format = fmts[c]
+                    out.append(cell)
+                else:
+                    out.append(v)
+            ws.append(out)
+        else:
+            ws.append(list(row))
+
+    with tempfile.TemporaryFile() as fp:
+        wb.save(fp)
+        fp.seek(0)
+        while True:
+            chunk = fp.read(FILE_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
+
+def export_response(fmt: str, filename_base: str, header: Sequence[str], rows_factory: RowsFactory,
+                    sheet_title: str = "Sheet1", col_widths: Optional[List[int]] = None,
+                    number_formats: Optional[dict] = None) -> StreamingResponse:
+    """
+    fmt: csv | xlsx
+    number_formats: {index คอลัมน์ (เริ่ม 0): รูปแบบ Excel เช่น '#,##0.00'} (ใช้กับ xlsx)
+    """
+    if fmt == "csv":
+        body = _iter_csv(header, rows_factory)
+        media_type = "text/csv; charset=utf-8"
+    elif fmt == "xlsx":
+        try:
+            import openpyxl  # noqa: F401
+        except ImportError:
+            raise HTTPException(status_code=501, detail="XLSX export requires openpyxl")
+        body = _iter_xlsx(header, rows_factory, sheet_title, col_widths, number_formats)
+        media_type = XLSX_MEDIA_TYPE
+    else:
+        raise HTTPException(status_code=400, detail="format must be csv or xlsx")
+
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": _disposition(f"{filename_base}.{fmt}")},
+    )
@@ -0,0 +1,133 @@
+# app/revenue_rollup.py
+"""
+ตารางสรุปยอดขายรายวัน ss_invoices.revenue_daily
+(วัน x ลูกค้า x ชื่อบนบิล x พนักงานขับรถ x ทะเบียนรถ x สินค้า)
+
+- แถวของสินค้า (cf_itemid) เก็บ item_count / quantity / quantity_ton / amount
+- แถว cf_itemid = '' ของแต่ละกลุ่มนับ invoice_count (ใบละ 1 แถว) ทำให้
+  SUM(invoice_count) = จำนวนบิลไม่ซ้ำ โดยไม่ต้อง count(distinct) จากตารางดิบ
+- คอลัมน์ใน key เป็น NOT NULL (ค่าว่างเก็บเป็น '') เพื่อใช้ ON CONFLICT ได้
+- บิลที่ไม่มี invoice_date ไม่ถูกนับ
+
+อัปเดตแบบ incremental ใน transaction เดียวกับการเขียนบิล:
+    revenue_rollup.remove_invoices(db, [idx])   # ก่อนแก้ไข/ลบ (ยังเห็นข้อมูลเดิมใน DB)
+    ... แก้ไขบิล / รายการ ...
+    db.flush()
+    revenue_rollup.add_invoices(db, [idx])      # หลังบันทึก
+ยอดเป็นการบวก/ลบ (signed upsert) จึงต้อง lock แถวบิลด้วย SELECT ... FOR UPDATE ก่อน remove_invoices
+ไม่งั้นสอง transaction ที่แก้บิลเดียวกันพร้อมกันจะถอนยอดเดิมซ้ำสองครั้ง
+สร้างใหม่ทั้งตาราง: python -m app.migrations revenue_rollup
+"""
+from typing import Iterable
+
+from sqlalchemy import func, text
+
+from . import models
+
+# ตัวเลือกแถวจากบิล + รายการ (ใช้ทั้ง incremental และ rebuild)
+_SOURCE_SQL = """
+    SELECT inv.invoice_date AS day,
+           coalesce(inv.personid, '') AS personid,
+           coalesce(inv.fname, '') AS fname,
+           coalesce(inv.driver_id, '') AS driver_id,
+           coalesce(inv.car_numberplate, '') AS car_numberplate,
+           '' AS cf_itemid,
+           1 AS invoice_count, 0 AS item_count,
+           0 AS quantity, 0 AS quantity_ton, 0 AS amount
+    FROM ss_invoices.invoices AS inv
+    WHERE inv.invoice_date IS NOT NULL {where}
+    UNION ALL
+    SELECT inv.invoice_date,
+           coalesce(inv.personid, ''),
+           coalesce(inv.fname, ''),
+           coalesce(inv.driver_id, ''),
+           coalesce(inv.car_numberplate, ''),
+           coalesce(it.cf_itemid, ''),
+           0, 1,
+           coalesce(it.quantity, 0),
+           CASE WHEN it.quantity >= 1000 THEN it.quantity / 1000.0 ELSE coalesce(it.quantity, 0) END,
+           coalesce(it.amount, coalesce(it.quantity, 0) * coalesce(it.cf_itempricelevel_price, 0))
+    FROM ss_invoices.invoices AS inv
+    JOIN ss_invoices.invoice_items AS it ON it.invoice_idx = inv.idx
+    WHERE inv.invoice_date IS NOT NULL {where}
+"""
+
+_KEY = "day, personid, fname, driver_id, car_numberplate, cf_itemid"
+
+_UPSERT_SQL = f"""
+    INSERT INTO ss_invoices.revenue_daily AS r
+        ({_KEY}, invoice_count, item_count, quantity, quantity_ton, amount)
+    SELECT {_KEY},
+           :sign * sum(invoice_count), :sign * sum(item_count),
+           :sign * sum(quantity), :sign * sum(quantity_ton), :sign * sum(amount)
+    FROM ({{source}}) AS s
+    GROUP BY {_KEY}
+    ON CONFLICT ({_KEY}) DO UPDATE SET
+        invoice_count = r.invoice_count + EXCLUDED.invoice_count,
+        item_count = r.item_count + EXCLUDED.item_count,
+        quantity = r.quantity + EXCLUDED.quantity,
+        quantity_ton = r.quantity_ton + EXCLUDED.quantity_ton,
+        amount = r.amount + EXCLUDED.amount
+"""
+
+CREATE_SQL = f"""
+    CREATE TABLE IF NOT EXISTS ss_invoices.revenue_daily (
+        day             date    NOT NULL,
+        personid        varchar NOT NULL DEFAULT '',
+        fname           varchar NOT NULL DEFAULT '',
+        driver_id       varchar NOT NULL DEFAULT '',
+        car_numberplate varchar NOT NULL DEFAULT '',
+        cf_itemid       varchar NOT NULL DEFAULT '',
+        invoice_count   integer NOT NULL DEFAULT 0,
+        item_count      integer NOT NULL DEFAULT 0,
+        quantity        numeric NOT NULL DEFAULT 0,
+        quantity_ton    numeric NOT NULL DEFAULT 0,
+        amount          numeric NOT NULL DEFAULT 0,
+        PRIMARY KEY ({_KEY})
+    )
+"""
+
+CREATE_INDEX_SQL = """
+    CREATE INDEX IF NOT EXISTS ix_ss_invoices_revenue_daily_driver_day
+    ON ss_invoices.revenue_daily (driver_id, day)
+"""
+
+
+def _apply(conn, invoice_idxs: Iterable[int], sign: int):
+    ids = [int(i) for i in invoice_idxs if i is not None]
+    if not ids:
+        return
+    source = _SOURCE_SQL.format(where="AND inv.idx = ANY(:ids)")
+    conn.execute(text(_UPSERT_SQL.format(source=source)), {"sign": sign, "ids": ids})
+    if sign < 0:
+        # กลุ่มที่ไม่เหลือบิลแล้ว ไม่ต้องเก็บแถวศูนย์ไว้
+        conn.execute(text("""
+            DELETE FROM ss_invoices.revenue_daily
+            WHERE invoice_count = 0 AND item_count = 0
+              AND day IN (SELECT invoice_date FROM ss_invoices.invoices WHERE idx = ANY(:ids))
+        """), {"ids": ids})
+
+def add_invoices(db, invoice_idxs: Iterable[int]):
+    """นับบิลเข้า rollup (เรียกหลัง flush บิลและรายการแล้ว)"""
+    _apply(db, invoice_idxs, 1)
+
+def remove_invoices(db, invoice_idxs: Iterable[int]):
+    """ถอนบิลออกจาก rollup (เรียกก่อนแก้ไข/ลบ ขณะที่ DB ยังเป็นข้อมูลเดิม)"""
+    _apply(db, invoice_idxs, -1)
+
+def rebuild(conn) -> int:
+    """สร้าง rollup ใหม่จากตารางบิลทั้งหมด คืนจำนวนแถว"""
+    conn.execute(text(CREATE_SQL))
+    conn.execute(text(CREATE_INDEX_SQL))
+    conn.execute(text("TRUNCATE ss_invoices.revenue_daily"))
+    conn.execute(text(_UPSERT_SQL.format(source=_SOURCE_SQL.format(where=""))), {"sign": 1})
+    conn.execute(text("ANALYZE ss_invoices.revenue_daily"))
+    return conn.execute(text("SELECT count(*) FROM ss_invoices.revenue_daily")).scalar()
+
+
+# ---------- ช่วยสำหรับ endpoint สรุปยอด (อ่านจาก RevenueDaily) ----------
+_PERIOD_FORMATS = {"day": "YYYY-MM-DD", "month": "YYYY-MM", "year": "YYYY"}
+
+def period_label(granularity: str):
+    """label ของช่วง (เดือน/ปี รวมจากแถวรายวัน)"""
+    return func.to_char(models.RevenueDaily.day, _PERIOD_FORMATS[granularity])
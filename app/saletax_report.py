@@ -1,40 +1,22 @@
 # /app/saletax_report.py
 from fastapi import APIRouter, Depends, Query, HTTPException
 from sqlalchemy.orm import Session
-from sqlalchemy import func, or_, cast, String, case
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, case, literal, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by
 from typing import Optional, List
-from datetime import date, datetime
 
-from . import models
-from .database import SessionLocal
+from . import models, periods, revenue_rollup
+from .database import ReadSessionLocal
+from .deps import get_read_db, get_async_read_db
+from .report_export import YIELD_PER, export_response
 
 router = APIRouter()
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-def _to_date(s: Optional[str]) -> Optional[date]:
-    if not s: return None
-    try:
-        return date.fromisoformat(s)
-    except Exception:
-        return None
-
 VAT_RATE = 0.07
 
-# -------- รายการใบกำกับ (ละเอียด) ภายในช่วง --------
-@router.get("/api/saletax/list")
-def saletax_list(
-    start: Optional[str] = Query(None),
-    end: Optional[str] = Query(None),
-    month: Optional[str] = Query(None),   # YYYY-MM
-    year: Optional[int] = Query(None),
-    db: Session = Depends(get_db)
-):
+def _saletax_list_query(start, end, month, year, *extra_cols):
+    """หัวบิล + ยอดต่อใบ (ใช้ร่วมกันระหว่าง /api/saletax/list และ /api/saletax/export)"""
     inv = models.Invoice
     itm = models.InvoiceItem
     cust = models.CustomerList
@@ -54,7 +36,7 @@ def saletax_list(
         )
     )
 
-    q = db.query(
+    q = select(
         inv.idx,
         inv.invoice_number,
         inv.invoice_date,
@@ -70,12 +52,10 @@ def saletax_list(
             func.coalesce(drv.first_name, ''), ' ',
             func.coalesce(drv.last_name, '')
         ).label("driver_name"),
+        *extra_cols,
     ).outerjoin(
         itm,
-        or_(
-            itm.invoice_number == inv.invoice_number,
-            itm.invoice_number == cast(inv.idx, String)
-        )
+        itm.invoice_idx == inv.idx
     ).outerjoin(
         cust,
         cust.personid == inv.personid
@@ -84,18 +64,9 @@ def saletax_list(
         inv.driver_id == drv.driver_id
     )
 
-    if month and len(month) == 7:
-        q = q.filter(func.to_char(inv.invoice_date, 'YYYY-MM') == month)
-    elif year:
-        q = q.filter(func.extract('year', inv.invoice_date) == year)
-    else:
-        d1, d2 = _to_date(start), _to_date(end)
-        if d1:
-            q = q.filter(inv.invoice_date >= d1)
-        if d2:
-            q = q.filter(inv.invoice_date <= d2)
-
-    q = q.group_by(
+    q = periods.apply(q, inv.invoice_date, start=start, end=end, month=month, year=year)
+
+    return q.group_by(
         inv.idx, inv.invoice_number, inv.invoice_date,
         inv.fname, inv.personid,
         func.coalesce(inv.cf_taxid, cust.cf_taxid),
@@ -103,41 +74,44 @@ def saletax_list(
         drv.prefix, drv.first_name, drv.last_name
     ).order_by(inv.invoice_date.asc(), inv.invoice_number.asc())
 
-    results = q.all()
+def _branch_text(hq, branch) -> str:
+    if hq == 1 or hq == "1":
+        return "\u0e2a\u0e33\u0e19\u0e31\u0e01\u0e07\u0e32\u0e19\u0e43\u0e2b\u0e0d\u0e48"
+    return f"\u0e2a\u0e32\u0e02\u0e32\u0e17\u0e35\u0e48 {branch}" if branch else "-"
+
+def _driver_text(driver_name) -> str:
+    drv_name = (driver_name or "").strip()
+    if not drv_name or drv_name.replace(" ", "") == "":
+        return "-"
+    return drv_name
+
+# -------- รายการใบกำกับ (ละเอียด) ภายในช่วง --------
+@router.get("/api/saletax/list")
+async def saletax_list(
+    start: Optional[str] = Query(None),
+    end: Optional[str] = Query(None),
+    month: Optional[str] = Query(None),   # YYYY-MM
+    year: Optional[int] = Query(None),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    itm = models.InvoiceItem
+    q = _saletax_list_query(start, end, month, year)
+
+    results = (await db.execute(q)).all()
 
     # Batch-load items
     inv_ids = [r[0] for r in results]
-    inv_number_map = {r[0]: r[1] for r in results}
 
     items_by_inv = {idx: [] for idx in inv_ids}
     if inv_ids:
-        all_inv_numbers = set()
-        all_idx_strings = set()
-        for _idx in inv_ids:
-            inv_no = inv_number_map.get(_idx)
-            if inv_no:
-                all_inv_numbers.add(inv_no)
-            all_idx_strings.add(str(_idx))
-
-        lookup_values = all_inv_numbers | all_idx_strings
-        item_rows = (
-            db.query(itm)
-            .filter(itm.invoice_number.in_(lookup_values))
+        item_rows = (await db.execute(
+            select(itm)
+            .filter(itm.invoice_idx.in_(inv_ids))
             .order_by(itm.idx.asc())
-            .all()
-        )
-
-        inv_no_to_idx = {}
-        for _idx in inv_ids:
-            inv_no = inv_number_map.get(_idx)
-            if inv_no and inv_no not in inv_no_to_idx:
-                inv_no_to_idx[inv_no] = _idx
-            idx_str = str(_idx)
-            if idx_str not in inv_no_to_idx:
-                inv_no_to_idx[idx_str] = _idx
+        )).scalars().all()
 
         for r in item_rows:
-            parent_idx = inv_no_to_idx.get(r.invoice_number)
+            parent_idx = r.invoice_idx
             if parent_idx is not None and parent_idx in items_by_inv:
                 items_by_inv[parent_idx].append({
                     "cf_itemid": r.cf_itemid,
@@ -151,15 +125,8 @@ def saletax_list(
         vat = before * VAT_RATE
         grand = before + vat
 
-        branch_text = (
-            "\u0e2a\u0e33\u0e19\u0e31\u0e01\u0e07\u0e32\u0e19\u0e43\u0e2b\u0e0d\u0e48"
-            if (hq == 1 or hq == "1")
-            else (f"\u0e2a\u0e32\u0e02\u0e32\u0e17\u0e35\u0e48 {branch}" if branch else "-")
-        )
-
-        drv_name = (driver_name or "").strip()
-        if not drv_name or drv_name.replace(" ", "") == "":
-            drv_name = "-"
+        branch_text = _branch_text(hq, branch)
+        drv_name = _driver_text(driver_name)
 
         rows.append({
             "idx": idx,
@@ -181,6 +148,67 @@ def saletax_list(
 
     return rows
 
+# -------- ส่งออก CSV / XLSX (หนึ่งแถวต่อใบ) แบบ stream --------
+EXPORT_HEADER = [
+    "ลำดับ", "วันเดือนปี", "เลขที่ใบกำกับ",
+    "รหัสลูกค้า", "ชื่อผู้ขายสินค้า/บริการ",
+    "เลขประจำตัวผู้เสียภาษี", "สถานประกอบการ",
+    "พนักงานขับรถ", "รหัสสินค้า", "รายการสินค้า",
+    "จำนวนตัน",
+    "มูลค่าสินค้า/บริการ", "VAT", "รวม",
+]
+EXPORT_COL_WIDTHS = [8, 14, 10, 16, 14, 36, 20, 20, 12, 40, 14, 16, 12, 16]
+
+def _thai_date(d) -> str:
+    return f"{d.day:02d}/{d.month:02d}/{d.year + 543}" if d else "-"
+
+def _iter_saletax_export_rows(start, end, month, year):
+    itm = models.InvoiceItem
+    item_ids = func.string_agg(itm.cf_itemid, aggregate_order_by(literal(", "), itm.idx)).label("item_ids")
+    item_names = func.string_agg(itm.cf_itemname, aggregate_order_by(literal(", "), itm.idx)).label("item_names")
+
+    db = ReadSessionLocal()
+    try:
+        q = _saletax_list_query(start, end, month, year, item_ids, item_names)
+        for n, (idx, inv_no, inv_date, company, personid, tax_id, hq, branch,
+                sum_qty, before, driver_name, ids, names) in enumerate(db.execute(q.execution_options(yield_per=YIELD_PER)), start=1):
+            before = round(float(before or 0.0), 2)
+            vat = round(before * VAT_RATE, 2)
+            yield [
+                n,
+                _thai_date(inv_date),
+                inv_no or "-",
+                personid or "-",
+                company or "-",
+                tax_id or "-",
+                _branch_text(hq, branch),
+                _driver_text(driver_name),
+                ids or "-",
+                names or "-",
+                round(float(sum_qty or 0.0), 3),
+                before, vat, round(before + vat, 2),
+            ]
+    finally:
+        db.close()
+
+@router.get("/api/saletax/export")
+def saletax_export(
+    start: Optional[str] = Query(None),
+    end: Optional[str] = Query(None),
+    month: Optional[str] = Query(None),   # YYYY-MM
+    year: Optional[int] = Query(None),
+    format: str = Query("xlsx", pattern="^(csv|xlsx)$"),
+):
+    return export_response(
+        format,
+        "saletax_report",
+        EXPORT_HEADER,
+        lambda: _iter_saletax_export_rows(start, end, month, year),
+        sheet_title="SaleTax",
+        col_widths=EXPORT_COL_WIDTHS,
+        number_formats={11: "#,##0.00", 12: "#,##0.00", 13: "#,##0.00"},
+    )
+
 # -------- สรุปยอดต่อช่วง (ไม่แยก/แยกบริษัท) --------
 @router.get("/api/saletax/summary")
 def saletax_summary(
@@ -188,47 +216,20 @@ def saletax_summary(
     start: Optional[str] = Query(None), end: Optional[str] = Query(None),
     month: Optional[str] = Query(None), year: Optional[int] = Query(None),
     split_by_company: bool = Query(False),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    inv = models.Invoice
-    itm = models.InvoiceItem
-
-    if granularity == "day":
-        label_expr = func.to_char(inv.invoice_date, 'YYYY-MM-DD')
-    elif granularity == "month":
-        label_expr = func.to_char(inv.invoice_date, 'YYYY-MM')
-    else:
-        label_expr = func.to_char(inv.invoice_date, 'YYYY')
-
-    join_cond = or_(
-        itm.invoice_number == inv.invoice_number,
-        itm.invoice_number == cast(inv.idx, String)
-    )
-    sum_amount = func.sum(
-        func.coalesce(itm.amount, func.coalesce(itm.quantity,0) * func.coalesce(itm.cf_itempricelevel_price,0))
-    )
-
-    cols = [label_expr.label("period")]
+    # อ่านจาก rollup รายวัน (เดือน/ปี รวมจากแถวรายวัน)
+    rd = models.RevenueDaily
+    cols = [revenue_rollup.period_label(granularity).label("period")]
     if split_by_company:
-        cols.append(inv.fname.label("company"))
+        cols.append(rd.fname.label("company"))
     cols += [
-        func.count(func.distinct(inv.idx)).label("count"),
-        func.coalesce(sum_amount, 0).label("before_vat")
+        func.coalesce(func.sum(rd.invoice_count), 0).label("count"),
+        func.coalesce(func.sum(rd.amount), 0).label("before_vat")
     ]
 
-    q = db.query(*cols).outerjoin(itm, join_cond)
-
-    # filter
-    if granularity == "day":
-        d1, d2 = _to_date(start), _to_date(end)
-        if d1: q = q.filter(inv.invoice_date >= d1)
-        if d2: q = q.filter(inv.invoice_date <= d2)
-    elif granularity == "month":
-        if month and len(month) == 7:
-            q = q.filter(func.to_char(inv.invoice_date, 'YYYY-MM') == month)
-    else:
-        if year:
-            q = q.filter(func.extract('year', inv.invoice_date) == year)
+    q = db.query(*cols)
+    q = periods.apply(q, rd.day, granularity, start, end, month, year)
 
     groups = ["period"] + (["company"] if split_by_company else [])
     q = q.group_by(*groups).order_by(*groups)
@@ -237,6 +238,7 @@ def saletax_summary(
     for row in q.all():
         if split_by_company:
             period, company, count, before = row
+            company = company or None  # rollup เก็บค่าว่างเป็น ''
         else:
             period, count, before = row
             company = None
@@ -33,9 +33,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
     async function loadAllCustomers() {
         try {
-            const res = await fetch('/api/customers/all');
-            if (!res.ok) throw new Error('Cannot load customers');
-            customersCache = await res.json();
+            customersCache = await CustomerLookup.load(['personid', 'fname']);
             customerList.innerHTML = customersCache.slice(0, 5000).map(c => {
                 const code = (c.personid ?? '').trim();
                 const name = (c.fname ?? c.customer_name ?? '').trim();
@@ -18,6 +18,8 @@ document.addEventListener('DOMContentLoaded', () => {
     const panelSearch = document.getElementById('panel-search');
     const searchBtn = document.getElementById('searchBtn');
     const searchResultsBody = document.getElementById('searchResultsBody');
+    const searchMoreBtn = document.getElementById('searchMoreBtn');
+    let searchNextCursor = null;
 
     const todayISO = new Date().toISOString().slice(0, 10);
     if (cnDateEl && !cnDateEl.value) cnDateEl.value = todayISO;
@@ -75,6 +77,8 @@ document.addEventListener('DOMContentLoaded', () => {
         });
         const data = await res.json().catch(() => ({}));
         if (!res.ok) { alert(data.detail || 'บันทึกไม่สำเร็จ'); return; }
+        // เลขจริงถูกจองตอนบันทึก (อาจเลื่อนไปถ้ามีคนใช้เลขที่แสดงไปก่อน)
+        if (data.creditnote_number) cnNoEl.value = data.creditnote_number;
         alert(`บันทึกสำเร็จ เลขที่เอกสาร: ${data.creditnote_number}`);
         btnSave.classList.add('hidden');
     });
@@ -139,20 +143,27 @@ document.addEventListener('DOMContentLoaded', () => {
     });
 
     // ===== SEARCH =====
-    searchBtn?.addEventListener('click', searchCreditNotes);
+    searchBtn?.addEventListener('click', () => searchCreditNotes());
+    searchMoreBtn?.addEventListener('click', () => searchCreditNotes(searchNextCursor));
 
-    async function searchCreditNotes() {
+    // cursor = ค่าจาก header X-Next-Cursor ของหน้าก่อน (ต่อท้ายตาราง), ไม่ส่ง = ค้นหาใหม่
+    async function searchCreditNotes(cursor = null) {
         const start = document.getElementById('searchStartDate').value;
         const end = document.getElementById('searchEndDate').value;
         const q = document.getElementById('searchQuery').value;
         const params = new URLSearchParams({ start, end, q });
+        if (cursor) params.set('cursor', cursor);
 
         try {
             const res = await fetch(`/api/search-credit-notes?${params.toString()}`);
+            if (!res.ok) throw new Error(await res.text());
             const results = await res.json();
 
-            searchResultsBody.innerHTML = '';
-            if (results.length === 0) {
+            searchNextCursor = res.headers.get('X-Next-Cursor');
+            searchMoreBtn?.classList.toggle('hidden', !searchNextCursor);
+
+            if (!cursor) searchResultsBody.innerHTML = '';
+            if (results.length === 0 && !cursor) {
                 searchResultsBody.innerHTML = '<tr><td colspan="5" class="p-4 text-center text-gray-500">ไม่พบข้อมูล</td></tr>';
                 return;
             }
@@ -461,6 +472,52 @@ function buildPayload() {
 const VAT_RATE = 0.07;
 function to2(n) { return (isNaN(n) ? 0 : n).toFixed(2); }
 
+// ราคาต่อ (ลูกค้า, GRN, รหัส): คำขอที่เกิดในรอบเดียวกันรวมเป็น POST /api/product-prices ครั้งเดียว
+// และจำผลไว้ (change + blur หรือหลายแถวรหัสเดียวกันไม่ยิงซ้ำ)
+const _priceCache = new Map();   // key -> Promise<number>
+let _pricePending = [];          // [{ key, code, grn, personid, resolve, reject }]
+
+function fetchPrice(code, grn) {
+    const personid = (document.getElementById('personid')?.value || '').trim();
+    const key = `${personid}\u0000${grn}\u0000${code}`;
+    if (!_priceCache.has(key)) {
+        const p = new Promise((resolve, reject) => {
+            _pricePending.push({ key, code, grn, personid, resolve, reject });
+            if (_pricePending.length === 1) setTimeout(_flushPrices, 0);
+        });
+        _priceCache.set(key, p);
+    }
+    return _priceCache.get(key);
+}
+
+async function _flushPrices() {
+    const batch = _pricePending;
+    _pricePending = [];
+    // แยกตาม personid (ปกติมีค่าเดียว)
+    const groups = new Map();
+    for (const r of batch) {
+        if (!groups.has(r.personid)) groups.set(r.personid, []);
+        groups.get(r.personid).push(r);
+    }
+    for (const [personid, reqs] of groups) {
+        try {
+            const res = await fetch('/api/product-prices', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({
+                    personid: personid || null,
+                    items: reqs.map(r => ({ code: r.code, grn: r.grn || null })),
+                }),
+            });
+            if (!res.ok) throw new Error(`HTTP ${res.status}`);
+            const data = await res.json();
+            reqs.forEach((r, i) => r.resolve(parseFloat(data?.prices?.[i]?.price || 0)));
+        } catch (e) {
+            reqs.forEach(r => { _priceCache.delete(r.key); r.reject(e); });
+        }
+    }
+}
+
 async function setBasePriceFromCode(row) {
     const codeInput = row.querySelector('.product_code');
     if (!codeInput) return;
@@ -468,13 +525,9 @@ async function setBasePriceFromCode(row) {
     if (!code) return;
 
     const grn = (row.querySelector('.grn_number')?.value || '').trim();
-    const url = `/api/products/price?code=${encodeURIComponent(code)}${grn ? `&grn=${encodeURIComponent(grn)}` : ''}`;
 
     try {
-        const res = await fetch(url, { method: 'GET' });
-        if (!res.ok) throw new Error(`HTTP ${res.status}`);
-        const data = await res.json();
-        const price = parseFloat(data?.price || 0);
+        const price = await fetchPrice(code, grn);
 
         row.querySelector('.base_price').value = isNaN(price) ? 0 : price;
         const unitEl = row.querySelector('.unit_price');
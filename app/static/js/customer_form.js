@@ -3,6 +3,12 @@
 // ===== Config / Endpoints =====
 const ENDPOINT_PROV_SUGGEST = '/api/suggest/province';
 
+// ฟิลด์ที่ตาราง/ฟอร์มแก้ไขใช้ (โหลดผ่าน customer_lookup.js)
+const CUSTOMER_FIELDS = [
+  'personid', 'prename', 'fname', 'lname', 'cf_taxid', 'cf_personaddress', 'cf_personzipcode',
+  'cf_provincename', 'tel', 'mobile', 'cf_hq', 'cf_branch', 'fmlpaymentcreditday',
+];
+
 // ===== State & Helpers =====
 let all = [];
 let filtered = [];
@@ -56,9 +62,7 @@ async function generateAndSetNewCustomerId() {
 // ===== โหลดทั้งหมด =====
 async function loadAll() {
   try {
-    const res = await fetch('/api/customers/all');
-    if (!res.ok) throw new Error('โหลดรายการลูกค้าไม่สำเร็จ');
-    all = await res.json();
+    all = await CustomerLookup.load(CUSTOMER_FIELDS);
     filtered = all.slice();
     currentPage = 1;
     renderPage();
@@ -254,10 +258,12 @@ async function saveCustomer(e) {
   });
   if (res.redirected) { window.location.href = res.url; return; }
   if (!res.ok) { alert('บันทึกล้มเหลว'); return; }
+  const data = await res.json().catch(() => ({}));
 
   await loadAll();
   if (!payload.idx) resetForm();
-  alert('บันทึกเรียบร้อย');
+  // รหัสลูกค้าจริงถูกจองตอนบันทึก (อาจเลื่อนไปถ้ามีคนใช้รหัสที่แสดงไปก่อน)
+  alert(data.personid && !payload.idx ? `บันทึกเรียบร้อย รหัสลูกค้า: ${data.personid}` : 'บันทึกเรียบร้อย');
 }
 function editRowByIdx(idx) {
   const c = all.find((it) => String(it.idx) === String(idx));
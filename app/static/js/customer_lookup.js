@@ -0,0 +1,77 @@
+// /static/js/customer_lookup.js
+// เก็บรายชื่อลูกค้าไว้ใน localStorage แล้ว sync เฉพาะแถวที่เปลี่ยน (GET /api/customers/lookup?since=)
+//
+//   const customers = await CustomerLookup.load(['personid', 'fname']);
+//   // -> [{idx, personid, fname, customer_name}, ...] เรียง idx ใหม่สุดก่อน (เหมือน /api/customers/all)
+//
+// ครั้งแรกโหลดทั้งชุดทีละหน้า; ครั้งต่อไปส่ง version ที่เก็บไว้ ได้เฉพาะแถวที่เพิ่ม/แก้/ลบ
+(function () {
+  const ENDPOINT = '/api/customers/lookup';
+  const PAGE_LIMIT = 2000;
+  const STORAGE_PREFIX = 'customer_lookup:v2:';  // v2: version เป็นเลข transaction (ไม่ใช่ sequence)
+
+  function storageKey(fields) { return STORAGE_PREFIX + fields.join(','); }
+
+  function readStore(key) {
+    try { return JSON.parse(localStorage.getItem(key) || 'null'); } catch { return null; }
+  }
+  function writeStore(key, data) {
+    try { localStorage.setItem(key, JSON.stringify(data)); } catch { /* เต็ม/ปิดใช้งาน: ใช้ใน memory อย่างเดียว */ }
+  }
+
+  async function fetchJson(params) {
+    const res = await fetch(`${ENDPOINT}?${params.toString()}`);
+    if (!res.ok) throw new Error(`customer lookup failed: ${res.status}`);
+    return res.json();
+  }
+
+  async function fullLoad(fields) {
+    const rows = {};
+    let cursor = null, version = 0, names = null;
+    do {
+      const params = new URLSearchParams({ fields: fields.join(','), limit: PAGE_LIMIT });
+      if (cursor) params.set('cursor', cursor);
+      const data = await fetchJson(params);
+      names = data.fields; version = data.version; cursor = data.next_cursor;
+      for (const r of data.rows) rows[r[0]] = r;
+    } while (cursor);
+    return { fields: names, version, rows };
+  }
+
+  async function sync(fields) {
+    const key = storageKey(fields);
+    let store = readStore(key);
+    if (store && store.rows) {
+      const params = new URLSearchParams({ fields: fields.join(','), since: store.version });
+      const data = await fetchJson(params);
+      if (data.reset) {
+        store = null;
+      } else {
+        for (const r of data.rows) store.rows[r[0]] = r;
+        for (const idx of data.deleted || []) delete store.rows[idx];
+        store.version = data.version;
+      }
+    }
+    if (!store || !store.rows) store = await fullLoad(fields);
+    writeStore(key, store);
+    return store;
+  }
+
+  function toObjects(store) {
+    const out = Object.values(store.rows).map((r) => {
+      const o = {};
+      store.fields.forEach((f, i) => { o[f] = r[i]; });
+      if ('fname' in o) o.customer_name = (o.fname || '').trim();
+      return o;
+    });
+    out.sort((a, b) => b.idx - a.idx);
+    return out;
+  }
+
+  async function load(fields) {
+    const wanted = ['idx', ...new Set((fields || []).filter((f) => f !== 'idx'))];
+    return toObjects(await sync(wanted));
+  }
+
+  window.CustomerLookup = { load };
+})();
@@ -116,7 +116,7 @@ async function loadRecentInvoices() {
     const startUTC = new Date(endUTC);
     startUTC.setUTCDate(endUTC.getUTCDate() - 6);
 
-    const url = `/api/invoices?start=${toISO(startUTC)}&end=${toISO(endUTC)}`;
+    const url = `/api/invoices?start=${toISO(startUTC)}&end=${toISO(endUTC)}&limit=10`;
 
     const res = await fetch(url);
     if (!res.ok) throw new Error("HTTP " + res.status);
@@ -64,6 +64,7 @@ function fillInvoiceItems(items) {
   (items || []).forEach(it => {
     const div = document.createElement("div");
     div.className = "item-row flex gap-2 items-center mb-2";
+    if (it.idx != null) div.dataset.idx = it.idx;  // ส่งกลับตอนบันทึก ให้ server แก้เฉพาะแถวที่เปลี่ยน
     div.innerHTML = `
       <input name="product_code" class="product_code w-32 bg-gray-50 border border-gray-300 text-sm rounded-lg p-2.5" value="${it.cf_itemid ?? ""}" readonly>
       <input name="description" class="description flex-1 min-w-[120px] bg-gray-100 border border-gray-300 text-sm rounded-lg p-2.5" value="${it.cf_itemname ?? ""}" readonly>
@@ -155,8 +156,12 @@ async function searchDrivers(q, page = 1, pageSize = 20) {
    Customer autocomplete
    =========================== */
 let customers = [];
-fetch('/api/customers/all')
-  .then(res => res.json())
+// ฟิลด์ที่ fillCustomerFromPersonid ใช้ (sync เฉพาะส่วนที่เปลี่ยนผ่าน customer_lookup.js)
+const CUSTOMER_FORM_FIELDS = [
+  'personid', 'fname', 'cf_taxid', 'cf_personaddress', 'cf_provincename', 'cf_personzipcode',
+  'tel', 'mobile', 'cf_branch', 'fmlpaymentcreditday',
+];
+CustomerLookup.load(CUSTOMER_FORM_FIELDS)
   .then(data => {
     customers = data || [];
 
@@ -588,7 +593,8 @@ function buildUpdatePayload() {
     const description = row.querySelector('.description')?.value || '';
     const quantity = parseFloat(row.querySelector('.quantity')?.value || 0);
     const unit_price = parseFloat(row.querySelector('.unit_price')?.value || 0);
-    if (product_code || description) payload.items.push({ cf_itemid: product_code, cf_itemname: description, quantity, unit_price });
+    const idx = row.dataset.idx ? parseInt(row.dataset.idx) : null;
+    if (product_code || description) payload.items.push({ idx, cf_itemid: product_code, cf_itemname: description, quantity, unit_price });
   });
   return payload;
 }
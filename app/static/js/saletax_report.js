@@ -1,4 +1,5 @@
 const API_LIST = "/api/saletax/list";
+const API_EXPORT = "/api/saletax/export";
 
 document.addEventListener("DOMContentLoaded", () => {
     const $ = s => document.querySelector(s);
@@ -74,8 +75,8 @@ document.addEventListener("DOMContentLoaded", () => {
     $("#btnPrint").addEventListener("click", () => window.print());
     $("#btnExcel").addEventListener("click", () => exportExcel());
 
-    async function buildReport() {
-        let params = new URLSearchParams();
+    function buildParams() {
+        const params = new URLSearchParams();
         if (granularity === "day") {
             if ($("#dayFrom").value) params.set("start", $("#dayFrom").value); // YYYY-MM-DD
             if ($("#dayTo").value) params.set("end", $("#dayTo").value);
@@ -85,7 +86,11 @@ document.addEventListener("DOMContentLoaded", () => {
             const y = ($("#yearPick").value || "").trim(); // YYYY
             if (y) params.set("year", y);
         }
+        return params;
+    }
 
+    async function buildReport() {
+        const params = buildParams();
         try {
             const res = await fetch(`${API_LIST}?${params}`);
             if (!res.ok) throw new Error(await res.text());
@@ -188,80 +193,12 @@ document.addEventListener("DOMContentLoaded", () => {
         document.getElementById("pageNext")?.addEventListener("click", () => { if (currentPage < maxPage) { currentPage++; render(rows); } });
     }
 
+    // ส่งออกผ่าน server (stream ทีละแถว) ด้วยเงื่อนไขเดียวกับรายงานที่แสดงอยู่
     function exportExcel() {
         if (!rows || !rows.length) { alert("ไม่มีข้อมูลส่งออก"); return; }
-        // ตรวจสอบว่า XLSX พร้อมใช้งาน และมี .utils.aoa_to_sheet จริงๆ
-        if (typeof XLSX === "undefined" || !XLSX || !XLSX.utils || !XLSX.utils.aoa_to_sheet) {
-            alert("ไม่พบไลบรารี XLSX (aoa_to_sheet) — กรุณาตรวจสอบว่าสคริปต์ xlsx.full.min.js โหลดสำเร็จ และไม่ได้ถูกบล็อค");
-            return;
-        }
-
-        const header = [
-            "ลำดับ", "วันเดือนปี", "เลขที่ใบกำกับ",
-            "รหัสลูกค้า", "ชื่อผู้ขายสินค้า/บริการ",
-            "เลขประจำตัวผู้เสียภาษี", "สถานประกอบการ",
-            "พนักงานขับรถ", "รหัสสินค้า", "รายการสินค้า",
-            "จำนวนตัน",
-            "มูลค่าสินค้า/บริการ", "VAT", "รวม"
-        ];
-
-
-        const data = [header];
-        rows.forEach((r, i) => {
-            const before = Number(r.before_vat || 0);
-            const vat = Number((r.vat ?? before * 0.07).toFixed(2));
-            const grand = Number((r.grand ?? before + vat).toFixed(2));
-            const branch = (r.cf_hq == 1) ? "สำนักงานใหญ่"
-                : (r.cf_branch ? `สาขาที่ ${r.cf_branch}` : "-");
-
-            const items = r.items || [];
-            const itemIds = items.map(it => it.cf_itemid || "").filter(Boolean).join(", ") || "-";
-            const itemNames = items.map(it => it.cf_itemname || "").filter(Boolean).join(", ") || "-";
-            const driverName = r.driver_name || "-";
-
-            data.push([
-                i + 1,
-                fmtThaiDate(r.invoice_date),
-                r.invoice_number || "-",
-                r.personid || "-",
-                r.company || "-",
-                r.cf_taxid || "-",
-                branch,
-                driverName,
-                itemIds,
-                itemNames,
-                Number(r.sum_qty || 0),
-                before, vat, grand
-            ]);
-        });
-
-        const ws = XLSX.utils.aoa_to_sheet(data);
-
-        // ความกว้างคอลัมน์
-        ws['!cols'] = [
-            { wch: 8 }, { wch: 14 }, { wch: 10 }, { wch: 16 }, { wch: 14 },
-            { wch: 36 }, { wch: 20 }, { wch: 20 }, { wch: 12 }, { wch: 40 },
-            { wch: 14 }, { wch: 16 }, { wch: 12 }, { wch: 16 }
-        ];
-
-        // จัดรูปแบบตัวเลขให้คอลัมน์เงิน
-        const range = XLSX.utils.decode_range(ws['!ref']);
-        for (let R = 1; R <= range.e.r; R++) {
-            [11, 12, 13].forEach(C => {
-                const addr = XLSX.utils.encode_cell({ r: R, c: C });
-                const cell = ws[addr];
-                if (cell && typeof cell.v === 'number') {
-                    cell.t = 'n';
-                    cell.z = '#,##0.00';
-                }
-            });
-        }
-
-        const wb = XLSX.utils.book_new();
-        XLSX.utils.book_append_sheet(wb, ws, "SaleTax");
-
-        // ตั้งชื่อไฟล์ .xlsx จริง
-        XLSX.writeFile(wb, "saletax_report.xlsx");
+        const params = buildParams();
+        params.set("format", "xlsx");
+        window.location.href = `${API_EXPORT}?${params}`;
     }
 
 
@@ -2,6 +2,7 @@
 const API_URL = "/api/invoices/summary";
 const API_LIST = "/api/invoices";
 const API_ITEMS = (id) => `/api/invoices/${id}/items`;
+const API_ITEMS_BULK = "/api/invoices/items";
 const API_DETAIL = (id) => `/api/invoices/${id}/detail`;
 const API_SAVE = (id) => `/api/invoices/${id}`;
 
@@ -26,9 +27,11 @@ let state = {
     yearPick: null,
     rows: [],
 
-    // all invoices
+    // all invoices (keyset pagination: allCursors[i] = cursor ของหน้า i+1)
     allRows: [],
     allPage: 1,
+    allCursors: [null],
+    allNextCursor: null,
     ALL_PAGE_SIZE: 20,
 };
 
@@ -66,11 +69,16 @@ document.addEventListener("DOMContentLoaded", () => {
     document.getElementById("tabAll").addEventListener("click", () => switchTab("all"));
 
     // All invoices actions
-    document.getElementById("btnAllApply").addEventListener("click", () => { state.allPage = 1; loadAllInvoices(); });
+    document.getElementById("btnAllApply").addEventListener("click", () => loadAllInvoices());
     document.getElementById("btnExportAllExcel").addEventListener("click", exportAllToExcel);
     document.getElementById("btnExportAllCsv").addEventListener("click", exportAllToCsv);
-    document.getElementById("allPrevPage").addEventListener("click", () => { if (state.allPage > 1) { state.allPage--; renderAllTable(); } });
-    document.getElementById("allNextPage").addEventListener("click", () => { state.allPage++; renderAllTable(true); });
+    document.getElementById("btnExportAllPdf").addEventListener("click", exportAllToPdf);
+    document.getElementById("allPrevPage").addEventListener("click", () => { if (state.allPage > 1) loadAllPage(state.allPage - 1); });
+    document.getElementById("allNextPage").addEventListener("click", () => {
+        if (!state.allNextCursor) return;
+        state.allCursors[state.allPage] = state.allNextCursor;
+        loadAllPage(state.allPage + 1);
+    });
 
     // Items modal
     document.getElementById("modalClose").addEventListener("click", () => toggleModal(false));
@@ -87,143 +95,57 @@ document.addEventListener("DOMContentLoaded", () => {
     loadAllInvoices(); // load all invoices
 });
 
-function exportAllToExcel() {
-    if (!state.allRows.length) {
-        alert("ไม่มีข้อมูลสำหรับส่งออก");
-        return;
-    }
+// ===== ส่งออกทั้งช่วงวันที่: ให้ server stream ไฟล์ (ไม่ต้องสร้างไฟล์ใหญ่ใน browser) =====
+function exportAllViaServer(format) {
+    const params = new URLSearchParams({ format });
+    const f = document.getElementById("allFrom")?.value;
+    const t = document.getElementById("allTo")?.value;
+    const q = document.getElementById("allQ")?.value?.trim();
+    if (f) params.set("start", f);
+    if (t) params.set("end", t);
+    if (q) params.set("q", q);
+    window.location.href = `/api/invoices/export?${params}`;
+}
 
-    const headers = [
-        "วันที่",
-        "เลขที่",
-        "ลูกค้า",
-        "PO",
-        "รหัสสินค้า",
-        "รายละเอียด",
-        "จำนวน",
-        "ราคา/หน่วย",
-        "พนักงานขับรถ",
-        "ยอดก่อนส่วนลด",
-        "VAT",
-        "สุทธิ"
-    ];
-
-    const dataForExport = [];
-    for (const r of state.allRows) {
-        const items = r.items || [];
-        if (items.length === 0) {
-            dataForExport.push({
-                "วันที่": r.invoice_date ?? "-",
-                "เลขที่": r.invoice_number ?? "-",
-                "ลูกค้า": r.fname ?? "-",
-                "PO": r.po_number ?? "-",
-                "รหัสสินค้า": "",
-                "รายละเอียด": "",
-                "จำนวน": "",
-                "ราคา/หน่วย": "",
-                "พนักงานขับรถ": r.driver_name ?? "-",
-                "ยอดก่อนส่วนลด": Number(r.amount) || 0,
-                "VAT": Number(r.vat) || 0,
-                "สุทธิ": Number(r.grand) || 0
-            });
-        } else {
-            for (let i = 0; i < items.length; i++) {
-                const it = items[i];
-                dataForExport.push({
-                    "วันที่": i === 0 ? (r.invoice_date ?? "-") : "",
-                    "เลขที่": i === 0 ? (r.invoice_number ?? "-") : "",
-                    "ลูกค้า": i === 0 ? (r.fname ?? "-") : "",
-                    "PO": i === 0 ? (r.po_number ?? "-") : "",
-                    "รหัสสินค้า": it.cf_itemid ?? "",
-                    "รายละเอียด": it.cf_itemname ?? "",
-                    "จำนวน": Number(it.quantity) || 0,
-                    "ราคา/หน่วย": Number(it.unit_price) || 0,
-                    "พนักงานขับรถ": i === 0 ? (r.driver_name ?? "-") : "",
-                    "ยอดก่อนส่วนลด": i === 0 ? (Number(r.amount) || 0) : "",
-                    "VAT": i === 0 ? (Number(r.vat) || 0) : "",
-                    "สุทธิ": i === 0 ? (Number(r.grand) || 0) : ""
-                });
-            }
-        }
-    }
+function exportAllToExcel() { exportAllViaServer("xlsx"); }
 
-    const ws = XLSX.utils.json_to_sheet(dataForExport, { header: headers });
-
-    ws['!cols'] = [
-        { wch: 12 },  // วันที่
-        { wch: 15 },  // เลขที่
-        { wch: 40 },  // ลูกค้า
-        { wch: 15 },  // PO
-        { wch: 12 },  // รหัสสินค้า
-        { wch: 40 },  // รายละเอียด
-        { wch: 10 },  // จำนวน
-        { wch: 12 },  // ราคา/หน่วย
-        { wch: 20 },  // พนักงานขับรถ
-        { wch: 18 },  // ยอดก่อนส่วนลด
-        { wch: 15 },  // VAT
-        { wch: 18 }   // สุทธิ
-    ];
-
-    const wb = XLSX.utils.book_new();
-    XLSX.utils.book_append_sheet(wb, ws, "รายการใบกำกับภาษี");
-
-    const f_start = document.getElementById("allFrom")?.value || 'start';
-    const f_end = document.getElementById("allTo")?.value || 'end';
-    XLSX.writeFile(wb, `Invoices_${f_start}_to_${f_end}.xlsx`);
-}
+function exportAllToCsv() { exportAllViaServer("csv"); }
 
-function exportAllToCsv() {
-    if (!state.allRows.length) {
-        alert("ไม่มีข้อมูลสำหรับส่งออก");
-        return;
-    }
+// ===== พิมพ์ PDF ทั้งช่วงวันที่ (งาน batch ฝั่ง server + poll ความคืบหน้า) =====
+async function exportAllToPdf() {
+    const btn = document.getElementById("btnExportAllPdf");
+    const f = document.getElementById("allFrom")?.value;
+    const t = document.getElementById("allTo")?.value;
+    if (!f && !t) { alert("กรุณาเลือกช่วงวันที่"); return; }
 
-    const headers = ["วันที่","เลขที่","ลูกค้า","PO","รหัสสินค้า","รายละเอียด","จำนวน","ราคา/หน่วย","พนักงานขับรถ","ยอดก่อนส่วนลด","VAT","สุทธิ"];
-    const csvEscape = (v) => {
-        const s = String(v ?? "");
-        return s.includes(",") || s.includes('"') || s.includes("\n") ? `"${s.replace(/"/g, '""')}"` : s;
-    };
-    const lines = [headers.map(csvEscape).join(",")];
-
-    for (const r of state.allRows) {
-        const items = r.items || [];
-        if (items.length === 0) {
-            lines.push([
-                r.invoice_date ?? "", r.invoice_number ?? "", r.fname ?? "", r.po_number ?? "",
-                "", "", "", "",
-                r.driver_name ?? "",
-                Number(r.amount) || 0, Number(r.vat) || 0, Number(r.grand) || 0
-            ].map(csvEscape).join(","));
-        } else {
-            for (let i = 0; i < items.length; i++) {
-                const it = items[i];
-                lines.push([
-                    i === 0 ? (r.invoice_date ?? "") : "",
-                    i === 0 ? (r.invoice_number ?? "") : "",
-                    i === 0 ? (r.fname ?? "") : "",
-                    i === 0 ? (r.po_number ?? "") : "",
-                    it.cf_itemid ?? "",
-                    it.cf_itemname ?? "",
-                    Number(it.quantity) || 0,
-                    Number(it.unit_price) || 0,
-                    i === 0 ? (r.driver_name ?? "") : "",
-                    i === 0 ? (Number(r.amount) || 0) : "",
-                    i === 0 ? (Number(r.vat) || 0) : "",
-                    i === 0 ? (Number(r.grand) || 0) : ""
-                ].map(csvEscape).join(","));
-            }
+    const originalText = btn.innerHTML;
+    btn.disabled = true;
+    btn.innerHTML = "กำลังเตรียม...";
+    try {
+        const res = await fetch("/api/invoices/export-batch", {
+            method: "POST",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify({ start: f || null, end: t || null, format: "pdf" })
+        });
+        if (!res.ok) throw new Error(await res.text());
+        const { status_url } = await res.json();
+
+        while (true) {
+            await new Promise(r => setTimeout(r, 1500));
+            const sr = await fetch(status_url, { headers: { "Accept": "application/json" } });
+            if (!sr.ok) throw new Error(await sr.text());
+            const job = await sr.json();
+            if (job.status === "error") throw new Error(job.error || "export failed");
+            if (job.status === "done") { window.location.href = job.download_url; break; }
+            btn.innerHTML = job.total ? `กำลังสร้าง ${job.done}/${job.total}` : "กำลังโหลดข้อมูล...";
         }
+    } catch (err) {
+        console.error(err);
+        alert("สร้าง PDF ไม่สำเร็จ: " + err.message);
+    } finally {
+        btn.disabled = false;
+        btn.innerHTML = originalText;
     }
-
-    const bom = "\uFEFF";
-    const blob = new Blob([bom + lines.join("\n")], { type: "text/csv;charset=utf-8" });
-    const a = document.createElement("a");
-    a.href = URL.createObjectURL(blob);
-    const f_start = document.getElementById("allFrom")?.value || 'start';
-    const f_end = document.getElementById("allTo")?.value || 'end';
-    a.download = `Invoices_${f_start}_to_${f_end}.csv`;
-    a.click();
-    URL.revokeObjectURL(a.href);
 }
 
 function switchTab(which) {
@@ -356,8 +278,8 @@ function exportCsv() {
     URL.revokeObjectURL(a.href);
 }
 
-// ===== All invoices (with pagination 20/หน้า) =====
-async function loadAllInvoices() {
+// ===== All invoices (keyset pagination 20/หน้า, โหลดสินค้าเฉพาะแถวที่แสดง) =====
+function allInvoiceParams() {
     const params = new URLSearchParams();
     const f = document.getElementById("allFrom")?.value;
     const t = document.getElementById("allTo")?.value;
@@ -365,38 +287,55 @@ async function loadAllInvoices() {
     if (f) params.set("start", f);
     if (t) params.set("end", t);
     if (q) params.set("q", q);
+    return params;
+}
+
+async function loadAllInvoices() {
+    state.allCursors = [null];
+    await loadAllPage(1);
+}
+
+async function loadAllPage(page) {
+    const params = allInvoiceParams();
+    params.set("limit", state.ALL_PAGE_SIZE);
+    const cursor = state.allCursors[page - 1];
+    if (cursor) params.set("cursor", cursor);
 
     try {
         const res = await fetch(`${API_LIST}?${params.toString()}`, { headers: { "Accept": "application/json" } });
         if (!res.ok) throw new Error(await res.text());
         const data = await res.json();
-        state.allRows = Array.isArray(data) ? data : [];
-        state.allPage = 1;
+        const rows = Array.isArray(data) ? data : [];
+
+        if (rows.length) {
+            const ids = rows.map(r => r.idx).join(",");
+            const ir = await fetch(`${API_ITEMS_BULK}?ids=${ids}`, { headers: { "Accept": "application/json" } });
+            if (!ir.ok) throw new Error(await ir.text());
+            const itemsById = await ir.json();
+            for (const r of rows) r.items = itemsById[r.idx] || [];
+        }
+
+        state.allRows = rows;
+        state.allPage = page;
+        state.allNextCursor = res.headers.get("X-Next-Cursor");
         renderAllTable();
     } catch (err) {
         console.error(err);
         state.allRows = [];
         state.allPage = 1;
+        state.allCursors = [null];
+        state.allNextCursor = null;
         renderAllTable();
         alert("ดึงรายการใบกำกับไม่สำเร็จ");
     }
 }
 
-function renderAllTable(isNextAttempt = false) {
+function renderAllTable() {
     const body = document.getElementById("allBody");
     body.innerHTML = "";
 
-    const total = state.allRows.length;
-    const pageSize = state.ALL_PAGE_SIZE;
-    const maxPage = Math.max(1, Math.ceil(total / pageSize));
-    if (state.allPage > maxPage) {
-        state.allPage = maxPage;
-        if (isNextAttempt) { /* ถ้ากดถัดไปเกิน ก็เด้งกลับมาโชว์หน้าสุดท้าย */ }
-    }
-
-    const startIdx = (state.allPage - 1) * pageSize;
-    const endIdx = Math.min(total, startIdx + pageSize);
-    const rows = state.allRows.slice(startIdx, endIdx);
+    const rows = state.allRows;
+    const startIdx = (state.allPage - 1) * state.ALL_PAGE_SIZE;
 
     if (!rows.length) {
         const tr = document.createElement("tr");
@@ -470,11 +409,14 @@ function renderAllTable(isNextAttempt = false) {
     const prevBtn = document.getElementById("allPrevPage");
     const nextBtn = document.getElementById("allNextPage");
 
-    const from = total === 0 ? 0 : startIdx + 1;
-    info.textContent = `แสดง ${from}-${endIdx} จากทั้งหมด ${total} รายการ`;
-    pageInfo.textContent = `หน้า ${state.allPage} / ${maxPage}`;
+    const from = rows.length === 0 ? 0 : startIdx + 1;
+    const to = startIdx + rows.length;
+    info.textContent = state.allNextCursor
+        ? `แสดง ${from}-${to} รายการ`
+        : `แสดง ${from}-${to} จากทั้งหมด ${to} รายการ`;
+    pageInfo.textContent = `หน้า ${state.allPage}`;
     prevBtn.disabled = state.allPage <= 1;
-    nextBtn.disabled = state.allPage >= maxPage;
+    nextBtn.disabled = !state.allNextCursor;
 }
 
 // Items modal
@@ -545,6 +487,7 @@ function fillEditItems(items) {
 function addItemRow(it = {}) {
     const body = document.getElementById("em_itemsBody");
     const tr = document.createElement("tr");
+    if (it.idx != null) tr.dataset.idx = it.idx;  // ส่งกลับตอนบันทึก ให้ server แก้เฉพาะแถวที่เปลี่ยน
     tr.innerHTML = `
     <td class="px-2 py-1 border-b"><input class="w-full border rounded px-2 py-1" value="${it.cf_itemid ?? ''}"></td>
     <td class="px-2 py-1 border-b"><input class="w-full border rounded px-2 py-1" value="${it.cf_itemname ?? ''}"></td>
@@ -586,7 +529,8 @@ async function saveEdit() {
         const cf_itemname = tds[1].querySelector("input").value.trim();
         const quantity = parseFloat(tds[2].querySelector("input").value || 0);
         const unit_price = parseFloat(tds[3].querySelector("input").value || 0);
-        items.push({ cf_itemid, cf_itemname, quantity, unit_price });
+        const idx = tr.dataset.idx ? parseInt(tr.dataset.idx) : null;
+        items.push({ idx, cf_itemid, cf_itemname, quantity, unit_price });
     });
     try {
         const res = await fetch(API_SAVE(currentEditId), {
@@ -0,0 +1,210 @@
+# app/static_assets.py
+"""
+ไฟล์ static ที่ build ไว้ล่วงหน้า: ชื่อไฟล์มี hash ของเนื้อหา + บีบอัดไว้แล้ว (.br / .gz)
+
+    python -m app.static_assets          # app/static -> app/static_build (รันใน Dockerfile)
+
+- ทุกไฟล์ใน app/static ถูก copy เป็น <ชื่อ>.<hash><นามสกุล> เช่น js/form.js -> js/form.1a2b3c4d5e.js
+  ไฟล์ที่บีบได้ (css, js, ฟอนต์ ttf, ...) มี .br (ถ้ามีโมดูล brotli) และ .gz ระดับสูงสุดวางคู่กัน
+- url(...) ใน css ที่ชี้ไฟล์ใน app/static (เช่นฟอนต์ TH Sarabun) ถูกแก้ให้ชี้ชื่อที่มี hash
+- manifest.json เก็บ ชื่อเดิม -> ชื่อที่มี hash และ encoding ที่มีของแต่ละไฟล์
+
+ฝั่ง web:
+- template ใช้ {{ static_url('js/form.js') }} -> /assets/js/form.1a2b3c4d5e.js
+  ถ้ายังไม่ได้ build (เครื่อง dev) ได้ /static/js/form.js ตามเดิม
+  (แก้ไฟล์ใน app/static แล้วต้อง build ใหม่ หรือลบ app/static_build)
+- /assets ส่ง .br / .gz ตาม Accept-Encoding พร้อม Cache-Control: public, max-age=31536000, immutable
+  ชื่อไฟล์เปลี่ยนทุกครั้งที่เนื้อหาเปลี่ยน browser จึงเก็บไว้ได้ตลอดโดยไม่ต้องถามซ้ำ
+- /static ยังอยู่ตามเดิม (PDF ของ WeasyPrint อ่านไฟล์จาก app/static โดยตรง)
+
+ตั้งค่าผ่าน environment:
+  STATIC_BUILD_DIR   โฟลเดอร์ผลลัพธ์ (ค่าเริ่มต้น app/static_build)
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import sys
+from pathlib import Path, PurePosixPath
+from typing import Dict, List, Optional
+
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.staticfiles import StaticFiles
+
+from .compression import accepted_encodings, brotli
+
+BASE_DIR = Path(__file__).resolve().parent
+SOURCE_DIR = BASE_DIR / "static"
+BUILD_DIR = Path(os.getenv("STATIC_BUILD_DIR", str(BASE_DIR / "static_build")))
+MANIFEST = "manifest.json"
+URL_PREFIX = "/assets"
+FALLBACK_PREFIX = "/static"
+
+CACHE_FOREVER = "public, max-age=31536000, immutable"
+HASH_LEN = 10
+
+COMPRESS_EXTS = {".css", ".js", ".json", ".svg", ".ttf", ".otf", ".txt", ".html", ".map"}
+SKIP_NAMES = {"desktop.ini", ".DS_Store", "Thumbs.db"}
+# บีบแล้วต้องเล็กลงอย่างน้อยเท่านี้ถึงจะเก็บไว้
+MIN_RATIO = 0.95
+_SUFFIX = {"br": ".br", "gzip": ".gz"}
+
+_CSS_URL_RE = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+
+# ---------- build ----------
+def _hashed_name(rel: str, data: bytes) -> str:
+    p = PurePosixPath(rel)
+    digest = hashlib.sha256(data).hexdigest()[:HASH_LEN]
+    return str(p.with_name(f"{p.stem}.{digest}{p.suffix}"))
+
+def _rewrite_css(rel: str, css: str, files: Dict[str, str]) -> str:
+    """url(../fonts/x.ttf) -> url(../fonts/x.<hash>.ttf) (เฉพาะ path ภายใน static ที่ build แล้ว)"""
+    base = PurePosixPath(rel).parent
+
+    def repl(m: re.Match) -> str:
+        quote, url = m.group(1), m.group(2).strip()
+        if url.startswith(("data:", "http:", "https:", "//", "#")):
+            return m.group(0)
+        path, sep, rest = url.partition("?") if "?" in url else url.partition("#")
+        if path.startswith("/static/"):
+            target = path[len("/static/"):]
+        elif path.startswith("/"):
+            return m.group(0)
+        else:
+            target = os.path.normpath(str(base / path)).replace(os.sep, "/")
+        hashed = files.get(target)
+        if hashed is None:
+            return m.group(0)
+        new = os.path.relpath(hashed, str(base) or ".").replace(os.sep, "/")
+        return f"url({quote}{new}{sep}{rest}{quote})"
+
+    return _CSS_URL_RE.sub(repl, css)
+
+def _write_variants(dest: Path, data: bytes) -> List[str]:
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    dest.write_bytes(data)
+    encodings = []
+    if dest.suffix.lower() not in COMPRESS_EXTS or not data:
+        return encodings
+    if brotli is not None:
+        br = brotli.compress(data, quality=11)
+        if len(br) <= len(data) * MIN_RATIO:
+            dest.with_name(dest.name + ".br").write_bytes(br)
+            encodings.append("br")
+    gz = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(gz) <= len(data) * MIN_RATIO:
+        dest.with_name(dest.name + ".gz").write_bytes(gz)
+        encodings.append("gzip")
+    return encodings
+
+def build(source: Path = SOURCE_DIR, out: Path = BUILD_DIR) -> dict:
+    """build ใหม่ทั้งโฟลเดอร์ คืนค่า manifest"""
+    rels = sorted(
+        p.relative_to(source).as_posix()
+        for p in source.rglob("*")
+        if p.is_file() and p.name not in SKIP_NAMES and not p.name.startswith(".")
+    )
+    if out.exists():
+        shutil.rmtree(out)
+    out.mkdir(parents=True)
+
+    files: Dict[str, str] = {}
+    encodings: Dict[str, List[str]] = {}
+    # css ทำทีหลัง เพราะต้องรู้ชื่อที่มี hash ของฟอนต์/รูปที่อ้างถึงก่อน
+    for rel in sorted(rels, key=lambda r: r.endswith(".css")):
+        data = (source / rel).read_bytes()
+        if rel.endswith(".css"):
+            data = _rewrite_css(rel, data.decode("utf-8"), files).encode("utf-8")
+        hashed = _hashed_name(rel, data)
+        files[rel] = hashed
+        encodings[hashed] = _write_variants(out / hashed, data)
+
+    manifest = {"files": files, "encodings": encodings}
+    (out / MANIFEST).write_text(json.dumps(manifest, ensure_ascii=False, indent=1), encoding="utf-8")
+    return manifest
+
+
+# ---------- runtime ----------
+_manifest: Optional[dict] = None
+
+def _load_manifest() -> dict:
+    global _manifest
+    if _manifest is None:
+        try:
+            _manifest = json.loads((BUILD_DIR / MANIFEST).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            _manifest = {"files": {}, "encodings": {}}
+    return _manifest
+
+def static_url(path: str) -> str:
+    """URL ของไฟล์ใน app/static สำหรับใช้ใน template: {{ static_url('css/style.css') }}"""
+    rel = path.lstrip("/")
+    if rel.startswith("static/"):
+        rel = rel[len("static/"):]
+    hashed = _load_manifest()["files"].get(rel)
+    if hashed is None:
+        return f"{FALLBACK_PREFIX}/{rel}"
+    return f"{URL_PREFIX}/{hashed}"
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles ที่ส่ง <ไฟล์>.br / .gz แทนตัวจริงเมื่อ browser รับได้ (ใช้กับ BUILD_DIR)"""
+
+    async def get_response(self, path: str, scope):
+        rel = path.replace(os.sep, "/")
+        if rel == MANIFEST:
+            raise HTTPException(status_code=404)
+        available = _load_manifest()["encodings"].get(rel)
+        if available is None:
+            # ไม่ได้อยู่ใน manifest (ไม่มี hash) — ส่งแบบปกติ ไม่ cache ยาว
+            return await super().get_response(path, scope)
+
+        response = None
+        for enc in accepted_encodings(Headers(scope=scope).get("accept-encoding", "")):
+            if enc in available:
+                response = await super().get_response(path + _SUFFIX[enc], scope)
+                if response.status_code in (200, 206):
+                    response.headers["Content-Type"] = self._media_type(rel)
+                    response.headers["Content-Encoding"] = enc
+                break
+        if response is None:
+            response = await super().get_response(path, scope)
+        response.headers["Cache-Control"] = CACHE_FOREVER
+        if available:
+            response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+    @staticmethod
+    def _media_type(rel: str) -> str:
+        media_type = mimetypes.guess_type(rel)[0] or "application/octet-stream"
+        if media_type.startswith("text/"):
+            media_type += "; charset=utf-8"
+        return media_type
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.static_assets")
+    parser.add_argument("--source", type=Path, default=SOURCE_DIR)
+    parser.add_argument("--out", type=Path, default=BUILD_DIR)
+    args = parser.parse_args(argv)
+
+    manifest = build(args.source, args.out)
+    raw = sum((args.source / rel).stat().st_size for rel in manifest["files"])
+    best = 0
+    for hashed, encs in manifest["encodings"].items():
+        sizes = [(args.out / hashed).stat().st_size]
+        sizes += [(args.out / (hashed + _SUFFIX[e])).stat().st_size for e in encs]
+        best += min(sizes)
+    print(f"static_assets: {len(manifest['files'])} files -> {args.out} "
+          f"({raw / 1024:.0f} KB -> {best / 1024:.0f} KB with {'br' if brotli else 'gzip'})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
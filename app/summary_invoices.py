@@ -3,27 +3,21 @@ from __future__ import annotations
 from typing import Optional, Dict, Any, List
 from datetime import date
 
-from fastapi import APIRouter, Depends, HTTPException, Query, Body
+from fastapi import APIRouter, Depends, HTTPException, Query, Body, Response
 from sqlalchemy.orm import Session
-from sqlalchemy import func, or_, cast, String
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, func, or_, select, true, tuple_
 
-from .database import SessionLocal
-from . import models
+from .database import ReadSessionLocal
+from .deps import get_db, get_async_read_db
+from . import grn_index, invoice_items, models, pdf_cache, periods, product_prices, revenue_rollup
+from .report_export import YIELD_PER, export_response
 
 router = APIRouter()
 
 VAT_RATE = 0.07
 
 
-# -------------------- DB Session --------------------
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
 # -------------------- Utils --------------------
 def _money(v) -> float:
     try:
@@ -39,80 +33,31 @@ def _iso(d) -> Optional[str]:
         return None
 
 
-def _to_date(s: Optional[str]) -> Optional[date]:
-    if not s:
-        return None
-    try:
-        return date.fromisoformat(s)  # 'YYYY-MM-DD'
-    except Exception:
-        return None
-
-
 # ====================================================
 # 1) SUMMARY
 # ====================================================
 @router.get("/api/invoices/summary")
-def api_invoice_summary(
+async def api_invoice_summary(
     granularity: str = Query("day", pattern="^(day|month|year)$"),
     start: Optional[str] = Query(None, description="YYYY-MM-DD"),
     end: Optional[str] = Query(None, description="YYYY-MM-DD"),
     month: Optional[str] = Query(None, description="YYYY-MM"),
     year: Optional[int] = Query(None, ge=2000, le=2100),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_read_db),
 ):
-    inv = models.Invoice
-    itm = models.InvoiceItem
-
-    # label ตามช่วง
-    if granularity == "day":
-        label_expr = func.to_char(inv.invoice_date, 'YYYY-MM-DD')
-    elif granularity == "month":
-        label_expr = func.to_char(inv.invoice_date, 'YYYY-MM')
-    else:
-        label_expr = func.to_char(inv.invoice_date, 'YYYY')
-
-    # JOIN เผื่อทั้งกรณีอ้างด้วยเลขที่บิล และกรณีอ้างด้วย idx เป็นข้อความ
-    join_cond = or_(
-        itm.invoice_number == inv.invoice_number,
-        itm.invoice_number == cast(inv.idx, String),
-    )
-
-    # SUM(COALESCE(amount, quantity * price))
-    sum_amount = func.sum(
-        func.coalesce(
-            itm.amount,
-            func.coalesce(itm.quantity, 0) * func.coalesce(itm.cf_itempricelevel_price, 0)
-        )
-    )
-
-    q = (
-        db.query(
-            label_expr.label("period"),
-            func.count(func.distinct(inv.idx)).label("count"),
-            func.coalesce(sum_amount, 0).label("amount"),
-        )
-        .outerjoin(itm, join_cond)
+    # อ่านจาก rollup รายวัน (เดือน/ปี รวมจากแถวรายวัน)
+    rd = models.RevenueDaily
+    label_expr = revenue_rollup.period_label(granularity)
+    q = select(
+        label_expr.label("period"),
+        func.coalesce(func.sum(rd.invoice_count), 0).label("count"),
+        func.coalesce(func.sum(rd.amount), 0).label("amount"),
     )
-
-    # ช่วงเวลา
-    if granularity == "day":
-        d1 = _to_date(start)
-        d2 = _to_date(end)
-        if d1:
-            q = q.filter(inv.invoice_date >= d1)
-        if d2:
-            q = q.filter(inv.invoice_date <= d2)
-    elif granularity == "month":
-        if month and len(month) == 7:
-            q = q.filter(func.to_char(inv.invoice_date, 'YYYY-MM') == month)
-    else:
-        if year:
-            q = q.filter(func.extract("year", inv.invoice_date) == year)
-
+    q = periods.apply(q, rd.day, granularity, start, end, month, year)
     q = q.group_by("period").order_by("period")
 
     out: List[Dict[str, Any]] = []
-    for period, count, amount in q.all():
+    for period, count, amount in (await db.execute(q)).all():
         amount = _money(amount)
         discount = 0.0
         before_vat = amount - discount
@@ -130,115 +75,151 @@ def api_invoice_summary(
     return out
 
 
+def _filter_invoice_list(q, start: Optional[str], end: Optional[str], qtext: Optional[str]):
+    """เงื่อนไขช่วงวันที่ + คำค้น ที่ใช้ร่วมกันระหว่าง /api/invoices และ /api/invoices/export"""
+    inv = models.Invoice
+    q = periods.apply(q, inv.invoice_date, start=start, end=end)
+
+    if qtext and qtext.strip():
+        pat = f"%{qtext.strip()}%"
+        q = q.filter(or_(
+            inv.invoice_number.ilike(pat),
+            inv.fname.ilike(pat),
+            inv.po_number.ilike(pat),
+        ))
+    return q
+
+
+def _invoice_order():
+    """
+    ลำดับของ /api/invoices และ /api/invoices/export: ใหม่ -> เก่า, บิลที่ไม่มีวันที่ขึ้นก่อน
+    (NULLS FIRST = ค่าปกติของ DESC ใน PostgreSQL เหมือนก่อนแบ่งหน้า)
+    """
+    inv = models.Invoice
+    return inv.invoice_date.desc().nulls_first(), inv.idx.desc()
+
+
+def _invoice_amount():
+    """
+    ยอดรวมของบิลหนึ่งใบ SUM(COALESCE(amount, quantity * price)) correlated กับ Invoice.idx
+    รวมเฉพาะรายการของบิลที่ถูกเลือก (ผ่าน index invoice_idx) ไม่ GROUP BY ทั้งตาราง invoice_items
+    """
+    itm = models.InvoiceItem
+    return (
+        select(func.coalesce(func.sum(
+            func.coalesce(
+                itm.amount,
+                func.coalesce(itm.quantity, 0) * func.coalesce(itm.cf_itempricelevel_price, 0)
+            )
+        ), 0).label("amount"))
+        .where(itm.invoice_idx == models.Invoice.idx)
+        .correlate(models.Invoice)
+    )
+
+
 # ====================================================
 # 2) รายการใบกำกับ (หัวบิล + ยอดรวมต่อใบ)
 # ====================================================
-# ====================================================
+LIST_DEFAULT_LIMIT = 50
+LIST_MAX_LIMIT = 500
+ITEMS_BULK_MAX = 500
+
+
+def _item_dict(r) -> Dict[str, Any]:
+    return {
+        "cf_itemid": r.cf_itemid,
+        "cf_itemname": r.cf_itemname,
+        "quantity": _money(r.quantity),
+        "unit_price": _money(r.cf_itempricelevel_price),
+        "amount": _money(r.amount if r.amount is not None else _money(r.quantity) * _money(r.cf_itempricelevel_price)),
+    }
+
+
+async def _items_by_invoice(db: AsyncSession, inv_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+    """รายการสินค้าของหลายใบใน query เดียว"""
+    itm = models.InvoiceItem
+    items_by_inv: Dict[int, List[Dict[str, Any]]] = {idx: [] for idx in inv_ids}
+    if inv_ids:
+        item_rows = (await db.execute(
+            select(itm)
+            .filter(itm.invoice_idx.in_(inv_ids))
+            .order_by(itm.idx.asc())
+        )).scalars().all()
+        for r in item_rows:
+            if r.invoice_idx in items_by_inv:
+                items_by_inv[r.invoice_idx].append(_item_dict(r))
+    return items_by_inv
+
+
+def _encode_cursor(invoice_date, idx: int) -> str:
+    return f"{_iso(invoice_date) or ''}|{idx}"
+
+
+def _decode_cursor(cursor: str):
+    """'YYYY-MM-DD|idx' (วันที่ว่าง = บิลที่ไม่มีวันที่ ซึ่งอยู่ต้นสุด)"""
+    try:
+        d, i = cursor.split("|", 1)
+        return (date.fromisoformat(d) if d else None), int(i)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid cursor")
+
+
 @router.get("/api/invoices")
-def api_invoices_list(
+async def api_invoices_list(
+    response: Response,
     start: Optional[str] = Query(None, description="YYYY-MM-DD"),
     end: Optional[str] = Query(None, description="YYYY-MM-DD"),
     qtext: Optional[str] = Query(None, alias="q"),
-    db: Session = Depends(get_db),
+    limit: int = Query(LIST_DEFAULT_LIMIT, ge=1, le=LIST_MAX_LIMIT),
+    cursor: Optional[str] = Query(None, description="ค่าจาก header X-Next-Cursor ของหน้าก่อน"),
+    include_items: bool = Query(False),
+    db: AsyncSession = Depends(get_async_read_db),
 ):
+    """
+    เรียงใหม่ -> เก่า (invoice_date desc, idx desc) แบบ keyset pagination
+    ถ้ายังมีหน้าถัดไป ส่ง cursor กลับใน header X-Next-Cursor
+    """
     inv = models.Invoice
-    itm = models.InvoiceItem
     drv = models.Driver
 
-    sub_amount = func.sum(
-        func.coalesce(
-            itm.amount,
-            func.coalesce(itm.quantity, 0) * func.coalesce(itm.cf_itempricelevel_price, 0)
-        )
-    )
-    sub = (
-        db.query(
-            itm.invoice_number.label("inv_no"),
-            func.coalesce(sub_amount, 0).label("amount"),
-        )
-        .group_by(itm.invoice_number)
-        .subquery()
-    )
+    # ยอดรวมต่อใบแบบ correlated subquery: คำนวณเฉพาะแถวในหน้านี้
+    amount = _invoice_amount().scalar_subquery()
 
     q = (
-        db.query(
+        select(
             inv.idx,
             inv.invoice_date,
             inv.invoice_number,
             inv.fname,
             inv.po_number,
-            func.coalesce(sub.c.amount, 0).label("amount"),
+            amount.label("amount"),
             func.concat(func.coalesce(drv.first_name, ''), ' ', func.coalesce(drv.last_name, '')).label("driver_name"),
         )
-        .outerjoin(
-            sub,
-            or_(
-                sub.c.inv_no == inv.invoice_number,
-                sub.c.inv_no == cast(inv.idx, String),
-            ),
-        )
         .outerjoin(drv, inv.driver_id == drv.driver_id)
     )
 
-    d1 = _to_date(start)
-    d2 = _to_date(end)
-    if d1:
-        q = q.filter(inv.invoice_date >= d1)
-    if d2:
-        q = q.filter(inv.invoice_date <= d2)
+    q = _filter_invoice_list(q, start, end, qtext)
 
-    if qtext and qtext.strip():
-        pat = f"%{qtext.strip()}%"
-        q = q.filter(or_(
-            inv.invoice_number.ilike(pat),
-            inv.fname.ilike(pat),
-            inv.po_number.ilike(pat),
-        ))
-
-    q = q.order_by(inv.invoice_date.desc(), inv.idx.desc())
+    if cursor:
+        c_date, c_idx = _decode_cursor(cursor)
+        if c_date is None:
+            q = q.filter(or_(
+                and_(inv.invoice_date.is_(None), inv.idx < c_idx),
+                inv.invoice_date.isnot(None),
+            ))
+        else:
+            # บิลที่ไม่มีวันที่ผ่านไปแล้ว (การเทียบ tuple กับ NULL ไม่เป็นจริง)
+            q = q.filter(tuple_(inv.invoice_date, inv.idx) < tuple_(c_date, c_idx))
 
-    results = q.all()
-    inv_ids = [row[0] for row in results]
-    inv_number_map: Dict[int, str] = {row[0]: row[2] for row in results}
-
-    # Batch-load items for all invoices
-    items_by_inv: Dict[int, List[Dict[str, Any]]] = {idx: [] for idx in inv_ids}
-    if inv_ids:
-        all_inv_numbers = set()
-        all_idx_strings = set()
-        for _idx in inv_ids:
-            inv_no = inv_number_map.get(_idx)
-            if inv_no:
-                all_inv_numbers.add(inv_no)
-            all_idx_strings.add(str(_idx))
-
-        lookup_values = all_inv_numbers | all_idx_strings
-        item_rows = (
-            db.query(itm)
-            .filter(itm.invoice_number.in_(lookup_values))
-            .order_by(itm.idx.asc())
-            .all()
-        )
+    q = q.order_by(*_invoice_order())
 
-        inv_no_to_idx: Dict[str, int] = {}
-        for _idx in inv_ids:
-            inv_no = inv_number_map.get(_idx)
-            if inv_no and inv_no not in inv_no_to_idx:
-                inv_no_to_idx[inv_no] = _idx
-            idx_str = str(_idx)
-            if idx_str not in inv_no_to_idx:
-                inv_no_to_idx[idx_str] = _idx
+    results = (await db.execute(q.limit(limit + 1))).all()
+    if len(results) > limit:
+        results = results[:limit]
+        last = results[-1]
+        response.headers["X-Next-Cursor"] = _encode_cursor(last.invoice_date, last.idx)
 
-        for r in item_rows:
-            parent_idx = inv_no_to_idx.get(r.invoice_number)
-            if parent_idx is not None and parent_idx in items_by_inv:
-                items_by_inv[parent_idx].append({
-                    "cf_itemid": r.cf_itemid,
-                    "cf_itemname": r.cf_itemname,
-                    "quantity": _money(r.quantity),
-                    "unit_price": _money(r.cf_itempricelevel_price),
-                    "amount": _money(r.amount if r.amount is not None else _money(r.quantity) * _money(r.cf_itempricelevel_price)),
-                })
+    items_by_inv = await _items_by_invoice(db, [row[0] for row in results]) if include_items else {}
 
     out: List[Dict[str, Any]] = []
     for idx, invoice_date, invoice_number, fname, po_number, amount, driver_name in results:
@@ -247,7 +228,7 @@ def api_invoices_list(
         before_vat = amount - discount
         vat = before_vat * VAT_RATE
         grand = before_vat + vat
-        out.append({
+        row = {
             "idx": idx,
             "invoice_date": _iso(invoice_date),
             "invoice_number": invoice_number,
@@ -257,11 +238,116 @@ def api_invoices_list(
             "vat": round(vat, 2),
             "grand": round(grand, 2),
             "driver_name": driver_name,
-            "items": items_by_inv.get(idx, []),
-        })
+        }
+        if include_items:
+            row["items"] = items_by_inv.get(idx, [])
+        out.append(row)
     return out
 
 
+@router.get("/api/invoices/items")
+async def api_invoices_items_bulk(
+    ids: str = Query(..., description="idx ของบิล คั่นด้วย comma"),
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    """รายการสินค้าของหลายใบ (เฉพาะแถวที่หน้าเว็บแสดง) คืน {idx: [items]}"""
+    try:
+        inv_ids = list(dict.fromkeys(int(x) for x in ids.split(",") if x.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be integers")
+    if len(inv_ids) > ITEMS_BULK_MAX:
+        raise HTTPException(status_code=400, detail=f"too many ids (max {ITEMS_BULK_MAX})")
+    return await _items_by_invoice(db, inv_ids)
+
+
+# ====================================================
+# 2.1) ส่งออก CSV / XLSX (หนึ่งแถวต่อรายการสินค้า) แบบ stream
+# ====================================================
+EXPORT_HEADER = [
+    "วันที่", "เลขที่", "ลูกค้า", "PO", "รหัสสินค้า", "รายละเอียด",
+    "จำนวน", "ราคา/หน่วย", "พนักงานขับรถ", "ยอดก่อนส่วนลด", "VAT", "สุทธิ",
+]
+EXPORT_COL_WIDTHS = [12, 15, 40, 15, 12, 40, 10, 12, 20, 18, 15, 18]
+
+
+def _iter_invoice_export_rows(start: Optional[str], end: Optional[str], qtext: Optional[str]):
+    """
+    หัวบิล + รายการ ในคิวรีเดียว อ่านผ่าน server-side cursor (yield_per)
+    แถวแรกของแต่ละใบมีข้อมูลหัวบิล แถวถัดไปเว้นว่าง (รูปแบบเดียวกับที่หน้าเว็บเคย export)
+    """
+    inv = models.Invoice
+    itm = models.InvoiceItem
+    drv = models.Driver
+
+    db = ReadSessionLocal()
+    try:
+        # LATERAL: ยอดรวมคำนวณครั้งเดียวต่อบิล (ก่อน join รายการ) เฉพาะบิลที่ผ่านตัวกรอง
+        amount = _invoice_amount().lateral("inv_amount")
+        q = (
+            db.query(
+                inv.idx,
+                inv.invoice_date,
+                inv.invoice_number,
+                inv.fname,
+                inv.po_number,
+                amount.c.amount,
+                func.concat(func.coalesce(drv.first_name, ''), ' ', func.coalesce(drv.last_name, '')).label("driver_name"),
+                itm.idx.label("item_idx"),
+                itm.cf_itemid,
+                itm.cf_itemname,
+                itm.quantity,
+                itm.cf_itempricelevel_price,
+            )
+            .select_from(inv)
+            .outerjoin(amount, true())
+            .outerjoin(drv, inv.driver_id == drv.driver_id)
+            .outerjoin(itm, itm.invoice_idx == inv.idx)
+        )
+        q = _filter_invoice_list(q, start, end, qtext)
+        q = q.order_by(*_invoice_order(), itm.idx.asc())
+
+        prev_idx = None
+        for (idx, invoice_date, invoice_number, fname, po_number, amount, driver_name,
+             item_idx, cf_itemid, cf_itemname, quantity, unit_price) in q.yield_per(YIELD_PER):
+            first = idx != prev_idx
+            prev_idx = idx
+
+            if first:
+                before_vat = _money(amount)
+                vat = before_vat * VAT_RATE
+                head = [_iso(invoice_date) or "", invoice_number or "", fname or "", po_number or ""]
+                tail = [(driver_name or "").strip(), round(before_vat, 2), round(vat, 2), round(before_vat + vat, 2)]
+            else:
+                head = ["", "", "", ""]
+                tail = ["", "", "", ""]
+
+            if item_idx is None:
+                item = ["", "", "", ""]
+            else:
+                item = [cf_itemid or "", cf_itemname or "", _money(quantity), _money(unit_price)]
+            yield head + item + tail
+    finally:
+        db.close()
+
+
+@router.get("/api/invoices/export")
+def api_invoices_export(
+    start: Optional[str] = Query(None, description="YYYY-MM-DD"),
+    end: Optional[str] = Query(None, description="YYYY-MM-DD"),
+    qtext: Optional[str] = Query(None, alias="q"),
+    format: str = Query("xlsx", pattern="^(csv|xlsx)$"),
+):
+    return export_response(
+        format,
+        f"Invoices_{start or 'start'}_to_{end or 'end'}",
+        EXPORT_HEADER,
+        lambda: _iter_invoice_export_rows(start, end, qtext),
+        sheet_title="รายการใบกำกับภาษี",
+        col_widths=EXPORT_COL_WIDTHS,
+        number_formats={9: "#,##0.00", 10: "#,##0.00", 11: "#,##0.00"},
+    )
+
+
 # ====================================================
 # 3) รายการสินค้าในใบเดียว
 # ====================================================
@@ -274,23 +360,11 @@ def api_invoice_items(invoice_id: int, db: Session = Depends(get_db)):
     it = models.InvoiceItem
     rows = (
         db.query(it)
-        .filter(or_(
-            it.invoice_number == inv.invoice_number,
-            it.invoice_number == cast(inv.idx, String),
-        ))
+        .filter(it.invoice_idx == inv.idx)
         .order_by(it.idx.asc())
         .all()
     )
-    return [
-        {
-            "cf_itemid": r.cf_itemid,
-            "cf_itemname": r.cf_itemname,
-            "quantity": _money(r.quantity),
-            "unit_price": _money(r.cf_itempricelevel_price),
-            "amount": _money(r.amount if r.amount is not None else _money(r.quantity) * _money(r.cf_itempricelevel_price)),
-        }
-        for r in rows
-    ]
+    return [_item_dict(r) for r in rows]
 
 
 # ====================================================
@@ -305,10 +379,7 @@ def api_invoice_detail(invoice_id: int, db: Session = Depends(get_db)):
     it = models.InvoiceItem
     items_q = (
         db.query(it)
-        .filter(or_(
-            it.invoice_number == inv.invoice_number,
-            it.invoice_number == cast(inv.idx, String),
-        ))
+        .filter(it.invoice_idx == inv.idx)
         .order_by(it.idx.asc())
         .all()
     )
@@ -351,11 +422,15 @@ def api_invoice_detail(invoice_id: int, db: Session = Depends(get_db)):
 # ====================================================
 @router.put("/api/invoices/{invoice_id}")
 def api_invoice_update(invoice_id: int, payload: Dict[str, Any] = Body(...), db: Session = Depends(get_db)):
-    inv = db.query(models.Invoice).filter(models.Invoice.idx == invoice_id).first()
+    # lock แถวบิลก่อนถอนออกจาก rollup: แก้บิลเดียวกันพร้อมกันจะรอกัน ไม่ถอนยอดซ้ำ
+    inv = db.query(models.Invoice).filter(models.Invoice.idx == invoice_id).with_for_update().first()
     if not inv:
         raise HTTPException(status_code=404, detail="invoice not found")
 
     old_inv_no = inv.invoice_number
+    revenue_rollup.remove_invoices(db, [inv.idx])
+    grn_index.remove_invoices(db, [inv.idx])
+    product_prices.remove_invoices(db, [inv.idx])
 
     head_fields = [
         "invoice_number", "invoice_date", "grn_number", "dn_number", "po_number",
@@ -372,20 +447,15 @@ def api_invoice_update(invoice_id: int, payload: Dict[str, Any] = Body(...), db:
 
     new_inv_no = inv.invoice_number or old_inv_no
 
+    db.flush()
     if "items" in payload and isinstance(payload["items"], list):
-        # ลบของเดิม (เผื่อเคยบันทึกด้วยเลข idx เป็นข้อความ)
-        db.query(models.InvoiceItem).filter(
-            or_(
-                models.InvoiceItem.invoice_number == old_inv_no,
-                models.InvoiceItem.invoice_number == cast(inv.idx, String),
-                models.InvoiceItem.invoice_number == new_inv_no,
-            )
-        ).delete(synchronize_session=False)
-
+        # เขียนเฉพาะรายการที่เปลี่ยน (จับคู่ตาม idx ของรายการเดิม ดู invoice_items.sync_items)
+        rows = []
         for it in payload["items"]:
             qty = _money(it.get("quantity"))
             price = _money(it.get("unit_price"))
-            row = models.InvoiceItem(
+            rows.append(dict(
+                idx=it.get("idx"),
                 invoice_number=new_inv_no,
                 personid=inv.personid or None,
                 cf_itemid=it.get("cf_itemid"),
@@ -395,8 +465,15 @@ def api_invoice_update(invoice_id: int, payload: Dict[str, Any] = Body(...), db:
                 cf_items_ordinary=None,
                 quantity=qty,
                 amount=qty * price,
-            )
-            db.add(row)
+            ))
+        invoice_items.sync_items(db, inv.idx, rows)
 
+    revenue_rollup.add_invoices(db, [inv.idx])
+    grn_index.add_invoices(db, [inv.idx])
+    product_prices.add_invoices(db, [inv.idx])
     db.commit()
+    pdf_cache.invalidate(
+        pdf_cache.make_tag("invoice", old_inv_no),
+        pdf_cache.make_tag("invoice", new_inv_no),
+    )
     return {"ok": True, "idx": inv.idx}
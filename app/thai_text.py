@@ -0,0 +1,102 @@
+# app/thai_text.py
+"""
+ทำให้ข้อความภาษาไทยอยู่ในรูปเดียวกันก่อนค้นหา (ใช้ทั้งตอนบันทึก search_key และตอนรับคำค้น)
+
+fold(s)
+  - เลขไทย ๐-๙ -> 0-9
+  - ลำดับวรรณยุกต์/สระบน-ล่าง: สระบน/ล่างก่อน แล้ววรรณยุกต์ (พิมพ์สลับกันได้ทั้งสองแบบ)
+    ตัดเครื่องหมายที่พิมพ์ซ้ำ, ํา -> ำ, ำ่ -> ่ำ, เเ -> แ
+  - ตัวพิมพ์เล็ก, ตัดช่องว่าง / zero-width / เครื่องหมายวรรคตอน (. , - ( ) / ฯลฯ)
+search_key(s)
+  - ตัดคำนำหน้า/ประเภทกิจการที่หัวหรือท้ายชื่อ แล้ว fold
+    (บริษัท, บจก., หจก., ห้างหุ้นส่วนจำกัด, นาย, นางสาว, ... , จำกัด, (มหาชน), co.,ltd.)
+  - ตัดเฉพาะเมื่อเป็นคำเต็ม คือมีช่องว่าง/เครื่องหมายวรรคตอนคั่นจากชื่อ (ดูจากข้อความเดิมก่อน fold)
+    ชื่อที่ขึ้นต้นด้วยพยางค์เดียวกัน (คุณภาพ, นางรอง, นายก) ไม่ถูกตัด
+
+    search_key("บริษัท  ศรีสมบูรณ์ จำกัด") == search_key("บจก.ศรีสมบูรณ์") == "ศรีสมบูรณ์"
+    search_key("คุณภาพดี จำกัด") == "คุณภาพดี"
+
+เปลี่ยนกฎแล้วต้องคำนวณ search_key ที่เก็บไว้ใหม่: python -m app.migrations search_keys
+"""
+import re
+import unicodedata
+
+_THAI_DIGITS = str.maketrans("๐๑๒๓๔๕๖๗๘๙", "0123456789")
+
+# สระบน/ล่าง (และไม้ไต่คู้ พินทุ) -> วรรณยุกต์ / การันต์ -> นิคหิต (ส่วนหน้าของ ำ ที่พิมพ์แยก)
+_UPPER_LOWER = "\u0e31\u0e34\u0e35\u0e36\u0e37\u0e38\u0e39\u0e3a\u0e47"
+_TONES = "\u0e48\u0e49\u0e4a\u0e4b\u0e4c"
+_NIKHAHIT = "\u0e4d"
+_MARK_ORDER = {ch: 0 for ch in _UPPER_LOWER}
+_MARK_ORDER.update({ch: 1 for ch in _TONES})
+_MARK_ORDER[_NIKHAHIT] = 2
+_MARKS_RE = re.compile(f"[{_UPPER_LOWER}{_TONES}{_NIKHAHIT}]{{2,}}")
+_AM_TONE_RE = re.compile(f"\u0e33([{_TONES}])")
+
+# ช่องว่าง, zero-width, เครื่องหมายวรรคตอน (ทั้ง ASCII และไทย เช่น ฯ ๆ ไม่ตัด เพราะเป็นส่วนของคำ)
+_SEP = r"\s\u200b\u200c\u200d\u2060\ufeff.,\-_/\\()\[\]{}\"'`:;!?&+*#@"
+_DROP_RE = re.compile(f"[{_SEP}]+")
+
+# เขียนแบบไม่มีช่องว่าง/จุด (ในข้อความจริงคั่นได้ เช่น บ.จ.ก., co., ltd.) เรียงยาวก่อนสั้น
+_PREFIXES = sorted([
+    "บริษัทมหาชนจำกัด", "บริษัท", "บจก", "บจ", "บมจ",
+    "ห้างหุ้นส่วนจำกัด", "ห้างหุ้นส่วนสามัญ", "ห้างหุ้นส่วน", "หจก", "หสม",
+    "นางสาว", "นาง", "นาย", "นส", "คุณ",
+], key=len, reverse=True)
+_SUFFIXES = sorted([
+    "จำกัดมหาชน", "จำกัด", "มหาชน",
+    "companylimited", "coltd", "ltd", "limited", "plc", "partltd",
+], key=len, reverse=True)
+
+
+def _spelled(word: str) -> str:
+    # ตัวอักษรของคำ โดยมีช่องว่าง/เครื่องหมายคั่นระหว่างตัวได้
+    return f"[{_SEP}]*".join(re.escape(ch) for ch in word)
+
+# คำนำหน้าต้องตามด้วยตัวคั่น คำลงท้ายต้องมีตัวคั่นนำหน้า
+_PREFIX_RE = re.compile(f"^[{_SEP}]*(?:{'|'.join(map(_spelled, _PREFIXES))})[{_SEP}]+")
+_SUFFIX_RE = re.compile(f"[{_SEP}]+(?:{'|'.join(map(_spelled, _SUFFIXES))})[{_SEP}]*$")
+
+
+def _sort_marks(m: re.Match) -> str:
+    out = []
+    for ch in sorted(m.group(0), key=_MARK_ORDER.__getitem__):
+        if ch not in out:
+            out.append(ch)
+    return "".join(out)
+
+def _normalize(s) -> str:
+    # ส่วนของ fold ที่ยังไม่ตัดตัวคั่น (search_key ต้องใช้ตัวคั่นหาขอบคำ)
+    s = str(s)
+    if not s.isascii():
+        s = unicodedata.normalize("NFC", s).translate(_THAI_DIGITS)
+        s = _MARKS_RE.sub(_sort_marks, s)
+        s = s.replace("\u0e4d\u0e32", "\u0e33").replace("\u0e40\u0e40", "\u0e41")
+        s = _AM_TONE_RE.sub("\\1\u0e33", s)
+    return s.casefold()
+
+def fold(s) -> str:
+    if not s:
+        return ""
+    return _DROP_RE.sub("", _normalize(s))
+
+def _strip_affixes(s: str) -> str:
+    changed = True
+    while changed:
+        changed = False
+        for affix_re in (_PREFIX_RE, _SUFFIX_RE):
+            rest = affix_re.sub("", s, count=1)
+            # ไม่ตัดจนไม่เหลือชื่อ (เช่น คำค้น "บริษัท")
+            if rest != s and _DROP_RE.sub("", rest):
+                s = rest
+                changed = True
+    return s
+
+def search_key(s, strip_prename: bool = True) -> str:
+    """คีย์สำหรับค้นหาชื่อ (เก็บในคอลัมน์ search_key และใช้กับคำค้น)"""
+    if not s:
+        return ""
+    s = _normalize(s)
+    if strip_prename:
+        s = _strip_affixes(s)
+    return _DROP_RE.sub("", s)
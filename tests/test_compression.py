@@ -0,0 +1,128 @@
+# tests/test_compression.py
+"""CompressionMiddleware: บีบ br/gzip ตาม Accept-Encoding ทั้ง response ปกติและ streaming"""
+import asyncio
+import gzip
+
+import pytest
+from starlette.responses import JSONResponse, Response, StreamingResponse
+
+from app import compression
+from app.compression import CompressionMiddleware, accepted_encodings
+
+
+def call(app, headers=(), path="/"):
+    """เรียก ASGI app ตรง ๆ คืน (status, headers, body chunks)"""
+    scope = {
+        "type": "http", "method": "GET", "path": path, "raw_path": path.encode(), "query_string": b"",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers], "http_version": "1.1",
+        "scheme": "http", "server": ("test", 80), "client": ("127.0.0.1", 40000), "root_path": "",
+    }
+    out = {"chunks": []}
+    sent = []
+
+    async def receive():
+        if not sent:
+            sent.append(True)
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            out["status"] = message["status"]
+            out["headers"] = {k.decode().lower(): v.decode() for k, v in message["headers"]}
+        elif message["type"] == "http.response.body":
+            out["chunks"].append(message.get("body", b""))
+
+    asyncio.run(asyncio.wait_for(app(scope, receive, send), 10))
+    return out["status"], out["headers"], out["chunks"]
+
+def wrap(response, minimum_size=100):
+    async def app(scope, receive, send):
+        await response(scope, receive, send)
+    return CompressionMiddleware(app, minimum_size=minimum_size)
+
+GZIP = [("Accept-Encoding", "gzip")]
+BIG = "ข้อมูลทดสอบ " * 200
+
+
+def test_accepted_encodings(monkeypatch):
+    assert accepted_encodings("gzip, deflate, br") == ["br", "gzip"]
+    assert accepted_encodings("br;q=0, gzip;q=0.5") == ["gzip"]
+    assert accepted_encodings("identity") == []
+    monkeypatch.setattr(compression, "brotli", None)
+    assert accepted_encodings("br, gzip") == ["gzip"]
+
+def test_streamed_csv_roundtrip():
+    rows = [f"{n},สินค้า {n},{n * 1.5}\n".encode("utf-8") for n in range(2000)]
+
+    async def gen():
+        for r in rows:
+            yield r
+
+    status, headers, chunks = call(wrap(StreamingResponse(gen(), media_type="text/csv")), GZIP)
+    assert status == 200
+    assert headers["content-encoding"] == "gzip"
+    assert "content-length" not in headers
+    assert headers["vary"] == "Accept-Encoding"
+    assert len(chunks) > 1
+    assert gzip.decompress(b"".join(chunks)) == b"".join(rows)
+
+def test_single_body_sets_content_length():
+    status, headers, chunks = call(wrap(Response(BIG, media_type="text/html")), GZIP)
+    body = b"".join(chunks)
+    assert headers["content-encoding"] == "gzip"
+    assert int(headers["content-length"]) == len(body)
+    assert gzip.decompress(body) == BIG.encode("utf-8")
+
+def test_brotli_preferred():
+    brotli = pytest.importorskip("brotli")
+    _, headers, chunks = call(wrap(JSONResponse({"x": BIG})), [("Accept-Encoding", "gzip, br")])
+    assert headers["content-encoding"] == "br"
+    assert BIG in brotli.decompress(b"".join(chunks)).decode("utf-8")
+
+def test_existing_vary_is_extended():
+    response = Response(BIG, media_type="text/plain", headers={"Vary": "Cookie"})
+    _, headers, _ = call(wrap(response), GZIP)
+    assert headers["vary"] == "Cookie, Accept-Encoding"
+
+def test_etag_becomes_weak():
+    _, headers, _ = call(wrap(Response(BIG, media_type="text/plain", headers={"ETag": '"abc"'})), GZIP)
+    assert headers["etag"] == 'W/"abc"'
+    _, headers, _ = call(wrap(Response(BIG, media_type="text/plain", headers={"ETag": 'W/"abc"'})), GZIP)
+    assert headers["etag"] == 'W/"abc"'
+
+def test_small_body_passthrough_adds_vary():
+    status, headers, chunks = call(wrap(Response("สั้น", media_type="text/plain")), GZIP)
+    assert status == 200
+    assert "content-encoding" not in headers
+    assert headers["vary"] == "Accept-Encoding"
+    assert b"".join(chunks) == "สั้น".encode("utf-8")
+
+@pytest.mark.parametrize("status", [204, 206, 304])
+def test_skip_status(status):
+    body = b"" if status in (204, 304) else BIG.encode("utf-8")
+    _, headers, chunks = call(wrap(Response(body, status_code=status, media_type="text/plain")), GZIP)
+    assert "content-encoding" not in headers
+    assert b"".join(chunks) == body
+
+def test_already_encoded_passthrough():
+    data = gzip.compress(BIG.encode("utf-8"))
+    response = Response(data, media_type="text/css", headers={"Content-Encoding": "gzip"})
+    _, headers, chunks = call(wrap(response), [("Accept-Encoding", "gzip, br")])
+    assert headers["content-encoding"] == "gzip"
+    assert b"".join(chunks) == data
+
+def test_binary_types_passthrough():
+    _, headers, chunks = call(wrap(Response(b"%PDF" * 500, media_type="application/pdf")), GZIP)
+    assert "content-encoding" not in headers
+    assert b"".join(chunks) == b"%PDF" * 500
+
+def test_no_accept_encoding_passthrough():
+    _, headers, chunks = call(wrap(Response(BIG, media_type="text/plain")))
+    assert "content-encoding" not in headers
+    assert "vary" not in headers
+    assert b"".join(chunks) == BIG.encode("utf-8")
+
+def test_disabled_with_zero_minimum():
+    _, headers, _ = call(wrap(Response(BIG, media_type="text/plain"), minimum_size=0), GZIP)
+    assert "content-encoding" not in headers
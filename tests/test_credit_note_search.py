@@ -0,0 +1,52 @@
+# tests/test_credit_note_search.py
+"""
+/api/search-credit-notes แบบ keyset: เดินทีละหน้าแล้วได้ลำดับเดียวกับคิวรีเดียว
+(created_at desc โดยใบที่ไม่มีวันที่ขึ้นก่อน, เลขที่ desc)
+"""
+from datetime import date
+
+import pytest
+from fastapi import Response
+
+from app import credit_note
+from app.database import SessionLocal
+
+NOTES = [
+    ("CN05", date(2026, 1, 10)),
+    ("CN04", date(2026, 1, 10)),
+    ("CN03", date(2026, 1, 9)),
+    ("CN07", None),
+    ("CN06", None),
+    ("CN01", date(2026, 1, 8)),
+    ("CN02", None),
+]
+EXPECTED = ["CN07", "CN06", "CN02", "CN05", "CN04", "CN03", "CN01"]
+
+
+@pytest.fixture
+def notes(pg):
+    with SessionLocal() as db:
+        db.add_all(credit_note.CreditNote(creditnote_number=no, created_at=d) for no, d in NOTES)
+        db.commit()
+    return pg
+
+def _search(**kw):
+    response = Response()
+    with SessionLocal() as db:
+        rows = credit_note.search_credit_notes(response, start=None, end=None, q=None, db=db, **kw)
+    return [r["creditnote_number"] for r in rows], response.headers.get("X-Next-Cursor")
+
+def test_single_page_nulls_first(notes):
+    numbers, cursor = _search(limit=100, cursor=None)
+    assert numbers == EXPECTED
+    assert cursor is None
+
+@pytest.mark.parametrize("limit", [1, 2, 3])
+def test_pages_match_single_query(notes, limit):
+    seen, cursor = [], None
+    while True:
+        numbers, cursor = _search(limit=limit, cursor=cursor)
+        seen += numbers
+        if cursor is None:
+            break
+    assert seen == EXPECTED
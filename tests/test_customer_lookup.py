@@ -0,0 +1,75 @@
+# tests/test_customer_lookup.py
+"""/api/customers/lookup delta sync: แถวของ transaction ที่ commit ช้าไม่หลุดจาก delta"""
+import json
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import text
+
+from app import customers, migrations, models
+from app.database import SessionLocal
+
+
+def _lookup(**kw) -> dict:
+    kw.setdefault("fields", "idx,fname")
+    kw.setdefault("since", None)
+    kw.setdefault("cursor", None)
+    kw.setdefault("limit", 1000)
+    with SessionLocal() as db:
+        return json.loads(customers.api_customers_lookup(db=db, **kw).body)
+
+def test_unknown_field():
+    with pytest.raises(HTTPException) as e:
+        customers.api_customers_lookup(fields="idx,password", since=None, cursor=None, limit=10, db=None)
+    assert e.value.status_code == 400
+
+
+# ---------- PostgreSQL ----------
+@pytest.fixture
+def versioned(pg):
+    with pg.begin() as conn:
+        migrations.migrate_customer_row_version(conn)
+        conn.execute(text("TRUNCATE products.customer_list_deleted"))
+    return pg
+
+def _add(fname: str) -> int:
+    with SessionLocal() as db:
+        c = models.CustomerList(fname=fname, personid=fname)
+        db.add(c)
+        db.commit()
+        return c.idx
+
+def _names(out: dict) -> dict:
+    return {r[0]: r[1] for r in out["rows"]}
+
+def test_late_commit_is_not_missed(versioned):
+    a = _add("A")
+    full = _lookup()
+    assert _names(full) == {a: "A"}
+    assert full["next_cursor"] is None
+
+    # transaction ช้าแก้ A ค้างไว้ ระหว่างนั้นมีคนเพิ่ม B แล้ว browser sync
+    with versioned.connect() as slow:
+        slow.begin()
+        slow.execute(text("UPDATE products.customer_list SET fname = 'A2' WHERE idx = :i"), {"i": a})
+        b = _add("B")
+        first = _lookup(since=full["version"])
+        assert _names(first) == {b: "B"}
+        slow.commit()
+
+    second = _lookup(since=first["version"])
+    assert _names(second).get(a) == "A2"
+
+def test_deleted_rows_reported(versioned):
+    a = _add("A")
+    version = _lookup()["version"]
+    with SessionLocal() as db:
+        db.query(models.CustomerList).filter(models.CustomerList.idx == a).delete()
+        db.commit()
+    out = _lookup(since=version)
+    assert out["deleted"] == [a]
+    assert a not in _names(out)
+
+def test_version_ahead_of_server_resets(versioned):
+    version = _lookup()["version"]
+    assert _lookup(since=version + 10_000_000)["reset"] is True
@@ -0,0 +1,112 @@
+# tests/test_doc_numbers.py
+"""ตัวนับเลขเอกสาร: บันทึกพร้อมกันต้องได้เลขไม่ซ้ำและไม่ข้าม, period ใหม่ seed ครั้งเดียว, block ไม่ทับกัน"""
+import threading
+import time
+
+import pytest
+from sqlalchemy import text
+
+from app import doc_numbers, migrations
+from app.database import SessionLocal
+
+
+def test_parse_blocks():
+    assert doc_numbers._parse_blocks("customer=20, driver=10,") == {"customer": 20, "driver": 10}
+    assert doc_numbers._parse_blocks("") == {}
+    with pytest.raises(ValueError):
+        doc_numbers._parse_blocks("customer")
+
+
+# ---------- PostgreSQL ----------
+@pytest.fixture
+def counters(pg, monkeypatch):
+    with pg.begin() as conn:
+        migrations.migrate_doc_counters(conn)
+        conn.execute(text("TRUNCATE public.doc_counters"))
+    monkeypatch.setattr(doc_numbers, "_seeds", {})
+    monkeypatch.setattr(doc_numbers, "_pools", {})
+    monkeypatch.setattr(doc_numbers, "BLOCKS", {})
+    return pg
+
+def _allocate_concurrently(name: str, threads: int, per_thread: int, period: str = "6901") -> list:
+    barrier = threading.Barrier(threads)
+    out, errors = [], []
+    lock = threading.Lock()
+
+    def run():
+        try:
+            barrier.wait()
+            for _ in range(per_thread):
+                with SessionLocal() as db:
+                    n = doc_numbers.allocate(db, name, period)
+                    db.commit()
+                with lock:
+                    out.append(n)
+        except Exception as e:  # ให้ assert ใน thread หลัก
+            errors.append(e)
+
+    workers = [threading.Thread(target=run) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join(timeout=30)
+    assert not errors, errors
+    return sorted(out)
+
+def test_concurrent_allocate_no_gaps_or_duplicates(counters):
+    doc_numbers.register("bill_note", lambda db, period: 0)
+    assert _allocate_concurrently("bill_note", threads=8, per_thread=10) == list(range(1, 81))
+
+def test_rollback_returns_number(counters):
+    doc_numbers.register("credit_note", lambda db, period: 41)
+    with SessionLocal() as db:
+        assert doc_numbers.peek(db, "credit_note", "2569") == 42
+        assert doc_numbers.allocate(db, "credit_note", "2569") == 42
+        db.rollback()
+    with SessionLocal() as db:
+        assert doc_numbers.allocate(db, "credit_note", "2569") == 42
+        db.commit()
+        assert doc_numbers.peek(db, "credit_note", "2569") == 43
+
+def test_first_use_seed_race(counters):
+    # ทุก request ไม่เจอแถว -> seed พร้อมกัน -> INSERT ... ON CONFLICT บวกต่อจากแถวที่ insert ก่อน
+    calls = []
+
+    def slow_seed(db, period):
+        calls.append(period)
+        time.sleep(0.2)
+        return 100
+
+    doc_numbers.register("bill_note", slow_seed)
+    assert _allocate_concurrently("bill_note", threads=4, per_thread=1) == [101, 102, 103, 104]
+    assert len(calls) >= 1
+    with SessionLocal() as db:
+        assert doc_numbers.peek(db, "bill_note", "6901") == 105
+
+def test_periods_are_independent(counters):
+    doc_numbers.register("bill_note", lambda db, period: 0)
+    with SessionLocal() as db:
+        assert doc_numbers.allocate(db, "bill_note", "6901") == 1
+        assert doc_numbers.allocate(db, "bill_note", "6902") == 1
+        assert doc_numbers.allocate(db, "bill_note", "6901") == 2
+        db.commit()
+
+def test_blocks_are_disjoint_between_processes(counters, monkeypatch):
+    doc_numbers.register("customer", lambda db, period: 0)
+    monkeypatch.setattr(doc_numbers, "BLOCKS", {"customer": 5})
+
+    with SessionLocal() as db:
+        first = [doc_numbers.allocate(db, "customer", "69") for _ in range(3)]
+        assert doc_numbers.peek(db, "customer", "69") == 4
+        # process ที่สอง: pool ใน memory ว่าง จองได้ block ถัดไป
+        monkeypatch.setattr(doc_numbers, "_pools", {})
+        second = [doc_numbers.allocate(db, "customer", "69") for _ in range(7)]
+    assert first == [1, 2, 3]
+    assert second == [6, 7, 8, 9, 10, 11, 12]
+
+def test_block_mode_concurrent_unique(counters, monkeypatch):
+    doc_numbers.register("driver", lambda db, period: 0)
+    monkeypatch.setattr(doc_numbers, "BLOCKS", {"driver": 4})
+    numbers = _allocate_concurrently("driver", threads=6, per_thread=5, period="")
+    assert len(set(numbers)) == len(numbers) == 30
+    assert max(numbers) <= 32   # ข้ามได้เฉพาะเลขท้าย block ที่ยังแจกไม่หมด
@@ -0,0 +1,66 @@
+# tests/test_internal_metrics.py
+"""/internal/metrics/* ตอบเฉพาะผู้ที่มี token (หรือเครื่องเดียวกันเมื่อไม่ได้ตั้ง token)"""
+import asyncio
+import json
+
+import pytest
+from fastapi import FastAPI
+
+from app import internal_metrics
+
+
+def _app() -> FastAPI:
+    app = FastAPI()
+    app.include_router(internal_metrics.router)
+    return app
+
+def _get(path: str, headers=(), client=("203.0.113.5", 40000)):
+    app = _app()
+    scope = {
+        "type": "http", "method": "GET", "path": path, "raw_path": path.encode(), "query_string": b"",
+        "headers": [(k.encode(), v.encode()) for k, v in headers], "http_version": "1.1",
+        "scheme": "http", "server": ("test", 80), "client": client, "root_path": "", "app": app,
+    }
+    out = {"body": b""}
+    sent = []
+
+    async def receive():
+        if not sent:
+            sent.append(True)
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            out["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            out["body"] += message.get("body", b"")
+
+    asyncio.run(asyncio.wait_for(app(scope, receive, send), 10))
+    return out["status"], json.loads(out["body"] or b"null")
+
+def test_every_metrics_route_is_protected():
+    for route in internal_metrics.router.routes:
+        assert any(d.dependency is internal_metrics.require_internal for d in route.dependencies), route.path
+
+def test_no_token_allows_only_loopback(monkeypatch):
+    monkeypatch.setattr(internal_metrics, "METRICS_TOKEN", "")
+    assert _get("/internal/metrics/pdf-cache")[0] == 403
+    status, body = _get("/internal/metrics/pdf-cache", client=("127.0.0.1", 40000))
+    assert status == 200 and "hits" in body
+
+@pytest.mark.parametrize("headers, status", [
+    ((), 403),
+    ((("authorization", "Bearer wrong"),), 403),
+    ((("x-metrics-token", "s3cret-"),), 403),
+    ((("authorization", "Bearer s3cret"),), 200),
+    ((("authorization", "bearer  s3cret"),), 200),
+    ((("x-metrics-token", "s3cret"),), 200),
+])
+def test_token_required_when_configured(monkeypatch, headers, status):
+    monkeypatch.setattr(internal_metrics, "METRICS_TOKEN", "s3cret")
+    assert _get("/internal/metrics/master-cache", headers)[0] == status
+
+def test_token_configured_loopback_still_needs_token(monkeypatch):
+    monkeypatch.setattr(internal_metrics, "METRICS_TOKEN", "s3cret")
+    assert _get("/internal/metrics/pdf-cache", client=("127.0.0.1", 40000))[0] == 403
@@ -0,0 +1,161 @@
+# tests/test_invoice_export.py
+"""งาน export batch เขียน PDF ทีละใบ (ZIP / PDF รวม) ตามลำดับบิล"""
+import io
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi import HTTPException
+from pypdf import PdfReader, PdfWriter
+
+from app import invoice_export, pdf_cache, pdf_pool
+
+
+def _pdf(width: int) -> bytes:
+    # PDF หน้าเดียว ใช้ความกว้างหน้าเป็นตัวระบุว่ามาจากใบไหน
+    w = PdfWriter()
+    w.add_blank_page(width=width, height=100)
+    buf = io.BytesIO()
+    w.write(buf)
+    return buf.getvalue()
+
+@pytest.fixture
+def job(monkeypatch, tmp_path):
+    executor = ThreadPoolExecutor(max_workers=4)
+    rendered = []
+    in_flight = {"now": 0, "max": 0}
+    lock = threading.Lock()
+
+    def render(width):
+        time.sleep(0.01)
+        with lock:
+            in_flight["now"] -= 1
+        return _pdf(width)
+
+    def submit(html, base_url=None, stylesheet=None):
+        rendered.append(html)
+        with lock:
+            in_flight["now"] += 1
+            in_flight["max"] = max(in_flight["max"], in_flight["now"])
+        return executor.submit(render, int(html))
+
+    monkeypatch.setattr(pdf_cache, "CACHE_DIR", tmp_path / "cache")
+    monkeypatch.setattr(pdf_cache, "_total_bytes", None)
+    monkeypatch.setattr(pdf_cache, "_stores_since_scan", 0)
+    monkeypatch.setattr(pdf_pool, "submit", submit)
+    monkeypatch.setattr(invoice_export, "build_multi_variant_html", lambda p: str(p["width"]))
+    monkeypatch.setattr(invoice_export.tempfile, "gettempdir", lambda: str(tmp_path))
+
+    def run(fmt, payloads):
+        monkeypatch.setattr(invoice_export, "_load_payloads", lambda _p: payloads)
+        invoice_export._jobs["j1"] = {"done": 0, "status": "queued"}
+        invoice_export._run_job("j1", invoice_export.ExportBatchPayload(idxs=[1], format=fmt))
+        return invoice_export._jobs.pop("j1")
+
+    run.rendered = rendered
+    run.in_flight = in_flight
+    yield run
+    executor.shutdown(wait=True)
+
+PAYLOADS = [
+    {"invoice_number": "IV1", "width": 101},
+    {"invoice_number": "IV2", "width": 102},
+    {"invoice_number": "IV1", "width": 103},
+    {"invoice_number": None, "width": 104},
+    {"invoice_number": "IV5", "width": 105},
+]
+
+def test_zip_export(job):
+    result = job("zip", PAYLOADS)
+    assert result["status"] == "done", result.get("error")
+    assert result["done"] == len(PAYLOADS)
+    with zipfile.ZipFile(result["path"]) as zf:
+        names = sorted(zf.namelist())
+        assert names == sorted(["invoice_IV1.pdf", "invoice_IV2.pdf", "invoice_IV1_1.pdf",
+                                "invoice_doc.pdf", "invoice_IV5.pdf"])
+        page = PdfReader(io.BytesIO(zf.read("invoice_IV1_1.pdf"))).pages[0]
+        assert float(page.mediabox.width) == 103
+
+def test_merged_export_keeps_invoice_order(job):
+    result = job("pdf", PAYLOADS)
+    assert result["status"] == "done", result.get("error")
+    widths = [float(p.mediabox.width) for p in PdfReader(result["path"]).pages]
+    assert widths == [101, 102, 103, 104, 105]
+
+def test_second_export_uses_cache(job):
+    job("pdf", PAYLOADS)
+    job.rendered.clear()
+    result = job("pdf", PAYLOADS)
+    assert result["status"] == "done"
+    assert job.rendered == []
+
+def test_failed_render_reports_error(job, monkeypatch):
+    def boom(html, base_url=None, stylesheet=None):
+        raise RuntimeError("renderer down")
+    monkeypatch.setattr(pdf_pool, "submit", boom)
+    result = job("zip", PAYLOADS)
+    assert result["status"] == "error"
+    assert "renderer down" in result["error"]
+
+def test_merged_pdf_has_lower_cap(monkeypatch):
+    monkeypatch.setattr(invoice_export, "EXPORT_MERGED_MAX", 3)
+    monkeypatch.setattr(invoice_export, "EXPORT_BATCH_MAX", 10)
+    with pytest.raises(HTTPException) as e:
+        invoice_export.create_export_batch(invoice_export.ExportBatchPayload(idxs=[1, 2, 3, 4], format="pdf"))
+    assert e.value.status_code == 400
+    assert invoice_export._max_invoices("zip") == 10
+
+def test_batch_renders_share_one_limit(job, monkeypatch):
+    monkeypatch.setattr(invoice_export, "EXPORT_RENDERS", 2)
+    monkeypatch.setattr(invoice_export, "_render_slots", threading.BoundedSemaphore(2))
+    payloads = [{"invoice_number": f"IV{n}", "width": 100 + n} for n in range(12)]
+    for jid in ("a", "b"):
+        invoice_export._jobs[jid] = {"done": 0}
+    try:
+        # สองงานพร้อมกัน รวมกันต้องไม่เกิน EXPORT_RENDERS
+        threads = [
+            threading.Thread(target=invoice_export._render_each, args=(jid, part, lambda i, data: None))
+            for jid, part in (("a", payloads[:6]), ("b", payloads[6:]))
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(10)
+        assert [invoice_export._jobs[j]["done"] for j in ("a", "b")] == [6, 6]
+    finally:
+        for jid in ("a", "b"):
+            invoice_export._jobs.pop(jid, None)
+    assert job.in_flight["max"] <= 2
+
+def test_full_queue_returns_503(monkeypatch):
+    started = []
+    monkeypatch.setattr(invoice_export, "EXPORT_MAX_JOBS", 1)
+    monkeypatch.setattr(invoice_export, "EXPORT_QUEUE_DEPTH", 1)
+    monkeypatch.setattr(invoice_export, "_jobs", {
+        "running": {"finished_at": None},
+        "queued": {"finished_at": None},
+        "old": {"finished_at": time.time()},
+    })
+
+    class NoThread:
+        def __init__(self, target, args, daemon):
+            self.args = args
+
+        def start(self):
+            started.append(self.args)
+
+    monkeypatch.setattr(invoice_export.threading, "Thread", NoThread)
+    payload = invoice_export.ExportBatchPayload(idxs=[1], format="zip")
+    with pytest.raises(HTTPException) as e:
+        invoice_export.create_export_batch(payload)
+    assert e.value.status_code == 503
+    assert e.value.headers["Retry-After"] == str(invoice_export.RETRY_AFTER)
+    assert started == []
+
+    # งานที่เสร็จแล้วไม่นับ: มีที่ว่างเมื่องานหนึ่งจบ
+    invoice_export._jobs["queued"]["finished_at"] = time.time()
+    out = invoice_export.create_export_batch(payload)
+    assert out["job_id"] in invoice_export._jobs
+    assert len(started) == 1
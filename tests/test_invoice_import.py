@@ -0,0 +1,298 @@
+# tests/test_invoice_import.py
+"""นำเข้าใบกำกับจาก CSV / XLSX: อ่านหัวคอลัมน์, รวมแถวเป็นบิล, ตรวจกับทะเบียน และรายงานแถวที่ผิด"""
+import io
+from datetime import date, datetime
+
+import pytest
+from fastapi import HTTPException, UploadFile
+from sqlalchemy import text
+
+from app import invoice_import, master_cache, models
+from app.database import SessionLocal
+from app.invoice_import import ImportFileError
+from tests.test_revenue_rollup import _rollup_matches
+
+CUSTOMERS = [
+    {"personid": "C001", "fname": "ศรีสมบูรณ์", "cf_taxid": "0105500000001", "cf_personaddress": "กาญจนบุรี",
+     "cf_personzipcode": "71000", "cf_provincename": "กาญจนบุรี", "cf_branch": None, "tel": None,
+     "mobile": "0810000000", "fmlpaymentcreditday": 30},
+    {"personid": "1001", "fname": "ลูกค้ารหัสตัวเลข", "fmlpaymentcreditday": None},
+]
+PRODUCTS = [
+    {"cf_itemid": "P01", "cf_itemname": "หินคลุก", "cf_unitname": "ตัน", "cf_itempricelevel_price": 250.0},
+    {"cf_itemid": "101", "cf_itemname": "ทราย", "cf_unitname": "คิว", "cf_itempricelevel_price": 300.0},
+]
+DRIVERS = [{"driver_id": "D01", "first_name": "สมชาย"}]
+
+
+class FakeDB:
+    """session ปลอม: เลขที่บิลที่มีอยู่แล้ว + นับ commit / rollback"""
+    def __init__(self, existing=()):
+        self.existing = list(existing)
+        self.commits = self.rollbacks = 0
+
+    def query(self, *args):
+        return self
+
+    def filter(self, *args):
+        return iter([(n,) for n in self.existing])
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+@pytest.fixture
+def registry(monkeypatch):
+    entries = {
+        "customers": master_cache.Entry("customers", CUSTOMERS, 0),
+        "products": master_cache.Entry("products", PRODUCTS, 0),
+        "drivers": master_cache.Entry("drivers", DRIVERS, 0),
+    }
+    monkeypatch.setattr(invoice_import.master_cache, "get", lambda name: entries[name])
+    inserted = []
+
+    def fake_insert(db, invoices):
+        inserted.extend(invoices)
+        return list(range(1, len(invoices) + 1)), sum(len(i.lines) for i in invoices)
+
+    monkeypatch.setattr(invoice_import, "_insert", fake_insert)
+    return inserted
+
+def _csv(content: str) -> io.BytesIO:
+    return io.BytesIO(content.encode("utf-8-sig"))
+
+def _rows(content: str):
+    return list(invoice_import._read_rows(_csv(content), "data.csv"))
+
+
+# ---------- อ่านไฟล์ ----------
+def test_header_aliases_and_blank_rows():
+    rows = _rows(
+        "Invoice Number,PersonID,Customer_Name,Product Code,Description,Quantity,Price,หมายเหตุ\n"
+        "IV1,C001,ร้านเอ,P01,หิน,2,100,ไม่ใช้\n"
+        ",,,,,,,\n"
+        "\n"
+        "IV1,C001,,P01,,3,,\n"
+    )
+    assert [n for n, _ in rows] == [2, 5]
+    first = rows[0][1]
+    assert first["fname"] == "ร้านเอ"
+    assert first["cf_itemid"] == "P01"
+    assert first["cf_itemname"] == "หิน"
+    assert first["unit_price"] == "100"
+    assert "หมายเหตุ" not in first and None not in first
+
+def test_missing_required_columns():
+    with pytest.raises(ImportFileError, match="personid, cf_itemid"):
+        _rows("invoice_number,quantity\nIV1,1\n")
+
+def test_empty_file():
+    with pytest.raises(ImportFileError, match="empty"):
+        _rows("")
+
+def test_too_many_rows(monkeypatch):
+    monkeypatch.setattr(invoice_import, "IMPORT_MAX_ROWS", 2)
+    with pytest.raises(ImportFileError, match="too many rows"):
+        _rows("invoice_number,personid,cf_itemid,quantity\n" + "IV1,C001,P01,1\n" * 3)
+
+def test_excel_numeric_codes():
+    openpyxl = pytest.importorskip("openpyxl")
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(["invoice_number", "invoice_date", "personid", "product_code", "quantity"])
+    ws.append([6901001, datetime(2026, 1, 5), 1001, 101.0, 2.5])
+    ws.append([None, None, None, None, None])
+    buf = io.BytesIO()
+    wb.save(buf)
+    buf.seek(0)
+
+    invoices = invoice_import._group(invoice_import._read_rows(buf, "scale.XLSX"))
+    inv = invoices["6901001"]
+    assert inv.errors == []
+    assert inv.head["personid"] == "1001"
+    assert inv.head["invoice_date"] == date(2026, 1, 5)
+    assert inv.lines[0]["cf_itemid"] == "101"
+    assert inv.lines[0]["quantity"] == 2.5
+
+def test_text_of_excel_numbers():
+    assert invoice_import._text(12.0) == "12"
+    assert invoice_import._text(12.5) == "12.5"
+    assert invoice_import._text(None) == ""
+    assert invoice_import._text("  x ") == "x"
+
+
+# ---------- รวมเป็นบิล ----------
+def test_group_rows_and_inconsistent_heads():
+    invoices = invoice_import._group(_rows(
+        "invoice_number,invoice_date,personid,driver_id,cf_itemid,quantity\n"
+        "IV1,2026-01-05,C001,D01,P01,1\n"
+        "IV2,05/01/2026,C001,,P01,2\n"
+        "IV1,,,,P01,3\n"                 # หัวบิลว่าง = ใช้ของแถวแรก
+        "IV1,2026-01-06,C001,,P01,4\n"   # วันที่ขัดกับแถวแรก
+        "IV2,,C002,,P01,5\n"             # ลูกค้าขัดกับแถวแรก
+    ))
+    iv1, iv2 = invoices["IV1"], invoices["IV2"]
+    assert [line["row"] for line in iv1.lines] == [2, 4]
+    assert iv1.errors == [{"row": 5, "invoice_number": "IV1", "error": "invoice_date differs from row 2"}]
+    assert iv2.head["invoice_date"] == date(2026, 1, 5)
+    assert iv2.errors == [{"row": 6, "invoice_number": "IV2", "error": "personid differs from row 3"}]
+
+def test_group_row_errors():
+    invoices = invoice_import._group(_rows(
+        "invoice_number,invoice_date,personid,cf_itemid,quantity,amount\n"
+        ",2026-01-05,C001,P01,1,\n"
+        "IV1,2026-13-40,C001,P01,1,\n"
+        "IV2,2026-01-05,C001,P01,,\n"
+        "IV3,2026-01-05,C001,P01,1,abc\n"
+        "IV4,2026-01-05,C001,P01,\"1,500\",\n"
+    ))
+    errors = {n: inv.errors[0]["error"] for n, inv in invoices.items() if inv.errors}
+    assert errors == {
+        "": "missing invoice_number",
+        "IV1": "invalid date '2026-13-40'",
+        "IV2": "missing quantity",
+        "IV3": "invalid amount 'abc'",
+    }
+    assert invoices["IV4"].lines[0]["quantity"] == 1500.0
+
+
+# ---------- ตรวจกับทะเบียน ----------
+def test_validate_fills_from_registry(registry):
+    invoices = invoice_import._group(_rows(
+        "invoice_number,invoice_date,personid,cf_itemid,quantity,unit_price\n"
+        "IV1,2026-01-05,C001,P01,2,\n"
+        "IV1,,,101,1,280\n"
+    ))
+    invoice_import._validate(FakeDB(), invoices)
+    inv = invoices["IV1"]
+    assert inv.errors == []
+    assert inv.head["fname"] == "ศรีสมบูรณ์"
+    assert inv.head["cf_taxid"] == "0105500000001"
+    assert inv.head["due_date"] == date(2026, 2, 4)   # เครดิต 30 วันจากทะเบียนลูกค้า
+    p01, sand = inv.lines
+    assert (p01["cf_itemname"], p01["cf_unitname"], p01["unit_price"], p01["amount"]) == ("หินคลุก", "ตัน", 250.0, 500.0)
+    assert (sand["unit_price"], sand["amount"]) == (280.0, 280.0)
+
+def test_validate_reports_unknown_references(registry):
+    invoices = invoice_import._group(_rows(
+        "invoice_number,personid,driver_id,cf_itemid,quantity\n"
+        "IV1,C999,,P01,1\n"
+        "IV2,C001,D99,P01,1\n"
+        "IV3,C001,,XX,1\n"
+        "IV4,C001,,P01,1\n"
+    ))
+    invoice_import._validate(FakeDB(existing=["IV4"]), invoices)
+    errors = {n: [e["error"] for e in inv.errors] for n, inv in invoices.items()}
+    assert errors == {
+        "IV1": ["unknown personid 'C999'"],
+        "IV2": ["unknown driver_id 'D99'"],
+        "IV3": ["unknown cf_itemid 'XX'"],
+        "IV4": ["invoice_number already exists"],
+    }
+
+
+# ---------- import_file ----------
+MIXED = (
+    "invoice_number,invoice_date,personid,cf_itemid,quantity\n"
+    "IV1,2026-01-05,C001,P01,1\n"
+    "IV2,2026-01-05,C001,XX,1\n"
+    "IV1,2026-01-05,C001,101,2\n"
+    "IV3,2026-01-05,C999,P01,1\n"
+    "IV2,2026-01-05,C001,P01,1\n"
+)
+
+def test_partial_import_skips_bad_invoices(registry):
+    db = FakeDB()
+    report = invoice_import.import_file(db, _csv(MIXED), "data.csv")
+    assert [inv.number for inv in registry] == ["IV1"]
+    assert db.commits == 1
+    assert report["ok"] is False
+    assert (report["invoices"], report["items"], report["skipped_invoices"]) == (1, 2, 2)
+    assert [(e["row"], e["invoice_number"]) for e in report["errors"]] == [(3, "IV2"), (5, "IV3")]
+
+def test_strict_import_saves_nothing(registry):
+    db = FakeDB()
+    report = invoice_import.import_file(db, _csv(MIXED), "data.csv", strict=True)
+    assert registry == [] and db.commits == 0
+    assert (report["invoices"], report["items"], report["error_count"]) == (0, 0, 2)
+
+def test_dry_run_saves_nothing(registry):
+    db = FakeDB()
+    report = invoice_import.import_file(db, _csv(MIXED), "data.csv", dry_run=True)
+    assert registry == [] and db.commits == 0
+    assert report["dry_run"] is True and report["invoices"] == 1
+
+def test_failed_insert_rolls_back(registry, monkeypatch):
+    def boom(db, invoices):
+        raise RuntimeError("db down")
+    monkeypatch.setattr(invoice_import, "_insert", boom)
+    db = FakeDB()
+    with pytest.raises(RuntimeError):
+        invoice_import.import_file(db, _csv(MIXED), "data.csv")
+    assert (db.commits, db.rollbacks) == (0, 1)
+
+def test_api_status_codes(registry):
+    def upload(content):
+        return UploadFile(file=_csv(content), filename="data.csv")
+
+    with pytest.raises(HTTPException) as e:
+        invoice_import.api_import_invoices(upload(MIXED), dry_run=False, strict=True, db=FakeDB())
+    assert e.value.status_code == 422
+    assert e.value.detail["error_count"] == 2
+
+    with pytest.raises(HTTPException) as e:
+        invoice_import.api_import_invoices(upload("invoice_number\nIV1\n"), dry_run=False, strict=False, db=FakeDB())
+    assert e.value.status_code == 400
+
+    report = invoice_import.api_import_invoices(upload(MIXED), dry_run=True, strict=False, db=FakeDB())
+    assert report["error_count"] == 2
+
+
+# ---------- PostgreSQL ----------
+@pytest.fixture
+def masters(pg):
+    with SessionLocal() as db:
+        db.add(models.CustomerList(personid="C001", fname="ศรีสมบูรณ์", fmlpaymentcreditday=30))
+        db.add(models.ProductList(cf_itemid="P01", cf_itemname="หินคลุก", cf_unitname="ตัน", cf_itempricelevel_price=250))
+        db.add(models.ProductList(cf_itemid="P02", cf_itemname="ทราย", cf_unitname="คิว", cf_itempricelevel_price=300))
+        db.commit()
+    master_cache.invalidate("customers", "products", "drivers")
+    yield pg
+    master_cache.invalidate("customers", "products", "drivers")
+
+def test_insert_and_rollups(masters):
+    content = (
+        "invoice_number,invoice_date,personid,grn_number,cf_itemid,quantity,unit_price\n"
+        "IV1,2026-01-05,C001,GRN-1,P01,2,\n"
+        "IV1,2026-01-05,C001,GRN-1,P02,1,280\n"
+        "IV2,2026-01-06,C001,,P01,4,240\n"
+    )
+    with SessionLocal() as db:
+        report = invoice_import.import_file(db, _csv(content), "data.csv")
+    assert report["ok"] and (report["invoices"], report["items"]) == (2, 3)
+
+    with SessionLocal() as db:
+        invs = {i.invoice_number: i for i in db.query(models.Invoice)}
+        assert invs["IV1"].due_date == date(2026, 2, 4)
+        items = db.query(models.InvoiceItem).order_by(models.InvoiceItem.idx).all()
+        assert [(it.invoice_idx, it.invoice_number, it.cf_items_ordinary, it.amount) for it in items] == [
+            (invs["IV1"].idx, str(invs["IV1"].idx), 1, 500.0),
+            (invs["IV1"].idx, str(invs["IV1"].idx), 2, 280.0),
+            (invs["IV2"].idx, str(invs["IV2"].idx), 1, 960.0),
+        ]
+
+    _rollup_matches(masters)
+    with masters.connect() as conn:
+        grn = conn.execute(text("SELECT invoice_count, quantity_sum FROM ss_invoices.grn_index "
+                                "WHERE grn_number = 'GRN-1'")).one()
+        assert (grn[0], float(grn[1])) == (1, 3.0)
+        price = conn.execute(text("SELECT price FROM ss_invoices.product_last_price "
+                                  "WHERE cf_itemid = 'P01' AND personid = 'C001'")).scalar()
+        assert float(price) == 240.0
+
+    # นำเข้าไฟล์เดิมซ้ำ: เลขที่บิลมีอยู่แล้ว ไม่บันทึกซ้ำ
+    with SessionLocal() as db:
+        again = invoice_import.import_file(db, _csv(content), "data.csv")
+    assert again["invoices"] == 0 and again["skipped_invoices"] == 2
@@ -0,0 +1,87 @@
+# tests/test_invoice_list.py
+"""
+/api/invoices แบบ keyset: ลำดับเดียวกับก่อนแบ่งหน้า (invoice_date desc โดยบิลที่ไม่มีวันที่ขึ้นก่อน, idx desc)
+และเดินทีละหน้าแล้วได้ลำดับเดียวกับคิวรีเดียว
+"""
+import asyncio
+from datetime import date
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException, Response
+from sqlalchemy.dialects import postgresql
+
+from app import models, summary_invoices
+from app.database import AsyncReadSessionLocal, SessionLocal, async_read_engine
+
+
+class FakeAsyncDB:
+    """session ปลอม: เก็บ statement ที่ถูก execute แล้วคืนผลว่าง"""
+    def __init__(self):
+        self.statements = []
+
+    async def execute(self, stmt, *args, **kwargs):
+        self.statements.append(stmt)
+        return SimpleNamespace(all=lambda: [])
+
+def _list_sql(cursor=None) -> str:
+    db = FakeAsyncDB()
+    asyncio.run(summary_invoices.api_invoices_list(
+        Response(), start=None, end=None, qtext=None, limit=10, cursor=cursor, include_items=False, db=db,
+    ))
+    return str(db.statements[0].compile(dialect=postgresql.dialect())).upper()
+
+def test_list_orders_undated_first():
+    assert "INVOICE_DATE DESC NULLS FIRST" in _list_sql()
+
+def test_dated_cursor_is_row_comparison_only():
+    where = _list_sql("2026-01-05|7").split("WHERE", 1)[1]
+    assert "IS NULL" not in where.split("ORDER BY")[0]
+
+def test_undated_cursor_continues_into_dated_rows():
+    where = _list_sql("|7").split("WHERE", 1)[1].split("ORDER BY")[0]
+    assert "INVOICE_DATE IS NULL" in where and "INVOICE_DATE IS NOT NULL" in where
+
+def test_invalid_cursor():
+    with pytest.raises(HTTPException) as e:
+        _list_sql("garbage")
+    assert e.value.status_code == 400
+
+
+# ---------- PostgreSQL ----------
+DATES = [date(2026, 1, 5), None, date(2026, 1, 7), date(2026, 1, 5), None, date(2026, 1, 6), None]
+
+@pytest.fixture
+def invoices(pg):
+    with SessionLocal() as db:
+        rows = [models.Invoice(invoice_number=f"IV{n}", invoice_date=d) for n, d in enumerate(DATES)]
+        db.add_all(rows)
+        db.commit()
+        # ไม่มีวันที่ก่อน (idx desc) แล้วใหม่ -> เก่า (idx desc)
+        expected = sorted(rows, key=lambda r: (r.invoice_date is not None, -(r.invoice_date or date.min).toordinal(), -r.idx))
+        return [r.invoice_number for r in expected]
+
+async def _walk(limit: int):
+    seen, cursor = [], None
+    try:
+        while True:
+            response = Response()
+            async with AsyncReadSessionLocal() as db:
+                rows = await summary_invoices.api_invoices_list(
+                    response, start=None, end=None, qtext=None, limit=limit, cursor=cursor,
+                    include_items=False, db=db,
+                )
+            seen += [r["invoice_number"] for r in rows]
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                return seen
+    finally:
+        await async_read_engine.dispose()
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 100])
+def test_pages_match_single_query(invoices, limit):
+    assert asyncio.run(_walk(limit)) == invoices
+
+def test_export_matches_list_order(invoices):
+    exported = [row[1] for row in summary_invoices._iter_invoice_export_rows(None, None, None) if row[1]]
+    assert exported == invoices
@@ -0,0 +1,72 @@
+# tests/test_pdf_cache.py
+import os
+import time
+
+import pytest
+
+from app import pdf_cache
+
+
+@pytest.fixture
+def cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(pdf_cache, "CACHE_DIR", tmp_path)
+    monkeypatch.setattr(pdf_cache, "MAX_BYTES", 1000)
+    monkeypatch.setattr(pdf_cache, "RESCAN_EVERY", 500)
+    monkeypatch.setattr(pdf_cache, "_total_bytes", None)
+    monkeypatch.setattr(pdf_cache, "_stores_since_scan", 0)
+    scans = []
+    real_entries = pdf_cache._entries
+    def entries():
+        scans.append(1)
+        return real_entries()
+    monkeypatch.setattr(pdf_cache, "_entries", entries)
+    return scans
+
+def _files(path):
+    return sorted(p.name for p in path.glob("*.pdf"))
+
+def _disk_bytes(path):
+    return sum(p.stat().st_size for p in path.glob("*.pdf"))
+
+def test_store_scans_only_first_time_while_under_limit(cache, tmp_path):
+    for n in range(5):
+        pdf_cache.store(f"invoice-IV{n}", f"<p>{n}</p>", None, b"x" * 100)
+    assert len(cache) == 1
+    assert pdf_cache._total_bytes == _disk_bytes(tmp_path) == 500
+
+def test_replacing_same_document_is_not_double_counted(cache, tmp_path):
+    pdf_cache.store("invoice-IV1", "<p>1</p>", None, b"x" * 100)
+    pdf_cache.store("invoice-IV1", "<p>1</p>", None, b"x" * 300)
+    assert pdf_cache._total_bytes == _disk_bytes(tmp_path) == 300
+
+def test_over_limit_evicts_least_recently_used(cache, tmp_path):
+    for n in range(4):
+        pdf_cache.store(f"invoice-IV{n}", f"<p>{n}</p>", None, b"x" * 300)
+        # mtime ต่างกันชัดเจน (LRU)
+        for p in tmp_path.glob(f"invoice-IV{n}__*.pdf"):
+            os.utime(p, (time.time() - 100 + n, time.time() - 100 + n))
+    assert _disk_bytes(tmp_path) <= 1000
+    assert pdf_cache._total_bytes == _disk_bytes(tmp_path)
+    assert not list(tmp_path.glob("invoice-IV0__*.pdf"))
+    assert list(tmp_path.glob("invoice-IV3__*.pdf"))
+
+def test_invalidate_updates_total(cache, tmp_path):
+    pdf_cache.store("invoice-IV1", "<p>1</p>", None, b"x" * 100)
+    pdf_cache.store("invoice-IV2", "<p>2</p>", None, b"x" * 200)
+    assert pdf_cache.invalidate("invoice-IV2") == 1
+    assert pdf_cache._total_bytes == _disk_bytes(tmp_path) == 100
+
+def test_periodic_rescan_picks_up_outside_changes(cache, tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_cache, "RESCAN_EVERY", 3)
+    pdf_cache.store("invoice-IV1", "<p>1</p>", None, b"x" * 100)
+    (tmp_path / "invoice-OTHER__abc.pdf").write_bytes(b"y" * 250)   # เขียนโดย process อื่น
+    for n in range(2, 6):
+        pdf_cache.store(f"invoice-IV{n}", f"<p>{n}</p>", None, b"x" * 100)
+    assert len(cache) == 2
+    assert pdf_cache._total_bytes == _disk_bytes(tmp_path)
+
+def test_disabled_cache_stores_nothing(cache, tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_cache, "MAX_BYTES", 0)
+    pdf_cache.store("invoice-IV1", "<p>1</p>", None, b"x")
+    assert _files(tmp_path) == []
+    assert pdf_cache.lookup("invoice-IV1", "<p>1</p>") is None
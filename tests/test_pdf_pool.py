@@ -0,0 +1,50 @@
+# tests/test_pdf_pool.py
+"""slot ของคิวเรนเดอร์ถูกคืนเมื่องานจบจริง (รวมงานที่ request เลิกรอเพราะ timeout)"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi import HTTPException
+
+from app import pdf_pool
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    # แทน process pool ด้วย thread pool และงานเรนเดอร์ที่รอสัญญาณ
+    release = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(pdf_pool, "_get_executor", lambda: executor)
+    monkeypatch.setattr(pdf_pool, "_render", lambda html, base_url, stylesheet: release.wait(5) and b"%PDF")
+    monkeypatch.setattr(pdf_pool, "_slots", threading.BoundedSemaphore(1))
+    monkeypatch.setattr(pdf_pool, "RENDER_TIMEOUT", 0.05)
+    yield release
+    release.set()
+    executor.shutdown(wait=True)
+
+def _wait_for_slot():
+    # done callback อาจทำงานหลัง result() คืนค่าไม่กี่ไมโครวินาที
+    assert pdf_pool._slots.acquire(timeout=5)
+    pdf_pool._slots.release()
+
+def test_timed_out_render_keeps_its_slot(pool):
+    with pytest.raises(HTTPException) as exc:
+        pdf_pool.render_pdf("<p>1</p>")
+    assert exc.value.status_code == 504
+
+    # งานแรกยังเรนเดอร์อยู่ -> คิวเต็ม ตอบ 503
+    with pytest.raises(HTTPException) as exc:
+        pdf_pool.render_pdf("<p>2</p>")
+    assert exc.value.status_code == 503
+    assert exc.value.headers["Retry-After"] == str(pdf_pool.RETRY_AFTER)
+
+    # งานแรกเสร็จ -> slot ว่าง
+    pool.set()
+    _wait_for_slot()
+    assert pdf_pool.render_pdf("<p>3</p>") == b"%PDF"
+
+def test_finished_render_releases_slot(pool):
+    pool.set()
+    assert pdf_pool.render_pdf("<p>1</p>") == b"%PDF"
+    _wait_for_slot()
+    assert pdf_pool.render_pdf("<p>2</p>") == b"%PDF"
@@ -0,0 +1,99 @@
+# tests/test_periods.py
+import json
+from datetime import date
+
+import pytest
+from sqlalchemy import select, text
+from sqlalchemy.dialects import postgresql
+
+from app import models, periods, saletax_report
+
+
+# ---------- ช่วงครึ่งเปิด [a, b) ----------
+def test_day_range_includes_end_day():
+    assert periods.day_range("2026-03-01", "2026-03-31") == (date(2026, 3, 1), date(2026, 4, 1))
+    assert periods.day_range(date(2026, 12, 31), date(2026, 12, 31)) == (date(2026, 12, 31), date(2027, 1, 1))
+
+def test_day_range_open_ends_and_invalid_input():
+    assert periods.day_range("2026-03-01", None) == (date(2026, 3, 1), None)
+    assert periods.day_range(None, "2026-02-28") == (None, date(2026, 3, 1))
+    assert periods.day_range("", "") == (None, None)
+    assert periods.day_range("01/03/2026", "2026-02-30") == (None, None)
+
+@pytest.mark.parametrize("month, expected", [
+    ("2026-01", (date(2026, 1, 1), date(2026, 2, 1))),
+    ("2024-02", (date(2024, 2, 1), date(2024, 3, 1))),
+    ("2026-12", (date(2026, 12, 1), date(2027, 1, 1))),
+])
+def test_month_range(month, expected):
+    assert periods.month_range(month) == expected
+
+@pytest.mark.parametrize("month", [None, "", "2026", "2026-1", "2026-13", "2026-00", "abcd-ef", "2026-01-15"])
+def test_month_range_invalid(month):
+    assert periods.month_range(month) == (None, None)
+
+def test_year_range():
+    assert periods.year_range(2026) == (date(2026, 1, 1), date(2027, 1, 1))
+    assert periods.year_range(None) == (None, None)
+    assert periods.year_range(0) == (None, None)
+    assert periods.year_range(10000) == (None, None)
+
+def test_period_range_without_granularity_prefers_month_then_year():
+    assert periods.period_range(None, "2026-01-01", "2026-01-10", month="2026-05", year=2020) == (date(2026, 5, 1), date(2026, 6, 1))
+    assert periods.period_range(None, "2026-01-01", "2026-01-10", year=2020) == (date(2020, 1, 1), date(2021, 1, 1))
+    assert periods.period_range(None, "2026-01-01", "2026-01-10") == (date(2026, 1, 1), date(2026, 1, 11))
+    # month ผิดรูปแบบ -> ใช้ year / start-end แทน
+    assert periods.period_range(None, month="2026-5", year=2020) == (date(2020, 1, 1), date(2021, 1, 1))
+
+def test_period_range_with_granularity():
+    kw = dict(start="2026-01-01", end="2026-01-10", month="2026-05", year=2020)
+    assert periods.period_range("day", **kw) == (date(2026, 1, 1), date(2026, 1, 11))
+    assert periods.period_range("month", **kw) == (date(2026, 5, 1), date(2026, 6, 1))
+    assert periods.period_range("year", **kw) == (date(2020, 1, 1), date(2021, 1, 1))
+    assert periods.period_range("month") == (None, None)
+
+def test_apply_emits_plain_range_predicates():
+    inv = models.Invoice
+    q = periods.apply(select(inv.idx), inv.invoice_date, "month", month="2026-12")
+    sql = str(q.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+    assert "invoices.invoice_date >= '2026-12-01'" in sql
+    assert "invoices.invoice_date < '2027-01-01'" in sql
+    assert "to_char" not in sql and "EXTRACT" not in sql.upper()
+
+def test_apply_without_range_adds_no_filter():
+    inv = models.Invoice
+    q = periods.apply(select(inv.idx), inv.invoice_date)
+    assert "WHERE" not in str(q.compile(dialect=postgresql.dialect()))
+
+
+# ---------- EXPLAIN: ตัวกรองใช้ index ของคอลัมน์วันที่ได้ ----------
+def _plan_nodes(node):
+    yield node
+    for child in node.get("Plans", ()):
+        yield from _plan_nodes(child)
+
+def _index_names(conn, q) -> set:
+    sql = q.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
+    with conn.begin():
+        # ตารางทดสอบเล็ก: ปิด seq scan ให้ planner เลือก index ถ้าเงื่อนไขใช้ index ได้
+        conn.execute(text("SET LOCAL enable_seqscan = off"))
+        plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return {n.get("Index Name") for n in _plan_nodes(plan[0]["Plan"]) if n.get("Index Name")}
+
+@pytest.mark.parametrize("kw", [
+    dict(month="2026-12"),
+    dict(year=2026),
+    dict(start="2026-01-01", end="2026-01-31"),
+])
+def test_saletax_list_uses_invoice_date_index(pg, kw):
+    q = saletax_report._saletax_list_query(kw.get("start"), kw.get("end"), kw.get("month"), kw.get("year"))
+    with pg.connect() as conn:
+        assert "ix_ss_invoices_invoices_invoice_date" in _index_names(conn, q)
+
+def test_revenue_summary_uses_rollup_day_key(pg):
+    rd = models.RevenueDaily
+    q = periods.apply(select(rd.day, rd.amount), rd.day, "month", month="2026-12")
+    with pg.connect() as conn:
+        assert "revenue_daily_pkey" in _index_names(conn, q)
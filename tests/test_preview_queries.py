@@ -0,0 +1,228 @@
+# tests/test_preview_queries.py
+"""
+หน้ารายละเอียดใบวางบิล / ใบกำกับที่ยังไม่วางบิล / preview ใบลดหนี้ ตอบด้วยคิวรีเดียว
+และรูปแบบ response เหมือนเดิมในกรณีว่าง / ไม่พบ
+"""
+from contextlib import contextmanager
+from datetime import date
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import event
+from starlette.requests import Request
+
+from app import bill_note, credit_note, invoice_items, models
+from app.database import SessionLocal
+
+
+def _request(path: str = "/credit_note.html") -> Request:
+    return Request({"type": "http", "method": "GET", "path": path, "headers": [], "query_string": b""})
+
+class FakeDB:
+    """session ปลอม: คืนแถวที่กำหนดและนับจำนวนครั้งที่ execute"""
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = 0
+
+    def execute(self, *args, **kwargs):
+        self.calls += 1
+        return SimpleNamespace(all=lambda: list(self.rows))
+
+def _bill_note(**kw):
+    fields = dict(billnote_number="BNTS2601001", bill_date=date(2026, 1, 20), payment_duedate=date(2026, 2, 19),
+                  prename="บริษัท", fname="ศรีสมบูรณ์", personid="C001", cf_taxid="0105500000001",
+                  cf_personaddress="กาญจนบุรี")
+    fields.update(kw)
+    return models.BillNote(**fields)
+
+def _customer(**kw):
+    fields = dict(idx=7, prename="บริษัท", fname="ศรีสมบูรณ์", personid="C001", cf_taxid="0105500000001",
+                  cf_personaddress="กาญจนบุรี", cf_hq=0, cf_branch="00002")
+    fields.update(kw)
+    return models.CustomerList(**fields)
+
+
+# ---------- รูปแบบ response (session ปลอม) ----------
+def test_bill_note_not_found():
+    db = FakeDB([])
+    with pytest.raises(HTTPException) as exc:
+        bill_note.get_billing_note_details("BNTS0000000", db)
+    assert exc.value.status_code == 404
+    assert db.calls == 1
+
+def test_empty_bill_note_shape():
+    bn = _bill_note()
+    db = FakeDB([SimpleNamespace(BillNote=bn, customer_idx=7, cf_hq=0, cf_branch="00002", item_idx=None,
+                                 invoice_number=None, invoice_date=None, due_date=None, sub_total=None)])
+    out = bill_note.get_billing_note_details(bn.billnote_number, db)
+    assert db.calls == 1
+    assert out == {
+        "customer": {"name": "ศรีสมบูรณ์", "prename": "บริษัท", "tax_id": "0105500000001",
+                     "branch": "สำนักงานใหญ่", "address": "กาญจนบุรี", "person_id": "C001"},
+        "invoices": [],
+        "summary": {"total_amount": 0},
+        "bill_note_number": "BNTS2601001",
+        "bill_date": date.today().isoformat(),
+    }
+
+def test_bill_note_details_shape():
+    bn = _bill_note()
+    def row(no, d, sub):
+        return SimpleNamespace(BillNote=bn, customer_idx=7, cf_hq=0, cf_branch="00002", item_idx=1,
+                               invoice_number=no, invoice_date=d, due_date=None, sub_total=sub)
+    db = FakeDB([row("IV1", date(2026, 1, 5), 100), row("IV2", date(2026, 1, 6), None)])
+    out = bill_note.get_billing_note_details(bn.billnote_number, db)
+    assert db.calls == 1
+    assert out["customer"]["branch"] == "สาขาที่ 00002"
+    assert out["invoices"] == [
+        {"invoice_number": "IV1", "invoice_date": "2026-01-05", "due_date": None, "amount": 107.0},
+        {"invoice_number": "IV2", "invoice_date": "2026-01-06", "due_date": None, "amount": 0.0},
+    ]
+    assert out["summary"] == {"total_amount": 107.0}
+    assert out["bill_date"] == "2026-01-20"
+    assert out["payment_duedate"] == "2026-02-19"
+
+def test_bill_note_customer_missing_is_head_office():
+    bn = _bill_note()
+    db = FakeDB([SimpleNamespace(BillNote=bn, customer_idx=None, cf_hq=None, cf_branch=None, item_idx=1,
+                                 invoice_number="IV1", invoice_date=None, due_date=None, sub_total=10)])
+    out = bill_note.get_billing_note_details(bn.billnote_number, db)
+    assert out["customer"]["branch"] == "สำนักงานใหญ่"
+
+def test_billing_invoices_customer_not_found():
+    db = FakeDB([])
+    assert bill_note.get_invoices_for_billing_note("2026-01-01", "2026-01-31", 999, db) == {"error": "Customer not found"}
+    assert db.calls == 1
+
+def test_billing_invoices_none_left():
+    c = _customer(cf_hq=1)
+    db = FakeDB([SimpleNamespace(CustomerList=c, invoice_idx=None, invoice_number=None,
+                                 invoice_date=None, due_date=None, sub_total=None)])
+    out = bill_note.get_invoices_for_billing_note("2026-01-01", "2026-01-31", c.idx, db)
+    assert db.calls == 1
+    assert out == {
+        "customer": {"name": "ศรีสมบูรณ์", "prename": "บริษัท", "tax_id": "0105500000001",
+                     "branch": "สำนักงานใหญ่", "address": "กาญจนบุรี", "person_id": "C001"},
+        "invoices": [],
+        "summary": {"total_amount": 0.0},
+    }
+
+def test_billing_invoices_shape():
+    c = _customer()
+    db = FakeDB([SimpleNamespace(CustomerList=c, invoice_idx=1, invoice_number="IV1",
+                                 invoice_date=date(2026, 1, 5), due_date=date(2026, 2, 4), sub_total=200)])
+    out = bill_note.get_invoices_for_billing_note("2026-01-01", "2026-01-31", c.idx, db)
+    assert out["customer"]["branch"] == "สาขาที่ 00002"
+    assert out["invoices"] == [{"invoice_number": "IV1", "invoice_date": "2026-01-05", "due_date": "2026-02-04", "amount": 214.0}]
+    assert out["summary"] == {"total_amount": 214.0}
+
+def _preview_row(**kw):
+    fields = dict(creditnote_number="CN2601001", created_at=date(2026, 1, 10), item_idx=1,
+                  invoice_number=" IV1 ", cf_itemname="หิน", sum_quantity=10, fine=2, price_after_fine=8,
+                  invoice_date=date(2026, 1, 5), buyer_found=True, fname="ศรีสมบูรณ์",
+                  cf_personaddress="กาญจนบุรี", cf_hq=1, cf_branch=None, cf_taxid="0105500000001")
+    fields.update(kw)
+    return SimpleNamespace(**fields)
+
+def test_credit_note_preview_not_found():
+    db = FakeDB([])
+    resp = credit_note.credit_note_preview_page(_request(), "CN0000000", db)
+    assert resp.status_code == 404
+    assert db.calls == 1
+
+def test_credit_note_preview_shape():
+    db = FakeDB([_preview_row()])
+    resp = credit_note.credit_note_preview_page(_request(), "CN2601001", db)
+    assert db.calls == 1
+    ctx = resp.context
+    assert ctx["doc_no"] == "CN2601001"
+    assert ctx["doc_date_be"] == "10/01/2569"
+    assert ctx["rows"] == [{"date": "05/01/2569", "inv": "IV1", "desc": "หิน", "amt_old": 100.0, "amt_new": 80.0}]
+    assert ctx["sum_reduce_value"] == 20.0
+    assert ctx["sum_reduce_vat"] == 1.4
+    assert ctx["sum_total"] == 21.4
+    assert ctx["buyer"] == {"name": "ศรีสมบูรณ์", "addr": "กาญจนบุรี", "branch": "สำนักงานใหญ่", "tax": "0105500000001"}
+
+def test_credit_note_preview_missing_buyer():
+    db = FakeDB([_preview_row(buyer_found=False, fname=None, cf_personaddress=None, cf_hq=None, cf_taxid=None)])
+    resp = credit_note.credit_note_preview_page(_request(), "CN2601001", db)
+    assert resp.context["buyer"] == {"name": "—", "addr": "", "branch": "", "tax": ""}
+
+def test_credit_note_preview_without_items():
+    db = FakeDB([_preview_row(item_idx=None, invoice_number=None, invoice_date=None, buyer_found=False)])
+    resp = credit_note.credit_note_preview_page(_request(), "CN2601001", db)
+    assert resp.context["rows"] == []
+    assert resp.context["sum_total"] == 0.0
+
+
+# ---------- จำนวนคิวรีจริง (PostgreSQL) ----------
+@contextmanager
+def _count_queries(engine):
+    statements = []
+    def before(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(engine, "before_cursor_execute", before)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before)
+
+def _endpoint_queries(statements):
+    # ไม่นับคำสั่งของ session เอง (BEGIN / SET TRANSACTION ...)
+    return [s for s in statements if s.lstrip().upper().startswith(("SELECT", "WITH"))]
+
+@pytest.fixture
+def seeded(pg):
+    with SessionLocal() as db:
+        db.add(_customer())
+        for n in range(3):
+            inv = models.Invoice(invoice_number=f"IV{n}", invoice_date=date(2026, 1, 5 + n), personid="C001")
+            db.add(inv)
+            db.flush()
+            invoice_items.insert_items(db, inv.idx, [
+                dict(invoice_number=inv.invoice_number, cf_itemid="P01", quantity=2, cf_itempricelevel_price=50),
+                dict(invoice_number=inv.invoice_number, cf_itemid="P02", quantity=1, cf_itempricelevel_price=10),
+            ])
+        db.add(_bill_note(billnote_number="BN1"))
+        db.add(_bill_note(billnote_number="BN_EMPTY"))
+        db.add_all([
+            models.BillNoteItem(billnote_number="BN1", invoice_number="IV0", invoice_date=date(2026, 1, 5)),
+            models.BillNoteItem(billnote_number="BN1", invoice_number="IV1", invoice_date=date(2026, 1, 6)),
+        ])
+        db.add(credit_note.CreditNote(creditnote_number="CN1", created_at=date(2026, 1, 10)))
+        db.add(credit_note.CreditNote(creditnote_number="CN_NOBUYER", created_at=date(2026, 1, 10)))
+        db.add_all([
+            credit_note.CreditNoteItem(creditnote_number="CN1", invoice_number="IV0", sum_quantity=2, fine=5, price_after_fine=45),
+            credit_note.CreditNoteItem(creditnote_number="CN1", invoice_number="IV1", sum_quantity=2, fine=5, price_after_fine=45),
+            credit_note.CreditNoteItem(creditnote_number="CN_NOBUYER", invoice_number="XX9", sum_quantity=1, fine=1, price_after_fine=9),
+        ])
+        db.commit()
+    return pg
+
+@pytest.mark.parametrize("number, n_invoices", [("BN1", 2), ("BN_EMPTY", 0)])
+def test_bill_note_details_single_query(seeded, number, n_invoices):
+    with SessionLocal() as db, _count_queries(seeded) as statements:
+        out = bill_note.get_billing_note_details(number, db)
+    assert len(_endpoint_queries(statements)) == 1
+    assert len(out["invoices"]) == n_invoices
+    if n_invoices:
+        assert out["summary"]["total_amount"] == round(2 * 110 * 1.07, 2)
+
+@pytest.mark.parametrize("customer_id, expected", [(7, 1), (999, None)])
+def test_billing_invoices_single_query(seeded, customer_id, expected):
+    with SessionLocal() as db, _count_queries(seeded) as statements:
+        out = bill_note.get_invoices_for_billing_note("2026-01-01", "2026-01-31", customer_id, db)
+    assert len(_endpoint_queries(statements)) == 1
+    if expected is None:
+        assert out == {"error": "Customer not found"}
+    else:
+        # IV0, IV1 อยู่ในใบวางบิลแล้ว เหลือ IV2
+        assert [i["invoice_number"] for i in out["invoices"]] == ["IV2"]
+
+@pytest.mark.parametrize("number, buyer", [("CN1", "ศรีสมบูรณ์"), ("CN_NOBUYER", "—")])
+def test_credit_note_preview_single_query(seeded, number, buyer):
+    with SessionLocal() as db, _count_queries(seeded) as statements:
+        resp = credit_note.credit_note_preview_page(_request(), number, db)
+    assert len(_endpoint_queries(statements)) == 1
+    assert resp.context["buyer"]["name"] == buyer
@@ -0,0 +1,102 @@
+# tests/test_revenue_rollup.py
+"""revenue_daily (signed upsert) ต้องตรงกับตารางบิลหลังแก้บิลเดียวกันพร้อมกันหลาย request"""
+import threading
+import time
+from datetime import date
+
+import pytest
+from sqlalchemy import text
+
+from app import form, invoice_items, models, revenue_rollup, summary_invoices
+from app.database import SessionLocal
+
+# รวมจากตารางบิลด้วยคิวรีเดียวกับ rebuild (ค่าที่ rollup ควรเป็น)
+_EXPECTED_SQL = f"""
+    SELECT day, cf_itemid, sum(invoice_count), sum(item_count), sum(quantity), sum(amount)
+    FROM ({revenue_rollup._SOURCE_SQL.format(where="")}) AS s
+    GROUP BY day, cf_itemid ORDER BY day, cf_itemid
+"""
+_ACTUAL_SQL = """
+    SELECT day, cf_itemid, sum(invoice_count), sum(item_count), sum(quantity), sum(amount)
+    FROM ss_invoices.revenue_daily
+    GROUP BY day, cf_itemid
+    HAVING sum(invoice_count) <> 0 OR sum(item_count) <> 0
+    ORDER BY day, cf_itemid
+"""
+
+
+def _seed() -> int:
+    with SessionLocal() as db:
+        inv = models.Invoice(invoice_number="IV6901001", invoice_date=date(2026, 1, 5), personid="C001", fname="ลูกค้า")
+        db.add(inv)
+        db.flush()
+        invoice_items.insert_items(db, inv.idx, [dict(
+            invoice_number=str(inv.idx), personid="C001", cf_itemid="P01", cf_itemname="หิน",
+            cf_itempricelevel_price=5.0, cf_items_ordinary=1, quantity=10.0, amount=50.0,
+        )])
+        revenue_rollup.add_invoices(db, [inv.idx])
+        db.commit()
+        return inv.idx
+
+def _slow_add(monkeypatch):
+    # ขยายช่วงระหว่าง remove_invoices กับ commit ให้ request ที่ไม่ lock ชนกันแน่นอน
+    real_add = revenue_rollup.add_invoices
+    def add(db, ids):
+        time.sleep(0.3)
+        real_add(db, ids)
+    monkeypatch.setattr(revenue_rollup, "add_invoices", add)
+
+def _run_concurrently(fns):
+    barrier = threading.Barrier(len(fns))
+    errors = []
+    def run(fn):
+        db = SessionLocal()
+        try:
+            barrier.wait()
+            fn(db)
+        except Exception as e:  # ให้ assert ใน thread หลัก
+            errors.append(e)
+        finally:
+            db.close()
+    threads = [threading.Thread(target=run, args=(fn,)) for fn in fns]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=30)
+    assert not errors, errors
+
+def _rollup_matches(engine):
+    with engine.connect() as conn:
+        expected = conn.execute(text(_EXPECTED_SQL)).all()
+        actual = conn.execute(text(_ACTUAL_SQL)).all()
+    assert actual == expected
+
+
+def test_concurrent_form_updates(pg, monkeypatch):
+    idx = _seed()
+    _slow_add(monkeypatch)
+
+    def edit(qty):
+        item = form.InvoiceItemIn(cf_itemid="P01", cf_itemname="หิน", quantity=qty, unit_price=5)
+        return lambda db: form.api_update_invoice(idx, form.InvoiceUpdate(items=[item]), db)
+
+    _run_concurrently([edit(20), edit(30), edit(40)])
+    _rollup_matches(pg)
+
+def test_concurrent_summary_updates(pg, monkeypatch):
+    idx = _seed()
+    _slow_add(monkeypatch)
+
+    def edit(qty):
+        payload = {"items": [{"cf_itemid": "P01", "cf_itemname": "หิน", "quantity": qty, "unit_price": 5}]}
+        return lambda db: summary_invoices.api_invoice_update(idx, payload, db)
+
+    _run_concurrently([edit(20), edit(30), edit(40)])
+    _rollup_matches(pg)
+
+def test_update_missing_invoice_is_404(pg):
+    from fastapi import HTTPException
+
+    with SessionLocal() as db, pytest.raises(HTTPException) as exc:
+        form.api_update_invoice(999, form.InvoiceUpdate(), db)
+    assert exc.value.status_code == 404
@@ -0,0 +1,105 @@
+# tests/test_static_assets.py
+"""build ไฟล์ static (ชื่อมี hash + .br/.gz) และ PrecompressedStaticFiles ที่ส่งไฟล์เหล่านั้น"""
+import gzip
+import json
+
+import pytest
+from starlette.applications import Starlette
+from starlette.routing import Mount
+
+from app import static_assets
+from tests.test_compression import call
+
+FONT = b"\x00\x01\x00\x00" + b"TH Sarabun New glyphs " * 300
+CSS = """@font-face { font-family: 'THSarabunNew'; src: url('../fonts/THSarabunNew.ttf') format('truetype'); }
+@font-face { font-family: 'Bold'; src: url(/static/fonts/THSarabunNew.ttf?v=2); }
+.logo { background: url("../img/missing.png"); }
+.inline { background: url(data:image/png;base64,AAAA); }
+.cdn { background: url(https://example.com/x.png); }
+"""
+JS = "console.log('สวัสดี');\n" * 200
+
+
+@pytest.fixture
+def built(tmp_path, monkeypatch):
+    src = tmp_path / "static"
+    (src / "fonts").mkdir(parents=True)
+    (src / "css").mkdir()
+    (src / "js").mkdir()
+    (src / "fonts" / "THSarabunNew.ttf").write_bytes(FONT)
+    (src / "css" / "style.css").write_text(CSS, encoding="utf-8")
+    (src / "js" / "form.js").write_text(JS, encoding="utf-8")
+    (src / "js" / ".hidden.js").write_text("x", encoding="utf-8")
+    out = tmp_path / "build"
+    manifest = static_assets.build(src, out)
+    monkeypatch.setattr(static_assets, "BUILD_DIR", out)
+    monkeypatch.setattr(static_assets, "_manifest", None)
+    return out, manifest
+
+def test_manifest_maps_hashed_names(built):
+    out, manifest = built
+    files = manifest["files"]
+    assert sorted(files) == ["css/style.css", "fonts/THSarabunNew.ttf", "js/form.js"]
+    assert files["js/form.js"].startswith("js/form.") and files["js/form.js"].endswith(".js")
+    assert json.loads((out / "manifest.json").read_text(encoding="utf-8")) == manifest
+    assert "gzip" in manifest["encodings"][files["js/form.js"]]
+    js = out / files["js/form.js"]
+    assert gzip.decompress((js.parent / (js.name + ".gz")).read_bytes()) == JS.encode("utf-8")
+
+def test_css_font_urls_rewritten(built):
+    out, manifest = built
+    font = manifest["files"]["fonts/THSarabunNew.ttf"]
+    css = (out / manifest["files"]["css/style.css"]).read_text(encoding="utf-8")
+    assert f"url('../{font}')" in css
+    assert f"url(../{font}?v=2)" in css
+    # ไฟล์ที่ไม่มี / data: / URL ภายนอก คงเดิม
+    assert 'url("../img/missing.png")' in css
+    assert "url(data:image/png;base64,AAAA)" in css
+    assert "url(https://example.com/x.png)" in css
+
+def test_hash_follows_content(tmp_path):
+    a = static_assets._hashed_name("js/a.js", b"one")
+    assert a == static_assets._hashed_name("js/a.js", b"one")
+    assert a != static_assets._hashed_name("js/a.js", b"two")
+
+def test_static_url(built):
+    _, manifest = built
+    assert static_assets.static_url("js/form.js") == f"/assets/{manifest['files']['js/form.js']}"
+    assert static_assets.static_url("/static/js/form.js") == f"/assets/{manifest['files']['js/form.js']}"
+    assert static_assets.static_url("js/unknown.js") == "/static/js/unknown.js"
+
+def _files_app(out):
+    # mount แบบเดียวกับ main.py
+    return Starlette(routes=[Mount(static_assets.URL_PREFIX, app=static_assets.PrecompressedStaticFiles(directory=out))])
+
+@pytest.mark.parametrize("accept, encoding", [("gzip", "gzip"), ("br, gzip", "br"), ("", None)])
+def test_serves_precompressed_variant(built, accept, encoding):
+    if encoding == "br" and static_assets.brotli is None:
+        pytest.skip("brotli ไม่ได้ติดตั้ง")
+    out, manifest = built
+    hashed = manifest["files"]["js/form.js"]
+    headers = [("Accept-Encoding", accept)] if accept else []
+    status, resp_headers, chunks = call(_files_app(out), headers, path=f"/assets/{hashed}")
+    body = b"".join(chunks)
+    assert status == 200
+    assert resp_headers["cache-control"] == static_assets.CACHE_FOREVER
+    assert resp_headers["vary"] == "Accept-Encoding"
+    assert "javascript" in resp_headers["content-type"]
+    assert resp_headers.get("content-encoding") == encoding
+    if encoding == "gzip":
+        body = gzip.decompress(body)
+    elif encoding == "br":
+        body = static_assets.brotli.decompress(body)
+    assert body == JS.encode("utf-8")
+
+def test_manifest_not_served(built):
+    out, _ = built
+    status, _, _ = call(_files_app(out), path="/assets/manifest.json")
+    assert status == 404
+
+def test_unlisted_file_not_cached_forever(built):
+    out, _ = built
+    (out / "extra.txt").write_text("x", encoding="utf-8")
+    status, headers, _ = call(_files_app(out), path="/assets/extra.txt")
+    assert status == 200
+    assert headers.get("cache-control") != static_assets.CACHE_FOREVER
@@ -0,0 +1,50 @@
+# tests/test_thai_text.py
+import pytest
+
+from app.thai_text import fold, search_key
+
+
+@pytest.mark.parametrize("name, key", [
+    ("บริษัท  ศรีสมบูรณ์ จำกัด", "ศรีสมบูรณ์"),
+    ("บจก.ศรีสมบูรณ์", "ศรีสมบูรณ์"),
+    ("บ.จ.ก. ศรีสมบูรณ์", "ศรีสมบูรณ์"),
+    ("หจก. ทรายทอง", "ทรายทอง"),
+    ("ห้างหุ้นส่วนจำกัด ทรายทอง", "ทรายทอง"),
+    ("บริษัท ปูนซิเมนต์ไทย จำกัด (มหาชน)", "ปูนซิเมนต์ไทย"),
+    ("ABC Co., Ltd.", "abc"),
+    ("นาย สมชาย ใจดี", "สมชายใจดี"),
+    ("นางสาว สมศรี", "สมศรี"),
+    ("น.ส.สมศรี", "สมศรี"),
+    ("คุณ สมหญิง", "สมหญิง"),
+])
+def test_search_key_strips_whole_affixes(name, key):
+    assert search_key(name) == key
+
+@pytest.mark.parametrize("name, key", [
+    # พยางค์แรกของชื่อซ้ำกับคำนำหน้า แต่ไม่ได้คั่นด้วยช่องว่าง/เครื่องหมาย
+    ("คุณภาพดี จำกัด", "คุณภาพดี"),
+    ("บริษัท คุณภาพดี จำกัด", "คุณภาพดี"),
+    ("นางรองวัสดุ", "นางรองวัสดุ"),
+    ("หจก.นางรองวัสดุ", "นางรองวัสดุ"),
+    ("นายกการช่าง", "นายกการช่าง"),
+    ("บจก. นายกการช่าง", "นายกการช่าง"),
+    ("นางสาวสมศรี", "นางสาวสมศรี"),
+    ("ศรีสมบูรณ์จำกัด", "ศรีสมบูรณ์จำกัด"),
+])
+def test_search_key_keeps_names_starting_like_affixes(name, key):
+    assert search_key(name) == key
+
+def test_search_key_keeps_bare_affix():
+    # คำค้นที่เป็นคำนำหน้าอย่างเดียวไม่กลายเป็นคำค้นว่าง
+    assert search_key("บริษัท") == "บริษัท"
+    assert search_key("บริษัท จำกัด") == "จำกัด"
+
+def test_search_key_without_strip():
+    assert search_key("บริษัท ศรีสมบูรณ์ จำกัด", strip_prename=False) == "บริษัทศรีสมบูรณ์จำกัด"
+    assert search_key(None) == ""
+
+def test_fold_normalizes_digits_marks_and_separators():
+    assert fold("๑๒๓ - ABC") == "123abc"
+    assert fold("เเม่") == fold("แม่")
+    assert fold("กํา") == fold("กำ")
+    assert fold("ก้ำ") == fold("กำ้")